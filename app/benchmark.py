@@ -0,0 +1,388 @@
+"""
+Benchmarks do pipeline de chat com um modelo stub
+
+Roda sem rede e sem baixar modelos: o NLPService recebe um tokenizer
+byte-level construído em memória e um modelo causal stub determinístico,
+que devolve sempre a mesma resposta para a mesma entrada (opcionalmente
+esperando um tempo fixo por token gerado, para simular o custo do
+``generate``). As interações vão para um repositório em memória.
+
+São medidos:
+
+- microbenchmarks: caminhos rápidos (cálculo, resposta pronta e o custo
+  de um prompt que não casa com nenhum), classificação do rate limiter,
+  sanitizador, tokenização e ``process_prompt`` completo;
+- ponta a ponta: requisições POST passando por ``chat_view`` (com o
+  middleware de tracing) a partir de N clientes concorrentes.
+
+O resultado é um dict serializável em JSON (ver ``run_benchmarks``), para
+comparar execuções ao longo do tempo (``compare_results``).
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest.mock import patch
+
+import torch
+from django.conf import settings
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from .services.nlp_service import MODEL_READY, NLPService
+
+SCHEMA_VERSION = 1
+
+# Respostas do modelo stub (escolhidas pela entrada, sempre a mesma para o mesmo prompt)
+STUB_REPLIES = (
+    "A fotossíntese é o processo pelo qual as plantas produzem energia a partir da luz.",
+    "Python é uma linguagem de programação muito usada em ciência de dados.",
+    "O Brasil tem vinte e seis estados e um Distrito Federal.",
+    "Uma boa noite de sono ajuda a memória e a concentração.",
+)
+
+# Prompts usados nos benchmarks, por caminho esperado
+MATH_PROMPT = 'quanto é 12 vezes 34'
+QUICK_PROMPT = 'bom dia'
+MODEL_PROMPT = 'Explique a fotossíntese das plantas'
+DEFAULT_MIX = (
+    MODEL_PROMPT,
+    'O que é uma rede neural',
+    MATH_PROMPT,
+    'Quantos estados tem o Brasil',
+    QUICK_PROMPT,
+    'Por que dormir bem é importante',
+)
+
+
+def build_stub_tokenizer():
+    """Tokenizer byte-level (um token por byte) montado em memória, sem downloads."""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {char: index for index, char in enumerate(sorted(pre_tokenizers.ByteLevel.alphabet()))}
+    vocab['<|endoftext|>'] = len(vocab)
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        eos_token='<|endoftext|>',
+        pad_token='<|endoftext|>',
+        model_max_length=1024,
+    )
+    tokenizer.padding_side = 'left'
+    return tokenizer
+
+
+class StubCausalLM(torch.nn.Module):
+    """
+    Modelo causal determinístico com a interface de ``generate`` usada pelo NLPService.
+
+    Cada linha do lote recebe uma das STUB_REPLIES (escolhida pelos tokens
+    da entrada) seguida do token de fim; linhas mais curtas são completadas
+    com padding, como no ``generate`` da Hugging Face. Os critérios de
+    parada (``stopping_criteria``) são consultados a cada passo e podem
+    encerrar uma linha antes do fim da resposta. ``token_latency``
+    (segundos) é esperado por passo de geração, uma vez para o lote todo.
+    """
+
+    def __init__(self, tokenizer, token_latency=0.0, replies=STUB_REPLIES):
+        super().__init__()
+        self.config = type('StubConfig', (), {'is_encoder_decoder': False})()
+        self.token_latency = token_latency
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id
+        self.reply_ids = [tokenizer(reply)['input_ids'] for reply in replies]
+        self.generate_calls = 0
+
+    def generate(self, input_ids=None, attention_mask=None, max_new_tokens=20, stopping_criteria=None, **kwargs):
+        self.generate_calls += 1
+        pending = [
+            (self.reply_ids[sum(row) % len(self.reply_ids)] + [self.eos_token_id])[:max_new_tokens]
+            for row in input_ids.tolist()
+        ]
+        rows = [[] for _ in pending]
+        finished = [False] * len(pending)
+        # Um token por passo, como no generate da Hugging Face, para os
+        # critérios de parada poderem encerrar cada linha
+        while not all(finished):
+            for index, reply in enumerate(pending):
+                if finished[index]:
+                    rows[index].append(self.pad_token_id)
+                    continue
+                rows[index].append(reply[len(rows[index])])
+                finished[index] = len(rows[index]) == len(reply)
+            if stopping_criteria:
+                sequences = torch.cat([input_ids, torch.tensor(rows, dtype=input_ids.dtype)], dim=1)
+                done = stopping_criteria(sequences, None)
+                finished = [was or bool(stop) for was, stop in zip(finished, done)]
+        steps = len(rows[0]) if rows else 0
+        if self.token_latency:
+            time.sleep(self.token_latency * steps)
+        generated = torch.tensor(rows, dtype=input_ids.dtype)
+        return torch.cat([input_ids, generated.to(input_ids.device)], dim=1)
+
+
+class InMemoryRepository:
+    """Repositório em memória com a parte da interface do MongoRepository usada pelo chat."""
+
+    def __init__(self):
+        self.interactions = []
+        self._lock = threading.Lock()
+
+    def save_interaction(self, interaction_data):
+        with self._lock:
+            self.interactions.append(dict(interaction_data))
+            return str(len(self.interactions))
+
+    def save_interactions(self, interactions):
+        with self._lock:
+            self.interactions.extend(dict(item) for item in interactions)
+            return len(interactions)
+
+    def get_interactions(self, limit=100, skip=0, filters=None):
+        with self._lock:
+            return list(reversed(self.interactions))[skip:skip + limit]
+
+
+def build_stub_service(token_latency=0.0):
+    """NLPService pronto para uso com o tokenizer e o modelo stub (sem carregar nada)."""
+    service = NLPService()
+    service.model_name = 'stub-causal'
+    service.tokenizer = build_stub_tokenizer()
+    service.model = StubCausalLM(service.tokenizer, token_latency=token_latency)
+    service.is_encoder_decoder = False
+    service.device = torch.device('cpu')
+    service._model_loaded = True
+    service.model_state = MODEL_READY
+    return service
+
+
+# ============================================
+# MEDIÇÃO
+# ============================================
+
+def _percentile(sorted_values, fraction):
+    """Percentil por interpolação linear de uma lista já ordenada."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(durations):
+    """Estatísticas de uma lista de durações (segundos)."""
+    values = sorted(durations)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'min': values[0],
+        'mean': statistics.fmean(values),
+        'p50': _percentile(values, 0.50),
+        'p95': _percentile(values, 0.95),
+        'p99': _percentile(values, 0.99),
+        'max': values[-1],
+    }
+
+
+def measure(fn, iterations, warmup=None):
+    """
+    Mede ``fn()`` chamada ``iterations`` vezes (após um aquecimento).
+
+    Returns:
+        dict: estatísticas de ``summarize`` mais ``ops_per_second``
+    """
+    for _ in range(warmup if warmup is not None else max(1, iterations // 10)):
+        fn()
+    durations = []
+    perf_counter = time.perf_counter
+    for _ in range(iterations):
+        start = perf_counter()
+        fn()
+        durations.append(perf_counter() - start)
+    result = summarize(durations)
+    total = sum(durations)
+    result['ops_per_second'] = iterations / total if total else None
+    return result
+
+
+def microbenchmarks(service, iterations=1000):
+    """
+    Microbenchmarks das etapas do pipeline.
+
+    Returns:
+        dict: nome -> estatísticas de ``measure``
+    """
+    formatted = service._format_model_input(MODEL_PROMPT)
+    raw_reply = STUB_REPLIES[0]
+    batch_inputs = [service._format_model_input(prompt) for prompt in DEFAULT_MIX]
+    model_iterations = max(1, iterations // 10)
+
+    cases = {
+        'fast_path.math': (lambda: service._fast_path(MATH_PROMPT), iterations),
+        'fast_path.quick': (lambda: service._fast_path(QUICK_PROMPT), iterations),
+        'fast_path.miss': (lambda: service._fast_path(MODEL_PROMPT), iterations),
+        'ratelimit.classify': (lambda: NLPService.is_fast_path(MODEL_PROMPT), iterations),
+        'sanitizer': (lambda: service._sanitize_response(
+            MODEL_PROMPT, service._normalize_prompt(MODEL_PROMPT), raw_reply, formatted,
+        ), iterations),
+        'tokenization.single': (lambda: service.tokenizer(
+            [formatted], return_tensors='pt', padding=True, truncation=True, return_attention_mask=True,
+        ), iterations),
+        'tokenization.batch': (lambda: service.tokenizer(
+            batch_inputs, return_tensors='pt', padding=True, truncation=True, return_attention_mask=True,
+        ), model_iterations),
+        'process_prompt.model': (lambda: service.process_prompt(MODEL_PROMPT), model_iterations),
+        'process_batch.mix': (lambda: service.process_batch(list(DEFAULT_MIX)), model_iterations),
+    }
+    return {name: measure(fn, count) for name, (fn, count) in cases.items()}
+
+
+def end_to_end(service, concurrency, requests_per_client, prompts=DEFAULT_MIX):
+    """
+    Requisições POST ao ``chat_view`` a partir de ``concurrency`` clientes simultâneos.
+
+    Cada cliente envia ``requests_per_client`` prompts de ``prompts`` em
+    sequência (cada um começando em um ponto diferente da lista).
+
+    Returns:
+        dict: latência (estatísticas), vazão, erros e distribuição por caminho
+    """
+    from . import views
+    from .middleware import TracingMiddleware
+
+    repository = InMemoryRepository()
+    factory = RequestFactory()
+    handler = TracingMiddleware(views.chat_view)
+
+    def client(client_index):
+        latencies, errors = [], 0
+        for number in range(requests_per_client):
+            prompt = prompts[(client_index + number) % len(prompts)]
+            request = factory.post('/', data=json.dumps({'prompt': prompt}), content_type='application/json')
+            start = time.perf_counter()
+            response = handler(request)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+        return latencies, errors
+
+    with patch.object(views, 'nlp_service', service), patch.object(views, 'mongo_repo', repository), \
+            override_settings(USE_HF_FOR_ALL=False):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(client, range(concurrency)))
+        wall_time = time.perf_counter() - started
+
+    latencies = [latency for client_latencies, _ in outcomes for latency in client_latencies]
+    errors = sum(client_errors for _, client_errors in outcomes)
+    paths = {}
+    for interaction in repository.interactions:
+        paths[interaction.get('path')] = paths.get(interaction.get('path'), 0) + 1
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': errors / len(latencies) if latencies else 0.0,
+        'wall_time': wall_time,
+        'throughput': len(latencies) / wall_time if wall_time else None,
+        'latency': summarize(latencies),
+        'paths': paths,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(iterations=1000, concurrency=(1, 4, 16), requests_per_client=20,
+                   token_latency=0.0, micro=True, e2e=True):
+    """
+    Roda a suíte de benchmarks.
+
+    Args:
+        iterations (int): chamadas por microbenchmark (um décimo para os
+            que chamam o modelo)
+        concurrency (iterable): números de clientes simultâneos do ponta a ponta
+        requests_per_client (int): requisições de cada cliente
+        token_latency (float): segundos por token gerado no modelo stub
+        micro (bool): roda os microbenchmarks
+        e2e (bool): roda o ponta a ponta
+
+    Returns:
+        dict: resultado serializável em JSON
+    """
+    service = build_stub_service(token_latency=token_latency)
+    result = {
+        'schema': SCHEMA_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'revision': _git_revision(),
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'torch_threads': torch.get_num_threads(),
+        },
+        'parameters': {
+            'iterations': iterations,
+            'concurrency': list(concurrency),
+            'requests_per_client': requests_per_client,
+            'token_latency': token_latency,
+        },
+        'micro': {},
+        'end_to_end': [],
+    }
+    if micro:
+        result['micro'] = microbenchmarks(service, iterations)
+    if e2e:
+        result['end_to_end'] = [
+            end_to_end(service, clients, requests_per_client) for clients in concurrency
+        ]
+    return result
+
+
+def compare_results(baseline, current):
+    """
+    Compara duas execuções (mediana dos microbenchmarks e p50/vazão do ponta a ponta).
+
+    Returns:
+        list: dicts com ``name``, ``metric``, ``baseline``, ``current`` e
+        ``ratio`` (current / baseline; > 1 é mais lento para latências)
+    """
+    rows = []
+
+    def add(name, metric, before, after):
+        if before and after is not None:
+            rows.append({'name': name, 'metric': metric, 'baseline': before, 'current': after,
+                         'ratio': after / before})
+
+    for name, stats in current.get('micro', {}).items():
+        add(name, 'p50', baseline.get('micro', {}).get(name, {}).get('p50'), stats.get('p50'))
+
+    baseline_runs = {run['concurrency']: run for run in baseline.get('end_to_end', [])}
+    for run in current.get('end_to_end', []):
+        before = baseline_runs.get(run['concurrency'])
+        if before is None:
+            continue
+        name = f"end_to_end.c{run['concurrency']}"
+        add(name, 'p50', before['latency'].get('p50'), run['latency'].get('p50'))
+        add(name, 'throughput', before.get('throughput'), run.get('throughput'))
+    return rows
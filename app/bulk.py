@@ -0,0 +1,328 @@
+"""
+Inferência em massa de arquivos de prompts
+
+Lê prompts de um arquivo JSONL ou CSV como stream, distribui blocos
+(chunks) entre processos workers - cada um com o seu NLPService - e grava
+as respostas em JSONL à medida que ficam prontas, na ordem da entrada.
+Dentro de cada worker o bloco passa por ``process_batch``, que resolve os
+caminhos rápidos e agrupa os demais prompts por tamanho em chamadas
+``generate`` de até BATCH_GENERATE_SIZE.
+
+A memória fica limitada: só ``max_in_flight`` blocos ficam em memória ao
+mesmo tempo. Depois de cada bloco gravado (e opcionalmente salvo no
+repositório) um checkpoint registra quantos registros da entrada foram
+concluídos e o tamanho da saída; ``resume`` descarta o que foi escrito
+depois do último checkpoint e continua dali. O salvamento no repositório é
+"pelo menos uma vez": um bloco salvo logo antes de uma queda pode ser
+salvo de novo na retomada.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from itertools import islice
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MODEL_CONFIGURED = 'configured'
+MODEL_STUB = 'stub'
+
+# Colunas aceitas no CSV de entrada
+CSV_PROMPT_COLUMNS = ('prompt', 'Prompt')
+CSV_ID_COLUMNS = ('id', 'ID', 'Id')
+
+
+def iter_prompts(path):
+    """
+    Lê o arquivo de entrada linha a linha.
+
+    JSONL: cada linha é um objeto com ``prompt`` (e ``id`` opcional) ou uma
+    string JSON; linhas em branco são ignoradas. CSV: coluna ``prompt`` (e
+    ``id`` opcional).
+
+    Yields:
+        tuple: (número do registro, id, prompt) - registros inválidos ou
+        sem prompt também são produzidos (prompt None) e viram erros na saída
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with path.open(encoding='utf-8-sig', newline='') as handle:
+            reader = csv.DictReader(handle)
+            prompt_column = next((column for column in CSV_PROMPT_COLUMNS if column in (reader.fieldnames or ())), None)
+            if prompt_column is None:
+                raise ValueError("O CSV precisa de uma coluna 'prompt'")
+            id_column = next((column for column in CSV_ID_COLUMNS if column in reader.fieldnames), None)
+            for number, row in enumerate(reader):
+                yield number, row.get(id_column) if id_column else None, _clean(row.get(prompt_column))
+        return
+
+    with path.open(encoding='utf-8') as handle:
+        for number, line in enumerate(handle):
+            line = line.strip()
+            if not line:
+                continue
+            record_id, prompt = None, None
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                record_id, prompt = record.get('id'), record.get('prompt')
+            elif isinstance(record, str):
+                prompt = record
+            yield number, record_id, _clean(prompt)
+
+
+def _clean(prompt):
+    if not isinstance(prompt, str):
+        return None
+    return prompt.strip() or None
+
+
+def iter_chunks(records, chunk_size):
+    """Agrupa os registros em listas de até ``chunk_size`` (sem ler o arquivo inteiro)."""
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ============================================
+# WORKERS
+# ============================================
+
+_worker_service = None
+
+
+def _build_service(model):
+    if model == MODEL_STUB:
+        from .benchmark import build_stub_service
+        return build_stub_service()
+    from .services.nlp_service import NLPService
+    return NLPService()
+
+
+def _init_worker(model):
+    """Inicializa o processo worker (Django e o NLPService do processo)."""
+    global _worker_service
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _worker_service = _build_service(model)
+
+
+def process_chunk(chunk, service=None):
+    """
+    Responde um bloco de registros.
+
+    Args:
+        chunk (list): tuplas (número, id, prompt) de ``iter_prompts``
+        service (NLPService, optional): padrão é o serviço do worker
+
+    Returns:
+        list: um dict por registro, na mesma ordem
+    """
+    service = service or _worker_service
+    prompts = [prompt for _, _, prompt in chunk if prompt]
+    try:
+        answers = iter(service.process_batch(prompts))
+    except Exception as e:
+        logger.error("Erro no lote de %s prompts, processando um a um: %s", len(prompts), e)
+        answers = iter(_process_each(service, prompts))
+
+    results = []
+    for number, record_id, prompt in chunk:
+        result = {'line': number, 'id': record_id, 'prompt': prompt}
+        if prompt is None:
+            result['error'] = 'Registro sem prompt'
+        else:
+            answer = next(answers)
+            if isinstance(answer, Exception):
+                result['error'] = str(answer)
+            else:
+                response, processing_time, usage = answer
+                result.update(response=response, processing_time=processing_time, **usage)
+        results.append(result)
+    return results
+
+
+def _process_each(service, prompts):
+    answers = []
+    for prompt in prompts:
+        try:
+            answers.append(service.process_prompt(prompt))
+        except Exception as e:
+            answers.append(e)
+    return answers
+
+
+def _process_chunk_in_worker(chunk):
+    return process_chunk(chunk)
+
+
+# ============================================
+# CHECKPOINT
+# ============================================
+
+def checkpoint_path(output_path):
+    return Path(f'{output_path}.checkpoint')
+
+
+def read_checkpoint(output_path, input_path):
+    """
+    Lê o checkpoint da saída.
+
+    Returns:
+        dict ou None: ``records`` concluídos e ``output_bytes`` válidos
+    """
+    path = checkpoint_path(output_path)
+    if not path.exists():
+        return None
+    checkpoint = json.loads(path.read_text(encoding='utf-8'))
+    if checkpoint.get('input') != str(Path(input_path).resolve()):
+        raise ValueError(f'O checkpoint {path} é de outro arquivo de entrada: {checkpoint.get("input")}')
+    return checkpoint
+
+
+def write_checkpoint(output_path, input_path, records, output_bytes, stats):
+    """Grava o checkpoint de forma atômica (arquivo temporário + rename)."""
+    path = checkpoint_path(output_path)
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps({
+        'input': str(Path(input_path).resolve()),
+        'records': records,
+        'output_bytes': output_bytes,
+        'stats': stats,
+    }), encoding='utf-8')
+    os.replace(temporary, path)
+
+
+# ============================================
+# EXECUÇÃO
+# ============================================
+
+class BulkInference:
+    """
+    Executa a inferência em massa de um arquivo.
+
+    Args:
+        input_path (str): JSONL ou CSV de prompts
+        output_path (str): JSONL de saída
+        workers (int): processos workers (0 = no próprio processo)
+        chunk_size (int): registros por bloco enviado a um worker
+        max_in_flight (int, optional): blocos em memória ao mesmo tempo
+            (padrão: 2 por worker)
+        model (str): MODEL_CONFIGURED ou MODEL_STUB
+        repository (MongoRepository, optional): salva as respostas em lote
+        resume (bool): continua a partir do checkpoint da saída
+        progress (callable, optional): chamado com as estatísticas após
+            cada bloco gravado
+    """
+
+    def __init__(self, input_path, output_path, workers=1, chunk_size=64, max_in_flight=None,
+                 model=MODEL_CONFIGURED, repository=None, resume=False, progress=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.workers = max(0, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.max_in_flight = max(1, max_in_flight or 2 * max(1, self.workers))
+        self.model = model
+        self.repository = repository
+        self.resume = resume
+        self.progress = progress
+        self.stats = {'records': 0, 'answered': 0, 'errors': 0, 'saved': 0, 'paths': {}}
+
+    def run(self):
+        """
+        Processa o arquivo todo.
+
+        Returns:
+            dict: contagem de registros, respostas, erros, salvos e caminhos
+        """
+        skip = 0
+        output_bytes = 0
+        checkpoint = read_checkpoint(self.output_path, self.input_path) if self.resume else None
+        if checkpoint:
+            skip = checkpoint['records']
+            output_bytes = checkpoint['output_bytes']
+            self.stats = checkpoint.get('stats') or self.stats
+            logger.info("Retomando a partir do registro %s", skip)
+
+        mode = 'r+b' if checkpoint and Path(self.output_path).exists() else 'wb'
+        started = time.perf_counter()
+        with open(self.output_path, mode) as output:
+            # Descarta o que foi escrito depois do último checkpoint
+            output.truncate(output_bytes)
+            output.seek(output_bytes)
+            chunks = iter_chunks(islice(iter_prompts(self.input_path), skip, None), self.chunk_size)
+            for results in self._results(chunks):
+                self._write(output, results)
+                skip += len(results)
+                write_checkpoint(self.output_path, self.input_path, skip, output.tell(), self.stats)
+                if self.progress:
+                    self.progress(self.stats)
+
+        self.stats['elapsed'] = time.perf_counter() - started
+        return self.stats
+
+    def _results(self, chunks):
+        """Respostas de cada bloco, na ordem da entrada, com no máximo max_in_flight pendentes."""
+        if self.workers == 0:
+            service = _build_service(self.model)
+            for chunk in chunks:
+                yield process_chunk(chunk, service)
+            return
+
+        # spawn: cada worker carrega o próprio modelo, sem herdar threads do torch
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(self.workers, initializer=_init_worker, initargs=(self.model,)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_process_chunk_in_worker, (chunk,)))
+                if len(pending) >= self.max_in_flight:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    def _write(self, output, results):
+        saved = []
+        lines = []
+        for result in results:
+            self.stats['records'] += 1
+            if 'error' in result:
+                self.stats['errors'] += 1
+            else:
+                self.stats['answered'] += 1
+                path = result.get('path')
+                self.stats['paths'][path] = self.stats['paths'].get(path, 0) + 1
+                saved.append(result)
+            lines.append(json.dumps(result, ensure_ascii=False))
+        output.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        output.flush()
+        os.fsync(output.fileno())
+
+        if self.repository is not None and saved:
+            self.stats['saved'] += self.repository.save_interactions([
+                {
+                    key: value for key, value in result.items()
+                    if key not in ('line', 'id')
+                } | {'model': self.model_name}
+                for result in saved
+            ])
+
+    @property
+    def model_name(self):
+        if self.model == MODEL_STUB:
+            return 'stub-causal'
+        from django.conf import settings
+        return settings.HF_MODEL_NAME
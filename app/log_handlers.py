@@ -0,0 +1,81 @@
+"""
+Handlers e filtros de logging da aplicação
+
+BackgroundHandler tira a escrita dos logs da thread da requisição: o
+registro é colocado em uma fila limitada e uma thread em background o
+repassa ao handler de destino (arquivo, console...). Se o disco travar e a
+fila encher, registros novos são descartados em vez de bloquear o chat.
+
+PayloadSamplingFilter mantém apenas uma amostra dos logs de payload
+(prompts e respostas completos), marcados com ``extra=PAYLOAD_LOG``.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+
+from django.utils.module_loading import import_string
+
+# Marca de logs com payload grande: logger.debug("...", texto, extra=PAYLOAD_LOG)
+PAYLOAD_LOG = {'payload': True}
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler com um QueueListener próprio escrevendo no handler de destino.
+
+    Configurado pelo LOGGING do Django, por exemplo::
+
+        'file': {
+            'class': 'app.log_handlers.BackgroundHandler',
+            'target': 'logging.FileHandler',
+            'filename': BASE_DIR / 'debug.log',
+            'formatter': 'verbose',
+        }
+
+    Os argumentos restantes são repassados ao handler de destino.
+    """
+
+    def __init__(self, target='logging.StreamHandler', queue_size=10000, **target_kwargs):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = import_string(target)(**target_kwargs)
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        # A formatação final é feita pelo destino, na thread em background;
+        # aqui só a mensagem é montada (em prepare)
+        self.target.setFormatter(fmt)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Escreve o que ainda estiver na fila antes de fechar o destino
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+        super().close()
+
+
+class PayloadSamplingFilter(logging.Filter):
+    """Deixa passar só uma fração ``rate`` dos registros marcados com PAYLOAD_LOG."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if not getattr(record, 'payload', False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
@@ -0,0 +1,92 @@
+"""
+Comando de benchmark do pipeline de chat (offline, com modelo stub)
+
+Roda os microbenchmarks e o teste ponta a ponta de ``app.benchmark`` e
+grava o resultado em JSON; com ``--compare`` mostra a variação em relação
+a uma execução anterior.
+
+Uso: python manage.py benchmark [--iterations N] [--concurrency 1,4,16]
+     [--requests N] [--token-latency S] [--output arquivo.json]
+     [--compare anterior.json] [--skip-micro] [--skip-e2e]
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import benchmark
+
+
+def _concurrency_list(value):
+    try:
+        levels = [int(level) for level in value.split(',') if level.strip()]
+    except ValueError:
+        levels = []
+    if not levels or min(levels) < 1:
+        raise CommandError('--concurrency deve ser uma lista de inteiros positivos (ex.: 1,4,16)')
+    return levels
+
+
+class Command(BaseCommand):
+    help = 'Mede o pipeline de chat com um modelo stub e um repositório em memória'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000,
+                            help='Chamadas por microbenchmark (um décimo nos que usam o modelo)')
+        parser.add_argument('--concurrency', default='1,4,16',
+                            help='Clientes simultâneos do ponta a ponta, separados por vírgula')
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Requisições por cliente no ponta a ponta')
+        parser.add_argument('--token-latency', type=float, default=0.0,
+                            help='Segundos por token gerado simulados no modelo stub')
+        parser.add_argument('--output', default=None,
+                            help='Arquivo JSON do resultado (padrão: saída padrão)')
+        parser.add_argument('--compare', default=None,
+                            help='Resultado anterior (JSON) para comparação')
+        parser.add_argument('--skip-micro', action='store_true', help='Não roda os microbenchmarks')
+        parser.add_argument('--skip-e2e', action='store_true', help='Não roda o ponta a ponta')
+        parser.add_argument('--verbose-logs', action='store_true',
+                            help='Mantém os logs da aplicação (por padrão só WARNING ou acima)')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as handle:
+                    baseline = json.load(handle)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Não foi possível ler {options["compare"]}: {e}')
+
+        app_logger = logging.getLogger('app')
+        previous_level = app_logger.level
+        if not options['verbose_logs']:
+            app_logger.setLevel(logging.WARNING)
+        try:
+            result = benchmark.run_benchmarks(
+                iterations=max(1, options['iterations']),
+                concurrency=_concurrency_list(options['concurrency']),
+                requests_per_client=max(1, options['requests']),
+                token_latency=max(0.0, options['token_latency']),
+                micro=not options['skip_micro'],
+                e2e=not options['skip_e2e'],
+            )
+        finally:
+            app_logger.setLevel(previous_level)
+
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                handle.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Resultado gravado em {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            for row in benchmark.compare_results(baseline, result):
+                self.stdout.write(
+                    f"{row['name']:<28} {row['metric']:<10} "
+                    f"{row['baseline']:.6g} -> {row['current']:.6g} ({row['ratio']:.2f}x)"
+                )
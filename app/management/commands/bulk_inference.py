@@ -0,0 +1,72 @@
+"""
+Comando de inferência em massa de um arquivo de prompts
+
+Responde um arquivo JSONL/CSV de prompts com um pool de processos
+workers (cada um com o seu NLPService) e grava as respostas em JSONL.
+Pode ser interrompido e retomado com ``--resume``.
+
+Uso: python manage.py bulk_inference prompts.jsonl respostas.jsonl
+     [--workers N] [--chunk-size N] [--max-in-flight N]
+     [--save] [--resume] [--model configured|stub]
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import bulk
+from app.services.mongo_repo import MongoRepository
+
+
+class Command(BaseCommand):
+    help = 'Responde um arquivo JSONL/CSV de prompts com vários processos e grava as respostas em JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Arquivo de prompts (.jsonl ou .csv)')
+        parser.add_argument('output', help='Arquivo JSONL de saída')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Processos workers, cada um com o seu modelo (0 = no próprio processo)')
+        parser.add_argument('--chunk-size', type=int, default=64,
+                            help='Prompts enviados por vez a um worker')
+        parser.add_argument('--max-in-flight', type=int, default=None,
+                            help='Blocos em memória ao mesmo tempo (padrão: 2 por worker)')
+        parser.add_argument('--save', action='store_true',
+                            help='Salva as respostas no histórico (MongoDB ou fallback SQLite)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continua a partir do checkpoint da saída')
+        parser.add_argument('--model', choices=(bulk.MODEL_CONFIGURED, bulk.MODEL_STUB),
+                            default=bulk.MODEL_CONFIGURED,
+                            help='Modelo configurado (HF_MODEL_NAME) ou o stub dos benchmarks')
+
+    def handle(self, *args, **options):
+        repo = None
+        if options['save']:
+            repo = MongoRepository.open()
+
+        runner = bulk.BulkInference(
+            options['input'], options['output'],
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            max_in_flight=options['max_in_flight'],
+            model=options['model'],
+            repository=repo,
+            resume=options['resume'],
+            progress=self._progress,
+        )
+        try:
+            stats = runner.run()
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        finally:
+            if repo is not None:
+                repo.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['answered']} respostas gravadas em {options['output']} "
+            f"({stats['errors']} erros, {stats['saved']} salvas no histórico) "
+            f"em {stats['elapsed']:.1f}s"
+        ))
+        self.stdout.write(f"Caminhos: {stats['paths']}")
+
+    def _progress(self, stats):
+        self.stdout.write(f"{stats['records']} registros processados ({stats['errors']} erros)")
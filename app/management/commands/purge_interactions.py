@@ -0,0 +1,33 @@
+"""
+Comando de retenção: arquiva e remove interações expiradas
+
+Interações mais antigas que RETENTION_DAYS são gravadas no arquivo frio
+(ARCHIVE_DIR, gzip particionado por dia) e removidas da coleção ativa.
+Deve ser agendado periodicamente (ex.: cron diário).
+
+Uso: python manage.py purge_interactions [--days N] [--batch-size N]
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+from django.core.management.base import BaseCommand
+
+from app.services.mongo_repo import MongoRepository
+
+
+class Command(BaseCommand):
+    help = 'Arquiva e remove as interações mais antigas que o prazo de retenção'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Prazo de retenção em dias (padrão: RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Interações arquivadas por lote')
+
+    def handle(self, *args, **options):
+        repo = MongoRepository.open()
+        try:
+            total = repo.purge_expired(retention_days=options['days'], batch_size=options['batch_size'])
+        finally:
+            repo.close()
+        self.stdout.write(self.style.SUCCESS(f'{total} interações arquivadas e removidas'))
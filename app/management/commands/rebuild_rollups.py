@@ -0,0 +1,26 @@
+"""
+Comando para recalcular as agregações de latência e uso
+
+Percorre o histórico completo e reconstrói as janelas por hora/dia e
+modelo usadas pelo endpoint /stats/. Útil para preencher dados antigos.
+
+Uso: python manage.py rebuild_rollups
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+from django.core.management.base import BaseCommand
+
+from app.services.mongo_repo import MongoRepository
+
+
+class Command(BaseCommand):
+    help = 'Recalcula as agregações de latência e uso a partir do histórico completo'
+
+    def handle(self, *args, **options):
+        repo = MongoRepository.open()
+        try:
+            total = repo.rebuild_rollups()
+        finally:
+            repo.close()
+        self.stdout.write(self.style.SUCCESS(f'{total} janelas de agregação recalculadas'))
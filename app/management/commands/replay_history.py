@@ -0,0 +1,102 @@
+"""
+Comando de replay do histórico exportado
+
+Reenvia os prompts de um ``chat_history.json``/``.csv`` (export_history)
+para uma instância rodando ou para o chat no próprio processo e mostra
+latência (p50/p95/p99), vazão, caminhos das respostas e taxa de erro.
+
+Uso: python manage.py replay_history chat_history.json
+     [--url http://localhost:8000/] [--api-key CHAVE]
+     [--model configured|stub] [--concurrency N]
+     [--timing original|none] [--rate 2.0] [--limit N] [--output relatorio.json]
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import benchmark, replay
+
+
+class Command(BaseCommand):
+    help = 'Reenvia o tráfego de um histórico exportado e mede latência, vazão e erros'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='chat_history.json ou chat_history.csv gerado pelo export')
+        parser.add_argument('--url', default=None,
+                            help='URL do chat de uma instância rodando (padrão: no próprio processo)')
+        parser.add_argument('--api-key', default=None, help='Enviada em X-API-Key (com --url)')
+        parser.add_argument('--model', choices=('configured', 'stub'), default='configured',
+                            help='No próprio processo: modelo configurado ou o stub dos benchmarks')
+        parser.add_argument('--concurrency', type=int, default=4, help='Clientes simultâneos')
+        parser.add_argument('--timing', choices=(replay.TIMING_ORIGINAL, replay.TIMING_NONE),
+                            default=replay.TIMING_ORIGINAL,
+                            help='original: respeita os intervalos entre prompts; none: o mais rápido possível')
+        parser.add_argument('--rate', type=float, default=1.0,
+                            help='Multiplicador da taxa original (2.0 = duas vezes mais rápido)')
+        parser.add_argument('--limit', type=int, default=None, help='Reenvia só os N primeiros prompts')
+        parser.add_argument('--output', default=None, help='Grava o relatório em JSON')
+
+    def handle(self, *args, **options):
+        try:
+            workload = replay.load_workload(options['file'], limit=options['limit'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Não foi possível ler {options["file"]}: {e}')
+        if not workload:
+            raise CommandError('Nenhum prompt encontrado no arquivo')
+
+        if options['timing'] == replay.TIMING_ORIGINAL and any(item['timestamp'] is None for item in workload):
+            self.stderr.write('Arquivo sem timestamps em todas as linhas; usando --timing none')
+
+        self.stdout.write(f'Reenviando {len(workload)} prompts...')
+        if options['url']:
+            report = self._replay(workload, replay.HttpTarget(options['url'], api_key=options['api_key']), options)
+        else:
+            service = repository = None
+            if options['model'] == 'stub':
+                service = benchmark.build_stub_service()
+                repository = benchmark.InMemoryRepository()
+            # Sem o log de cada prompt durante o replay
+            app_logger = logging.getLogger('app')
+            previous_level = app_logger.level
+            app_logger.setLevel(logging.WARNING)
+            try:
+                with replay.InProcessTarget(service, repository) as target:
+                    report = self._replay(workload, target, options)
+            finally:
+                app_logger.setLevel(previous_level)
+
+        self._print_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Relatório gravado em {options["output"]}'))
+
+    @staticmethod
+    def _replay(workload, target, options):
+        return replay.replay(
+            workload, target,
+            concurrency=max(1, options['concurrency']),
+            timing=options['timing'],
+            rate=options['rate'],
+        )
+
+    def _print_report(self, report):
+        latency = report['latency']
+        self.stdout.write(
+            f"Requisições: {report['requests']} em {report['wall_time']:.2f}s "
+            f"({report['throughput'] or 0:.2f} req/s, timing={report['timing']}, rate={report['rate']}x)"
+        )
+        if latency.get('count'):
+            self.stdout.write(
+                f"Latência: p50={latency['p50'] * 1000:.1f}ms p95={latency['p95'] * 1000:.1f}ms "
+                f"p99={latency['p99'] * 1000:.1f}ms max={latency['max'] * 1000:.1f}ms"
+            )
+        self.stdout.write(f"Erros: {report['errors']} ({report['error_rate']:.1%}) - status {report['status']}")
+        self.stdout.write(f"Caminhos: {report['paths']} (original: {report['original_paths']})")
+        lag = report.get('schedule_lag')
+        if lag and lag.get('count'):
+            self.stdout.write(f"Atraso sobre o agendado: p50={lag['p50'] * 1000:.1f}ms p99={lag['p99'] * 1000:.1f}ms")
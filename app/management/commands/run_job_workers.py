@@ -0,0 +1,51 @@
+"""
+Workers dedicados da fila de jobs assíncronos
+
+Processa os jobs enfileirados pelo endpoint /jobs/ fora do processo web.
+Use com JOB_WORKERS=0 nos processos web para que apenas estes workers
+ocupem o modelo. Pode ser reiniciado a qualquer momento: jobs pendentes
+continuam na fila e jobs interrompidos voltam para ela.
+
+Uso: python manage.py run_job_workers [--workers N]
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.services.jobs import JobWorkerPool
+from app.services.mongo_repo import MongoRepository
+from app.services.nlp_service import NLPService
+
+
+class Command(BaseCommand):
+    help = 'Executa workers que processam a fila persistente de jobs de geração'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Número de workers (padrão: JOB_WORKERS ou 1)')
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or max(getattr(settings, 'JOB_WORKERS', 1), 1)
+        repo = MongoRepository.open()
+        pool = JobWorkerPool(NLPService(), repo, workers=workers)
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        pool.start()
+        self.stdout.write(self.style.SUCCESS(f'{workers} workers de jobs em execução (Ctrl+C para encerrar)'))
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # O job em andamento termina antes do encerramento
+            pool.stop()
+            repo.close()
+        self.stdout.write('Workers de jobs encerrados')
@@ -0,0 +1,199 @@
+"""
+Middlewares da aplicação
+
+TracingMiddleware abre o trace de cada requisição (request id e spans das
+etapas) e devolve o id em ``X-Request-ID`` e o resumo dos tempos em
+``Server-Timing``.
+
+RateLimitMiddleware aplica os limites por cliente (ver
+``services.ratelimit``) às rotas que geram respostas: chat, lote e jobs.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import math
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from .services import metrics, ratelimit, tracing
+from .services.nlp_service import NLPService
+
+
+class TracingMiddleware:
+    """Inicia um trace por requisição (funciona sob WSGI e ASGI)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        trace, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            tracing.end_trace(token)
+        return self._finish(trace, response)
+
+    async def __acall__(self, request):
+        trace, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            tracing.end_trace(token)
+        return self._finish(trace, response)
+
+    @staticmethod
+    def _start(request):
+        request_id = tracing.new_request_id(request.headers.get('X-Request-ID'))
+        trace, token = tracing.start_trace(request_id)
+        request.trace = trace
+        return trace, token
+
+    @staticmethod
+    def _finish(trace, response):
+        response['X-Request-ID'] = trace.request_id
+        if getattr(settings, 'SERVER_TIMING', True):
+            response['Server-Timing'] = trace.server_timing()
+        return response
+
+
+class RateLimitMiddleware:
+    """
+    Limita prompts por cliente com orçamentos separados para o modelo e
+    para os caminhos rápidos; acima do limite responde 429.
+
+    Cada prompt custa um token do orçamento do caminho que vai atendê-lo
+    (um lote consome dos dois conforme os seus prompts; jobs sempre vão ao
+    modelo). Respostas levam ``X-RateLimit-Limit``, ``X-RateLimit-Remaining``
+    e ``X-RateLimit-Reset`` (segundos até o bucket encher); o 429 também
+    traz ``Retry-After``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    # Rotas (url_name) que consomem tokens
+    LIMITED_ROUTES = ('chat', 'batch', 'jobs')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        limiter = self._limiter_for(request)
+        if limiter is None:
+            return self.get_response(request)
+        decision = self._check(limiter, request)
+        if not decision.allowed:
+            return self._too_many_requests(decision)
+        return self._set_headers(self.get_response(request), decision)
+
+    async def __acall__(self, request):
+        limiter = self._limiter_for(request)
+        if limiter is None:
+            return await self.get_response(request)
+        if limiter.store.blocking:
+            decision = await sync_to_async(self._check)(limiter, request)
+        else:
+            decision = self._check(limiter, request)
+        if not decision.allowed:
+            return self._too_many_requests(decision)
+        return self._set_headers(await self.get_response(request), decision)
+
+    def _limiter_for(self, request):
+        """Rate limiter a aplicar, ou None se a requisição não é limitada."""
+        if request.method != 'POST':
+            return None
+        limiter = ratelimit.get_rate_limiter()
+        if limiter is None:
+            return None
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        if url_name not in self.LIMITED_ROUTES:
+            return None
+        request.rate_limit_route = url_name
+        return limiter
+
+    def _check(self, limiter, request):
+        """
+        Consome os tokens da requisição e retorna a decisão mais restritiva.
+
+        Se um orçamento recusa, os tokens já consumidos nos outros são
+        devolvidos: a requisição recusada não gasta nada.
+        """
+        client = ratelimit.client_key(request)
+        decisions = []
+        taken = []
+        for budget_name, cost in self._costs(request).items():
+            if not cost:
+                continue
+            # Um lote maior que o burst só passa com o bucket cheio (e o esvazia)
+            cost = min(cost, limiter.budgets[budget_name].burst)
+            decision = limiter.take(client, budget_name, cost)
+            if not decision.allowed:
+                metrics.inc('pln_rate_limited_total', budget=budget_name)
+                for taken_budget, taken_cost in taken:
+                    limiter.refund(client, taken_budget, taken_cost)
+                return decision
+            decisions.append(decision)
+            taken.append((budget_name, cost))
+        return min(decisions, key=lambda decision: decision.remaining)
+
+    @staticmethod
+    def _costs(request):
+        """Prompts da requisição por orçamento (model/fast)."""
+        costs = {ratelimit.BUDGET_MODEL: 0, ratelimit.BUDGET_FAST: 0}
+        if request.rate_limit_route == 'jobs':
+            costs[ratelimit.BUDGET_MODEL] = 1
+            return costs
+        try:
+            data = json.loads(request.body)
+        except (ValueError, UnicodeDecodeError):
+            data = None
+        if request.rate_limit_route == 'batch':
+            prompts = data.get('prompts') if isinstance(data, dict) else data
+        else:
+            prompts = [data.get('prompt')] if isinstance(data, dict) else None
+        if not isinstance(prompts, list) or not prompts:
+            # Body inválido: a view rejeita sem chamar o modelo
+            costs[ratelimit.BUDGET_FAST] = 1
+            return costs
+        for prompt in prompts:
+            if isinstance(prompt, str) and NLPService.is_fast_path(prompt):
+                costs[ratelimit.BUDGET_FAST] += 1
+            else:
+                costs[ratelimit.BUDGET_MODEL] += 1
+        return costs
+
+    @staticmethod
+    def _set_headers(response, decision):
+        response['X-RateLimit-Limit'] = str(decision.limit)
+        response['X-RateLimit-Remaining'] = str(decision.remaining)
+        response['X-RateLimit-Reset'] = str(math.ceil(decision.reset))
+        return response
+
+    def _too_many_requests(self, decision):
+        retry_after = max(1, math.ceil(decision.retry_after))
+        response = JsonResponse({
+            'error': f'Limite de requisições excedido. Tente novamente em {retry_after} segundos.',
+            'retry_after': retry_after,
+        }, status=429)
+        response['Retry-After'] = str(retry_after)
+        return self._set_headers(response, decision)
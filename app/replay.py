@@ -0,0 +1,233 @@
+"""
+Replay de tráfego real a partir do histórico exportado
+
+Lê um ``chat_history.json`` ou ``chat_history.csv`` gerado por
+``export_history`` e reenvia os prompts, na ordem em que chegaram, para
+uma instância rodando (``--url``) ou para o ``chat_view`` no próprio
+processo (com o modelo configurado ou com o modelo stub dos benchmarks).
+
+Dois modos de temporização:
+
+- ``original``: cada prompt é disparado no mesmo instante relativo em que
+  chegou originalmente, dividido pelo multiplicador de taxa (2.0 = duas
+  vezes mais rápido); se todos os clientes estiverem ocupados ele espera,
+  e o atraso em relação ao agendado entra no relatório;
+- ``none``: os clientes enviam o próximo prompt assim que recebem a
+  resposta anterior (vazão máxima).
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import csv
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from .benchmark import summarize
+
+TIMING_ORIGINAL = 'original'
+TIMING_NONE = 'none'
+
+# Cabeçalhos do CSV exportado -> campos do JSON exportado
+CSV_FIELDS = {
+    'Timestamp': 'timestamp',
+    'Prompt': 'prompt',
+    'Path': 'path',
+    'Model': 'model',
+    'Processing Time (s)': 'processing_time',
+}
+
+
+def _parse_timestamp(value):
+    if not value or value == 'None':
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def load_workload(path, limit=None):
+    """
+    Lê o arquivo exportado e devolve os prompts em ordem de chegada.
+
+    Args:
+        path (str): arquivo ``.json`` ou ``.csv`` do export_history
+        limit (int, optional): usa apenas os N primeiros prompts
+
+    Returns:
+        list: dicts com ``prompt``, ``timestamp`` (epoch ou None) e o
+        ``path`` registrado originalmente
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with path.open(encoding='utf-8-sig', newline='') as handle:
+            records = [
+                {field: row.get(header) for header, field in CSV_FIELDS.items()}
+                for row in csv.DictReader(handle)
+            ]
+    else:
+        with path.open(encoding='utf-8') as handle:
+            records = json.load(handle)
+        if not isinstance(records, list):
+            raise ValueError('O JSON exportado deve ser uma lista de interações')
+
+    workload = []
+    for record in records:
+        prompt = (record.get('prompt') or '').strip()
+        if prompt:
+            workload.append({
+                'prompt': prompt,
+                'timestamp': _parse_timestamp(record.get('timestamp')),
+                'path': record.get('path') or None,
+            })
+
+    # O export vem do mais recente para o mais antigo
+    if all(item['timestamp'] is not None for item in workload):
+        workload.sort(key=lambda item: item['timestamp'])
+    else:
+        workload.reverse()
+    return workload[:limit] if limit else workload
+
+
+class HttpTarget:
+    """Envia os prompts para o chat de uma instância rodando."""
+
+    def __init__(self, url, api_key=None, timeout=120):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def send(self, prompt):
+        """
+        Returns:
+            tuple: (status HTTP, caminho da resposta ou None)
+        """
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['X-API-Key'] = self.api_key
+        request = urllib.request.Request(
+            self.url, data=json.dumps({'prompt': prompt}).encode('utf-8'), headers=headers,
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = json.loads(response.read().decode('utf-8'))
+                return response.status, data.get('path')
+        except urllib.error.HTTPError as e:
+            return e.code, None
+        except (urllib.error.URLError, OSError, ValueError):
+            return 0, None
+
+
+class InProcessTarget:
+    """Chama o ``chat_view`` (atrás do middleware de tracing) no próprio processo."""
+
+    def __init__(self, service=None, repository=None):
+        from django.test import RequestFactory
+
+        from . import views
+        from .middleware import TracingMiddleware
+
+        self.views = views
+        self.service = service
+        self.repository = repository
+        self.factory = RequestFactory()
+        self.handler = TracingMiddleware(views.chat_view)
+
+    def __enter__(self):
+        # Substitui o serviço e o repositório das views só durante o replay
+        self._previous = (self.views.nlp_service, self.views.mongo_repo)
+        if self.service is not None:
+            self.views.nlp_service = self.service
+        if self.repository is not None:
+            self.views.mongo_repo = self.repository
+        return self
+
+    def __exit__(self, *exc_info):
+        self.views.nlp_service, self.views.mongo_repo = self._previous
+
+    def send(self, prompt):
+        request = self.factory.post('/', data=json.dumps({'prompt': prompt}), content_type='application/json')
+        response = self.handler(request)
+        try:
+            path = json.loads(response.content).get('path')
+        except ValueError:
+            path = None
+        return response.status_code, path
+
+
+def replay(workload, target, concurrency=4, timing=TIMING_ORIGINAL, rate=1.0):
+    """
+    Reenvia a carga para o alvo e mede o resultado.
+
+    Args:
+        workload (list): saída de ``load_workload``
+        target: HttpTarget ou InProcessTarget (qualquer objeto com ``send(prompt)``)
+        concurrency (int): clientes simultâneos
+        timing (str): TIMING_ORIGINAL ou TIMING_NONE
+        rate (float): multiplicador da taxa original (só em TIMING_ORIGINAL)
+
+    Returns:
+        dict: latência (p50/p95/p99), vazão, taxa de erro, status, caminhos
+        (no replay e no tráfego original) e atraso em relação ao agendado
+    """
+    if timing == TIMING_ORIGINAL and any(item['timestamp'] is None for item in workload):
+        timing = TIMING_NONE
+    rate = rate if rate and rate > 0 else 1.0
+
+    results = [None] * len(workload)
+    lags = []
+    lock = threading.Lock()
+    first_timestamp = workload[0]['timestamp'] if workload else None
+    started = time.perf_counter()
+
+    def run(index, due=None):
+        begin = time.perf_counter()
+        if due is not None:
+            with lock:
+                lags.append(max(0.0, begin - due))
+        try:
+            status, path = target.send(workload[index]['prompt'])
+        except Exception:
+            # Falha do cliente conta como erro (status 0)
+            status, path = 0, None
+        latency = time.perf_counter() - begin
+        results[index] = (status, path, latency)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        if timing == TIMING_ORIGINAL:
+            for index, item in enumerate(workload):
+                due = started + (item['timestamp'] - first_timestamp) / rate
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(run, index, due)
+        else:
+            pool.map(run, range(len(workload)))
+    wall_time = time.perf_counter() - started
+
+    completed = [result for result in results if result is not None]
+    errors = sum(1 for status, _, _ in completed if not 200 <= status < 300)
+    report = {
+        'requests': len(completed),
+        'timing': timing,
+        'rate': rate,
+        'concurrency': concurrency,
+        'wall_time': wall_time,
+        'throughput': len(completed) / wall_time if wall_time else None,
+        'errors': errors,
+        'error_rate': errors / len(completed) if completed else 0.0,
+        'status': dict(Counter(str(status) for status, _, _ in completed)),
+        'latency': summarize([latency for _, _, latency in completed]),
+        'paths': dict(Counter(path for status, path, _ in completed if path and 200 <= status < 300)),
+        'original_paths': dict(Counter(item['path'] for item in workload if item['path'])),
+    }
+    if timing == TIMING_ORIGINAL:
+        report['schedule_lag'] = summarize(lags)
+    return report
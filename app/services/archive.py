@@ -0,0 +1,146 @@
+"""
+Arquivo frio de interações expiradas
+
+Guarda interações antigas em arquivos JSON Lines comprimidos (gzip),
+particionados por data (ARCHIVE_DIR/AAAA/MM/AAAA-MM-DD.jsonl.gz), para
+que a coleção principal e seus índices permaneçam pequenos sem perder
+o histórico, que continua disponível para exportação sob demanda.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import gzip
+import json
+import logging
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveStore:
+    """
+    Armazenamento de interações arquivadas em partições diárias comprimidas.
+
+    Cada execução do arquivamento acrescenta um novo membro gzip à partição
+    do dia; a leitura trata os membros concatenados como um único arquivo.
+    """
+
+    def __init__(self, base_dir):
+        """
+        Args:
+            base_dir (str | Path): diretório raiz do arquivo
+        """
+        self.base_dir = Path(base_dir)
+
+    def partition_path(self, day):
+        """Retorna o caminho da partição de uma data."""
+        return self.base_dir / f"{day:%Y}" / f"{day:%m}" / f"{day:%Y-%m-%d}.jsonl.gz"
+
+    def append(self, interactions):
+        """
+        Acrescenta interações às partições das suas datas.
+
+        Args:
+            interactions (iterable): dicts com ao menos o campo timestamp
+
+        Returns:
+            int: número de interações arquivadas
+        """
+        by_day = {}
+        for interaction in interactions:
+            timestamp = interaction.get('timestamp') or datetime.now()
+            by_day.setdefault(timestamp.date(), []).append(interaction)
+
+        total = 0
+        for day, items in by_day.items():
+            path = self.partition_path(day)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(path, 'at', encoding='utf-8') as archive_file:
+                for interaction in items:
+                    archive_file.write(json.dumps(self._serialize(interaction), ensure_ascii=False))
+                    archive_file.write('\n')
+            total += len(items)
+            logger.info("%s interações arquivadas em %s", len(items), path)
+        return total
+
+    def partitions(self):
+        """
+        Lista as datas que possuem partição, da mais recente para a mais antiga.
+
+        Returns:
+            list: objetos date
+        """
+        days = []
+        for path in self.base_dir.glob('*/*/*.jsonl.gz'):
+            try:
+                days.append(date.fromisoformat(path.name[:10]))
+            except ValueError:
+                continue
+        return sorted(days, reverse=True)
+
+    def iter_interactions(self, date_from=None, date_to=None):
+        """
+        Lê as interações arquivadas sob demanda, da mais recente para a mais antiga.
+
+        Apenas as partições dentro do intervalo são abertas.
+
+        Args:
+            date_from (date, optional): data inicial (inclusiva)
+            date_to (date, optional): data final (inclusiva)
+
+        Yields:
+            dict: interação com timestamp convertido para datetime
+        """
+        for day in self.partitions():
+            if date_from and day < date_from:
+                continue
+            if date_to and day > date_to:
+                continue
+
+            interactions = []
+            seen_ids = set()
+            try:
+                with gzip.open(self.partition_path(day), 'rt', encoding='utf-8') as archive_file:
+                    for line in archive_file:
+                        if not line.strip():
+                            continue
+                        interaction = self._deserialize(json.loads(line))
+                        # Um arquivamento interrompido pode ter gravado a mesma interação duas vezes
+                        interaction_id = interaction.get('_id')
+                        if interaction_id is not None:
+                            if interaction_id in seen_ids:
+                                continue
+                            seen_ids.add(interaction_id)
+                        interactions.append(interaction)
+            except (OSError, EOFError, json.JSONDecodeError) as e:
+                logger.error("Erro ao ler partição arquivada %s: %s", day, e)
+
+            interactions.sort(key=lambda item: item['timestamp'], reverse=True)
+            yield from interactions
+
+    @staticmethod
+    def _serialize(interaction):
+        """Converte a interação para um dict serializável em JSON."""
+        data = {}
+        for key, value in interaction.items():
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif key == '_id':
+                value = str(value)
+            data[key] = value
+        return data
+
+    @staticmethod
+    def _deserialize(data):
+        """Converte o timestamp de volta para datetime."""
+        try:
+            data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            data['timestamp'] = datetime.min
+        return data
+
+
+def retention_cutoff(retention_days, now=None):
+    """Retorna o instante a partir do qual as interações são mantidas."""
+    return (now or datetime.now()) - timedelta(days=retention_days)
@@ -0,0 +1,160 @@
+"""
+Geração assistida (decodificação especulativa) com um modelo rascunho
+
+Um modelo causal pequeno (ASSISTANT_MODEL_NAME) propõe alguns tokens de
+cada vez e o modelo principal verifica todos em uma única passada, usando
+o ``assistant_model`` do ``generate`` da Hugging Face. Com amostragem a
+verificação preserva a distribuição do modelo principal; o ganho vem de
+cada passada do modelo principal produzir mais de um token.
+
+O rascunho só é usado quando tem exatamente o mesmo vocabulário do modelo
+principal; caso contrário (ou se não carregar) a geração segue sem ele.
+
+A taxa de aceitação e o speedup de cada geração são estimados contando as
+passadas (forward) dos dois modelos: cada passada do rascunho propõe um
+token e cada passada do principal aceita parte deles e acrescenta um.
+
+O rascunho e os contadores ficam juntos em um ``AssistedDecoding``: cada
+geração usa a instância que estava ativa quando começou, e desabilitar o
+rascunho só remove os contadores depois que as gerações em andamento
+terminam.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import logging
+import threading
+
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+
+def tokenizers_compatible(tokenizer, draft_tokenizer):
+    """O rascunho precisa usar os mesmos ids de token que o modelo principal."""
+    return (
+        tokenizer.get_vocab() == draft_tokenizer.get_vocab()
+        and tokenizer.eos_token_id == draft_tokenizer.eos_token_id
+    )
+
+
+def load_draft_model(name, tokenizer, device, num_tokens=None):
+    """
+    Carrega o modelo rascunho se ele for compatível com o tokenizer principal.
+
+    Args:
+        name (str): nome do modelo rascunho na Hugging Face
+        tokenizer: tokenizer do modelo principal
+        device (torch.device): dispositivo do modelo principal
+        num_tokens (int, optional): tokens propostos por rodada (valor
+            inicial; a Hugging Face ajusta conforme as aceitações)
+
+    Returns:
+        modelo rascunho ou None (incompatível ou falha ao carregar)
+    """
+    try:
+        config = AutoConfig.from_pretrained(name)
+        if getattr(config, 'is_encoder_decoder', False):
+            logger.warning("Modelo rascunho %s não é causal; geração assistida desabilitada", name)
+            return None
+        draft_tokenizer = AutoTokenizer.from_pretrained(name)
+        if not tokenizers_compatible(tokenizer, draft_tokenizer):
+            logger.warning("Tokenizer do modelo rascunho %s é incompatível; geração assistida desabilitada", name)
+            return None
+        draft = AutoModelForCausalLM.from_pretrained(name)
+        draft.to(device)
+        draft.eval()
+    except Exception as e:
+        logger.warning("Falha ao carregar o modelo rascunho %s: %s", name, e)
+        return None
+
+    if num_tokens:
+        draft.generation_config.num_assistant_tokens = num_tokens
+    logger.info("Modelo rascunho carregado: %s", name)
+    return draft
+
+
+class ForwardCounter:
+    """
+    Conta as passadas (forward) de um modelo feitas pela thread atual.
+
+    O contador é por thread para que gerações simultâneas no mesmo modelo
+    não se misturem.
+    """
+
+    def __init__(self, module):
+        self._local = threading.local()
+        self._handle = module.register_forward_pre_hook(self._hook)
+
+    def _hook(self, module, args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def remove(self):
+        self._handle.remove()
+
+
+class AssistedDecoding:
+    """
+    Modelo rascunho e contadores de passadas de uma configuração de geração assistida.
+
+    Cada geração chama ``acquire()`` antes de usar a instância e
+    ``release()`` ao terminar; ``retire()`` marca a instância como
+    substituída e os hooks dos contadores são removidos quando a última
+    geração termina.
+    """
+
+    def __init__(self, model, draft):
+        self.draft = draft
+        self.target_counter = ForwardCounter(model)
+        self.draft_counter = ForwardCounter(draft)
+        self._lock = threading.Lock()
+        self._users = 0
+        self._retired = False
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            remove = self._retired and self._users == 0
+        if remove:
+            self._remove_counters()
+
+    def retire(self):
+        """Deixa de ser usada; os contadores saem quando não houver geração em andamento."""
+        with self._lock:
+            self._retired = True
+            remove = self._users == 0
+        if remove:
+            self._remove_counters()
+
+    def _remove_counters(self):
+        self.target_counter.remove()
+        self.draft_counter.remove()
+
+
+def assisted_stats(generated_tokens, target_passes, draft_passes):
+    """
+    Estatísticas de uma geração assistida.
+
+    Returns:
+        dict: ``draft_proposed`` e ``draft_accepted`` (tokens),
+        ``draft_acceptance`` (aceitos / propostos) e ``draft_speedup``
+        (tokens gerados por passada do modelo principal, 1.0 sem ganho)
+    """
+    accepted = max(0, min(generated_tokens - target_passes, draft_passes))
+    return {
+        'draft_proposed': draft_passes,
+        'draft_accepted': accepted,
+        'draft_acceptance': accepted / draft_passes if draft_passes else None,
+        'draft_speedup': generated_tokens / target_passes if target_passes else None,
+    }
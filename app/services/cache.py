@@ -0,0 +1,147 @@
+"""
+Cache de leitura do histórico invalidado por geração
+
+Páginas renderizadas do histórico e snapshots de exportação são guardados
+no cache do Django junto com a "geração" dos dados no momento em que foram
+produzidos. Toda escrita no repositório incrementa a geração, o que torna
+as entradas antigas inválidas sem precisar apagá-las uma a uma.
+
+Dashboards que aceitam dados um pouco desatualizados podem informar uma
+tolerância (``Cache-Control: max-stale=N``) e receber a entrada anterior
+mesmo depois de uma escrita, até N segundos após ela ter sido gerada.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'history:generation'
+
+_MAX_STALE_PATTERN = re.compile(r'max-stale(?:\s*=\s*"?(\d+)"?)?', re.IGNORECASE)
+
+
+class HistoryCache:
+    """Cache read-through das leituras do histórico, invalidado por geração."""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'HISTORY_CACHE_TIMEOUT', 300)
+
+    def generation(self):
+        """Retorna a geração atual dos dados do histórico."""
+        generation = self.backend.get(GENERATION_KEY)
+        if generation is None:
+            # add() não sobrescreve um valor criado por outro processo
+            self.backend.add(GENERATION_KEY, 0, timeout=None)
+            generation = self.backend.get(GENERATION_KEY, 0)
+        return generation
+
+    def bump(self):
+        """Incrementa a geração, invalidando todas as entradas do histórico."""
+        try:
+            try:
+                return self.backend.incr(GENERATION_KEY)
+            except ValueError:
+                # Chave ausente (cache reiniciado ou expirado)
+                self.backend.add(GENERATION_KEY, 1, timeout=None)
+                return self.backend.get(GENERATION_KEY, 1)
+        except Exception as e:
+            logger.error("Erro ao invalidar cache do histórico: %s", e)
+            return None
+
+    @staticmethod
+    def make_key(namespace, params):
+        """Monta a chave do cache a partir do namespace e dos parâmetros."""
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return f'history:{namespace}:{digest}'
+
+    def get(self, namespace, params, max_staleness=0):
+        """
+        Busca uma entrada válida no cache.
+
+        Args:
+            namespace (str): tipo de leitura ('page', 'export', ...)
+            params (dict): filtros, página etc. que identificam a leitura
+            max_staleness (float): segundos de tolerância para entradas de
+                gerações anteriores
+
+        Returns:
+            valor em cache ou None se não houver entrada utilizável
+        """
+        if not self.timeout:
+            return None
+        try:
+            entry = self.backend.get(self.make_key(namespace, params))
+            if entry is not None:
+                fresh = entry['generation'] == self.generation()
+                if fresh or (max_staleness and time.time() - entry['created_at'] <= max_staleness):
+                    metrics.inc('pln_cache_hits_total', cache=namespace)
+                    return entry['value']
+        except Exception as e:
+            logger.error("Erro ao ler cache do histórico: %s", e)
+        metrics.inc('pln_cache_misses_total', cache=namespace)
+        return None
+
+    def set(self, namespace, params, value, generation):
+        """
+        Guarda uma entrada produzida a partir dos dados da geração informada.
+
+        A geração deve ser lida ANTES de consultar o banco: assim uma escrita
+        concorrente nunca fica mascarada por uma entrada marcada como atual.
+        """
+        if not self.timeout:
+            return
+        try:
+            self.backend.set(
+                self.make_key(namespace, params),
+                {'generation': generation, 'created_at': time.time(), 'value': value},
+                timeout=self.timeout,
+            )
+        except Exception as e:
+            logger.error("Erro ao gravar cache do histórico: %s", e)
+
+
+def requested_staleness(cache_control):
+    """
+    Calcula a tolerância a dados desatualizados pedida pelo cliente.
+
+    Usa ``max-stale`` do header Cache-Control quando presente, senão
+    HISTORY_CACHE_STALENESS; o resultado é limitado por
+    HISTORY_CACHE_MAX_STALENESS.
+
+    Args:
+        cache_control (str): valor do header Cache-Control (pode ser vazio)
+
+    Returns:
+        float: segundos de tolerância
+    """
+    limit = getattr(settings, 'HISTORY_CACHE_MAX_STALENESS', 60)
+    staleness = getattr(settings, 'HISTORY_CACHE_STALENESS', 0)
+
+    match = _MAX_STALE_PATTERN.search(cache_control or '')
+    if match:
+        # max-stale sem valor: aceita qualquer idade (até o limite)
+        staleness = int(match.group(1)) if match.group(1) else limit
+    return max(0, min(staleness, limit))
+
+
+# Instância compartilhada pelo repositório e pelas views
+history_cache = HistoryCache()
@@ -0,0 +1,122 @@
+"""
+Cancelamento cooperativo da geração
+
+A view cria um ``CancelToken`` por requisição (com o prazo de
+CHAT_DEADLINE_SECONDS, se configurado) e o ativa com ``use_token``; o
+token fica em uma ContextVar, então acompanha a tarefa até a thread do
+executor do modelo. A view assíncrona cancela o token quando o cliente
+desconecta (o Django cancela a view ao receber ``http.disconnect``).
+
+O NLPService consulta o token entre as etapas (antes da geração, das
+regenerações e da API de inferência) e ``CancelledStoppingCriteria``
+interrompe o ``generate`` no próximo passo da decodificação, liberando a
+vaga do executor em vez de terminar uma resposta que ninguém vai ler.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+import torch
+from transformers import StoppingCriteria
+
+REASON_DISCONNECT = 'disconnect'
+REASON_DEADLINE = 'deadline'
+
+
+class GenerationCancelled(BaseException):
+    """
+    O trabalho da requisição foi cancelado (cliente desconectado ou prazo).
+
+    Herda de BaseException, como ``asyncio.CancelledError``, para não ser
+    engolida pelos ``except Exception`` que tentam regenerar ou recorrer à
+    API de inferência.
+    """
+
+    def __init__(self, reason):
+        self.reason = reason
+        super().__init__(f'Geração cancelada ({reason})')
+
+
+class CancelToken:
+    """
+    Sinal de cancelamento de uma requisição.
+
+    Args:
+        deadline (float, optional): instante (``time.monotonic``) a partir do
+            qual o token conta como cancelado por prazo
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self._reason = None
+
+    @classmethod
+    def with_timeout(cls, seconds):
+        """Token com prazo de ``seconds`` a partir de agora (sem prazo se vazio ou 0)."""
+        return cls(time.monotonic() + seconds if seconds else None)
+
+    def cancel(self, reason=REASON_DISCONNECT):
+        """Cancela o trabalho da requisição."""
+        if self._reason is None:
+            self._reason = reason
+
+    @property
+    def reason(self):
+        """Motivo do cancelamento ou None se a requisição continua ativa."""
+        if self._reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(REASON_DEADLINE)
+        return self._reason
+
+    @property
+    def remaining(self):
+        """Segundos até o prazo (None sem prazo)."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def raise_if_cancelled(self):
+        reason = self.reason
+        if reason is not None:
+            raise GenerationCancelled(reason)
+
+
+_current_token = contextvars.ContextVar('cancel_token', default=None)
+
+
+def current_token():
+    """Token da requisição em andamento (None fora de uma requisição)."""
+    return _current_token.get()
+
+
+@contextmanager
+def use_token(token):
+    """Ativa o token no contexto atual (e nas tarefas despachadas a partir dele)."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def raise_if_cancelled():
+    """Levanta GenerationCancelled se a requisição em andamento foi cancelada."""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+class CancelledStoppingCriteria(StoppingCriteria):
+    """Encerra todas as linhas do ``generate`` quando o token é cancelado."""
+
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        return torch.full((input_ids.shape[0],), self.token.cancelled, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,77 @@
+"""
+Agrupamento de chamadas idênticas em andamento (single-flight)
+
+Quando várias threads pedem o mesmo resultado ao mesmo tempo (o mesmo
+prompt canônico, por exemplo), só a primeira executa a função; as demais
+esperam e recebem o mesmo resultado - ou a mesma exceção. Assim que a
+chamada termina a chave é liberada: não é um cache, chamadas posteriores
+executam de novo. Quem espera desiste se a própria requisição for
+cancelada (ver cancellation); a chamada continua para os demais.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import threading
+
+from . import cancellation
+
+# Intervalo (segundos) entre as verificações de cancelamento de quem espera
+WAIT_POLL_INTERVAL = 0.1
+
+
+class _Call:
+    """Uma chamada em andamento e quem está esperando por ela."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Executa no máximo uma chamada por chave ao mesmo tempo."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, *args, **kwargs):
+        """
+        Executa ``fn`` ou aguarda a chamada já em andamento com a mesma chave.
+
+        Returns:
+            tuple: (resultado, compartilhado) - ``compartilhado`` é True
+            quando o resultado veio da chamada de outra thread
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+
+        if not leader:
+            # Espera em intervalos curtos para desistir se a própria requisição for cancelada
+            while not call.done.wait(WAIT_POLL_INTERVAL):
+                cancellation.raise_if_cancelled()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        """Número de chaves com chamada em andamento."""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,285 @@
+"""
+Executor limitado e com prioridades para o trabalho do modelo
+
+As views não podem executar a geração à vontade: o trabalho do modelo é
+despachado para um pool de threads de tamanho fixo, com uma fila
+limitada. Quando a fila enche, a requisição é recusada imediatamente em
+vez de acumular conexões esperando indefinidamente.
+
+Cada tarefa tem uma classe de prioridade (``interactive`` para o chat,
+``bulk`` para lotes, jobs e integrações; ver ``request_priority``). A
+thread livre escolhe a próxima tarefa conforme MODEL_SCHEDULER_POLICY:
+
+- ``strict``: sempre a classe mais prioritária com tarefas na fila; para
+  não haver inanição, uma tarefa de classe inferior que espera há mais de
+  MODEL_PRIORITY_MAX_WAIT segundos passa à frente;
+- ``weighted``: round-robin ponderado entre as classes com tarefas na
+  fila (MODEL_PRIORITY_WEIGHTS), que divide as threads na proporção dos
+  pesos quando as duas classes têm trabalho.
+
+Tarefas ``bulk`` ocupam no máximo MODEL_EXECUTOR_BULK_QUEUE vagas da
+fila, de modo que um lote grande não recusa o tráfego interativo. A
+geração em andamento não é interrompida: uma tarefa interativa espera no
+máximo a geração em curso de uma das threads.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+# Da mais para a menos prioritária
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+POLICY_STRICT = 'strict'
+POLICY_WEIGHTED = 'weighted'
+
+DEFAULT_WEIGHTS = {PRIORITY_INTERACTIVE: 4, PRIORITY_BULK: 1}
+
+
+class ExecutorBusy(Exception):
+    """Levantada quando a fila do executor do modelo está cheia."""
+
+
+def parse_weights(value):
+    """Converte ``interactive=4,bulk=1`` em dict (classes ausentes ficam com o peso padrão)."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in (value or '').split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name in weights and weight.strip():
+            weights[name] = max(1, int(weight))
+    return weights
+
+
+def request_priority(request, default=PRIORITY_INTERACTIVE):
+    """
+    Classe de prioridade de uma requisição.
+
+    Chaves de API listadas em BULK_API_KEYS são sempre ``bulk``; o header
+    ``X-Priority: bulk`` rebaixa a requisição; senão vale o padrão do
+    endpoint. O header só rebaixa: ninguém se promove a interativo.
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in getattr(settings, 'BULK_API_KEYS', ()):
+        return PRIORITY_BULK
+    if request.headers.get('X-Priority', '').strip().lower() == PRIORITY_BULK:
+        return PRIORITY_BULK
+    return default
+
+
+class _Task:
+    """Uma tarefa na fila do executor."""
+
+    __slots__ = ('future', 'fn', 'args', 'kwargs', 'priority', 'enqueued_at')
+
+    def __init__(self, future, fn, args, kwargs, priority):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+
+class ModelExecutor:
+    """
+    Pool de threads com capacidade limitada e fila por classe de prioridade.
+
+    No máximo ``max_workers`` tarefas executam ao mesmo tempo e outras
+    ``max_queue`` aguardam na fila (``bulk_queue`` delas, no máximo, da
+    classe bulk); além disso ``submit`` levanta ExecutorBusy.
+    """
+
+    def __init__(self, max_workers, max_queue, policy=POLICY_STRICT, weights=None,
+                 max_wait=10.0, bulk_queue=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.max_wait = max_wait
+        self.limits = {
+            PRIORITY_INTERACTIVE: max_workers + max_queue,
+            PRIORITY_BULK: max_workers + (max_queue if bulk_queue is None else min(bulk_queue, max_queue)),
+        }
+        self._queues = {priority: deque() for priority in PRIORITY_CLASSES}
+        self._credits = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._pending_by_class = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._pending = 0
+        self._threads = []
+        for index in range(max_workers):
+            thread = threading.Thread(target=self._worker, name=f'model-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def pending(self):
+        """Número de tarefas em execução ou aguardando na fila."""
+        return self._pending
+
+    def pending_by_class(self):
+        """Tarefas em execução ou na fila, por classe de prioridade."""
+        with self._condition:
+            return dict(self._pending_by_class)
+
+    def submit(self, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Agenda uma tarefa no pool.
+
+        Returns:
+            concurrent.futures.Future: resultado da tarefa
+
+        Raises:
+            ExecutorBusy: se não houver vaga na fila para a classe
+        """
+        if priority not in self._queues:
+            raise ValueError(f'Classe de prioridade desconhecida: {priority}')
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('Executor encerrado')
+            if self._pending >= self.limits[PRIORITY_INTERACTIVE] or \
+                    self._pending_by_class[priority] >= self.limits[priority]:
+                raise ExecutorBusy('Fila do modelo cheia')
+            self._pending += 1
+            self._pending_by_class[priority] += 1
+            self._queues[priority].append(_Task(future, fn, args, kwargs, priority))
+            self._condition.notify()
+        metrics.add_gauge('pln_executor_queued', 1, priority=priority)
+        # Tarefa cancelada ainda na fila libera a vaga na hora (a executada, ao terminar)
+        future.add_done_callback(lambda done: done.cancelled() and self._release(priority))
+        return future
+
+    def _release(self, priority):
+        """Libera a vaga ocupada por uma tarefa."""
+        with self._condition:
+            self._pending -= 1
+            self._pending_by_class[priority] -= 1
+
+    def _next_task(self):
+        """Escolhe a próxima tarefa conforme a política (chamado com a condição adquirida)."""
+        waiting = [priority for priority in PRIORITY_CLASSES if self._queues[priority]]
+        if not waiting:
+            return None
+
+        if self.policy == POLICY_WEIGHTED:
+            # Round-robin ponderado suave (o mesmo do nginx) entre as classes com fila
+            total = 0
+            for priority in waiting:
+                self._credits[priority] += self.weights.get(priority, 1)
+                total += self.weights.get(priority, 1)
+            chosen = max(waiting, key=lambda priority: self._credits[priority])
+            self._credits[chosen] -= total
+        else:
+            chosen = waiting[0]
+            if self.max_wait is not None:
+                now = time.monotonic()
+                starving = [
+                    priority for priority in waiting[1:]
+                    if now - self._queues[priority][0].enqueued_at >= self.max_wait
+                ]
+                if starving:
+                    chosen = starving[0]
+                    metrics.inc('pln_executor_promoted_total', priority=chosen)
+        return self._queues[chosen].popleft()
+
+    def _worker(self):
+        """Laço de uma thread: executa a próxima tarefa escolhida pela política."""
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None:
+                    if self._shutdown:
+                        return
+                    self._condition.wait()
+                    task = self._next_task()
+
+            metrics.add_gauge('pln_executor_queued', -1, priority=task.priority)
+            if not task.future.set_running_or_notify_cancel():
+                # Cancelada enquanto esperava (cliente desconectou ou prazo)
+                continue
+            metrics.observe('pln_executor_queue_wait_seconds', time.monotonic() - task.enqueued_at, priority=task.priority)
+            try:
+                result = task.fn(*task.args, **task.kwargs)
+            except BaseException as e:
+                self._release(task.priority)
+                task.future.set_exception(e)
+            else:
+                self._release(task.priority)
+                task.future.set_result(result)
+            task = None
+
+    def call(self, fn, *args, priority=PRIORITY_INTERACTIVE, timeout=None, **kwargs):
+        """
+        Executa a tarefa no pool e bloqueia até o resultado (views síncronas).
+
+        A tarefa roda com uma cópia do contexto atual (trace e token de
+        cancelamento da requisição). Se ``timeout`` expirar a tarefa é
+        cancelada (descartada se ainda estiver na fila) e TimeoutError é
+        levantado.
+        """
+        context = contextvars.copy_context()
+        future = self.submit(context.run, fn, *args, priority=priority, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    async def run(self, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Executa a tarefa no pool e aguarda o resultado sem bloquear o event loop.
+
+        A tarefa roda com uma cópia do contexto atual (trace da requisição).
+        """
+        context = contextvars.copy_context()
+        return await asyncio.wrap_future(self.submit(context.run, fn, *args, priority=priority, **kwargs))
+
+    def shutdown(self, wait=True):
+        """Encerra o pool (as tarefas já na fila ainda são executadas)."""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_model_executor = None
+_model_executor_lock = threading.Lock()
+
+
+def get_model_executor():
+    """Retorna o executor compartilhado do processo (criado sob demanda)."""
+    global _model_executor
+    if _model_executor is None:
+        with _model_executor_lock:
+            if _model_executor is None:
+                _model_executor = ModelExecutor(
+                    max_workers=getattr(settings, 'MODEL_EXECUTOR_WORKERS', 2),
+                    max_queue=getattr(settings, 'MODEL_EXECUTOR_QUEUE', 64),
+                    policy=getattr(settings, 'MODEL_SCHEDULER_POLICY', POLICY_STRICT),
+                    weights=parse_weights(getattr(settings, 'MODEL_PRIORITY_WEIGHTS', '')),
+                    max_wait=getattr(settings, 'MODEL_PRIORITY_MAX_WAIT', 10.0),
+                    bulk_queue=getattr(settings, 'MODEL_EXECUTOR_BULK_QUEUE', None),
+                )
+                logger.info(
+                    "Executor do modelo criado: %s workers, fila de %s, política %s",
+                    _model_executor.max_workers, _model_executor.max_queue, _model_executor.policy,
+                )
+    return _model_executor
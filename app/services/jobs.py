@@ -0,0 +1,251 @@
+"""
+Jobs assíncronos de geração
+
+Permite aceitar um prompt imediatamente e processá-lo depois: o job é
+gravado em uma fila persistente (MongoDB, com o SQLite como fallback) e
+workers em background o executam. O cliente consulta o resultado pelo id,
+opcionalmente com long-poll, sem manter a conexão aberta durante toda a
+geração.
+
+Como a fila fica no banco, jobs enfileirados sobrevivem a reinícios, e jobs
+que estavam em execução quando um worker caiu voltam para a fila depois de
+JOB_RUNNING_TIMEOUT segundos.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+from . import tracing
+from .executor import PRIORITY_BULK, ExecutorBusy, get_model_executor
+
+logger = logging.getLogger(__name__)
+
+# Estados de um job
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+TERMINAL_STATES = (JOB_DONE, JOB_FAILED)
+
+STALE_JOB_ERROR = 'Job abandonado: tempo de execução esgotado'
+
+# Avisa quem aguarda (long-poll) quando um worker deste processo termina um job
+_job_finished = threading.Condition()
+
+
+def new_job(prompt):
+    """Monta um job novo no estado 'queued'."""
+    return {
+        'job_id': uuid.uuid4().hex,
+        'prompt': prompt,
+        'state': JOB_QUEUED,
+        'created_at': datetime.now(),
+        'started_at': None,
+        'finished_at': None,
+        'worker': None,
+        'attempts': 0,
+        'response': None,
+        'processing_time': None,
+        'model': None,
+        'error': None,
+        'queue_wait': None,
+        'run_time': None,
+    }
+
+
+def serialize_job(job):
+    """
+    Converte um job para a resposta JSON da API.
+
+    Returns:
+        dict: campos públicos do job com datas em ISO 8601
+    """
+    data = {}
+    for key in ('job_id', 'state', 'prompt', 'response', 'processing_time', 'model', 'error',
+                'created_at', 'started_at', 'finished_at', 'queue_wait', 'run_time', 'attempts'):
+        value = job.get(key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        data[key] = value
+    return data
+
+
+def wait_for_job(repository, job_id, timeout):
+    """
+    Aguarda um job terminar (long-poll) por até ``timeout`` segundos.
+
+    Jobs terminados por workers deste processo acordam a espera na hora;
+    os de outros processos são percebidos a cada JOB_POLL_INTERVAL segundos.
+
+    Returns:
+        dict: job no estado atual (terminal ou não) ou None se não existir
+    """
+    poll_interval = getattr(settings, 'JOB_POLL_INTERVAL', 0.5)
+    deadline = time.monotonic() + max(0, timeout)
+    while True:
+        job = repository.get_job(job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job['state'] in TERMINAL_STATES or remaining <= 0:
+            return job
+        with _job_finished:
+            _job_finished.wait(min(poll_interval, remaining))
+
+
+class JobWorkerPool:
+    """
+    Threads que consomem a fila persistente de jobs.
+
+    Cada worker reserva o job mais antigo, executa ``process_prompt`` no
+    executor do modelo com prioridade ``bulk`` (o chat interativo passa à
+    frente), salva a interação no histórico e registra resultado, espera
+    na fila e tempo de execução no próprio job.
+    """
+
+    def __init__(self, nlp_service, repository, workers=1):
+        self.nlp_service = nlp_service
+        self.repository = repository
+        self.workers = workers
+        self.poll_interval = getattr(settings, 'JOB_POLL_INTERVAL', 0.5)
+        self.running_timeout = getattr(settings, 'JOB_RUNNING_TIMEOUT', 600)
+        self.max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+        self._threads = []
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._name = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        """Devolve à fila jobs abandonados e inicia as threads dos workers."""
+        self.repository.requeue_stale_jobs(self.running_timeout, self.max_attempts)
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run,
+                args=(f"{self._name}:{index}",),
+                name=f'job-worker-{index}',
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info("%s workers de jobs iniciados", self.workers)
+
+    def notify(self):
+        """Acorda os workers ociosos (um job acabou de ser enfileirado)."""
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        """Sinaliza o fim dos workers e aguarda as threads terminarem."""
+        self._stop_event.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def process_next(self, worker_id):
+        """
+        Reserva e executa um job da fila.
+
+        Returns:
+            bool: True se um job foi processado, False se a fila estava vazia
+        """
+        job = self.repository.claim_job(worker_id)
+        if job is None:
+            return False
+
+        logger.info("Job %s iniciado por %s (espera na fila: %.2fs)", job['job_id'], worker_id, job['queue_wait'])
+        # O id do job faz as vezes de request id nos spans salvos com a interação
+        trace, token = tracing.start_trace(job['job_id'])
+        try:
+            response, processing_time, usage = self._generate(job['prompt'])
+            self.repository.save_interaction({
+                'prompt': job['prompt'],
+                'response': response,
+                'processing_time': processing_time,
+                'model': self.nlp_service.model_name,
+                **usage,
+                'request_id': trace.request_id,
+                'spans': trace.as_dict()['spans'],
+            })
+            self.repository.finish_job(
+                job, JOB_DONE,
+                response=response,
+                processing_time=processing_time,
+                model=self.nlp_service.model_name,
+            )
+            logger.info("Job %s concluído em %.2fs", job['job_id'], processing_time)
+        except Exception as e:
+            logger.exception("Erro ao processar job %s: %s", job['job_id'], e)
+            self.repository.finish_job(job, JOB_FAILED, error=str(e))
+        finally:
+            tracing.end_trace(token)
+
+        with _job_finished:
+            _job_finished.notify_all()
+        return True
+
+    def _generate(self, prompt):
+        """Gera a resposta no executor do modelo, aguardando vaga na fila bulk."""
+        executor = get_model_executor()
+        while True:
+            try:
+                return executor.call(self.nlp_service.process_prompt, prompt, priority=PRIORITY_BULK)
+            except ExecutorBusy:
+                # O job já está reservado: espera uma vaga em vez de devolvê-lo à fila
+                if self._stop_event.wait(self.poll_interval):
+                    raise
+
+    def _run(self, worker_id):
+        """Laço de um worker: processa jobs até a fila esvaziar e então aguarda."""
+        from django.db import close_old_connections
+
+        last_requeue = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                processed = self.process_next(worker_id)
+            except Exception as e:
+                logger.error("Erro no worker de jobs %s: %s", worker_id, e)
+                processed = False
+            finally:
+                close_old_connections()
+
+            # Recupera periodicamente jobs de workers que caíram
+            if time.monotonic() - last_requeue > self.running_timeout:
+                self.repository.requeue_stale_jobs(self.running_timeout, self.max_attempts)
+                last_requeue = time.monotonic()
+
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+
+_job_workers = None
+_job_workers_lock = threading.Lock()
+
+
+def get_job_workers(nlp_service, repository):
+    """
+    Retorna os workers de jobs deste processo, iniciando-os na primeira chamada
+    (na inicialização do servidor; ver ``views.start_job_workers``).
+
+    Com JOB_WORKERS=0 nenhuma thread é criada no processo web e os jobs
+    ficam para workers dedicados (``manage.py run_job_workers``).
+
+    Returns:
+        JobWorkerPool: pool iniciado ou None se desabilitado
+    """
+    global _job_workers
+    workers = getattr(settings, 'JOB_WORKERS', 1)
+    if _job_workers is None and workers > 0:
+        with _job_workers_lock:
+            if _job_workers is None:
+                pool = JobWorkerPool(nlp_service, repository, workers=workers)
+                pool.start()
+                _job_workers = pool
+    return _job_workers
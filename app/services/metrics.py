@@ -0,0 +1,317 @@
+"""
+Métricas no formato de exposição de texto do Prometheus
+
+Mantém contadores, gauges e histogramas de latência por etapa do pipeline
+de chat e os expõe em ``/metrics``.
+
+Com vários processos (gunicorn/uvicorn com workers), cada processo grava
+periodicamente um snapshot das suas métricas em METRICS_DIR
+(``metrics_<pid>.json``) e a coleta soma os snapshots de todos eles.
+Contadores e histogramas de processos encerrados continuam somando; gauges
+só contam processos vivos. O diretório deve ser esvaziado a cada deploy.
+Sem METRICS_DIR as métricas são só do processo.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+# Etapas do pipeline com histograma de latência
+STAGES = (
+    'math', 'quick', 'tokenization', 'encoder', 'generate', 'regeneration',
+    'sanitizer', 'hf_api', 'mongo_save', 'sqlite_fallback',
+)
+
+# Limites dos buckets dos histogramas (segundos)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+# Estados do carregamento do modelo (gauge one-hot por processo)
+MODEL_STATES = ('unloaded', 'loading', 'ready', 'failed')
+
+# Nome -> (tipo, descrição)
+METRICS = {
+    'pln_stage_duration_seconds': ('histogram', 'Duração de cada etapa do pipeline de chat'),
+    'pln_answers_total': ('counter', 'Respostas por caminho que respondeu (math, quick, local, local-regenerated, hf)'),
+    'pln_cache_hits_total': ('counter', 'Leituras do histórico atendidas pelo cache'),
+    'pln_cache_misses_total': ('counter', 'Leituras do histórico que foram ao banco'),
+    'pln_fallbacks_total': ('counter', 'Fallbacks acionados (sqlite, hf_api)'),
+    'pln_errors_total': ('counter', 'Erros por componente'),
+    'pln_coalesced_total': ('counter', 'Requisições atendidas pela geração de um prompt idêntico em andamento'),
+    'pln_generation_stops_total': ('counter', 'Gerações causais por motivo de parada (eos, max_tokens, new_turn, instruction_echo, sentence)'),
+    'pln_draft_tokens_total': ('counter', 'Tokens do modelo rascunho na geração assistida, por resultado (proposed, accepted)'),
+    'pln_assisted_target_passes_total': ('counter', 'Passadas do modelo principal nas gerações assistidas'),
+    'pln_assisted_tokens_total': ('counter', 'Tokens produzidos pelas gerações assistidas'),
+    'pln_encoder_passes_total': ('counter', 'Entradas seq2seq codificadas (miss) ou com a saída do encoder reutilizada na requisição (reused)'),
+    'pln_cancelled_total': ('counter', 'Requisições com a geração cancelada, por motivo (disconnect, deadline)'),
+    'pln_rate_limited_total': ('counter', 'Requisições recusadas pelo rate limiter, por orçamento (model, fast)'),
+    'pln_executor_queue_wait_seconds': ('histogram', 'Espera na fila do executor do modelo, por classe de prioridade'),
+    'pln_executor_promoted_total': ('counter', 'Tarefas de classe inferior atendidas antes por esperarem demais (proteção contra inanição)'),
+    'pln_requests_in_flight': ('gauge', 'Requisições de chat em processamento'),
+    'pln_executor_queued': ('gauge', 'Tarefas aguardando na fila do executor do modelo, por classe de prioridade'),
+    'pln_model_state': ('gauge', 'Processos em cada estado de carregamento do modelo'),
+}
+
+
+def _key(name, labels):
+    """Chave interna de uma série: nome + labels ordenados."""
+    return name, tuple(sorted(labels.items()))
+
+
+def _pid_alive(pid):
+    """Verifica se um processo ainda existe (snapshots no mesmo host)."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class MetricsRegistry:
+    """Registro de métricas do processo, com snapshot em arquivo para multiprocesso."""
+
+    def __init__(self, directory=None, flush_interval=1.0, buckets=DEFAULT_BUCKETS):
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._last_flush = 0.0
+
+    # ============================================
+    # ATUALIZAÇÃO
+    # ============================================
+
+    def inc(self, name, value=1, **labels):
+        """Incrementa um contador."""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def set_gauge(self, name, value, **labels):
+        """Define o valor de um gauge."""
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+        self._maybe_flush()
+
+    def add_gauge(self, name, delta, **labels):
+        """Soma (ou subtrai) um valor de um gauge."""
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        """Registra uma observação em um histograma."""
+        key = _key(name, labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            entry['buckets'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+        self._maybe_flush()
+
+    @contextmanager
+    def stage_timer(self, stage):
+        """
+        Mede a duração de uma etapa do pipeline (inclusive se levantar exceção).
+
+        A medida também vira um span do trace da requisição, se houver um.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.observe('pln_stage_duration_seconds', duration, stage=stage)
+            tracing.record_span(stage, start, duration)
+
+    def set_model_state(self, state):
+        """Marca o estado de carregamento do modelo deste processo."""
+        for candidate in MODEL_STATES:
+            self.set_gauge('pln_model_state', 1 if candidate == state else 0, state=candidate)
+
+    # ============================================
+    # SNAPSHOT E COLETA
+    # ============================================
+
+    def snapshot(self):
+        """Retorna as métricas do processo em formato serializável."""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                'gauges': [[name, dict(labels), value] for (name, labels), value in self._gauges.items()],
+                'histograms': [
+                    [name, dict(labels), list(entry['buckets']), entry['sum'], entry['count']]
+                    for (name, labels), entry in self._histograms.items()
+                ],
+            }
+
+    def _snapshot_path(self, pid=None):
+        return self.directory / f"metrics_{pid or os.getpid()}.json"
+
+    def flush(self):
+        """Grava o snapshot do processo em METRICS_DIR (escrita atômica)."""
+        if self.directory is None:
+            return
+        # Outra thread já está gravando: o próximo flush leva estes valores
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = time.monotonic()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._snapshot_path()
+            tmp_path = path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(self.snapshot()), encoding='utf-8')
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error("Erro ao gravar snapshot de métricas: %s", e)
+        finally:
+            self._flush_lock.release()
+
+    def _maybe_flush(self):
+        if self.directory is not None and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def collect(self):
+        """
+        Soma os snapshots de todos os processos.
+
+        Returns:
+            tuple: (counters, gauges, histograms) indexados por (nome, labels)
+        """
+        snapshots = [self.snapshot()]
+        if self.directory is not None:
+            own_path = self._snapshot_path()
+            for path in self.directory.glob('metrics_*.json'):
+                if path == own_path:
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text(encoding='utf-8')))
+                except (OSError, ValueError) as e:
+                    logger.debug("Snapshot de métricas ignorado (%s): %s", path, e)
+
+        counters, gauges, histograms = {}, {}, {}
+        for snap in snapshots:
+            alive = snap.get('pid') == os.getpid() or _pid_alive(snap.get('pid', 0))
+            for name, labels, value in snap.get('counters', []):
+                key = _key(name, labels)
+                counters[key] = counters.get(key, 0) + value
+            if alive:
+                for name, labels, value in snap.get('gauges', []):
+                    key = _key(name, labels)
+                    gauges[key] = gauges.get(key, 0) + value
+            for name, labels, buckets, total, count in snap.get('histograms', []):
+                key = _key(name, labels)
+                entry = histograms.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                entry['buckets'] = [a + b for a, b in zip(entry['buckets'], buckets)]
+                entry['sum'] += total
+                entry['count'] += count
+        return counters, gauges, histograms
+
+    def render(self):
+        """Gera a exposição de texto do Prometheus com as métricas somadas."""
+        counters, gauges, histograms = self.collect()
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            source = {'counter': counters, 'gauge': gauges, 'histogram': histograms}[metric_type]
+            series = sorted((key, value) for key, value in source.items() if key[0] == name)
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (_, labels), value in series:
+                if metric_type == 'histogram':
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets, value['buckets']):
+                        cumulative += bucket_count
+                        le = '+Inf' if bound == math.inf else repr(float(bound))
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    """Formata os labels no padrão ``{a="1",b="2"}``."""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def _escape_label_value(value):
+    """Escapa barra invertida, aspas e quebra de linha do valor de um label."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Retorna o registro de métricas do processo (criado sob demanda)."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                directory = getattr(settings, 'METRICS_DIR', None)
+                _registry = MetricsRegistry(
+                    directory=directory,
+                    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0),
+                )
+                _registry.set_model_state('unloaded')
+                if directory:
+                    atexit.register(_registry.flush)
+    return _registry
+
+
+# Atalhos usados pelos serviços e views
+def inc(name, value=1, **labels):
+    get_registry().inc(name, value, **labels)
+
+
+def add_gauge(name, delta, **labels):
+    get_registry().add_gauge(name, delta, **labels)
+
+
+def observe(name, value, **labels):
+    get_registry().observe(name, value, **labels)
+
+
+def stage_timer(stage):
+    return get_registry().stage_timer(stage)
+
+
+def set_model_state(state):
+    get_registry().set_model_state(state)
+
+
+def render():
+    return get_registry().render()
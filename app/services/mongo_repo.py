@@ -7,13 +7,149 @@ Implementa fallback para SQLite quando MongoDB não está disponível.
 Desenvolvido por: ANNA, CÉSAR E EVILY
 """
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING, TEXT, ReturnDocument
+from pymongo.errors import ConnectionFailure, OperationFailure
 from django.conf import settings
-from datetime import datetime
+from datetime import datetime, timedelta
+import json
+import threading
 import logging
 
+from . import rollups
+from . import search
+from .archive import ArchiveStore, retention_cutoff
+from .cache import history_cache
+from . import jobs
+from . import metrics
+from . import tracing
+
 logger = logging.getLogger(__name__)
 
+# Estados da conexão com o MongoDB
+STATE_DISABLED = 'disabled'      # MONGODB_URI não configurado
+STATE_CONNECTING = 'connecting'  # aguardando o primeiro health check
+STATE_UP = 'up'                  # MongoDB respondendo
+STATE_DOWN = 'down'              # MongoDB fora do ar, usando SQLite
+
+# Esquema do fallback SQLite (criado sob demanda)
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS chat_interactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        prompt TEXT NOT NULL,
+        response TEXT NOT NULL,
+        processing_time REAL,
+        model TEXT,
+        timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        request_id TEXT,
+        spans TEXT,
+        path TEXT,
+        input_tokens INTEGER,
+        generated_tokens INTEGER,
+        generate_calls INTEGER,
+        truncated INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_rollups (
+        granularity TEXT NOT NULL,
+        bucket DATETIME NOT NULL,
+        model TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        total REAL NOT NULL DEFAULT 0,
+        min_time REAL,
+        max_time REAL,
+        PRIMARY KEY (granularity, bucket, model)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_rollup_bins (
+        granularity TEXT NOT NULL,
+        bucket DATETIME NOT NULL,
+        model TEXT NOT NULL,
+        bin INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (granularity, bucket, model, bin)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_jobs (
+        id TEXT PRIMARY KEY,
+        prompt TEXT NOT NULL,
+        state TEXT NOT NULL,
+        created_at DATETIME NOT NULL,
+        started_at DATETIME,
+        finished_at DATETIME,
+        worker TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        response TEXT,
+        processing_time REAL,
+        model TEXT,
+        error TEXT,
+        queue_wait REAL,
+        run_time REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS chat_jobs_state_created ON chat_jobs (state, created_at)",
+]
+
+# Colunas acrescentadas a chat_interactions depois da primeira versão
+# (adicionadas com ALTER TABLE em bancos já existentes)
+SQLITE_ADDED_COLUMNS = (
+    ('request_id', 'TEXT'),
+    ('spans', 'TEXT'),
+    ('path', 'TEXT'),
+    ('input_tokens', 'INTEGER'),
+    ('generated_tokens', 'INTEGER'),
+    ('generate_calls', 'INTEGER'),
+    ('truncated', 'INTEGER'),
+)
+
+SQLITE_INSERT_INTERACTION = """
+    INSERT INTO chat_interactions (
+        prompt, response, processing_time, model, timestamp, request_id, spans,
+        path, input_tokens, generated_tokens, generate_calls, truncated
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Campos de contabilidade de tokens das interações (ver nlp_service.new_usage)
+USAGE_FIELDS = ('path', 'input_tokens', 'generated_tokens', 'generate_calls', 'truncated')
+
+# Colunas lidas de chat_interactions (ver _interaction_from_sqlite)
+SQLITE_INTERACTION_SELECT = (
+    "id, prompt, response, processing_time, model, timestamp, " + ", ".join(USAGE_FIELDS)
+)
+
+# Colunas da tabela chat_jobs, na ordem usada pelos SELECTs
+SQLITE_JOB_COLUMNS = (
+    'id', 'prompt', 'state', 'created_at', 'started_at', 'finished_at', 'worker',
+    'attempts', 'response', 'processing_time', 'model', 'error', 'queue_wait', 'run_time',
+)
+
+# Índice FTS5 do fallback SQLite (tabela de conteúdo externo sincronizada por triggers)
+SQLITE_FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_interactions_fts USING fts5(
+        prompt, response,
+        content='chat_interactions', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_fts_ai AFTER INSERT ON chat_interactions BEGIN
+        INSERT INTO chat_interactions_fts (rowid, prompt, response)
+        VALUES (new.id, new.prompt, new.response);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_fts_ad AFTER DELETE ON chat_interactions BEGIN
+        INSERT INTO chat_interactions_fts (chat_interactions_fts, rowid, prompt, response)
+        VALUES ('delete', old.id, old.prompt, old.response);
+    END
+    """,
+]
+
 
 class MongoRepository:
     """
@@ -25,36 +161,228 @@ class MongoRepository:
     
     def __init__(self):
         """
-        Inicializa a conexão com MongoDB.
-        
-        Se a conexão falhar, o repositório continua funcionando
-        mas sem persistência (graceful degradation).
+        Inicializa o cliente MongoDB sem bloquear.
+
+        O MongoClient é criado com ``connect=False`` e um pool configurado
+        explicitamente; a verificação de conectividade acontece em uma thread
+        de health check em background. Enquanto o MongoDB estiver fora do ar,
+        as operações usam o SQLite como fallback (graceful degradation) e
+        voltam automaticamente para o MongoDB quando ele se recupera.
         """
         self.client = None
         self.db = None
         self.collection = None
-        
+
+        self.state = STATE_DISABLED
+        self.last_error = None
+        self.last_probe_at = None
+        self.last_state_change_at = None
+
+        self.health_interval = getattr(settings, 'MONGODB_HEALTH_INTERVAL', 10)
+        self._state_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._prober = None
+
         try:
             if not settings.MONGODB_URI:
                 logger.warning("MONGODB_URI não configurado nas settings")
                 return
-            
-            # Tenta conectar ao MongoDB com timeout curto
-            self.client = MongoClient(settings.MONGODB_URI, serverSelectionTimeoutMS=5000)
+
+            # Cria o cliente sem conectar: nenhuma operação de rede acontece aqui
+            self.client = MongoClient(
+                settings.MONGODB_URI,
+                connect=False,
+                serverSelectionTimeoutMS=getattr(settings, 'MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000),
+                minPoolSize=getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+                maxPoolSize=getattr(settings, 'MONGODB_MAX_POOL_SIZE', 50),
+                maxIdleTimeMS=getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', 60000),
+            )
             self.db = self.client[settings.MONGODB_DB]
             self.collection = self.db['chat_interactions']
-            
-            # Testa a conexão
-            self.client.admin.command('ping')
-            logger.info("Conexão com MongoDB estabelecida com sucesso")
-            
+            self.state = STATE_CONNECTING
+
+            # A conectividade é verificada em background
+            self._start_health_prober()
+            logger.info("Cliente MongoDB criado, verificando conexão em background")
+
         except Exception as e:
-            logger.error(f"Erro ao conectar ao MongoDB: {str(e)}")
+            logger.error("Erro ao configurar cliente MongoDB: %s", e)
             # Não levanta exceção - permite graceful degradation
             self.client = None
             self.db = None
             self.collection = None
+            self.state = STATE_DISABLED
+
+    # ============================================
+    # CICLO DE VIDA DA CONEXÃO / HEALTH CHECK
+    # ============================================
+
+    @classmethod
+    def open(cls):
+        """
+        Cria o repositório e aguarda a primeira verificação de conectividade.
+
+        Usado pelos comandos de gerenciamento, que executam logo ao iniciar
+        e precisariam esperar a thread de health check para usar o MongoDB.
+        """
+        repo = cls()
+        repo.probe()
+        return repo
 
+    def _start_health_prober(self):
+        """Inicia a thread daemon que monitora a saúde do MongoDB."""
+        self._prober = threading.Thread(
+            target=self._health_probe_loop,
+            name='mongo-health-prober',
+            daemon=True,
+        )
+        self._prober.start()
+
+    def _health_probe_loop(self):
+        """Executa o ping periodicamente até o repositório ser fechado."""
+        while not self._stop_event.is_set():
+            self.probe()
+            self._stop_event.wait(self.health_interval)
+
+    def probe(self):
+        """
+        Verifica a conectividade com o MongoDB e atualiza o estado.
+
+        Returns:
+            bool: True se o MongoDB respondeu ao ping
+        """
+        if self.client is None:
+            return False
+
+        self.last_probe_at = datetime.now()
+        try:
+            self.client.admin.command('ping')
+        except Exception as e:
+            self._mark_down(e)
+            return False
+
+        self._mark_up()
+        return True
+
+    def _mark_up(self):
+        """Marca o MongoDB como disponível (saindo do fallback SQLite)."""
+        with self._state_lock:
+            if self.state == STATE_UP:
+                return
+            previous = self.state
+            self.state = STATE_UP
+            self.last_error = None
+            self.last_state_change_at = datetime.now()
+
+        if previous == STATE_DOWN:
+            logger.info("MongoDB disponível novamente, saindo do fallback SQLite")
+        else:
+            logger.info("Conexão com MongoDB estabelecida com sucesso")
+        self._ensure_indexes()
+
+    def _mark_down(self, error):
+        """Marca o MongoDB como indisponível (usando fallback SQLite)."""
+        with self._state_lock:
+            self.last_error = str(error)
+            if self.state == STATE_DOWN:
+                return
+            self.state = STATE_DOWN
+            self.last_state_change_at = datetime.now()
+
+        logger.error("MongoDB indisponível, usando fallback SQLite: %s", error)
+
+    def _ensure_indexes(self):
+        """Cria os índices usados pelas consultas (operação idempotente)."""
+        try:
+            self._ensure_timestamp_index()
+            rollups_collection = self.db['chat_rollups']
+            rollups_collection.create_index(
+                [('granularity', ASCENDING), ('model', ASCENDING), ('bucket', DESCENDING)],
+                unique=True,
+            )
+            rollups_collection.create_index([('granularity', ASCENDING), ('bucket', DESCENDING)])
+            self.collection.create_index(
+                [('prompt', TEXT), ('response', TEXT)],
+                name='chat_text_search',
+                default_language='portuguese',
+            )
+            self.db['chat_jobs'].create_index([('state', ASCENDING), ('created_at', ASCENDING)])
+        except Exception as e:
+            logger.warning("Não foi possível criar índices no MongoDB: %s", e)
+
+    def _ensure_timestamp_index(self):
+        """
+        Cria o índice de timestamp, como índice TTL quando há retenção configurada.
+
+        O TTL expira as interações RETENTION_TTL_GRACE_DAYS dias depois do prazo
+        de retenção: o purge periódico arquiva e remove antes disso, e o TTL
+        serve de garantia caso o purge deixe de rodar.
+        """
+        retention_days = getattr(settings, 'RETENTION_DAYS', 0)
+        if not retention_days:
+            self.collection.create_index([('timestamp', DESCENDING)])
+            return
+
+        grace_days = getattr(settings, 'RETENTION_TTL_GRACE_DAYS', 1)
+        expire_after = int((retention_days + grace_days) * 86400)
+        try:
+            self.collection.create_index([('timestamp', DESCENDING)], expireAfterSeconds=expire_after)
+        except OperationFailure:
+            # O índice já existe com outras opções: ajusta o TTL no lugar
+            self.db.command(
+                'collMod', self.collection.name,
+                index={'keyPattern': {'timestamp': -1}, 'expireAfterSeconds': expire_after},
+            )
+
+    def is_mongo_available(self):
+        """
+        Indica se as operações devem ser direcionadas ao MongoDB.
+
+        Só depois de um health check bem-sucedido: enquanto a primeira
+        verificação não termina, e depois de uma falha, as operações vão
+        direto para o SQLite, sem esperar o timeout de seleção do servidor.
+        """
+        return self.collection is not None and self.state == STATE_UP
+
+    def _handle_mongo_error(self, error):
+        """Marca o MongoDB como indisponível em erros de conectividade."""
+        if isinstance(error, ConnectionFailure):
+            self._mark_down(error)
+
+    def health_status(self):
+        """
+        Retorna o estado atual da persistência para o endpoint de saúde.
+
+        Returns:
+            dict: backend ativo, estado da conexão e configuração do pool
+        """
+        def _iso(value):
+            return value.isoformat() if value else None
+
+        return {
+            'backend': 'mongodb' if self.is_mongo_available() else 'sqlite',
+            'mongodb_state': self.state,
+            'last_probe_at': _iso(self.last_probe_at),
+            'last_state_change_at': _iso(self.last_state_change_at),
+            'last_error': self.last_error,
+            'health_interval': self.health_interval,
+            'pool': {
+                'min_pool_size': getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+                'max_pool_size': getattr(settings, 'MONGODB_MAX_POOL_SIZE', 50),
+                'max_idle_time_ms': getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', 60000),
+            },
+        }
+
+    def close(self):
+        """Interrompe o health check e fecha o cliente MongoDB."""
+        self._stop_event.set()
+        try:
+            if self.client:
+                self.client.close()
+        except Exception:
+            pass
+
+    @tracing.traced('repo.save_interaction')
     def save_interaction(self, interaction_data):
         """
         Salva uma interação de chat no banco de dados.
@@ -71,7 +399,7 @@ class MongoRepository:
         Returns:
             str/int: ID da interação salva ou None se falhar completamente
         """
-        if self.collection is None:
+        if not self.is_mongo_available():
             logger.debug("MongoDB não disponível, tentando fallback SQLite")
             return self._save_to_sqlite(interaction_data)
         
@@ -80,15 +408,162 @@ class MongoRepository:
             interaction_data['timestamp'] = datetime.now()
             
             # Insere no MongoDB
-            result = self.collection.insert_one(interaction_data)
-            logger.info(f"Interação salva no MongoDB com ID: {result.inserted_id}")
+            with metrics.stage_timer('mongo_save'):
+                result = self.collection.insert_one(interaction_data)
+            logger.info("Interação salva no MongoDB com ID: %s", result.inserted_id)
+            self._update_rollups([interaction_data], use_mongo=True)
+            history_cache.bump()
             return str(result.inserted_id)
             
         except Exception as e:
-            logger.error(f"Erro ao salvar interação no MongoDB: {str(e)}")
+            logger.error("Erro ao salvar interação no MongoDB: %s", e)
+            metrics.inc('pln_errors_total', component='mongodb')
+            self._handle_mongo_error(e)
             # Tenta fallback para SQLite
             return self._save_to_sqlite(interaction_data)
 
+    @tracing.traced('repo.save_interactions')
+    def save_interactions(self, interactions):
+        """
+        Salva várias interações com uma única escrita em lote.
+
+        Usado pelo endpoint de lote: um ``insert_many`` no MongoDB (ou um
+        ``executemany`` no SQLite), uma atualização das agregações e uma
+        única invalidação do cache do histórico.
+
+        Args:
+            interactions (list): Dicionários no mesmo formato de save_interaction
+
+        Returns:
+            int: Número de interações salvas (0 se falhar completamente)
+        """
+        if not interactions:
+            return 0
+
+        if not self.is_mongo_available():
+            logger.debug("MongoDB não disponível, tentando fallback SQLite")
+            return self._save_many_to_sqlite(interactions)
+
+        try:
+            timestamp = datetime.now()
+            for interaction_data in interactions:
+                interaction_data['timestamp'] = timestamp
+
+            # ordered=False: uma falha pontual não impede o restante do lote
+            with metrics.stage_timer('mongo_save'):
+                result = self.collection.insert_many(interactions, ordered=False)
+            logger.info("%s interações salvas no MongoDB em lote", len(result.inserted_ids))
+            self._update_rollups(interactions, use_mongo=True)
+            history_cache.bump()
+            return len(result.inserted_ids)
+
+        except Exception as e:
+            logger.error("Erro ao salvar lote no MongoDB: %s", e)
+            metrics.inc('pln_errors_total', component='mongodb')
+            self._handle_mongo_error(e)
+            for interaction_data in interactions:
+                interaction_data.pop('_id', None)
+            return self._save_many_to_sqlite(interactions)
+
+    def _save_many_to_sqlite(self, interactions):
+        """
+        Salva um lote de interações no SQLite como fallback.
+
+        Args:
+            interactions (list): Dados das interações
+
+        Returns:
+            int: Número de interações salvas (0 se falhar)
+        """
+        metrics.inc('pln_fallbacks_total', kind='sqlite')
+        try:
+            from django.db import connection, transaction
+
+            timestamp = datetime.now()
+            with metrics.stage_timer('sqlite_fallback'), transaction.atomic(), connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+                cursor.executemany(SQLITE_INSERT_INTERACTION, [
+                    self._sqlite_interaction_row(interaction_data, timestamp)
+                    for interaction_data in interactions
+                ])
+
+            logger.info("%s interações salvas no SQLite (fallback)", len(interactions))
+            self._update_rollups(
+                [dict(interaction_data, timestamp=timestamp) for interaction_data in interactions],
+                use_mongo=False,
+            )
+            history_cache.bump()
+            return len(interactions)
+
+        except Exception as e:
+            logger.error("Erro ao salvar lote no SQLite: %s", e)
+            metrics.inc('pln_errors_total', component='sqlite')
+            return 0
+
+    def _ensure_sqlite_schema(self, cursor):
+        """Cria as tabelas do fallback SQLite se ainda não existirem."""
+        for statement in SQLITE_SCHEMA:
+            cursor.execute(statement)
+
+        cursor.execute("PRAGMA table_info(chat_interactions)")
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        for column, column_type in SQLITE_ADDED_COLUMNS:
+            if column not in existing_columns:
+                cursor.execute(f"ALTER TABLE chat_interactions ADD COLUMN {column} {column_type}")
+
+        # O índice FTS5 é criado uma única vez e populado com as linhas já existentes
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_interactions_fts'")
+        if cursor.fetchone() is None:
+            try:
+                for statement in SQLITE_FTS_SCHEMA:
+                    cursor.execute(statement)
+                # Com a tabela vazia não há o que indexar (e o rebuild de um índice
+                # recém-criado quebra o ROLLBACK TO SAVEPOINT do SQLite)
+                cursor.execute("SELECT 1 FROM chat_interactions LIMIT 1")
+                if cursor.fetchone() is not None:
+                    cursor.execute("INSERT INTO chat_interactions_fts (chat_interactions_fts) VALUES ('rebuild')")
+            except Exception as e:
+                logger.error("Não foi possível criar o índice FTS5 no SQLite: %s", e)
+
+    @staticmethod
+    def _sqlite_interaction_row(interaction_data, timestamp):
+        """Monta os parâmetros de SQLITE_INSERT_INTERACTION para uma interação."""
+        spans = interaction_data.get('spans')
+        return [
+            interaction_data.get('prompt', ''),
+            interaction_data.get('response', ''),
+            interaction_data.get('processing_time', 0),
+            interaction_data.get('model', ''),
+            timestamp,
+            interaction_data.get('request_id'),
+            json.dumps(spans) if spans is not None else None,
+        ] + [interaction_data.get(field) for field in USAGE_FIELDS]
+
+    def _interaction_from_sqlite(self, row):
+        """Converte uma linha de SQLITE_INTERACTION_SELECT para o formato do MongoDB."""
+        interaction = {
+            '_id': row[0],
+            'prompt': row[1],
+            'response': row[2],
+            'processing_time': row[3] or 0,
+            'model': row[4] or 'local',
+            'timestamp': self._parse_sqlite_timestamp(row[5]),
+        }
+        interaction.update(zip(USAGE_FIELDS, row[6:]))
+        if interaction['truncated'] is not None:
+            interaction['truncated'] = bool(interaction['truncated'])
+        return interaction
+
+    @staticmethod
+    def _parse_sqlite_timestamp(value):
+        """Converte o timestamp lido do SQLite (datetime ou texto) para datetime."""
+        if isinstance(value, datetime):
+            return value
+        try:
+            return datetime.fromisoformat(str(value))
+        except (TypeError, ValueError):
+            return datetime.now()
+
     def _save_to_sqlite(self, interaction_data):
         """
         Salva interação no SQLite como fallback.
@@ -99,41 +574,219 @@ class MongoRepository:
         Returns:
             int: ID da interação salva ou None se falhar
         """
+        metrics.inc('pln_fallbacks_total', kind='sqlite')
         try:
             from django.db import connection
             
-            with connection.cursor() as cursor:
-                # Cria tabela se não existir
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_interactions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        prompt TEXT NOT NULL,
-                        response TEXT NOT NULL,
-                        processing_time REAL,
-                        model TEXT,
-                        timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
+            timestamp = datetime.now()
+            with metrics.stage_timer('sqlite_fallback'), connection.cursor() as cursor:
+                # Cria tabelas se não existirem
+                self._ensure_sqlite_schema(cursor)
                 
                 # Insere a interação
-                cursor.execute("""
-                    INSERT INTO chat_interactions (prompt, response, processing_time, model, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                """, [
-                    interaction_data.get('prompt', ''),
-                    interaction_data.get('response', ''),
-                    interaction_data.get('processing_time', 0),
-                    interaction_data.get('model', ''),
-                    datetime.now()
-                ])
+                cursor.execute(SQLITE_INSERT_INTERACTION, self._sqlite_interaction_row(interaction_data, timestamp))
                 
                 logger.info("Interação salva no SQLite (fallback)")
-                return cursor.lastrowid
+                interaction_id = cursor.lastrowid
+
+            self._update_rollups([dict(interaction_data, timestamp=timestamp)], use_mongo=False)
+            history_cache.bump()
+            return interaction_id
                 
         except Exception as e:
-            logger.error(f"Erro ao salvar no SQLite: {e}")
+            logger.error("Erro ao salvar no SQLite: %s", e)
+            metrics.inc('pln_errors_total', component='sqlite')
             return None
 
+    # ============================================
+    # AGREGAÇÕES DE LATÊNCIA E USO
+    # ============================================
+
+    def _update_rollups(self, interactions, use_mongo):
+        """
+        Atualiza incrementalmente as agregações por hora/dia e modelo.
+
+        Falhas aqui são apenas registradas: a interação já foi salva.
+        """
+        try:
+            stats = rollups.aggregate(interactions)
+            if use_mongo:
+                self._merge_rollups_mongo(stats)
+            else:
+                self._merge_rollups_sqlite(stats)
+        except Exception as e:
+            logger.error("Erro ao atualizar agregações: %s", e)
+
+    def _merge_rollups_mongo(self, stats):
+        """Soma as estatísticas nas agregações do MongoDB (upsert atômico)."""
+        operations = []
+        for (granularity, bucket, model), entry in stats.items():
+            increments = {'count': entry['count'], 'sum': entry['sum']}
+            for index, count in entry['hist'].items():
+                increments[f'hist.{index}'] = count
+            operations.append(UpdateOne(
+                {'granularity': granularity, 'bucket': bucket, 'model': model},
+                {'$inc': increments, '$min': {'min': entry['min']}, '$max': {'max': entry['max']}},
+                upsert=True,
+            ))
+        if operations:
+            self.db['chat_rollups'].bulk_write(operations, ordered=False)
+
+    def _merge_rollups_sqlite(self, stats):
+        """Soma as estatísticas nas agregações do SQLite (upsert)."""
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            self._ensure_sqlite_schema(cursor)
+            for (granularity, bucket, model), entry in stats.items():
+                cursor.execute("""
+                    INSERT INTO chat_rollups (granularity, bucket, model, count, total, min_time, max_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (granularity, bucket, model) DO UPDATE SET
+                        count = count + excluded.count,
+                        total = total + excluded.total,
+                        min_time = MIN(min_time, excluded.min_time),
+                        max_time = MAX(max_time, excluded.max_time)
+                """, [granularity, bucket, model, entry['count'], entry['sum'], entry['min'], entry['max']])
+                for index, count in entry['hist'].items():
+                    cursor.execute("""
+                        INSERT INTO chat_rollup_bins (granularity, bucket, model, bin, count)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (granularity, bucket, model, bin) DO UPDATE SET
+                            count = count + excluded.count
+                    """, [granularity, bucket, model, index, count])
+
+    @tracing.traced('repo.get_rollups')
+    def get_rollups(self, granularity='hour', model=None, limit=24):
+        """
+        Retorna as agregações mais recentes, sem varrer o histórico.
+
+        A leitura é limitada às ``limit`` janelas mais recentes (por modelo),
+        usando o índice das agregações.
+
+        Args:
+            granularity (str): 'hour' ou 'day'
+            model (str, optional): filtra por modelo
+            limit (int): número máximo de janelas retornadas
+
+        Returns:
+            list: resumos (mais recente primeiro) com count, avg, min, max e percentis
+        """
+        if granularity not in rollups.GRANULARITIES:
+            raise ValueError(f"Granularidade inválida: {granularity}")
+
+        if not self.is_mongo_available():
+            return self._get_rollups_from_sqlite(granularity, model, limit)
+
+        try:
+            query = {'granularity': granularity}
+            if model:
+                query['model'] = model
+            cursor = self.db['chat_rollups'].find(query).sort('bucket', -1).limit(limit)
+            return [
+                rollups.summarize(
+                    doc['granularity'], doc['bucket'], doc['model'], doc.get('count', 0),
+                    doc.get('sum', 0.0), doc.get('min'), doc.get('max'),
+                    {int(index): count for index, count in doc.get('hist', {}).items()},
+                )
+                for doc in cursor
+            ]
+        except Exception as e:
+            logger.error("Erro ao recuperar agregações do MongoDB: %s", e)
+            self._handle_mongo_error(e)
+            return self._get_rollups_from_sqlite(granularity, model, limit)
+
+    def _get_rollups_from_sqlite(self, granularity, model, limit):
+        """Lê as agregações mais recentes do fallback SQLite."""
+        from datetime import datetime as dt
+
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+
+                query = ("SELECT granularity, bucket, model, count, total, min_time, max_time "
+                         "FROM chat_rollups WHERE granularity = ?")
+                params = [granularity]
+                if model:
+                    query += " AND model = ?"
+                    params.append(model)
+                query += " ORDER BY bucket DESC LIMIT ?"
+                params.append(limit)
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                if not rows:
+                    return []
+
+                # Busca os bins apenas das janelas retornadas
+                oldest = min(row[1] for row in rows)
+                bins_query = ("SELECT bucket, model, bin, count FROM chat_rollup_bins "
+                              "WHERE granularity = ? AND bucket >= ?")
+                bins_params = [granularity, oldest]
+                if model:
+                    bins_query += " AND model = ?"
+                    bins_params.append(model)
+                cursor.execute(bins_query, bins_params)
+                hists = {}
+                for bucket, bin_model, index, count in cursor.fetchall():
+                    hists.setdefault((bucket, bin_model), {})[index] = count
+
+            summaries = []
+            for row_granularity, bucket, row_model, count, total, minimum, maximum in rows:
+                hist = hists.get((bucket, row_model), {})
+                try:
+                    bucket = dt.fromisoformat(str(bucket))
+                except ValueError:
+                    pass
+                summaries.append(rollups.summarize(
+                    row_granularity, bucket, row_model, count, total, minimum, maximum, hist
+                ))
+            return summaries
+
+        except Exception as e:
+            logger.error("Erro ao recuperar agregações do SQLite: %s", e)
+            return []
+
+    def rebuild_rollups(self):
+        """
+        Recalcula todas as agregações a partir do histórico completo.
+
+        Usado para preencher as agregações de dados antigos (job de agregação);
+        o histórico é percorrido em streaming, mantendo em memória apenas as janelas.
+
+        Returns:
+            int: número de janelas (granularidade, bucket, modelo) geradas
+        """
+        fields = {'timestamp': 1, 'model': 1, 'processing_time': 1, '_id': 0}
+        if self.is_mongo_available():
+            try:
+                stats = rollups.aggregate(self.collection.find({}, fields))
+                self.db['chat_rollups'].delete_many({})
+                self._merge_rollups_mongo(stats)
+                logger.info("Agregações do MongoDB recalculadas: %s janelas", len(stats))
+                return len(stats)
+            except Exception as e:
+                logger.error("Erro ao recalcular agregações no MongoDB: %s", e)
+                self._handle_mongo_error(e)
+
+        from django.db import connection
+        from datetime import datetime as dt
+
+        with connection.cursor() as cursor:
+            self._ensure_sqlite_schema(cursor)
+            cursor.execute("SELECT timestamp, model, processing_time FROM chat_interactions")
+            stats = rollups.aggregate(
+                {'timestamp': dt.fromisoformat(str(row[0])), 'model': row[1], 'processing_time': row[2]}
+                for row in cursor.fetchall()
+            )
+            cursor.execute("DELETE FROM chat_rollups")
+            cursor.execute("DELETE FROM chat_rollup_bins")
+        self._merge_rollups_sqlite(stats)
+        logger.info("Agregações do SQLite recalculadas: %s janelas", len(stats))
+        return len(stats)
+
+    @tracing.traced('repo.get_interactions')
     def get_interactions(self, filters=None):
         """
         Recupera interações de chat com filtros opcionais.
@@ -147,7 +800,7 @@ class MongoRepository:
         Returns:
             list: Lista de interações encontradas
         """
-        if self.collection is None:
+        if not self.is_mongo_available():
             logger.debug("MongoDB não disponível, buscando no SQLite")
             return self._get_from_sqlite(filters)
         
@@ -156,29 +809,120 @@ class MongoRepository:
                 filters = {}
             
             # Converte filtros de data para objetos datetime do MongoDB
-            mongo_filters = {}
-            if 'timestamp' in filters and isinstance(filters['timestamp'], dict):
-                from datetime import datetime as dt
-                if '$gte' in filters['timestamp']:
-                    mongo_filters['timestamp'] = {'$gte': dt.fromisoformat(filters['timestamp']['$gte'])}
-                if '$lte' in filters['timestamp']:
-                    if 'timestamp' in mongo_filters:
-                        mongo_filters['timestamp']['$lte'] = dt.fromisoformat(filters['timestamp']['$lte'])
-                    else:
-                        mongo_filters['timestamp'] = {'$lte': dt.fromisoformat(filters['timestamp']['$lte'])}
+            mongo_filters = self._build_mongo_filters(filters)
             
             # Busca no MongoDB ordenado por timestamp (mais recente primeiro)
             cursor = self.collection.find(mongo_filters if mongo_filters else filters).sort('timestamp', -1)
             interactions = list(cursor)
             
-            logger.info(f"Recuperadas {len(interactions)} interações do MongoDB")
+            logger.info("Recuperadas %s interações do MongoDB", len(interactions))
             return interactions
             
         except Exception as e:
-            logger.error(f"Erro ao recuperar interações do MongoDB: {str(e)}")
+            logger.error("Erro ao recuperar interações do MongoDB: %s", e)
+            self._handle_mongo_error(e)
             # Fallback para SQLite
             return self._get_from_sqlite(filters)
 
+    @tracing.traced('repo.get_version')
+    def get_version(self, filters=None):
+        """
+        Retorna a "versão" dos dados de um filtro: total e timestamp mais recente.
+
+        Consulta barata (contagem e um único documento pelo índice de
+        timestamp) usada para ETag/Last-Modified sem carregar as interações.
+        Inserções mudam o timestamp mais recente e remoções mudam o total.
+
+        Args:
+            filters (dict, optional): mesmos filtros de get_interactions
+
+        Returns:
+            dict: {'count': int, 'newest': datetime ou None}
+        """
+        if not self.is_mongo_available():
+            return self._get_version_from_sqlite(filters)
+
+        try:
+            mongo_filters = self._build_mongo_filters(filters or {})
+            count = self.collection.count_documents(mongo_filters)
+            newest = self.collection.find_one(
+                mongo_filters, {'timestamp': 1}, sort=[('timestamp', DESCENDING)],
+            )
+            return {'count': count, 'newest': newest.get('timestamp') if newest else None}
+
+        except Exception as e:
+            logger.error("Erro ao consultar versão do histórico no MongoDB: %s", e)
+            self._handle_mongo_error(e)
+            return self._get_version_from_sqlite(filters)
+
+    def _get_version_from_sqlite(self, filters=None):
+        """Calcula total e timestamp mais recente de um filtro no SQLite."""
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+
+                date_sql, date_params = self._sqlite_date_clauses(filters)
+                cursor.execute(
+                    f"SELECT COUNT(*), MAX(timestamp) FROM chat_interactions WHERE 1 = 1{date_sql}",
+                    date_params,
+                )
+                count, newest = cursor.fetchone()
+            return {
+                'count': count,
+                'newest': self._parse_sqlite_timestamp(newest) if newest else None,
+            }
+
+        except Exception as e:
+            logger.error("Erro ao consultar versão do histórico no SQLite: %s", e)
+            return {'count': 0, 'newest': None}
+
+    @staticmethod
+    def _build_mongo_filters(filters):
+        """
+        Converte os filtros de data (strings ISO) para datetimes do MongoDB.
+
+        Args:
+            filters (dict): pode conter timestamp com $gte e/ou $lte
+
+        Returns:
+            dict: filtros prontos para o MongoDB (vazio se não houver filtros de data)
+        """
+        from datetime import datetime as dt
+
+        mongo_filters = {}
+        if filters and isinstance(filters.get('timestamp'), dict):
+            if '$gte' in filters['timestamp']:
+                mongo_filters['timestamp'] = {'$gte': dt.fromisoformat(filters['timestamp']['$gte'])}
+            if '$lte' in filters['timestamp']:
+                if 'timestamp' in mongo_filters:
+                    mongo_filters['timestamp']['$lte'] = dt.fromisoformat(filters['timestamp']['$lte'])
+                else:
+                    mongo_filters['timestamp'] = {'$lte': dt.fromisoformat(filters['timestamp']['$lte'])}
+        return mongo_filters
+
+    @staticmethod
+    def _sqlite_date_clauses(filters, column='timestamp'):
+        """
+        Monta as cláusulas de data do SQLite a partir dos filtros.
+
+        Returns:
+            tuple: (sql com prefixo AND, lista de parâmetros)
+        """
+        sql = ''
+        params = []
+        if filters and isinstance(filters.get('timestamp'), dict):
+            date_from = filters['timestamp'].get('$gte')
+            date_to = filters['timestamp'].get('$lte')
+            if date_from:
+                sql += f" AND DATE({column}) >= ?"
+                params.append(date_from)
+            if date_to:
+                sql += f" AND DATE({column}) <= ?"
+                params.append(date_to)
+        return sql, params
+
     def _get_from_sqlite(self, filters=None):
         """
         Recupera interações do SQLite com filtros opcionais.
@@ -191,35 +935,18 @@ class MongoRepository:
         """
         try:
             from django.db import connection
-            from datetime import datetime as dt
             
             with connection.cursor() as cursor:
-                # Cria tabela se não existir
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_interactions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        prompt TEXT NOT NULL,
-                        response TEXT NOT NULL,
-                        processing_time REAL,
-                        model TEXT,
-                        timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
+                # Cria tabelas se não existirem
+                self._ensure_sqlite_schema(cursor)
                 
                 # Monta query com filtros
-                query = "SELECT id, prompt, response, processing_time, model, timestamp FROM chat_interactions WHERE 1=1"
+                query = f"SELECT {SQLITE_INTERACTION_SELECT} FROM chat_interactions WHERE 1=1"
                 params = []
                 
-                if filters:
-                    date_from = filters.get('timestamp', {}).get('$gte') if isinstance(filters.get('timestamp'), dict) else None
-                    date_to = filters.get('timestamp', {}).get('$lte') if isinstance(filters.get('timestamp'), dict) else None
-                    
-                    if date_from:
-                        query += " AND DATE(timestamp) >= ?"
-                        params.append(date_from)
-                    if date_to:
-                        query += " AND DATE(timestamp) <= ?"
-                        params.append(date_to)
+                date_sql, date_params = self._sqlite_date_clauses(filters)
+                query += date_sql
+                params.extend(date_params)
                 
                 query += " ORDER BY timestamp DESC"
                 
@@ -227,38 +954,491 @@ class MongoRepository:
                 rows = cursor.fetchall()
                 
                 # Converte resultados para formato compatível com MongoDB
-                interactions = []
-                for row in rows:
-                    try:
-                        # Tenta parsear timestamp com diferentes formatos
-                        timestamp_str = row[5]
-                        if '.' in timestamp_str:
-                            timestamp = dt.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S.%f')
-                        else:
-                            timestamp = dt.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                    except:
-                        timestamp = dt.now()
-                    
-                    interactions.append({
-                        '_id': row[0],
-                        'prompt': row[1],
-                        'response': row[2],
-                        'processing_time': row[3] or 0,
-                        'model': row[4] or 'local',
-                        'timestamp': timestamp
-                    })
+                interactions = [self._interaction_from_sqlite(row) for row in rows]
                 
-                logger.info(f"Recuperadas {len(interactions)} interações do SQLite")
+                logger.info("Recuperadas %s interações do SQLite", len(interactions))
                 return interactions
                 
         except Exception as e:
-            logger.error(f"Erro ao recuperar do SQLite: {e}")
+            logger.error("Erro ao recuperar do SQLite: %s", e)
+            return []
+
+    # ============================================
+    # RETENÇÃO E ARQUIVAMENTO
+    # ============================================
+
+    def get_archive(self):
+        """Retorna o arquivo frio configurado em ARCHIVE_DIR."""
+        return ArchiveStore(getattr(settings, 'ARCHIVE_DIR', 'archive'))
+
+    def purge_expired(self, retention_days=None, batch_size=1000, now=None):
+        """
+        Arquiva e remove as interações mais antigas que o prazo de retenção.
+
+        As interações são gravadas no arquivo comprimido antes de serem
+        removidas, em lotes, para manter a memória limitada.
+
+        Args:
+            retention_days (int, optional): prazo em dias (padrão: RETENTION_DAYS)
+            batch_size (int): interações por lote
+            now (datetime, optional): instante de referência
+
+        Returns:
+            int: número de interações arquivadas e removidas
+        """
+        if retention_days is None:
+            retention_days = getattr(settings, 'RETENTION_DAYS', 0)
+        if not retention_days:
+            logger.info("Retenção desabilitada (RETENTION_DAYS=0), nada a remover")
+            return 0
+
+        cutoff = retention_cutoff(retention_days, now)
+        archive = self.get_archive()
+
+        total = 0
+        if self.is_mongo_available():
+            try:
+                total = self._purge_mongo(cutoff, archive, batch_size)
+            except Exception as e:
+                logger.error("Erro ao remover interações expiradas do MongoDB: %s", e)
+                self._handle_mongo_error(e)
+                # Parte dos lotes pode ter sido removida antes do erro
+                history_cache.bump()
+        else:
+            total = self._purge_sqlite(cutoff, archive, batch_size)
+
+        if total:
+            history_cache.bump()
+        return total
+
+    def _purge_mongo(self, cutoff, archive, batch_size):
+        """Arquiva e remove do MongoDB, lote a lote, as interações anteriores ao corte."""
+        total = 0
+        while True:
+            batch = list(
+                self.collection.find({'timestamp': {'$lt': cutoff}}).sort('timestamp', 1).limit(batch_size)
+            )
+            if not batch:
+                break
+            archive.append(batch)
+            self.collection.delete_many({'_id': {'$in': [doc['_id'] for doc in batch]}})
+            total += len(batch)
+        logger.info("%s interações expiradas arquivadas e removidas do MongoDB", total)
+        return total
+
+    def _purge_sqlite(self, cutoff, archive, batch_size):
+        """Arquiva e remove do SQLite, lote a lote, as interações anteriores ao corte."""
+        from django.db import connection
+
+        total = 0
+        try:
+            while True:
+                with connection.cursor() as cursor:
+                    self._ensure_sqlite_schema(cursor)
+                    cursor.execute(f"""
+                        SELECT {SQLITE_INTERACTION_SELECT}
+                        FROM chat_interactions WHERE timestamp < ?
+                        ORDER BY timestamp LIMIT ?
+                    """, [cutoff, batch_size])
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+
+                    archive.append(self._interaction_from_sqlite(row) for row in rows)
+
+                    ids = [row[0] for row in rows]
+                    placeholders = ', '.join('?' for _ in ids)
+                    # Os triggers do FTS5 removem as entradas do índice de busca
+                    cursor.execute(f"DELETE FROM chat_interactions WHERE id IN ({placeholders})", ids)
+                    total += len(rows)
+        except Exception as e:
+            logger.error("Erro ao remover interações expiradas do SQLite: %s", e)
+
+        logger.info("%s interações expiradas arquivadas e removidas do SQLite", total)
+        return total
+
+    # ============================================
+    # BUSCA TEXTUAL
+    # ============================================
+
+    @tracing.traced('repo.search_interactions')
+    def search_interactions(self, query, filters=None, offset=0, limit=10):
+        """
+        Busca interações pelo índice de texto, ordenadas por relevância.
+
+        Usa o índice de texto do MongoDB ($text) ou o FTS5 do SQLite; nunca
+        varre a coleção com expressões regulares.
+
+        Args:
+            query (str): termos de busca
+            filters (dict, optional): filtros de data (mesmo formato de get_interactions)
+            offset (int): número de resultados a pular
+            limit (int): número máximo de resultados
+
+        Returns:
+            list: interações com score e os campos prompt_highlighted/response_highlighted
+                  (termos delimitados por search.HIGHLIGHT_START/HIGHLIGHT_END)
+        """
+        terms = search.extract_terms(query)
+        if not terms or limit <= 0:
+            return []
+
+        if not self.is_mongo_available():
+            return self._search_sqlite(terms, filters, offset, limit)
+
+        try:
+            mongo_filters = self._build_mongo_filters(filters)
+            mongo_filters['$text'] = {'$search': search.build_mongo_search(terms)}
+            cursor = self.collection.find(
+                mongo_filters, {'score': {'$meta': 'textScore'}}
+            ).sort([('score', {'$meta': 'textScore'})]).skip(offset).limit(limit)
+
+            results = []
+            for doc in cursor:
+                doc['prompt_highlighted'] = search.mark_terms(doc.get('prompt', ''), terms)
+                doc['response_highlighted'] = search.mark_terms(doc.get('response', ''), terms)
+                results.append(doc)
+            return results
+
+        except Exception as e:
+            logger.error("Erro na busca textual no MongoDB: %s", e)
+            self._handle_mongo_error(e)
+            return self._search_sqlite(terms, filters, offset, limit)
+
+    @tracing.traced('repo.count_search')
+    def count_search(self, query, filters=None):
+        """
+        Conta os resultados de uma busca textual (usado na paginação).
+
+        Returns:
+            int: total de interações que casam com a busca
+        """
+        terms = search.extract_terms(query)
+        if not terms:
+            return 0
+
+        if not self.is_mongo_available():
+            return self._count_search_sqlite(terms, filters)
+
+        try:
+            mongo_filters = self._build_mongo_filters(filters)
+            mongo_filters['$text'] = {'$search': search.build_mongo_search(terms)}
+            return self.collection.count_documents(mongo_filters)
+        except Exception as e:
+            logger.error("Erro ao contar resultados da busca no MongoDB: %s", e)
+            self._handle_mongo_error(e)
+            return self._count_search_sqlite(terms, filters)
+
+    def _search_sqlite(self, terms, filters, offset, limit):
+        """Busca no índice FTS5 do SQLite, ordenando por bm25."""
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+
+                date_sql, date_params = self._sqlite_date_clauses(filters, column='c.timestamp')
+                cursor.execute(f"""
+                    SELECT c.id, c.prompt, c.response, c.processing_time, c.model, c.timestamp,
+                           highlight(chat_interactions_fts, 0, ?, ?),
+                           highlight(chat_interactions_fts, 1, ?, ?),
+                           bm25(chat_interactions_fts) AS rank
+                    FROM chat_interactions_fts
+                    JOIN chat_interactions c ON c.id = chat_interactions_fts.rowid
+                    WHERE chat_interactions_fts MATCH ?{date_sql}
+                    ORDER BY rank
+                    LIMIT ? OFFSET ?
+                """, [
+                    search.HIGHLIGHT_START, search.HIGHLIGHT_END,
+                    search.HIGHLIGHT_START, search.HIGHLIGHT_END,
+                    search.build_fts_query(terms), *date_params, limit, offset,
+                ])
+                rows = cursor.fetchall()
+
+            return [{
+                '_id': row[0],
+                'prompt': row[1],
+                'response': row[2],
+                'processing_time': row[3] or 0,
+                'model': row[4] or 'local',
+                'timestamp': self._parse_sqlite_timestamp(row[5]),
+                'prompt_highlighted': row[6],
+                'response_highlighted': row[7],
+                # bm25 é negativo: quanto menor, mais relevante
+                'score': -row[8],
+            } for row in rows]
+
+        except Exception as e:
+            logger.error("Erro na busca textual no SQLite: %s", e)
             return []
 
+    def _count_search_sqlite(self, terms, filters):
+        """Conta os resultados no índice FTS5 do SQLite."""
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+
+                date_sql, date_params = self._sqlite_date_clauses(filters, column='c.timestamp')
+                cursor.execute(f"""
+                    SELECT COUNT(*)
+                    FROM chat_interactions_fts
+                    JOIN chat_interactions c ON c.id = chat_interactions_fts.rowid
+                    WHERE chat_interactions_fts MATCH ?{date_sql}
+                """, [search.build_fts_query(terms), *date_params])
+                return cursor.fetchone()[0]
+
+        except Exception as e:
+            logger.error("Erro ao contar resultados da busca no SQLite: %s", e)
+            return 0
+
+    # ============================================
+    # FILA PERSISTENTE DE JOBS
+    # ============================================
+
+    def create_job(self, prompt):
+        """
+        Enfileira um job de geração.
+
+        Args:
+            prompt (str): prompt a ser processado
+
+        Returns:
+            dict: job criado (estado 'queued') ou None se falhar
+        """
+        job = jobs.new_job(prompt)
+        if self.is_mongo_available():
+            try:
+                self.db['chat_jobs'].insert_one(self._job_to_mongo(job))
+                logger.info("Job %s enfileirado no MongoDB", job['job_id'])
+                return dict(job, backend='mongodb')
+            except Exception as e:
+                logger.error("Erro ao enfileirar job no MongoDB: %s", e)
+                self._handle_mongo_error(e)
+
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+                cursor.execute(
+                    "INSERT INTO chat_jobs (id, prompt, state, created_at, attempts) VALUES (?, ?, ?, ?, 0)",
+                    [job['job_id'], job['prompt'], job['state'], job['created_at']],
+                )
+            logger.info("Job %s enfileirado no SQLite (fallback)", job['job_id'])
+            return dict(job, backend='sqlite')
+        except Exception as e:
+            logger.error("Erro ao enfileirar job no SQLite: %s", e)
+            return None
+
+    def get_job(self, job_id):
+        """
+        Busca um job pelo id no MongoDB e, se não encontrado, no SQLite.
+
+        Returns:
+            dict: job ou None se não existir
+        """
+        if self.is_mongo_available():
+            try:
+                document = self.db['chat_jobs'].find_one({'_id': job_id})
+                if document is not None:
+                    return self._job_from_mongo(document)
+            except Exception as e:
+                logger.error("Erro ao buscar job no MongoDB: %s", e)
+                self._handle_mongo_error(e)
+
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+                cursor.execute(
+                    f"SELECT {', '.join(SQLITE_JOB_COLUMNS)} FROM chat_jobs WHERE id = ?",
+                    [job_id],
+                )
+                row = cursor.fetchone()
+            return self._job_from_sqlite(row) if row else None
+        except Exception as e:
+            logger.error("Erro ao buscar job no SQLite: %s", e)
+            return None
+
+    def claim_job(self, worker_id):
+        """
+        Reserva atomicamente o job mais antigo da fila para um worker.
+
+        Jobs do MongoDB têm prioridade; em seguida os enfileirados no
+        SQLite enquanto o MongoDB estava fora do ar.
+
+        Returns:
+            dict: job no estado 'running' ou None se a fila estiver vazia
+        """
+        now = datetime.now()
+        if self.is_mongo_available():
+            try:
+                document = self.db['chat_jobs'].find_one_and_update(
+                    {'state': jobs.JOB_QUEUED},
+                    {'$set': {'state': jobs.JOB_RUNNING, 'started_at': now, 'worker': worker_id},
+                     '$inc': {'attempts': 1}},
+                    sort=[('created_at', ASCENDING)],
+                    return_document=ReturnDocument.AFTER,
+                )
+                if document is not None:
+                    job = self._job_from_mongo(document)
+                    job['queue_wait'] = (now - job['created_at']).total_seconds()
+                    self.db['chat_jobs'].update_one({'_id': job['job_id']}, {'$set': {'queue_wait': job['queue_wait']}})
+                    return job
+            except Exception as e:
+                logger.error("Erro ao reservar job no MongoDB: %s", e)
+                self._handle_mongo_error(e)
+
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+                # UPDATE ... RETURNING em uma única instrução: dois workers nunca pegam o mesmo job
+                cursor.execute(f"""
+                    UPDATE chat_jobs
+                    SET state = ?, started_at = ?, worker = ?, attempts = attempts + 1
+                    WHERE id = (
+                        SELECT id FROM chat_jobs WHERE state = ? ORDER BY created_at, rowid LIMIT 1
+                    ) AND state = ?
+                    RETURNING {', '.join(SQLITE_JOB_COLUMNS)}
+                """, [jobs.JOB_RUNNING, now, worker_id, jobs.JOB_QUEUED, jobs.JOB_QUEUED])
+                # fetchall() conclui a instrução (com RETURNING ela fica aberta até o fim das linhas)
+                rows = cursor.fetchall()
+                if not rows:
+                    return None
+                job = self._job_from_sqlite(rows[0])
+                job['queue_wait'] = (now - job['created_at']).total_seconds()
+                cursor.execute("UPDATE chat_jobs SET queue_wait = ? WHERE id = ?", [job['queue_wait'], job['job_id']])
+            return job
+        except Exception as e:
+            logger.error("Erro ao reservar job no SQLite: %s", e)
+            return None
+
+    def finish_job(self, job, state, **fields):
+        """
+        Registra o resultado de um job e o tempo de execução.
+
+        Args:
+            job (dict): job retornado por claim_job
+            state (str): 'done' ou 'failed'
+            **fields: response, processing_time, model ou error
+        """
+        now = datetime.now()
+        update = {
+            'state': state,
+            'finished_at': now,
+            'run_time': (now - job['started_at']).total_seconds() if job.get('started_at') else None,
+        }
+        update.update(fields)
+
+        if job.get('backend') == 'mongodb':
+            try:
+                self.db['chat_jobs'].update_one({'_id': job['job_id']}, {'$set': update})
+                return
+            except Exception as e:
+                logger.error("Erro ao finalizar job no MongoDB: %s", e)
+                self._handle_mongo_error(e)
+                return
+
+        try:
+            from django.db import connection
+
+            columns = list(update)
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+                cursor.execute(
+                    f"UPDATE chat_jobs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                    [update[column] for column in columns] + [job['job_id']],
+                )
+        except Exception as e:
+            logger.error("Erro ao finalizar job no SQLite: %s", e)
+
+    def requeue_stale_jobs(self, timeout, max_attempts):
+        """
+        Devolve à fila jobs presos em 'running' (worker reiniciado ou travado).
+
+        Jobs que já esgotaram max_attempts tentativas são marcados como falha.
+
+        Args:
+            timeout (float): segundos em 'running' para considerar o job abandonado
+            max_attempts (int): tentativas permitidas por job
+
+        Returns:
+            int: número de jobs devolvidos à fila
+        """
+        now = datetime.now()
+        cutoff = now - timedelta(seconds=timeout)
+        requeued = 0
+
+        if self.is_mongo_available():
+            try:
+                stale = {'state': jobs.JOB_RUNNING, 'started_at': {'$lt': cutoff}}
+                self.db['chat_jobs'].update_many(
+                    dict(stale, attempts={'$gte': max_attempts}),
+                    {'$set': {'state': jobs.JOB_FAILED, 'finished_at': now, 'error': jobs.STALE_JOB_ERROR}},
+                )
+                result = self.db['chat_jobs'].update_many(
+                    stale, {'$set': {'state': jobs.JOB_QUEUED, 'worker': None}},
+                )
+                requeued += result.modified_count
+            except Exception as e:
+                logger.error("Erro ao devolver jobs à fila no MongoDB: %s", e)
+                self._handle_mongo_error(e)
+
+        try:
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                self._ensure_sqlite_schema(cursor)
+                cursor.execute("""
+                    UPDATE chat_jobs SET state = ?, finished_at = ?, error = ?
+                    WHERE state = ? AND started_at < ? AND attempts >= ?
+                """, [jobs.JOB_FAILED, now, jobs.STALE_JOB_ERROR, jobs.JOB_RUNNING, cutoff, max_attempts])
+                cursor.execute("""
+                    UPDATE chat_jobs SET state = ?, worker = NULL
+                    WHERE state = ? AND started_at < ?
+                """, [jobs.JOB_QUEUED, jobs.JOB_RUNNING, cutoff])
+                requeued += cursor.rowcount
+        except Exception as e:
+            logger.error("Erro ao devolver jobs à fila no SQLite: %s", e)
+
+        if requeued:
+            logger.warning("%s jobs abandonados devolvidos à fila", requeued)
+        return requeued
+
+    @staticmethod
+    def _job_to_mongo(job):
+        """Converte o job para o documento do MongoDB (job_id vira _id)."""
+        document = {key: value for key, value in job.items() if key not in ('job_id', 'backend')}
+        document['_id'] = job['job_id']
+        return document
+
+    @staticmethod
+    def _job_from_mongo(document):
+        """Converte um documento do MongoDB para o formato de job."""
+        job = {key: document.get(key) for key in SQLITE_JOB_COLUMNS if key != 'id'}
+        job['job_id'] = document['_id']
+        job['attempts'] = job['attempts'] or 0
+        job['backend'] = 'mongodb'
+        return job
+
+    def _job_from_sqlite(self, row):
+        """Converte uma linha da tabela chat_jobs para o formato de job."""
+        job = dict(zip(SQLITE_JOB_COLUMNS, row))
+        job['job_id'] = job.pop('id')
+        for key in ('created_at', 'started_at', 'finished_at'):
+            if job[key] is not None:
+                job[key] = self._parse_sqlite_timestamp(job[key])
+        job['backend'] = 'sqlite'
+        return job
+
     def __del__(self):
         """Fecha a conexão com MongoDB quando o objeto é destruído."""
         try:
-            if self.client:
-                self.client.close()
+            self.close()
         except:
             pass
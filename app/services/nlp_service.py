@@ -8,16 +8,188 @@ Desenvolvido por: ANNA, CÉSAR E EVILY
 import time
 import json
 import re
+import threading
 import urllib.request
 import urllib.error
-from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
+from contextlib import contextmanager
+from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer, StoppingCriteriaList
+from transformers.modeling_outputs import BaseModelOutput
 import torch
 from django.conf import settings
 import logging
 
+from ..log_handlers import PAYLOAD_LOG
+from . import cancellation
+from . import metrics
+from . import tracing
+from .assisted import AssistedDecoding, assisted_stats, load_draft_model
+from .coalescing import SingleFlight
+from .stopping import PROFILE_SHORT, STOP_MAX_TOKENS, ResponseStoppingCriteria, trim_response
+
 logger = logging.getLogger(__name__)
 
 
+# ============================================
+# CÁLCULOS MATEMÁTICOS AUTOMÁTICOS
+# ============================================
+MATH_PATTERNS = [
+    # Multiplicação
+    (re.compile(r'quanto\s+é\s+(\d+)\s+vezes\s+(\d+)'), lambda m: int(m.group(1)) * int(m.group(2))),
+    (re.compile(r'(\d+)\s+vezes\s+(\d+)'), lambda m: int(m.group(1)) * int(m.group(2))),
+    (re.compile(r'(\d+)\s*[xX×]\s*(\d+)'), lambda m: int(m.group(1)) * int(m.group(2))),
+    # Adição
+    (re.compile(r'quanto\s+é\s+(\d+)\s+mais\s+(\d+)'), lambda m: int(m.group(1)) + int(m.group(2))),
+    (re.compile(r'(\d+)\s+mais\s+(\d+)'), lambda m: int(m.group(1)) + int(m.group(2))),
+    (re.compile(r'(\d+)\s*\+\s*(\d+)'), lambda m: int(m.group(1)) + int(m.group(2))),
+    # Subtração
+    (re.compile(r'quanto\s+é\s+(\d+)\s+menos\s+(\d+)'), lambda m: int(m.group(1)) - int(m.group(2))),
+    (re.compile(r'(\d+)\s+menos\s+(\d+)'), lambda m: int(m.group(1)) - int(m.group(2))),
+    (re.compile(r'(\d+)\s*-\s*(\d+)'), lambda m: int(m.group(1)) - int(m.group(2))),
+    # Divisão
+    (re.compile(r'quanto\s+é\s+(\d+)\s+dividido\s+por\s+(\d+)'), lambda m: int(m.group(1)) / int(m.group(2)) if int(m.group(2)) != 0 else None),
+    (re.compile(r'(\d+)\s+dividido\s+por\s+(\d+)'), lambda m: int(m.group(1)) / int(m.group(2)) if int(m.group(2)) != 0 else None),
+    (re.compile(r'(\d+)\s*/\s*(\d+)'), lambda m: int(m.group(1)) / int(m.group(2)) if int(m.group(2)) != 0 else None),
+]
+
+# ============================================
+# RESPOSTAS RÁPIDAS PARA PERGUNTAS COMUNS
+# ============================================
+QUICK_RESPONSES = {
+    # Saudações
+    "oi": "Olá! Como posso ajudá-lo hoje?",
+    "olá": "Olá! Em que posso ajudá-lo?",
+    "bom dia": "Bom dia! Como posso ajudá-lo?",
+    "boa tarde": "Boa tarde! Como posso ajudá-lo?",
+    "boa noite": "Boa noite! Como posso ajudá-lo?",
+    "oi tudo bem": "Tudo bem, obrigado! Como posso ajudá-lo?",
+    "tudo bem": "Sim, tudo bem! Em que posso ajudá-lo?",
+    "ping ping sam": "Ping pong! Sistema funcionando perfeitamente! 🏓",
+    
+    # Matemática comum
+    "dois mais dois": "Quatro (4)",
+    "2+2": "Quatro (4)",
+    "dois vezes dois": "Quatro (4)",
+    "2x2": "Quatro (4)",
+    
+    # Linguagem e Português
+    "me dá as vogais": "As vogais do alfabeto português são: A, E, I, O, U.",
+    "quais são as vogais": "As vogais são: A, E, I, O, U (e Y quando usado como vogal).",
+    "me diga as vogais": "As vogais são: A, E, I, O, U.",
+    "vogais": "As vogais do alfabeto português são: A, E, I, O, U.",
+    
+    # Animais
+    "os leões tem quantas patas": "Os leões têm 4 patas.",
+    "quantas patas tem um leão": "Um leão tem 4 patas.",
+    "leão quantas patas": "Os leões têm 4 patas.",
+    "quantas patas tem um cachorro": "Um cachorro tem 4 patas.",
+    "quantas patas tem um gato": "Um gato tem 4 patas.",
+    "quantas patas tem um cavalo": "Um cavalo tem 4 patas.",
+    
+    # Tecnologia
+    "o que é python": "Python é uma linguagem de programação de alto nível, interpretada e de propósito geral, conhecida por sua simplicidade e legibilidade. É amplamente usada em desenvolvimento web, ciência de dados, automação e inteligência artificial.",
+    "o que é django": "Django é um framework web de alto nível escrito em Python que facilita o desenvolvimento rápido de sites e aplicações web seguras e escaláveis.",
+    "o que é javascript": "JavaScript é uma linguagem de programação usada principalmente para criar interatividade em páginas web. É uma das tecnologias fundamentais da web moderna.",
+    
+    # História e Geografia
+    "quem descobriu o brasil": "Pedro Álvares Cabral descobriu o Brasil em 22 de abril de 1500.",
+    "capital do brasil": "A capital do Brasil é Brasília, localizada no Distrito Federal.",
+    "qual a capital da frança": "A capital da França é Paris.",
+    "qual a capital da espanha": "A capital da Espanha é Madrid.",
+    "qual a capital de portugal": "A capital de Portugal é Lisboa.",
+    
+    # Perguntas comuns
+    "como você está": "Estou funcionando perfeitamente! Como posso ajudá-lo?",
+    "qual seu nome": "Sou um assistente de IA especializado em Processamento de Linguagem Natural. Pode me chamar de PLN Assistant!",
+    "quem é você": "Sou um assistente virtual inteligente desenvolvido para ajudar com perguntas e conversas em português.",
+    
+    # Sistema
+    "fez o l": "Sim, fiz! O sistema está funcionando perfeitamente!",
+    "teste": "Sistema funcionando! Estou pronto para ajudar.",
+    "funciona": "Sim, o sistema está funcionando corretamente!",
+    
+    # Ciências
+    "o que é água": "Água (H2O) é uma molécula composta por dois átomos de hidrogênio e um de oxigênio. É essencial para a vida e cobre cerca de 71% da superfície da Terra.",
+    "quantos planetas existem": "No nosso Sistema Solar existem 8 planetas: Mercúrio, Vênus, Terra, Marte, Júpiter, Saturno, Urano e Netuno.",
+    
+    # Cultura
+    "qual a maior cidade do brasil": "A maior cidade do Brasil é São Paulo, com aproximadamente 12 milhões de habitantes.",
+    "quem escreveu romeu e julieta": "Romeu e Julieta foi escrita por William Shakespeare, o grande dramaturgo inglês.",
+}
+
+# Instrução usada na formatação do prompt dos modelos causais
+INSTRUCTION = (
+    "Você é um assistente útil, educado e objetivo que SEMPRE responde APENAS em Português Brasileiro. "
+    "NUNCA responda em inglês. Responda de forma direta, sem repetir a pergunta, "
+    "sem usar palavras como 'question' ou 'questions', e forneça uma resposta clara e curta quando possível. "
+    "Responda diretamente a pergunta sem ecoar o prompt."
+)
+
+# Entradas das regenerações dos modelos causais. Nos seq2seq as regenerações
+# usam a mesma entrada da primeira geração (e a saída do encoder já calculada
+# para ela) e mudam só os parâmetros da decodificação
+REGENERATION_TEMPLATE = "Por favor, responda de forma direta:\n{prompt}\nResposta:"
+PORTUGUESE_ONLY_TEMPLATE = "Responda APENAS em português brasileiro: {prompt}"
+
+# Caminhos que podem produzir a resposta (campo ``path`` dos metadados)
+PATH_MATH = 'math'
+PATH_QUICK = 'quick'
+PATH_LOCAL = 'local'
+PATH_LOCAL_REGENERATED = 'local-regenerated'
+PATH_HF = 'hf'
+
+# Tokens gerados por chamada ``generate`` (reservados no orçamento de entrada dos causais)
+MAX_NEW_TOKENS_CAUSAL = 150
+MAX_NEW_TOKENS_SEQ2SEQ = 200
+
+# Janela de contexto quando nem o modelo nem o tokenizer informam uma
+DEFAULT_CONTEXT_TOKENS = 1024
+# Estimativa de caracteres por token quando não há tokenizer carregado (só API)
+CHARS_PER_TOKEN_ESTIMATE = 4
+
+# Estados do carregamento do modelo local
+MODEL_UNLOADED = 'unloaded'
+MODEL_LOADING = 'loading'
+MODEL_READY = 'ready'
+MODEL_FAILED = 'failed'
+
+
+def new_usage(path):
+    """
+    Metadados de uma resposta, devolvidos por process_prompt.
+
+    Os tokens somam todas as chamadas ``generate`` feitas para a resposta
+    (inclusive regenerações); ficam None quando nenhum modelo local foi
+    usado. ``truncated`` indica que a última geração parou em
+    ``max_new_tokens`` sem chegar ao token de fim e ``stop_reason`` diz por
+    que a última geração causal parou (ver stopping). ``prompt_tokens`` é o
+    tamanho do prompt do usuário (sem a instrução), contado no orçamento
+    de entrada quando o prompt vai para um modelo. ``draft_acceptance`` e
+    ``draft_speedup`` só são preenchidos quando a geração usou o modelo
+    rascunho (ver assisted).
+    """
+    return {
+        'path': path,
+        'prompt_tokens': None,
+        'input_tokens': None,
+        'generated_tokens': None,
+        'generate_calls': 0,
+        'truncated': False,
+        'stop_reason': None,
+        'draft_acceptance': None,
+        'draft_speedup': None,
+    }
+
+
+class PromptTooLong(ValueError):
+    """O prompt não cabe no orçamento de entrada do modelo."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        super().__init__(
+            f"Prompt com {budget['prompt_tokens']} tokens excede o limite de {budget['max_prompt_tokens']}"
+        )
+
+
 class NLPService:
     """
     Serviço responsável pelo processamento de linguagem natural.
@@ -37,16 +209,40 @@ class NLPService:
         self._model_loaded = False
         self.is_encoder_decoder = False
         
+        # Modelo rascunho da geração assistida (ASSISTANT_MODEL_NAME) com os
+        # contadores de passadas dos dois modelos; trocado sob o lock
+        self._assisted = None
+        self._assistant_lock = threading.Lock()
+        
+        # Carregamento único do modelo (uma thread carrega, as demais esperam)
+        self.model_state = MODEL_UNLOADED
+        self._load_lock = threading.Lock()
+        self._load_failures = 0
+        self._load_retry_at = 0.0
+        
+        # Prompts canônicos idênticos em andamento compartilham a mesma geração
+        self._in_flight = SingleFlight()
+        
+        # Tokens da instrução/template em volta do prompt (calculado uma vez por modelo)
+        self._preamble_tokens = None
+        
+        # Saídas do encoder (seq2seq) da requisição em andamento, por thread
+        self._request_state = threading.local()
+        
         # Detecta se há GPU disponível, caso contrário usa CPU
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        logger.info(f"NLPService inicializado. Device: {self.device}")
+        logger.info("NLPService inicializado. Device: %s", self.device)
 
     def _ensure_model_loaded(self):
         """
         Carrega o modelo e tokenizer apenas quando necessário (lazy loading).
         
-        Detecta automaticamente o tipo de modelo (causal ou encoder-decoder)
-        e carrega o modelo apropriado.
+        O carregamento é feito por uma única thread: as requisições que
+        chegam enquanto isso esperam pelo mesmo carregamento em vez de
+        carregar outra cópia do modelo. Se falhar, o estado fica 'failed'
+        e novas tentativas só acontecem depois de um intervalo que dobra a
+        cada falha (MODEL_LOAD_RETRY_BACKOFF até MODEL_LOAD_RETRY_MAX);
+        nesse meio tempo as requisições seguem para o fallback da API.
         """
         if self._model_loaded:
             return
@@ -55,8 +251,29 @@ class NLPService:
             logger.error("HF_MODEL_NAME não configurado nas settings")
             raise RuntimeError('HF_MODEL_NAME não está configurado nas settings')
         
+        with self._load_lock:
+            if self._model_loaded:
+                return
+            if self.model_state == MODEL_FAILED and time.monotonic() < self._load_retry_at:
+                return
+            try:
+                self._load_model()
+            except Exception:
+                self._load_failures += 1
+                base = getattr(settings, 'MODEL_LOAD_RETRY_BACKOFF', 5.0)
+                delay = min(base * 2 ** (self._load_failures - 1), getattr(settings, 'MODEL_LOAD_RETRY_MAX', 300.0))
+                self._load_retry_at = time.monotonic() + delay
+                logger.warning("Nova tentativa de carregar o modelo em %.0f segundos", delay)
+            else:
+                self._load_failures = 0
+
+    def _load_model(self):
+        """Carrega tokenizer e modelo (chamado com _load_lock adquirido)."""
         try:
-            logger.info(f"Carregando modelo: {self.model_name}")
+            self.model_state = MODEL_LOADING
+            self._preamble_tokens = None
+            metrics.set_model_state('loading')
+            logger.info("Carregando modelo: %s", self.model_name)
             
             # Carrega o tokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
@@ -87,14 +304,83 @@ class NLPService:
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
             
+            # Em lotes de modelos causais o padding fica à esquerda, para que a
+            # geração continue logo após o último token de cada prompt
+            if not self.is_encoder_decoder:
+                self.tokenizer.padding_side = 'left'
+                self._load_assistant_model()
+            
             self._model_loaded = True
-            logger.info(f"Modelo carregado com sucesso: {self.model_name}")
+            self.model_state = MODEL_READY
+            metrics.set_model_state('ready')
+            logger.info("Modelo carregado com sucesso: %s", self.model_name)
             
         except Exception as e:
-            logger.error(f"Erro ao carregar modelo: {e}")
+            logger.error("Erro ao carregar modelo: %s", e)
             self._model_loaded = False
+            self.model = None
+            self.model_state = MODEL_FAILED
+            metrics.set_model_state('failed')
             raise
 
+    def _load_assistant_model(self):
+        """Carrega o modelo rascunho configurado (geração assistida dos modelos causais)."""
+        name = getattr(settings, 'ASSISTANT_MODEL_NAME', '')
+        if not name or self.assistant_model is not None:
+            return
+        draft = load_draft_model(
+            name, self.tokenizer, self.device,
+            num_tokens=getattr(settings, 'ASSISTANT_NUM_TOKENS', 5),
+        )
+        if draft is not None:
+            self.set_assistant_model(draft)
+
+    @property
+    def assistant_model(self):
+        """Modelo rascunho em uso (None sem geração assistida)."""
+        assisted = self._assisted
+        return assisted.draft if assisted is not None else None
+
+    def set_assistant_model(self, draft):
+        """
+        Passa a usar o modelo rascunho nas gerações de um único prompt (None desabilita).
+        
+        Gerações assistidas em andamento terminam com o rascunho com que
+        começaram.
+        """
+        with self._assistant_lock:
+            previous = self._assisted
+            self._assisted = AssistedDecoding(self.model, draft) if draft is not None else None
+        if previous is not None:
+            previous.retire()
+
+    def _disable_assisted(self, assisted):
+        """Desabilita a geração assistida que falhou (se ainda for a configuração ativa)."""
+        with self._assistant_lock:
+            if self._assisted is not assisted:
+                return
+            self._assisted = None
+        assisted.retire()
+
+    @contextmanager
+    def _assisted_scope(self, enabled):
+        """
+        Configuração de geração assistida usada por uma geração (None sem rascunho).
+        
+        A instância é lida uma vez no início: mesmo que outra thread troque
+        ou desabilite o rascunho, esta geração usa só o rascunho e os
+        contadores que recebeu.
+        """
+        with self._assistant_lock:
+            assisted = self._assisted if enabled else None
+            if assisted is not None:
+                assisted.acquire()
+        try:
+            yield assisted
+        finally:
+            if assisted is not None:
+                assisted.release()
+
     def hf_inference(self, prompt):
         """
         Usa a API de Inferência da Hugging Face para processar o prompt.
@@ -104,7 +390,16 @@ class NLPService:
             
         Returns:
             str: Resposta do modelo ou None em caso de erro
+            
+        Raises:
+            GenerationCancelled: se a requisição já foi cancelada
         """
+        cancellation.raise_if_cancelled()
+        with metrics.stage_timer('hf_api'):
+            return self._call_hf_inference(prompt)
+
+    def _call_hf_inference(self, prompt):
+        """Faz a chamada à API de inferência (com uma nova tentativa em caso de 503)."""
         if not self.api_token:
             logger.warning("HF_API_TOKEN não configurado, API de inferência não disponível")
             return None
@@ -132,7 +427,7 @@ class NLPService:
                     elif 'summary_text' in result:
                         return result['summary_text']
                     elif isinstance(result.get('error'), str):
-                        logger.error(f"Erro na API HF: {result['error']}")
+                        logger.error("Erro na API HF: %s", result['error'])
                         return None
                 
                 if isinstance(result, list) and len(result) > 0:
@@ -142,65 +437,116 @@ class NLPService:
                     elif isinstance(first_item, str):
                         return first_item
                 
-                logger.warning(f"Formato de resposta inesperado da API: {result}")
+                logger.warning("Formato de resposta inesperado da API: %s", result)
                 return None
                 
         except urllib.error.HTTPError as e:
-            logger.error(f"Erro HTTP na API de inferência: {e.code} - {e.reason}")
+            logger.error("Erro HTTP na API de inferência: %s - %s", e.code, e.reason)
             if e.code == 503:
                 logger.warning("Modelo ainda carregando na API, tentando novamente...")
-                time.sleep(5)
-                return self.hf_inference(prompt)  # Retry uma vez
+                with tracing.span('hf_retry_wait'):
+                    time.sleep(5)
+                return self._call_hf_inference(prompt)  # Retry uma vez
+            metrics.inc('pln_errors_total', component='hf_api')
             return None
         except Exception as e:
-            logger.error(f"Erro ao chamar API de inferência: {e}")
+            logger.error("Erro ao chamar API de inferência: %s", e)
+            metrics.inc('pln_errors_total', component='hf_api')
             return None
 
-    def process_prompt(self, prompt):
+    def hf_inference_batch(self, prompts):
         """
-        Processa um prompt e retorna a resposta do modelo.
-        
-        Implementa múltiplas camadas de processamento:
-        1. Respostas rápidas para perguntas comuns
-        2. Cálculos matemáticos automáticos
-        3. Processamento pelo modelo local ou API
+        Usa a API de Inferência da Hugging Face para vários prompts em uma única chamada.
         
         Args:
-            prompt (str): Texto de entrada do usuário
+            prompts (list): Textos a serem processados pelo modelo
             
         Returns:
-            tuple: (resposta, tempo_processamento) ou levanta RuntimeError
+            list: Respostas na mesma ordem dos prompts (None onde não houve resposta)
         """
-        start_time = time.time()
+        cancellation.raise_if_cancelled()
+        with metrics.stage_timer('hf_api'):
+            return self._call_hf_inference_batch(prompts)
+
+    def _call_hf_inference_batch(self, prompts, retry=True):
+        """Faz a chamada em lote à API (tenta novamente uma vez se o modelo estiver carregando)."""
+        if not prompts:
+            return []
+        if not self.api_token:
+            logger.warning("HF_API_TOKEN não configurado, API de inferência não disponível")
+            return [None] * len(prompts)
         
-        # Normaliza o prompt para comparações
-        prompt_lower = prompt.lower().strip().replace('?', '').replace('.', '').replace(',', '')
+        try:
+            api_url = f"https://api-inference.huggingface.co/models/{self.inference_model}"
+            headers = {
+                "Authorization": f"Bearer {self.api_token}",
+                "Content-Type": "application/json"
+            }
+            
+            data = json.dumps({"inputs": list(prompts)}).encode('utf-8')
+            req = urllib.request.Request(api_url, data=data, headers=headers)
+            
+            with urllib.request.urlopen(req, timeout=30 + 5 * len(prompts)) as response:
+                result = json.loads(response.read().decode())
+            
+            if isinstance(result, dict) and isinstance(result.get('error'), str):
+                logger.error("Erro na API HF: %s", result['error'])
+                return [None] * len(prompts)
+            
+            if not isinstance(result, list) or len(result) != len(prompts):
+                logger.warning("Formato de resposta inesperado da API em lote: %s", result)
+                return [None] * len(prompts)
+            
+            responses = []
+            for item in result:
+                # Cada item pode vir como lista de candidatos, dict ou texto puro
+                if isinstance(item, list) and item:
+                    item = item[0]
+                if isinstance(item, dict):
+                    item = item.get('generated_text') or item.get('summary_text')
+                responses.append(item if isinstance(item, str) and item else None)
+            return responses
+            
+        except urllib.error.HTTPError as e:
+            logger.error("Erro HTTP na API de inferência: %s - %s", e.code, e.reason)
+            if e.code == 503 and retry:
+                logger.warning("Modelo ainda carregando na API, tentando novamente...")
+                with tracing.span('hf_retry_wait'):
+                    time.sleep(5)
+                return self._call_hf_inference_batch(prompts, retry=False)
+            metrics.inc('pln_errors_total', component='hf_api')
+            return [None] * len(prompts)
+        except Exception as e:
+            logger.error("Erro ao chamar API de inferência em lote: %s", e)
+            metrics.inc('pln_errors_total', component='hf_api')
+            return [None] * len(prompts)
+
+    @staticmethod
+    def _normalize_prompt(prompt):
+        """Normaliza o prompt para as comparações dos caminhos rápidos."""
+        return prompt.lower().strip().replace('?', '').replace('.', '').replace(',', '')
+
+    @staticmethod
+    def is_fast_path(prompt):
+        """
+        Indica, sem calcular a resposta, se o prompt seria atendido pelos
+        caminhos rápidos (usado para escolher o orçamento do rate limiter).
+        """
+        prompt_lower = NLPService._normalize_prompt(prompt)
+        return (
+            any(pattern.search(prompt_lower) for pattern, _ in MATH_PATTERNS)
+            or any(key in prompt_lower for key in QUICK_RESPONSES)
+        )
+
+    def _try_math(self, prompt, prompt_lower):
+        """
+        Resolve operações matemáticas simples presentes no prompt.
         
-        # ============================================
-        # CÁLCULOS MATEMÁTICOS AUTOMÁTICOS
-        # ============================================
-        math_patterns = [
-            # Multiplicação
-            (r'quanto\s+é\s+(\d+)\s+vezes\s+(\d+)', lambda m: int(m.group(1)) * int(m.group(2))),
-            (r'(\d+)\s+vezes\s+(\d+)', lambda m: int(m.group(1)) * int(m.group(2))),
-            (r'(\d+)\s*[xX×]\s*(\d+)', lambda m: int(m.group(1)) * int(m.group(2))),
-            # Adição
-            (r'quanto\s+é\s+(\d+)\s+mais\s+(\d+)', lambda m: int(m.group(1)) + int(m.group(2))),
-            (r'(\d+)\s+mais\s+(\d+)', lambda m: int(m.group(1)) + int(m.group(2))),
-            (r'(\d+)\s*\+\s*(\d+)', lambda m: int(m.group(1)) + int(m.group(2))),
-            # Subtração
-            (r'quanto\s+é\s+(\d+)\s+menos\s+(\d+)', lambda m: int(m.group(1)) - int(m.group(2))),
-            (r'(\d+)\s+menos\s+(\d+)', lambda m: int(m.group(1)) - int(m.group(2))),
-            (r'(\d+)\s*-\s*(\d+)', lambda m: int(m.group(1)) - int(m.group(2))),
-            # Divisão
-            (r'quanto\s+é\s+(\d+)\s+dividido\s+por\s+(\d+)', lambda m: int(m.group(1)) / int(m.group(2)) if int(m.group(2)) != 0 else None),
-            (r'(\d+)\s+dividido\s+por\s+(\d+)', lambda m: int(m.group(1)) / int(m.group(2)) if int(m.group(2)) != 0 else None),
-            (r'(\d+)\s*/\s*(\d+)', lambda m: int(m.group(1)) / int(m.group(2)) if int(m.group(2)) != 0 else None),
-        ]
-        
-        # Verifica se o prompt contém operação matemática
-        for pattern, func in math_patterns:
-            match = re.search(pattern, prompt_lower)
+        Returns:
+            str: Resposta com o resultado ou None se não houver operação
+        """
+        for pattern, func in MATH_PATTERNS:
+            match = pattern.search(prompt_lower)
             if match:
                 try:
                     result = func(match)
@@ -211,84 +557,203 @@ class NLPService:
                         result_str = str(int(result))
                     else:
                         result_str = f"{result:.2f}".rstrip('0').rstrip('.')
-                    processing_time = time.time() - start_time
-                    logger.info(f"Usando cálculo matemático para: {prompt[:50]}")
-                    return f"O resultado é {result_str}", processing_time
+                    logger.info("Usando cálculo matemático para: %s", prompt[:50])
+                    return f"O resultado é {result_str}"
                 except Exception as e:
-                    logger.debug(f"Erro no cálculo matemático: {e}")
+                    logger.debug("Erro no cálculo matemático: %s", e)
                     continue
+        return None
+
+    def _try_quick_response(self, prompt, prompt_lower):
+        """
+        Procura uma resposta pronta para perguntas comuns.
+        
+        Returns:
+            str: Resposta rápida ou None se nenhuma chave corresponder
+        """
+        for key, response in QUICK_RESPONSES.items():
+            if key in prompt_lower:
+                logger.info("Usando resposta rápida para: %s", prompt[:50])
+                return response
+        return None
+
+    def _fast_path(self, prompt):
+        """
+        Tenta responder sem usar o modelo (cálculo matemático ou resposta rápida).
+        
+        Returns:
+            tuple: (resposta, caminho) com caminho 'math' ou 'quick', ou
+            (None, None) se o prompt precisar do modelo
+        """
+        prompt_lower = self._normalize_prompt(prompt)
+        with metrics.stage_timer('math'):
+            response = self._try_math(prompt, prompt_lower)
+        if response is not None:
+            return response, PATH_MATH
+        with metrics.stage_timer('quick'):
+            response = self._try_quick_response(prompt, prompt_lower)
+        if response is not None:
+            return response, PATH_QUICK
+        return None, None
+
+    def process_prompt(self, prompt):
+        """
+        Processa um prompt e retorna a resposta do modelo.
+        
+        Implementa múltiplas camadas de processamento:
+        1. Respostas rápidas para perguntas comuns
+        2. Cálculos matemáticos automáticos
+        3. Processamento pelo modelo local ou API
+        
+        Requisições simultâneas com o mesmo prompt canônico (ver
+        ``_canonical_prompt``) compartilham uma única geração.
+        
+        Com um token de cancelamento ativo (ver cancellation) o trabalho é
+        interrompido assim que a requisição é cancelada.
+        
+        Args:
+            prompt (str): Texto de entrada do usuário
+            
+        Returns:
+            tuple: (resposta, tempo_processamento, metadados) ou levanta
+            RuntimeError; os metadados são os campos de ``new_usage``
+            
+        Raises:
+            GenerationCancelled: se a requisição for cancelada
+        """
+        start_time = time.time()
         
         # ============================================
-        # RESPOSTAS RÁPIDAS PARA PERGUNTAS COMUNS
+        # CÁLCULOS MATEMÁTICOS E RESPOSTAS RÁPIDAS
         # ============================================
-        quick_responses = {
-            # Saudações
-            "oi": "Olá! Como posso ajudá-lo hoje?",
-            "olá": "Olá! Em que posso ajudá-lo?",
-            "bom dia": "Bom dia! Como posso ajudá-lo?",
-            "boa tarde": "Boa tarde! Como posso ajudá-lo?",
-            "boa noite": "Boa noite! Como posso ajudá-lo?",
-            "oi tudo bem": "Tudo bem, obrigado! Como posso ajudá-lo?",
-            "tudo bem": "Sim, tudo bem! Em que posso ajudá-lo?",
-            "ping ping sam": "Ping pong! Sistema funcionando perfeitamente! 🏓",
-            
-            # Matemática comum
-            "dois mais dois": "Quatro (4)",
-            "2+2": "Quatro (4)",
-            "dois vezes dois": "Quatro (4)",
-            "2x2": "Quatro (4)",
-            
-            # Linguagem e Português
-            "me dá as vogais": "As vogais do alfabeto português são: A, E, I, O, U.",
-            "quais são as vogais": "As vogais são: A, E, I, O, U (e Y quando usado como vogal).",
-            "me diga as vogais": "As vogais são: A, E, I, O, U.",
-            "vogais": "As vogais do alfabeto português são: A, E, I, O, U.",
-            
-            # Animais
-            "os leões tem quantas patas": "Os leões têm 4 patas.",
-            "quantas patas tem um leão": "Um leão tem 4 patas.",
-            "leão quantas patas": "Os leões têm 4 patas.",
-            "quantas patas tem um cachorro": "Um cachorro tem 4 patas.",
-            "quantas patas tem um gato": "Um gato tem 4 patas.",
-            "quantas patas tem um cavalo": "Um cavalo tem 4 patas.",
-            
-            # Tecnologia
-            "o que é python": "Python é uma linguagem de programação de alto nível, interpretada e de propósito geral, conhecida por sua simplicidade e legibilidade. É amplamente usada em desenvolvimento web, ciência de dados, automação e inteligência artificial.",
-            "o que é django": "Django é um framework web de alto nível escrito em Python que facilita o desenvolvimento rápido de sites e aplicações web seguras e escaláveis.",
-            "o que é javascript": "JavaScript é uma linguagem de programação usada principalmente para criar interatividade em páginas web. É uma das tecnologias fundamentais da web moderna.",
-            
-            # História e Geografia
-            "quem descobriu o brasil": "Pedro Álvares Cabral descobriu o Brasil em 22 de abril de 1500.",
-            "capital do brasil": "A capital do Brasil é Brasília, localizada no Distrito Federal.",
-            "qual a capital da frança": "A capital da França é Paris.",
-            "qual a capital da espanha": "A capital da Espanha é Madrid.",
-            "qual a capital de portugal": "A capital de Portugal é Lisboa.",
-            
-            # Perguntas comuns
-            "como você está": "Estou funcionando perfeitamente! Como posso ajudá-lo?",
-            "qual seu nome": "Sou um assistente de IA especializado em Processamento de Linguagem Natural. Pode me chamar de PLN Assistant!",
-            "quem é você": "Sou um assistente virtual inteligente desenvolvido para ajudar com perguntas e conversas em português.",
-            
-            # Sistema
-            "fez o l": "Sim, fiz! O sistema está funcionando perfeitamente!",
-            "teste": "Sistema funcionando! Estou pronto para ajudar.",
-            "funciona": "Sim, o sistema está funcionando corretamente!",
-            
-            # Ciências
-            "o que é água": "Água (H2O) é uma molécula composta por dois átomos de hidrogênio e um de oxigênio. É essencial para a vida e cobre cerca de 71% da superfície da Terra.",
-            "quantos planetas existem": "No nosso Sistema Solar existem 8 planetas: Mercúrio, Vênus, Terra, Marte, Júpiter, Saturno, Urano e Netuno.",
-            
-            # Cultura
-            "qual a maior cidade do brasil": "A maior cidade do Brasil é São Paulo, com aproximadamente 12 milhões de habitantes.",
-            "quem escreveu romeu e julieta": "Romeu e Julieta foi escrita por William Shakespeare, o grande dramaturgo inglês.",
+        response, path = self._fast_path(prompt)
+        if response is not None:
+            metrics.inc('pln_answers_total', path=path)
+            return response, time.time() - start_time, new_usage(path)
+        
+        # Orçamento de entrada (levanta PromptTooLong): exato se o tokenizer já
+        # está carregado, senão estimado; o modelo só é carregado dentro da
+        # geração compartilhada, que confere de novo com o tokenizer
+        budget = self.check_prompt(prompt)
+        cancellation.raise_if_cancelled()
+        
+        if getattr(settings, 'COALESCE_PROMPTS', True):
+            try:
+                (response, usage), shared = self._in_flight.run(
+                    self._canonical_prompt(prompt), self._answer_with_model, prompt
+                )
+            except cancellation.GenerationCancelled:
+                # A geração compartilhada foi cancelada pelo cliente de outra
+                # requisição: se esta continua ativa, gera a própria resposta
+                cancellation.raise_if_cancelled()
+                (response, usage), shared = self._answer_with_model(prompt), False
+            if shared:
+                logger.debug("Resposta compartilhada com requisição idêntica em andamento")
+                metrics.inc('pln_coalesced_total')
+                usage = dict(usage)
+        else:
+            response, usage = self._answer_with_model(prompt)
+        
+        if usage.get('prompt_tokens') is None:
+            usage['prompt_tokens'] = budget['prompt_tokens']
+        metrics.inc('pln_answers_total', path=usage['path'])
+        return response, time.time() - start_time, usage
+
+    # ============================================
+    # ORÇAMENTO DE TOKENS DA ENTRADA
+    # ============================================
+
+    def prompt_budget(self, prompt):
+        """
+        Conta os tokens do prompt e calcula quantos cabem na entrada do modelo.
+        
+        Com o tokenizer carregado a contagem é exata e o limite é a janela
+        de contexto do modelo (ou MODEL_MAX_INPUT_TOKENS) menos os tokens da
+        instrução/template e, nos modelos causais, os tokens reservados para
+        a resposta. Sem tokenizer (só a API de inferência) a contagem é
+        estimada pelo número de caracteres.
+        
+        Returns:
+            dict: ``prompt_tokens``, ``max_prompt_tokens`` e ``estimated``
+        """
+        if self.tokenizer is None or not self._model_loaded:
+            return {
+                'prompt_tokens': -(-len(prompt) // CHARS_PER_TOKEN_ESTIMATE),
+                'max_prompt_tokens': getattr(settings, 'MODEL_MAX_INPUT_TOKENS', 0) or DEFAULT_CONTEXT_TOKENS,
+                'estimated': True,
+            }
+        
+        if self._preamble_tokens is None:
+            self._preamble_tokens = self._count_tokens(self._format_model_input(''))
+        reserved = self._preamble_tokens
+        if not getattr(self, 'is_encoder_decoder', False):
+            reserved += MAX_NEW_TOKENS_CAUSAL
+        return {
+            'prompt_tokens': self._count_tokens(prompt),
+            'max_prompt_tokens': max(0, self._context_tokens() - reserved),
+            'estimated': False,
         }
+
+    def check_prompt(self, prompt):
+        """
+        Verifica se o prompt cabe no orçamento de entrada.
         
-        # Verifica se há resposta rápida disponível
-        for key, response in quick_responses.items():
-            if key in prompt_lower:
-                processing_time = time.time() - start_time
-                logger.info(f"Usando resposta rápida para: {prompt[:50]}")
-                return response, processing_time
+        Returns:
+            dict: o orçamento de ``prompt_budget``
+            
+        Raises:
+            PromptTooLong: se o prompt tiver mais tokens que o permitido
+        """
+        budget = self.prompt_budget(prompt)
+        if budget['prompt_tokens'] > budget['max_prompt_tokens']:
+            raise PromptTooLong(budget)
+        return budget
+
+    def _count_tokens(self, text):
+        """Número de tokens do texto (sem tokens especiais)."""
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def _context_tokens(self):
+        """
+        Janela de contexto de entrada do modelo carregado.
+        
+        MODEL_MAX_INPUT_TOKENS, se configurado; senão o que a configuração do
+        modelo ou o tokenizer informam; senão DEFAULT_CONTEXT_TOKENS.
+        """
+        configured = getattr(settings, 'MODEL_MAX_INPUT_TOKENS', 0)
+        if configured:
+            return configured
+        config = getattr(self.model, 'config', None)
+        for attribute in ('max_position_embeddings', 'n_positions'):
+            value = getattr(config, attribute, None)
+            if isinstance(value, int) and value > 0:
+                return value
+        # Tokenizers sem limite definido usam um valor enorme (1e30)
+        value = getattr(self.tokenizer, 'model_max_length', None)
+        if isinstance(value, int) and 0 < value < 1_000_000:
+            return value
+        return DEFAULT_CONTEXT_TOKENS
+
+    def _max_input_length(self):
+        """Limite de tokens da entrada formatada na tokenização para ``generate``."""
+        if getattr(self, 'is_encoder_decoder', False):
+            return self._context_tokens()
+        return max(1, self._context_tokens() - MAX_NEW_TOKENS_CAUSAL)
+
+    @staticmethod
+    def _canonical_prompt(prompt):
+        """Forma canônica usada para agrupar prompts idênticos em andamento."""
+        return ' '.join(prompt.lower().split())
+
+    def _answer_with_model(self, prompt):
+        """
+        Responde com a API de inferência (USE_HF_FOR_ALL) ou o modelo local,
+        recorrendo à API se o modelo local não estiver disponível ou falhar.
+        
+        Returns:
+            tuple: (resposta, metadados)
+        """
+        start_time = time.time()
         
         # ============================================
         # USAR API DE INFERÊNCIA SE CONFIGURADO
@@ -297,9 +762,8 @@ class NLPService:
             logger.debug("USE_HF_FOR_ALL habilitado — usando API de Inferência HF")
             hf_resp = self.hf_inference(prompt)
             if hf_resp:
-                processing_time = time.time() - start_time
-                logger.info(f"Processado via API HF em {processing_time:.2f} segundos")
-                return hf_resp, processing_time
+                logger.info("Processado via API HF em %.2f segundos", time.time() - start_time)
+                return hf_resp, new_usage(PATH_HF)
             else:
                 logger.debug("API HF não retornou resultado, usando modelo local")
 
@@ -311,56 +775,197 @@ class NLPService:
         # Se o modelo não carregou, tenta usar API como fallback
         if not self._model_loaded or not self.model or not self.tokenizer:
             logger.warning("Modelo local não disponível, tentando API de inferência como fallback")
+            metrics.inc('pln_fallbacks_total', kind='hf_api')
             hf_resp = self.hf_inference(prompt)
             if hf_resp:
-                processing_time = time.time() - start_time
-                logger.info(f"Processado via API HF (fallback) em {processing_time:.2f} segundos")
-                return hf_resp, processing_time
+                logger.info("Processado via API HF (fallback) em %.2f segundos", time.time() - start_time)
+                return hf_resp, new_usage(PATH_HF)
             else:
                 raise RuntimeError("Nem o modelo local nem a API de inferência estão disponíveis")
         
+        # Com o tokenizer carregado a contagem é exata (levanta PromptTooLong)
+        budget = self.check_prompt(prompt)
+        
         try:
-            # ============================================
-            # FORMATAÇÃO DO PROMPT PARA O MODELO
-            # ============================================
-            instruction = (
-                "Você é um assistente útil, educado e objetivo que SEMPRE responde APENAS em Português Brasileiro. "
-                "NUNCA responda em inglês. Responda de forma direta, sem repetir a pergunta, "
-                "sem usar palavras como 'question' ou 'questions', e forneça uma resposta clara e curta quando possível. "
-                "Responda diretamente a pergunta sem ecoar o prompt."
-            )
+            with self._request_scope():
+                raw_response, formatted_prompt, usage = self._generate_local([prompt])[0]
+                response = self._postprocess_response(prompt, raw_response, formatted_prompt, usage=usage)
+            usage['prompt_tokens'] = budget['prompt_tokens']
 
-            if getattr(self, 'is_encoder_decoder', False):
-                # Modelos encoder-decoder (T5, Flan-T5, etc.)
-                if "flan" in self.model_name.lower() or "t5" in self.model_name.lower():
-                    # Formato otimizado para Flan-T5
-                    seq_input = f"Responda em português: {prompt}"
+            logger.info("Prompt processado em %.2f segundos", time.time() - start_time)
+            return response, usage
+            
+        except Exception as e:
+            logger.exception("Erro ao processar prompt: %s", e)
+            metrics.inc('pln_errors_total', component='generate')
+            # Último recurso: tenta API de inferência
+            metrics.inc('pln_fallbacks_total', kind='hf_api')
+            hf_resp = self.hf_inference(prompt)
+            if hf_resp:
+                return hf_resp, new_usage(PATH_HF)
+            raise
+
+    def process_batch(self, prompts):
+        """
+        Processa vários prompts de uma vez.
+        
+        Os caminhos rápidos (matemática e respostas prontas) são resolvidos
+        por prompt; os demais são agrupados por tamanho e enviados ao modelo
+        em chamadas ``generate`` com padding (ou em uma única chamada à API
+        de inferência quando USE_HF_FOR_ALL está habilitado).
+        
+        Args:
+            prompts (list): Textos de entrada, na ordem do pedido
+            
+        Returns:
+            list: tuplas (resposta, tempo_processamento, metadados) na mesma
+            ordem dos prompts
+        """
+        results = [None] * len(prompts)
+        pending = []
+        
+        for index, prompt in enumerate(prompts):
+            start_time = time.time()
+            response, path = self._fast_path(prompt)
+            if response is not None:
+                metrics.inc('pln_answers_total', path=path)
+                results[index] = (response, time.time() - start_time, new_usage(path))
+            else:
+                pending.append(index)
+        
+        if not pending:
+            return results
+        
+        if getattr(settings, 'USE_HF_FOR_ALL', False):
+            logger.debug("USE_HF_FOR_ALL habilitado — usando API de Inferência HF em lote")
+            start_time = time.time()
+            hf_responses = self.hf_inference_batch([prompts[i] for i in pending])
+            elapsed = time.time() - start_time
+            remaining = []
+            for index, hf_resp in zip(pending, hf_responses):
+                if hf_resp:
+                    metrics.inc('pln_answers_total', path=PATH_HF)
+                    results[index] = (hf_resp, elapsed, new_usage(PATH_HF))
                 else:
-                    # Outros modelos seq2seq
-                    seq_input = f"pergunta: {prompt} resposta:"
-                
-                # Tokeniza o input
-                inputs = self.tokenizer(seq_input, return_tensors="pt", padding=True, truncation=True, max_length=512)
-                inputs = {k: v.to(self.device) for k, v in inputs.items()}
-                
-                # Gera a resposta
-                with torch.no_grad():
-                    outputs = self.model.generate(
-                        **inputs,
-                        max_new_tokens=200,
-                        min_length=10,
-                        do_sample=True,
-                        temperature=0.8,
-                        top_k=50,
-                        top_p=0.95,
-                        no_repeat_ngram_size=3,
-                        repetition_penalty=1.2,
-                        pad_token_id=self.tokenizer.pad_token_id if self.tokenizer.pad_token_id else self.tokenizer.eos_token_id,
-                    )
+                    remaining.append(index)
+            pending = remaining
+            if not pending:
+                logger.info("Lote processado via API HF em %.2f segundos", elapsed)
+                return results
+        
+        self._ensure_model_loaded()
+        
+        if not self._model_loaded or not self.model or not self.tokenizer:
+            logger.warning("Modelo local não disponível, tentando API de inferência como fallback")
+            metrics.inc('pln_fallbacks_total', kind='hf_api')
+            self._fill_from_hf_batch(prompts, pending, results)
+            return results
+        
+        # Prompts de tamanho parecido no mesmo lote reduzem o padding
+        pending.sort(key=lambda i: len(prompts[i]))
+        batch_size = max(1, getattr(settings, 'BATCH_GENERATE_SIZE', 16))
+        
+        for offset in range(0, len(pending), batch_size):
+            cancellation.raise_if_cancelled()
+            chunk = pending[offset:offset + batch_size]
+            start_time = time.time()
+            with self._request_scope():
+                try:
+                    generated = self._generate_local([prompts[i] for i in chunk])
+                except Exception as e:
+                    logger.exception("Erro ao processar lote de prompts: %s", e)
+                    metrics.inc('pln_errors_total', component='generate')
+                    metrics.inc('pln_fallbacks_total', kind='hf_api')
+                    self._fill_from_hf_batch(prompts, chunk, results)
+                    continue
+                generate_time = time.time() - start_time
                 
+                for index, (raw_response, formatted_prompt, usage) in zip(chunk, generated):
+                    item_start = time.time()
+                    response = self._postprocess_response(prompts[index], raw_response, formatted_prompt, usage=usage)
+                    metrics.inc('pln_answers_total', path=usage['path'])
+                    results[index] = (response, generate_time + time.time() - item_start, usage)
+            
+            logger.info("Lote de %s prompts processado em %.2f segundos", len(chunk), time.time() - start_time)
+        
+        return results
+
+    def _fill_from_hf_batch(self, prompts, indexes, results):
+        """
+        Preenche os resultados pendentes usando a API de inferência em lote.
+        
+        Levanta RuntimeError se algum prompt ficar sem resposta.
+        """
+        start_time = time.time()
+        hf_responses = self.hf_inference_batch([prompts[i] for i in indexes])
+        elapsed = time.time() - start_time
+        for index, hf_resp in zip(indexes, hf_responses):
+            if not hf_resp:
+                raise RuntimeError("Nem o modelo local nem a API de inferência estão disponíveis")
+            metrics.inc('pln_answers_total', path=PATH_HF)
+            results[index] = (hf_resp, elapsed, new_usage(PATH_HF))
+
+    def _format_model_input(self, prompt):
+        """Monta o texto de entrada do modelo local conforme o tipo de modelo."""
+        if getattr(self, 'is_encoder_decoder', False):
+            # Modelos encoder-decoder (T5, Flan-T5, etc.)
+            if "flan" in self.model_name.lower() or "t5" in self.model_name.lower():
+                # Formato otimizado para Flan-T5
+                return f"Responda em português: {prompt}"
+            # Outros modelos seq2seq
+            return f"pergunta: {prompt} resposta:"
+        # Modelos causais (GPT-like)
+        return f"{INSTRUCTION}\nUser: {prompt}\nBot:"
+
+    def _generate_local(self, prompts):
+        """
+        Gera respostas com o modelo local para um lote de prompts.
+        
+        Os prompts são tokenizados juntos com padding e processados em uma
+        única chamada ``generate``. Para modelos causais o padding fica à
+        esquerda, então a parte gerada começa no mesmo índice para todo o lote.
+        
+        Args:
+            prompts (list): Textos de entrada do usuário
+            
+        Returns:
+            list: tuplas (resposta_bruta, entrada_formatada, metadados) na
+            ordem dos prompts
+        """
+        model_inputs = [self._format_model_input(prompt) for prompt in prompts]
+        results = []
+
+        if getattr(self, 'is_encoder_decoder', False):
+            # Codifica o input (ou reutiliza a codificação já feita na requisição)
+            encoder_outputs, attention_mask = self._stack_encoded(self._encode(model_inputs))
+            inputs = {'attention_mask': attention_mask}
+            
+            # Gera a resposta
+            with torch.no_grad(), metrics.stage_timer('generate'):
+                outputs = self.model.generate(
+                    encoder_outputs=encoder_outputs,
+                    attention_mask=attention_mask,
+                    max_new_tokens=MAX_NEW_TOKENS_SEQ2SEQ,
+                    stopping_criteria=self._stopping_list(),
+                    min_length=10,
+                    do_sample=True,
+                    temperature=0.8,
+                    top_k=50,
+                    top_p=0.95,
+                    no_repeat_ngram_size=3,
+                    repetition_penalty=1.2,
+                    pad_token_id=self.tokenizer.pad_token_id if self.tokenizer.pad_token_id else self.tokenizer.eos_token_id,
+                )
+            
+            cancellation.raise_if_cancelled()
+            
+            for row, (seq_input, output) in enumerate(zip(model_inputs, outputs)):
+                usage = new_usage(PATH_LOCAL)
+                self._count_generation(usage, self._input_token_count(inputs, row), output)
+
                 # Decodifica a resposta
                 try:
-                    response = self.tokenizer.decode(outputs[0].cpu(), skip_special_tokens=True).strip()
+                    response = self.tokenizer.decode(output.cpu(), skip_special_tokens=True).strip()
                     
                     # Remove prefixos comuns que podem aparecer
                     prefixes_to_remove = ["resposta:", "Resposta:", "RESPOSTA:", "responda:", "Responda:", "RESPONDA:"]
@@ -373,290 +978,519 @@ class NLPService:
                     has_portuguese = any(word in response.lower() for word in ["que", "o", "a", "do", "da", "é"])
                     
                     if has_english and has_portuguese and len(response) < 50:
-                        logger.warning(f"Resposta de baixa qualidade detectada: {response}")
+                        logger.warning("Resposta de baixa qualidade detectada: %s", response, extra=PAYLOAD_LOG)
                         if "does the question mean" in response.lower():
                             response = "Desculpe, não consegui processar essa pergunta adequadamente. Tente reformular ou ser mais específico."
                 except Exception:
                     response = ""
                 
-                logger.debug(f"Input seq2seq: {seq_input}")
-                logger.debug(f"Resposta gerada: {response}")
-                
+                logger.debug("Input seq2seq: %s", seq_input, extra=PAYLOAD_LOG)
+                logger.debug("Resposta gerada: %s", response, extra=PAYLOAD_LOG)
+                # A entrada do seq2seq nunca é ecoada na saída do decoder
+                results.append((response, None, usage))
+            
+            return results
+
+        # Tokeniza o input
+        with metrics.stage_timer('tokenization'):
+            inputs = self.tokenizer(
+                model_inputs, return_tensors="pt", padding=True, truncation=True,
+                max_length=self._max_input_length(), return_attention_mask=True,
+            )
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+        input_ids = inputs["input_ids"]
+        input_len = input_ids.shape[-1]
+        stopping = self._stopping_criteria(input_len)
+        generate_kwargs = dict(
+            attention_mask=inputs.get("attention_mask"),
+            max_new_tokens=MAX_NEW_TOKENS_CAUSAL,
+            stopping_criteria=self._stopping_list(stopping),
+            num_return_sequences=1,
+            do_sample=True,
+            temperature=0.7,
+            top_k=50,
+            top_p=0.95,
+            no_repeat_ngram_size=3,
+            repetition_penalty=1.1,
+            pad_token_id=self.tokenizer.eos_token_id,
+        )
+        # Gera a resposta (a geração assistida da Hugging Face só aceita um prompt por vez)
+        with self._assisted_scope(len(prompts) == 1) as assisted:
+            with torch.no_grad(), metrics.stage_timer('generate'):
+                outputs = None
+                if assisted is not None:
+                    outputs = self._generate_assisted(input_ids, generate_kwargs, assisted)
+                    if outputs is None:
+                        assisted = None
+                if outputs is None:
+                    outputs = self.model.generate(input_ids, **generate_kwargs)
+            if assisted is not None:
+                # Contadores por thread: lidos antes de liberar a configuração
+                target_passes = assisted.target_counter.count
+                draft_passes = assisted.draft_counter.count
+        cancellation.raise_if_cancelled()
+
+        for row, (formatted_prompt, output) in enumerate(zip(model_inputs, outputs)):
+            # Decodifica apenas a parte gerada (não inclui o prompt)
+            generated_ids = output[input_len:]
+            usage = new_usage(PATH_LOCAL)
+            self._count_generation(usage, self._input_token_count(inputs, row), generated_ids, stopping, row)
+            if assisted is not None:
+                self._record_assisted(usage, generated_ids, target_passes, draft_passes)
+            if generated_ids.shape[0] == 0:
+                try:
+                    response = self.tokenizer.decode(output.cpu(), skip_special_tokens=True)
+                except Exception:
+                    response = ""
             else:
-                # Modelos causais (GPT-like)
-                formatted_prompt = f"{instruction}\nUser: {prompt}\nBot:"
-                
-                # Tokeniza o input
-                inputs = self.tokenizer(formatted_prompt, return_tensors="pt", padding=True, truncation=True, return_attention_mask=True)
+                response = self.tokenizer.decode(generated_ids.cpu(), skip_special_tokens=True).strip()
+                response = trim_response(response, usage['stop_reason'])
+
+            logger.debug("Prompt formatado: %s", formatted_prompt, extra=PAYLOAD_LOG)
+            logger.debug("Comprimento dos tokens: %s", input_len)
+            logger.debug("Resposta gerada: %s", response, extra=PAYLOAD_LOG)
+            results.append((response, formatted_prompt, usage))
+
+        return results
+
+    @staticmethod
+    def _stopping_list(*criteria):
+        """Critérios de parada de um ``generate``, mais o cancelamento da requisição em andamento."""
+        criteria = [criterion for criterion in criteria if criterion is not None]
+        token = cancellation.current_token()
+        if token is not None:
+            criteria.append(cancellation.CancelledStoppingCriteria(token))
+        return StoppingCriteriaList(criteria)
+
+    @contextmanager
+    def _request_scope(self):
+        """
+        Escopo de uma requisição: as saídas do encoder calculadas dentro dele
+        são reutilizadas pelas regenerações com a mesma entrada.
+        """
+        previous = getattr(self._request_state, 'encoder_cache', None)
+        self._request_state.encoder_cache = previous if previous is not None else {}
+        try:
+            yield
+        finally:
+            self._request_state.encoder_cache = previous
+
+    def _encode(self, texts):
+        """
+        Saídas do encoder (modelos seq2seq) de cada texto de entrada.
+        
+        Dentro de ``_request_scope`` os textos já codificados na requisição
+        não passam de novo pelo encoder; os demais são codificados juntos em
+        uma única passada. Cada saída guarda só as posições reais (sem
+        padding), então pode ser combinada em qualquer lote.
+        
+        Returns:
+            list: tuplas (estados ocultos [1, n, d], máscara de atenção [1, n])
+            na ordem dos textos
+        """
+        cache = getattr(self._request_state, 'encoder_cache', None)
+        if cache is None:
+            cache = {}
+        missing = [text for text in dict.fromkeys(texts) if text not in cache]
+        
+        if missing:
+            with metrics.stage_timer('tokenization'):
+                inputs = self.tokenizer(missing, return_tensors="pt", padding=True, truncation=True, max_length=self._max_input_length())
                 inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            with torch.no_grad(), metrics.stage_timer('encoder'):
+                hidden_states = self.model.get_encoder()(
+                    input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask'], return_dict=True,
+                ).last_hidden_state
+            for row, text in enumerate(missing):
+                real = inputs['attention_mask'][row].bool()
+                states = hidden_states[row][real].unsqueeze(0)
+                cache[text] = (states, torch.ones(states.shape[:2], dtype=torch.long, device=states.device))
+            metrics.inc('pln_encoder_passes_total', len(missing), result='miss')
+        
+        if len(texts) > len(missing):
+            metrics.inc('pln_encoder_passes_total', len(texts) - len(missing), result='reused')
+        return [cache[text] for text in texts]
 
-                input_ids = inputs["input_ids"]
-                input_len = input_ids.shape[-1]
+    @staticmethod
+    def _stack_encoded(encoded):
+        """Junta saídas do encoder de ``_encode`` em um lote com padding à direita."""
+        length = max(states.shape[1] for states, _ in encoded)
+        hidden_states = torch.cat([
+            torch.nn.functional.pad(states, (0, 0, 0, length - states.shape[1])) for states, _ in encoded
+        ])
+        attention_mask = torch.cat([
+            torch.nn.functional.pad(mask, (0, length - mask.shape[1])) for _, mask in encoded
+        ])
+        return BaseModelOutput(last_hidden_state=hidden_states), attention_mask
 
-                # Gera a resposta
-                with torch.no_grad():
-                    outputs = self.model.generate(
-                        input_ids,
-                        attention_mask=inputs.get("attention_mask"),
-                        max_new_tokens=150,
+    def _regenerate(self, prompt, template, **sampling):
+        """
+        Gera outra resposta para o prompt com outros parâmetros de amostragem.
+        
+        Nos modelos seq2seq a entrada é a mesma da primeira geração, e a
+        saída do encoder vem da requisição; nos causais a entrada é
+        ``template`` com o prompt.
+        
+        Returns:
+            tuple: (resposta, tokens de entrada, ids gerados, critério de
+            parada ou None)
+        """
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id else self.tokenizer.eos_token_id
+        
+        if getattr(self, 'is_encoder_decoder', False):
+            encoder_outputs, attention_mask = self._stack_encoded(self._encode([self._format_model_input(prompt)]))
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    encoder_outputs=encoder_outputs,
+                    attention_mask=attention_mask,
+                    max_new_tokens=MAX_NEW_TOKENS_SEQ2SEQ,
+                    stopping_criteria=self._stopping_list(),
+                    pad_token_id=pad_token_id,
+                    **sampling,
+                )
+            cancellation.raise_if_cancelled()
+            generated_ids = outputs[0]
+            response = self.tokenizer.decode(generated_ids.cpu(), skip_special_tokens=True).strip()
+            return response, int(attention_mask[0].sum()), generated_ids, None
+        
+        inputs = self.tokenizer(
+            template.format(prompt=prompt), return_tensors="pt", truncation=True,
+            max_length=self._max_input_length(), return_attention_mask=True,
+        )
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        input_len = inputs['input_ids'].shape[-1]
+        stopping = self._stopping_criteria(input_len)
+        with torch.no_grad():
+            outputs = self.model.generate(
+                inputs['input_ids'],
+                attention_mask=inputs.get('attention_mask'),
+                max_new_tokens=MAX_NEW_TOKENS_CAUSAL,
+                stopping_criteria=self._stopping_list(stopping),
+                pad_token_id=pad_token_id,
+                **sampling,
+            )
+        cancellation.raise_if_cancelled()
+        generated_ids = outputs[0][input_len:]
+        response = self.tokenizer.decode(generated_ids.cpu(), skip_special_tokens=True).strip()
+        response = trim_response(response, stopping.reason(0, generated_ids.tolist(), self.tokenizer.eos_token_id))
+        return response, self._input_token_count(inputs, 0), generated_ids, stopping
+
+    def _generate_assisted(self, input_ids, generate_kwargs, assisted):
+        """
+        ``generate`` com o modelo rascunho propondo tokens.
+        
+        Se a geração assistida falhar, o rascunho é desabilitado para as
+        próximas gerações e o chamador gera sem ele.
+        
+        Args:
+            assisted (AssistedDecoding): configuração lida no início da geração
+        
+        Returns:
+            tensor com as sequências geradas ou None
+        """
+        assisted.target_counter.reset()
+        assisted.draft_counter.reset()
+        try:
+            return self.model.generate(input_ids, assistant_model=assisted.draft, **generate_kwargs)
+        except Exception as e:
+            logger.warning("Geração assistida falhou, desabilitando o modelo rascunho: %s", e)
+            metrics.inc('pln_errors_total', component='assisted')
+            self._disable_assisted(assisted)
+            return None
+
+    def _record_assisted(self, usage, generated_ids, target_passes, draft_passes):
+        """Registra a taxa de aceitação e o speedup da geração assistida."""
+        stats = assisted_stats(int(generated_ids.shape[0]), target_passes, draft_passes)
+        usage['draft_acceptance'] = stats['draft_acceptance']
+        usage['draft_speedup'] = stats['draft_speedup']
+        metrics.inc('pln_draft_tokens_total', stats['draft_proposed'], outcome='proposed')
+        metrics.inc('pln_draft_tokens_total', stats['draft_accepted'], outcome='accepted')
+        metrics.inc('pln_assisted_target_passes_total', target_passes)
+        metrics.inc('pln_assisted_tokens_total', int(generated_ids.shape[0]))
+        logger.debug(
+            "Geração assistida: aceitação %s, speedup %s",
+            stats['draft_acceptance'], stats['draft_speedup'],
+        )
+
+    @staticmethod
+    def _input_token_count(inputs, row):
+        """Número de tokens reais (sem padding) da entrada de uma linha do lote."""
+        attention_mask = inputs.get('attention_mask')
+        if attention_mask is not None:
+            return int(attention_mask[row].sum())
+        return int(inputs['input_ids'][row].shape[-1])
+
+    def _stopping_criteria(self, prompt_length):
+        """Critério de parada de uma chamada ``generate`` causal (perfil ANSWER_PROFILE)."""
+        return ResponseStoppingCriteria(
+            self.tokenizer, prompt_length,
+            short_answer=getattr(settings, 'ANSWER_PROFILE', 'default') == PROFILE_SHORT,
+            min_sentence_tokens=getattr(settings, 'SHORT_ANSWER_MIN_TOKENS', 8),
+        )
+
+    def _count_generation(self, usage, input_tokens, generated_ids, stopping=None, row=0):
+        """
+        Acrescenta uma chamada ``generate`` aos metadados da resposta.
+
+        Tokens de padding/fim não contam como gerados; a geração é
+        considerada truncada quando não chegou ao token de fim nem foi
+        encerrada pelo critério de parada, cujo motivo é contado em
+        ``pln_generation_stops_total``.
+        """
+        eos_token_id = self.tokenizer.eos_token_id
+        special_ids = {eos_token_id, self.tokenizer.pad_token_id}
+        token_ids = generated_ids.tolist()
+        usage['generate_calls'] += 1
+        usage['input_tokens'] = (usage['input_tokens'] or 0) + input_tokens
+        usage['generated_tokens'] = (usage['generated_tokens'] or 0) + sum(
+            1 for token_id in token_ids if token_id not in special_ids
+        )
+        if stopping is None:
+            usage['truncated'] = eos_token_id not in token_ids
+            return
+        usage['stop_reason'] = stopping.reason(row, token_ids, eos_token_id)
+        usage['truncated'] = usage['stop_reason'] == STOP_MAX_TOKENS
+        metrics.inc('pln_generation_stops_total', reason=usage['stop_reason'])
+
+    def _postprocess_response(self, prompt, response, formatted_prompt=None, usage=None):
+        """
+        Regenera respostas ruins e limpa a resposta do modelo local.
+        
+        Args:
+            prompt (str): Texto original do usuário
+            response (str): Resposta bruta gerada pelo modelo
+            formatted_prompt (str, optional): Entrada do modelo causal, removida
+                caso apareça ecoada no início da resposta
+            usage (dict, optional): metadados da resposta, atualizados com as
+                regenerações e o caminho final
+            
+        Returns:
+            str: Resposta final para o usuário
+        """
+        prompt_lower = self._normalize_prompt(prompt)
+
+        # ============================================
+        # TENTA REGENERAR SE A RESPOSTA FOR RUIM
+        # ============================================
+        if (not response) or (response.strip().lower() == prompt.strip().lower()) or (prompt.strip() in response):
+            with metrics.stage_timer('regeneration'):
+                try:
+                    alt_response, input_tokens, alt_generated, stopping = self._regenerate(
+                        prompt, REGENERATION_TEMPLATE,
                         num_return_sequences=1,
                         do_sample=True,
-                        temperature=0.7,
+                        temperature=1.0,
                         top_k=50,
                         top_p=0.95,
                         no_repeat_ngram_size=3,
-                        repetition_penalty=1.1,
-                        pad_token_id=self.tokenizer.eos_token_id,
+                        repetition_penalty=1.05,
                     )
-
-                # Decodifica apenas a parte gerada (não inclui o prompt)
-                try:
-                    full_decoded = self.tokenizer.decode(outputs[0].cpu(), skip_special_tokens=True)
-                except Exception:
-                    full_decoded = ""
-
-                generated_ids = outputs[0][input_len:]
-                if generated_ids.shape[0] == 0:
-                    response = full_decoded
-                else:
-                    response = self.tokenizer.decode(generated_ids.cpu(), skip_special_tokens=True).strip()
-
-                logger.debug(f"Prompt formatado: {formatted_prompt}")
-                logger.debug(f"Comprimento dos tokens: {input_len}")
-                logger.debug(f"Resposta completa: {full_decoded}")
-                logger.debug(f"Resposta gerada: {response}")
-
-            # ============================================
-            # TENTA REGENERAR SE A RESPOSTA FOR RUIM
-            # ============================================
-            if (not response) or (response.strip().lower() == prompt.strip().lower()) or (prompt.strip() in response):
-                try:
-                    alt_prompt = f"Por favor, responda de forma direta:\n{prompt}\nResposta:"
-                    alt_inputs = self.tokenizer(alt_prompt, return_tensors="pt", padding=True, truncation=True, return_attention_mask=True)
-                    alt_inputs = {k: v.to(self.device) for k, v in alt_inputs.items()}
-                    alt_input_ids = alt_inputs['input_ids']
-                    alt_input_len = alt_input_ids.shape[-1]
-                    
-                    with torch.no_grad():
-                        alt_outputs = self.model.generate(
-                            alt_input_ids,
-                            attention_mask=alt_inputs.get('attention_mask'),
-                            max_new_tokens=150,
-                            num_return_sequences=1,
-                            do_sample=True,
-                            temperature=1.0,
-                            top_k=50,
-                            top_p=0.95,
-                            no_repeat_ngram_size=3,
-                            repetition_penalty=1.05,
-                            pad_token_id=self.tokenizer.eos_token_id,
-                        )
-                    
-                    try:
-                        alt_full = self.tokenizer.decode(alt_outputs[0].cpu(), skip_special_tokens=True)
-                    except Exception:
-                        alt_full = ""
-                    
-                    alt_generated = alt_outputs[0][alt_input_len:]
+                    if usage is not None:
+                        self._count_generation(usage, input_tokens, alt_generated, stopping)
+                        usage['path'] = PATH_LOCAL_REGENERATED
                     if alt_generated.shape[0] > 0:
-                        response = self.tokenizer.decode(alt_generated.cpu(), skip_special_tokens=True).strip()
-                    
-                    logger.debug(f"Resposta alternativa completa: {alt_full}")
-                    logger.debug(f"Resposta alternativa gerada: {response}")
+                        response = alt_response
+                
+                    logger.debug("Resposta alternativa gerada: %s", response, extra=PAYLOAD_LOG)
                 except Exception:
                     pass
 
-            # ============================================
-            # LIMPEZA E PÓS-PROCESSAMENTO DA RESPOSTA
-            # ============================================
-            try:
-                cleaned = response.strip()
-                
-                # Lista de padrões a remover (ecos de instruções)
-                patterns_to_remove = [
-                    instruction,
-                    "Você é um assistente",
-                    "Você é un assistente",
-                    "assistente útil, educado e objetivo",
-                    "Responda de forma direta",
-                    "Responda em português",
-                    "Responda em Português",
+        with metrics.stage_timer('sanitizer'):
+            return self._sanitize_response(prompt, prompt_lower, response, formatted_prompt, usage)
+
+    def _sanitize_response(self, prompt, prompt_lower, response, formatted_prompt=None, usage=None):
+        """
+        Remove ecos do prompt e da instrução e troca respostas de baixa qualidade.
+        
+        Pode regenerar a resposta (seq2seq) ou recorrer à API de inferência
+        quando o texto limpo continua em inglês ou vazio.
+        
+        Returns:
+            str: Resposta limpa
+        """
+        # ============================================
+        # LIMPEZA E PÓS-PROCESSAMENTO DA RESPOSTA
+        # ============================================
+        try:
+            cleaned = response.strip()
+            
+            # Lista de padrões a remover (ecos de instruções)
+            patterns_to_remove = [
+                INSTRUCTION,
+                "Você é um assistente",
+                "Você é un assistente",
+                "assistente útil, educado e objetivo",
+                "Responda de forma direta",
+                "Responda em português",
+                "Responda em Português",
+                "responda:",
+                "Resposta:",
+                "resposta:",
+            ]
+            
+            # Remove cada padrão
+            for pattern in patterns_to_remove:
+                if pattern.lower() in cleaned.lower():
+                    cleaned = cleaned.replace(pattern, "").replace(pattern.lower(), "").replace(pattern.upper(), "")
+                    cleaned = cleaned.replace(pattern.capitalize(), "")
+            
+            # Remove o prompt original se aparecer no início
+            if cleaned.lower().startswith(prompt.lower()):
+                cleaned = cleaned[len(prompt):].strip()
+            
+            # Para modelos seq2seq, remove prefixos específicos
+            if getattr(self, 'is_encoder_decoder', False):
+                seq_prefixes = [
+                    "Responda em português de forma clara e direta:",
                     "responda:",
-                    "Resposta:",
+                    "pergunta:",
                     "resposta:",
+                    "Pergunta:",
+                    "Resposta:"
                 ]
+                for prefix in seq_prefixes:
+                    if cleaned.lower().startswith(prefix.lower()):
+                        cleaned = cleaned[len(prefix):].strip()
                 
-                # Remove cada padrão
+                # Remove "Pergunta:" se aparecer
+                if cleaned.startswith("Pergunta:") or cleaned.startswith("pergunta:"):
+                    if "Resposta:" in cleaned or "resposta:" in cleaned:
+                        parts = cleaned.split("Resposta:") if "Resposta:" in cleaned else cleaned.split("resposta:")
+                        if len(parts) > 1:
+                            cleaned = parts[-1].strip()
+                    else:
+                        cleaned = cleaned.replace("Pergunta:", "").replace("pergunta:", "").replace(prompt, "").strip()
+            
+            # Remove ecos de 'User:'/'Bot:' para modelos causais
+            if not getattr(self, 'is_encoder_decoder', False):
+                if formatted_prompt and cleaned.startswith(formatted_prompt):
+                    cleaned = cleaned[len(formatted_prompt):].strip()
+            
+            # Remove linhas que são apenas eco da instrução
+            lines = cleaned.split('\n')
+            filtered_lines = []
+            for line in lines:
+                line_clean = line.strip()
+                skip = False
                 for pattern in patterns_to_remove:
-                    if pattern.lower() in cleaned.lower():
-                        cleaned = cleaned.replace(pattern, "").replace(pattern.lower(), "").replace(pattern.upper(), "")
-                        cleaned = cleaned.replace(pattern.capitalize(), "")
-                
-                # Remove o prompt original se aparecer no início
-                if cleaned.lower().startswith(prompt.lower()):
-                    cleaned = cleaned[len(prompt):].strip()
-                
-                # Para modelos seq2seq, remove prefixos específicos
-                if getattr(self, 'is_encoder_decoder', False):
-                    seq_prefixes = [
-                        "Responda em português de forma clara e direta:",
-                        "responda:",
-                        "pergunta:",
-                        "resposta:",
-                        "Pergunta:",
-                        "Resposta:"
-                    ]
-                    for prefix in seq_prefixes:
-                        if cleaned.lower().startswith(prefix.lower()):
-                            cleaned = cleaned[len(prefix):].strip()
-                    
-                    # Remove "Pergunta:" se aparecer
-                    if cleaned.startswith("Pergunta:") or cleaned.startswith("pergunta:"):
-                        if "Resposta:" in cleaned or "resposta:" in cleaned:
-                            parts = cleaned.split("Resposta:") if "Resposta:" in cleaned else cleaned.split("resposta:")
-                            if len(parts) > 1:
-                                cleaned = parts[-1].strip()
-                        else:
-                            cleaned = cleaned.replace("Pergunta:", "").replace("pergunta:", "").replace(prompt, "").strip()
-                
-                # Remove ecos de 'User:'/'Bot:' para modelos causais
-                if not getattr(self, 'is_encoder_decoder', False):
-                    if 'formatted_prompt' in locals() and cleaned.startswith(formatted_prompt):
-                        cleaned = cleaned[len(formatted_prompt):].strip()
-                
-                # Remove linhas que são apenas eco da instrução
-                lines = cleaned.split('\n')
-                filtered_lines = []
-                for line in lines:
-                    line_clean = line.strip()
-                    skip = False
-                    for pattern in patterns_to_remove:
-                        if pattern.lower() in line_clean.lower() and len(line_clean) < 100:
-                            skip = True
-                            break
-                    if not skip and line_clean:
-                        filtered_lines.append(line)
-                cleaned = '\n'.join(filtered_lines)
-                
-                # Limpa pontuação e espaços extras
-                cleaned = cleaned.lstrip('\n\r :\t-')
-                cleaned = cleaned.strip()
-                
-                # Se ainda contém muito da instrução, extrai apenas a parte significativa
-                if len(cleaned) > 0 and (instruction[:20].lower() in cleaned.lower() or prompt.lower() in cleaned.lower()[:len(prompt)*2]):
-                    parts = cleaned.split(prompt)
-                    if len(parts) > 1:
-                        cleaned = parts[-1].strip()
-                
-                # ============================================
-                # DETECÇÃO DE RESPOSTAS DE BAIXA QUALIDADE
-                # ============================================
-                cleaned_lower = cleaned.lower()
-                
-                # Detecta inglês indesejado
-                english_indicators = [
-                    "question:", "questions:", "what", "how", "does", "are you", "is a", 
-                    "is the", "the question", "does the question", "what does", "how does",
-                    "are you a", "is it", "can you", "will you", "do you", "have you"
-                ]
-                has_english = any(indicator in cleaned_lower for indicator in english_indicators)
-                has_question_words = any(word in cleaned_lower for word in ["question:", "questions:", "what", "how", "does", "mean"])
-                has_unrelated_english = any(phrase in cleaned_lower for phrase in [
-                    "how long", "does it take", "finish the", "the report", "to finish", "are you a", "is a"
-                ])
-                has_echo = any(phrase in cleaned_lower for phrase in ["pergunta:", "resposta:", "question:", "answer:", "questions:"])
-                
-                # Calcula similaridade com o prompt
-                prompt_words = set(prompt_lower.split())
-                response_words = set(cleaned_lower.split())
-                similarity = len(prompt_words.intersection(response_words)) / max(len(prompt_words), 1)
-                
-                # Verifica se começa com perguntas em inglês
-                starts_with_english_question = cleaned_lower.startswith(("question", "questions", "what", "how", "does", "are you", "is a"))
-                
-                # Determina se a resposta é ruim
-                is_bad_response = (
-                    not cleaned or
-                    len(cleaned) < 3 or
-                    cleaned.lower() == prompt.lower() or
-                    similarity > 0.7 or
-                    starts_with_english_question or
-                    ("question:" in cleaned_lower or "questions:" in cleaned_lower) or
-                    ("does the question mean" in cleaned_lower) or
-                    (has_english and len(cleaned) < 60) or
-                    (has_question_words and has_unrelated_english) or
-                    (has_question_words and len(cleaned) < 40) or
-                    (has_echo and len(cleaned) < 20) or
-                    (has_english and "pata" in cleaned_lower) or
-                    (any(word in cleaned_lower for word in ["what", "how", "does", "are you"]) and
-                     any(word in cleaned_lower for word in ["que", "o", "a"]) and len(cleaned) < 50)
+                    if pattern.lower() in line_clean.lower() and len(line_clean) < 100:
+                        skip = True
+                        break
+                if not skip and line_clean:
+                    filtered_lines.append(line)
+            cleaned = '\n'.join(filtered_lines)
+            
+            # Limpa pontuação e espaços extras
+            cleaned = cleaned.lstrip('\n\r :\t-')
+            cleaned = cleaned.strip()
+            
+            # Se ainda contém muito da instrução, extrai apenas a parte significativa
+            if len(cleaned) > 0 and (INSTRUCTION[:20].lower() in cleaned.lower() or prompt.lower() in cleaned.lower()[:len(prompt)*2]):
+                parts = cleaned.split(prompt)
+                if len(parts) > 1:
+                    cleaned = parts[-1].strip()
+            
+            # ============================================
+            # DETECÇÃO DE RESPOSTAS DE BAIXA QUALIDADE
+            # ============================================
+            cleaned_lower = cleaned.lower()
+            
+            # Detecta inglês indesejado
+            english_indicators = [
+                "question:", "questions:", "what", "how", "does", "are you", "is a", 
+                "is the", "the question", "does the question", "what does", "how does",
+                "are you a", "is it", "can you", "will you", "do you", "have you"
+            ]
+            has_english = any(indicator in cleaned_lower for indicator in english_indicators)
+            has_question_words = any(word in cleaned_lower for word in ["question:", "questions:", "what", "how", "does", "mean"])
+            has_unrelated_english = any(phrase in cleaned_lower for phrase in [
+                "how long", "does it take", "finish the", "the report", "to finish", "are you a", "is a"
+            ])
+            has_echo = any(phrase in cleaned_lower for phrase in ["pergunta:", "resposta:", "question:", "answer:", "questions:"])
+            
+            # Calcula similaridade com o prompt
+            prompt_words = set(prompt_lower.split())
+            response_words = set(cleaned_lower.split())
+            similarity = len(prompt_words.intersection(response_words)) / max(len(prompt_words), 1)
+            
+            # Verifica se começa com perguntas em inglês
+            starts_with_english_question = cleaned_lower.startswith(("question", "questions", "what", "how", "does", "are you", "is a"))
+            
+            # Determina se a resposta é ruim
+            is_bad_response = (
+                not cleaned or
+                len(cleaned) < 3 or
+                cleaned.lower() == prompt.lower() or
+                similarity > 0.7 or
+                starts_with_english_question or
+                ("question:" in cleaned_lower or "questions:" in cleaned_lower) or
+                ("does the question mean" in cleaned_lower) or
+                (has_english and len(cleaned) < 60) or
+                (has_question_words and has_unrelated_english) or
+                (has_question_words and len(cleaned) < 40) or
+                (has_echo and len(cleaned) < 20) or
+                (has_english and "pata" in cleaned_lower) or
+                (any(word in cleaned_lower for word in ["what", "how", "does", "are you"]) and
+                 any(word in cleaned_lower for word in ["que", "o", "a"]) and len(cleaned) < 50)
+            )
+            
+            # Se a resposta é ruim, tenta melhorar
+            if is_bad_response:
+                logger.warning(
+                    "Resposta de baixa qualidade detectada (similaridade: %.2f, tem_ingles: %s)",
+                    similarity, has_english,
                 )
                 
-                # Se a resposta é ruim, tenta melhorar
-                if is_bad_response:
-                    logger.warning(f"Resposta de baixa qualidade detectada (similaridade: {similarity:.2f}, tem_ingles: {has_english})")
-                    
-                    # Tenta regenerar se está em inglês
-                    if has_english or starts_with_english_question:
-                        try:
-                            alt_seq = f"Responda APENAS em português brasileiro: {prompt}"
-                            alt_inputs = self.tokenizer(alt_seq, return_tensors="pt", padding=True, truncation=True, max_length=512)
-                            alt_inputs = {k: v.to(self.device) for k, v in alt_inputs.items()}
-                            
-                            with torch.no_grad():
-                                alt_outputs = self.model.generate(
-                                    **alt_inputs,
-                                    max_new_tokens=150,
-                                    min_length=10,
-                                    do_sample=True,
-                                    temperature=0.9,
-                                    repetition_penalty=1.3,
-                                    no_repeat_ngram_size=3,
-                                    pad_token_id=self.tokenizer.pad_token_id if self.tokenizer.pad_token_id else self.tokenizer.eos_token_id,
-                                )
-                            
-                            alt_response = self.tokenizer.decode(alt_outputs[0].cpu(), skip_special_tokens=True).strip()
-                            alt_lower = alt_response.lower()
-                            
-                            # Verifica se a nova resposta é melhor
-                            if not any(word in alt_lower for word in ["question", "questions", "what", "how", "does", "are you"]):
-                                cleaned = alt_response
-                                logger.info("Resposta regenerada com sucesso sem inglês")
-                        except Exception as e:
-                            logger.debug(f"Falha ao regenerar resposta: {e}")
-                    
-                    # Se ainda está ruim, tenta API de inferência
-                    if is_bad_response and (has_english or not cleaned or len(cleaned) < 5):
-                        logger.warning("Tentando API de inferência como fallback")
-                        hf_resp = self.hf_inference(prompt)
-                        if hf_resp and hf_resp.strip() and hf_resp.lower() != prompt.lower() and len(hf_resp) > 10:
-                            hf_lower = hf_resp.lower()
-                            hf_similarity = len(prompt_words.intersection(set(hf_lower.split()))) / max(len(prompt_words), 1)
-                            hf_has_english = any(word in hf_lower for word in ["question", "questions", "what", "how", "does", "are you"])
-                            
-                            if hf_similarity < 0.6 and not hf_has_english:
-                                cleaned = hf_resp.strip()
-                            else:
-                                cleaned = "Desculpe, não consegui entender sua pergunta. Pode reformular de outra forma?"
-                        elif not cleaned or len(cleaned) < 5:
-                            cleaned = "Desculpe, não consegui gerar uma resposta adequada para essa pergunta. Poderia reformular de outra forma?"
-                
-                response = cleaned.strip()
+                # Tenta regenerar se está em inglês
+                if has_english or starts_with_english_question:
+                    try:
+                        with metrics.stage_timer('regeneration'):
+                            alt_response, input_tokens, alt_generated, stopping = self._regenerate(
+                                prompt, PORTUGUESE_ONLY_TEMPLATE,
+                                min_length=10,
+                                do_sample=True,
+                                temperature=0.9,
+                                repetition_penalty=1.3,
+                                no_repeat_ngram_size=3,
+                            )
+                        
+                        if usage is not None:
+                            self._count_generation(usage, input_tokens, alt_generated, stopping)
+                        alt_lower = alt_response.lower()
+                        
+                        # Verifica se a nova resposta é melhor
+                        if not any(word in alt_lower for word in ["question", "questions", "what", "how", "does", "are you"]):
+                            cleaned = alt_response
+                            if usage is not None:
+                                usage['path'] = PATH_LOCAL_REGENERATED
+                            logger.info("Resposta regenerada com sucesso sem inglês")
+                    except Exception as e:
+                        logger.debug("Falha ao regenerar resposta: %s", e)
                 
-            except Exception as e:
-                logger.debug(f"Erro durante limpeza da resposta: {e}")
-                response = "Desculpe, ocorreu um erro ao processar sua pergunta. Tente novamente."
-
-            processing_time = time.time() - start_time
-            logger.info(f"Prompt processado em {processing_time:.2f} segundos")
-
-            return response, processing_time
+                # Se ainda está ruim, tenta API de inferência
+                if is_bad_response and (has_english or not cleaned or len(cleaned) < 5):
+                    logger.warning("Tentando API de inferência como fallback")
+                    metrics.inc('pln_fallbacks_total', kind='hf_api')
+                    hf_resp = self.hf_inference(prompt)
+                    if hf_resp and hf_resp.strip() and hf_resp.lower() != prompt.lower() and len(hf_resp) > 10:
+                        hf_lower = hf_resp.lower()
+                        hf_similarity = len(prompt_words.intersection(set(hf_lower.split()))) / max(len(prompt_words), 1)
+                        hf_has_english = any(word in hf_lower for word in ["question", "questions", "what", "how", "does", "are you"])
+                        
+                        if hf_similarity < 0.6 and not hf_has_english:
+                            cleaned = hf_resp.strip()
+                            if usage is not None:
+                                usage['path'] = PATH_HF
+                        else:
+                            cleaned = "Desculpe, não consegui entender sua pergunta. Pode reformular de outra forma?"
+                    elif not cleaned or len(cleaned) < 5:
+                        cleaned = "Desculpe, não consegui gerar uma resposta adequada para essa pergunta. Poderia reformular de outra forma?"
+            
+            response = cleaned.strip()
             
         except Exception as e:
-            logger.exception(f"Erro ao processar prompt: {e}")
-            # Último recurso: tenta API de inferência
-            hf_resp = self.hf_inference(prompt)
-            if hf_resp:
-                processing_time = time.time() - start_time
-                return hf_resp, processing_time
-            raise
+            logger.debug("Erro durante limpeza da resposta: %s", e)
+            response = "Desculpe, ocorreu um erro ao processar sua pergunta. Tente novamente."
+
+        return response
@@ -0,0 +1,306 @@
+"""
+Profiling sob demanda das requisições de chat
+
+Um administrador arma o profiler para as próximas N requisições de chat
+ou por T segundos. Cada requisição capturada roda ``process_prompt`` e o
+salvamento no repositório sob cProfile (e, opcionalmente, tracemalloc) e
+gera em PROFILING_DIR:
+
+- ``<id>.pstats``: perfil de CPU (abrir com ``python -m pstats``)
+- ``<id>.tracemalloc``: snapshot de alocações (``tracemalloc.Snapshot.load``)
+- ``<id>.json``: resumo com as funções mais custosas e as maiores alocações
+
+Enquanto o profiler está desarmado, ``start_session`` só lê um atributo e
+``call`` chama a função diretamente. O estado é por processo: com vários
+workers, cada um precisa ser armado (ou o endpoint atinge só o que atendeu).
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+# Nomes aceitos para download (evita acesso fora de PROFILING_DIR)
+_REPORT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+\.(pstats|tracemalloc|json)$')
+
+# Quantidade de itens no resumo
+TOP_HOTSPOTS = 15
+TOP_ALLOCATIONS = 10
+
+
+class ProfilingSession:
+    """Captura de uma requisição: perfis de CPU de cada chamada e diferença de memória."""
+
+    def __init__(self, profiler, session_id, memory):
+        self.profiler = profiler
+        self.session_id = session_id
+        self.memory = memory
+        self.started_at = time.perf_counter()
+        self._stats = None
+        self._lock = threading.Lock()
+        self._memory_before = None
+        self._memory_after = None
+
+    def run(self, fn, *args, **kwargs):
+        """Executa ``fn`` sob cProfile na thread atual e acumula o perfil."""
+        if self.memory:
+            self.profiler._acquire_tracemalloc()
+            if self._memory_before is None:
+                self._memory_before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+            if self.memory:
+                self._memory_after = tracemalloc.take_snapshot()
+                self.profiler._release_tracemalloc()
+
+    def finish(self):
+        """Grava os relatórios da captura e retorna o resumo."""
+        try:
+            return self.profiler._write_reports(self)
+        except Exception as e:
+            logger.error("Erro ao gravar relatório de profiling %s: %s", self.session_id, e)
+            return None
+
+
+class Profiler:
+    """Estado do profiler do processo: quantas requisições e até quando capturar."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.armed = False
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._deadline = None
+        self._memory = False
+        self._tracemalloc_users = 0
+        self._tracemalloc_owner = False
+        self._armed_at = None
+
+    def arm(self, requests=None, seconds=None, memory=False):
+        """
+        Arma o profiler.
+
+        Args:
+            requests (int, optional): número de requisições a capturar
+            seconds (float, optional): janela de captura em segundos
+            memory (bool): também captura alocações com tracemalloc
+
+        Sem ``requests`` nem ``seconds`` captura apenas a próxima requisição.
+        """
+        with self._lock:
+            self._remaining = requests if requests or seconds else 1
+            self._deadline = time.monotonic() + seconds if seconds else None
+            self._memory = memory
+            self._armed_at = datetime.now()
+            self.armed = True
+        logger.warning("Profiling armado: requisições=%s, segundos=%s, memória=%s", self._remaining, seconds, memory)
+
+    def disarm(self):
+        """Desarma o profiler."""
+        with self._lock:
+            self.armed = False
+            self._remaining = None
+            self._deadline = None
+
+    def status(self):
+        """Estado atual do profiler (para o endpoint de administração)."""
+        with self._lock:
+            if self.armed and self._deadline is not None and time.monotonic() >= self._deadline:
+                self.armed = False
+            return {
+                'armed': self.armed,
+                'remaining_requests': self._remaining if self.armed else None,
+                'remaining_seconds': (
+                    round(max(0.0, self._deadline - time.monotonic()), 1)
+                    if self.armed and self._deadline is not None else None
+                ),
+                'memory': self._memory,
+                'armed_at': self._armed_at.isoformat() if self._armed_at else None,
+            }
+
+    def start_session(self):
+        """
+        Reserva a captura de uma requisição, se o profiler estiver armado.
+
+        Returns:
+            ProfilingSession ou None
+        """
+        if not self.armed:
+            return None
+        with self._lock:
+            if not self.armed:
+                return None
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                self.armed = False
+                return None
+            if self._remaining is not None:
+                self._remaining -= 1
+                if self._remaining <= 0:
+                    self.armed = False
+            memory = self._memory
+
+        trace = tracing.current_trace()
+        session_id = f"{datetime.now():%Y%m%d-%H%M%S-%f}"
+        if trace is not None:
+            session_id += f"-{trace.request_id}"
+        return ProfilingSession(self, re.sub(r'[^A-Za-z0-9_.-]', '_', session_id), memory)
+
+    # ============================================
+    # TRACEMALLOC (compartilhado entre capturas simultâneas)
+    # ============================================
+
+    def _acquire_tracemalloc(self):
+        with self._lock:
+            if self._tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                self._tracemalloc_owner = True
+            self._tracemalloc_users += 1
+
+    def _release_tracemalloc(self):
+        with self._lock:
+            self._tracemalloc_users -= 1
+            # Só para o tracemalloc se foi iniciado aqui (PYTHONTRACEMALLOC continua ativo)
+            if self._tracemalloc_users == 0 and self._tracemalloc_owner:
+                tracemalloc.stop()
+                self._tracemalloc_owner = False
+
+    # ============================================
+    # RELATÓRIOS
+    # ============================================
+
+    def _write_reports(self, session):
+        """Grava pstats, snapshot de memória e o resumo JSON de uma captura."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        base = self.directory / session.session_id
+        summary = {
+            'id': session.session_id,
+            'created_at': datetime.now().isoformat(),
+            'duration': round(time.perf_counter() - session.started_at, 6),
+            'files': [],
+            'hotspots': [],
+            'allocations': [],
+        }
+
+        if session._stats is not None:
+            session._stats.dump_stats(f"{base}.pstats")
+            summary['files'].append(f"{session.session_id}.pstats")
+            summary['hotspots'] = _top_hotspots(session._stats)
+            summary['report'] = _stats_report(session._stats)
+
+        if session._memory_after is not None:
+            session._memory_after.dump(f"{base}.tracemalloc")
+            summary['files'].append(f"{session.session_id}.tracemalloc")
+            summary['allocations'] = _top_allocations(session._memory_before, session._memory_after)
+
+        summary['files'].append(f"{session.session_id}.json")
+        Path(f"{base}.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding='utf-8')
+        logger.info("Relatório de profiling gravado: %s.json", base)
+        return summary
+
+    def list_reports(self):
+        """Resumos das capturas gravadas, da mais recente para a mais antiga."""
+        reports = []
+        if not self.directory.exists():
+            return reports
+        for path in sorted(self.directory.glob('*.json'), reverse=True):
+            try:
+                summary = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            summary.pop('report', None)
+            reports.append(summary)
+        return reports
+
+    def report_path(self, name):
+        """
+        Caminho de um arquivo de relatório para download.
+
+        Returns:
+            Path ou None se o nome for inválido ou o arquivo não existir
+        """
+        if not _REPORT_NAME_PATTERN.match(name):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+
+def _top_hotspots(stats, limit=TOP_HOTSPOTS):
+    """Funções com maior tempo próprio (tottime)."""
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f"{filename}:{line}({function})",
+            'ncalls': ncalls,
+            'tottime': round(tottime, 6),
+            'cumtime': round(cumtime, 6),
+        })
+    rows.sort(key=lambda row: row['tottime'], reverse=True)
+    return rows[:limit]
+
+
+def _stats_report(stats, limit=30):
+    """Relatório de texto do pstats ordenado por tempo acumulado."""
+    output = io.StringIO()
+    stream, stats.stream = stats.stream, output
+    try:
+        stats.sort_stats('cumulative').print_stats(limit)
+    finally:
+        stats.stream = stream
+    return output.getvalue()
+
+
+def _top_allocations(before, after, limit=TOP_ALLOCATIONS):
+    """Linhas de código que mais alocaram memória durante a captura."""
+    if before is None or after is None:
+        return []
+    return [
+        {
+            'location': str(stat.traceback[0]) if stat.traceback else '',
+            'size_diff': stat.size_diff,
+            'count_diff': stat.count_diff,
+        }
+        for stat in after.compare_to(before, 'lineno')[:limit]
+    ]
+
+
+def call(session, fn, *args, **kwargs):
+    """Executa ``fn`` sob a captura ``session`` ou diretamente se não houver uma."""
+    if session is None:
+        return fn(*args, **kwargs)
+    return session.run(fn, *args, **kwargs)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Retorna o profiler do processo (criado sob demanda)."""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = Profiler(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+    return _profiler
@@ -0,0 +1,271 @@
+"""
+Rate limiting por cliente com token buckets
+
+Cada cliente (chave de API cadastrada em RATE_LIMIT_API_KEYS, se
+enviada, ou IP) tem um bucket por orçamento: ``model`` para prompts que vão ao modelo e ``fast`` para os
+atendidos pelos caminhos rápidos (cálculos e respostas prontas), que são
+baratos e têm um limite bem maior. Um bucket comporta até ``burst``
+tokens e é recarregado continuamente à taxa de ``per_minute`` por minuto;
+cada prompt consome um token.
+
+O estado fica em memória no processo (``local``) ou em uma tabela do
+banco SQLite padrão do Django (``sqlite``), compartilhada entre os
+workers da mesma máquina.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BUDGET_MODEL = 'model'
+BUDGET_FAST = 'fast'
+
+# Buckets sem uso há mais tempo que isso são descartados (já estariam cheios)
+IDLE_PRUNE_SECONDS = 3600
+# Frequência (em consumos) da limpeza da tabela do store SQLite
+SQLITE_PRUNE_EVERY = 1000
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        allowed INTEGER NOT NULL DEFAULT 1
+    )
+"""
+
+# Recarga e consumo em um único comando (atômico entre processos). No
+# UPDATE as expressões enxergam os valores antigos da linha.
+SQLITE_TAKE = """
+    INSERT INTO rate_limit_buckets (key, tokens, updated_at, allowed)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        tokens = CASE
+            WHEN MIN(?, tokens + MAX(0, ? - updated_at) * ?) >= ?
+            THEN MIN(?, tokens + MAX(0, ? - updated_at) * ?) - ?
+            ELSE MIN(?, tokens + MAX(0, ? - updated_at) * ?)
+        END,
+        allowed = MIN(?, tokens + MAX(0, ? - updated_at) * ?) >= ?,
+        updated_at = ?
+    RETURNING tokens, allowed
+"""
+
+# Resultado de uma tentativa de consumo
+Decision = namedtuple('Decision', 'allowed limit remaining reset retry_after')
+
+
+class Budget:
+    """Parâmetros de um orçamento: capacidade (burst) e recarga por minuto."""
+
+    def __init__(self, name, per_minute, burst):
+        self.name = name
+        # Recarga precisa ser positiva; para desligar o limite use RATE_LIMIT_ENABLED
+        self.per_minute = max(float(per_minute), 0.001)
+        self.burst = max(1, int(burst))
+
+    @property
+    def rate(self):
+        """Tokens recarregados por segundo."""
+        return self.per_minute / 60.0
+
+    def decision(self, allowed, tokens, cost):
+        """Monta a Decision a partir do saldo do bucket após a tentativa."""
+        reset = (self.burst - tokens) / self.rate
+        retry_after = 0.0 if allowed else max(0.0, cost - tokens) / self.rate
+        return Decision(allowed, self.burst, max(0, int(tokens)), reset, retry_after)
+
+
+class LocalBucketStore:
+    """Buckets em memória do processo."""
+
+    # Não faz I/O: pode ser chamado direto do event loop
+    blocking = False
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_prune = clock()
+
+    def take(self, key, budget, cost=1):
+        now = self.clock()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (budget.burst, now))
+            tokens = min(budget.burst, tokens + max(0.0, now - updated_at) * budget.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if now - self._last_prune > IDLE_PRUNE_SECONDS:
+                self._prune(now)
+        return budget.decision(allowed, tokens, cost)
+
+    def refund(self, key, budget, cost=1):
+        """Devolve tokens consumidos (sem passar do burst)."""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated_at = self._buckets[key]
+                self._buckets[key] = (min(budget.burst, tokens + cost), updated_at)
+
+    def _prune(self, now):
+        self._buckets = {
+            key: value for key, value in self._buckets.items()
+            if now - value[1] <= IDLE_PRUNE_SECONDS
+        }
+        self._last_prune = now
+
+
+class SQLiteBucketStore:
+    """Buckets na tabela ``rate_limit_buckets`` do banco padrão (compartilhados entre processos)."""
+
+    blocking = True
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._schema_ready = False
+        self._takes = 0
+
+    def take(self, key, budget, cost=1):
+        from django.db import connection
+
+        now = self.clock()
+        capacity, rate = budget.burst, budget.rate
+        refill = (capacity, now, rate)
+        initial_allowed = capacity >= cost
+        params = [key, capacity - cost if initial_allowed else capacity, now, int(initial_allowed)]
+        params += [*refill, cost, *refill, cost, *refill, *refill, cost, now]
+        with connection.cursor() as cursor:
+            if not self._schema_ready:
+                cursor.execute(SQLITE_SCHEMA)
+                self._schema_ready = True
+            cursor.execute(SQLITE_TAKE, params)
+            tokens, allowed = cursor.fetchall()[0]
+            self._takes += 1
+            if self._takes % SQLITE_PRUNE_EVERY == 0:
+                # Limpeza ocasional dos buckets abandonados
+                cursor.execute(
+                    "DELETE FROM rate_limit_buckets WHERE updated_at < ?",
+                    [now - IDLE_PRUNE_SECONDS],
+                )
+        return budget.decision(bool(allowed), tokens, cost)
+
+    def refund(self, key, budget, cost=1):
+        """Devolve tokens consumidos (sem passar do burst)."""
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE rate_limit_buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?",
+                [budget.burst, cost, key],
+            )
+
+
+class RateLimiter:
+    """Aplica os orçamentos ``model`` e ``fast`` sobre um store de buckets."""
+
+    def __init__(self, store, budgets):
+        self.store = store
+        self.budgets = {budget.name: budget for budget in budgets}
+
+    def take(self, client, budget_name, cost=1):
+        """
+        Consome ``cost`` tokens do bucket do cliente no orçamento informado.
+
+        Args:
+            client (str): identificação do cliente (ver ``client_key``)
+            budget_name (str): BUDGET_MODEL ou BUDGET_FAST
+            cost (int): número de prompts
+
+        Returns:
+            Decision: se foi permitido, limite, saldo e tempos de recarga.
+            Em caso de erro no store a requisição é permitida.
+        """
+        budget = self.budgets[budget_name]
+        try:
+            return self.store.take(f'{budget_name}:{client}', budget, cost)
+        except Exception as e:
+            logger.error("Erro no rate limiter (%s): %s", budget_name, e)
+            return Decision(True, budget.burst, budget.burst, 0.0, 0.0)
+
+    def refund(self, client, budget_name, cost=1):
+        """Devolve os tokens de um consumo permitido cuja requisição foi recusada por outro orçamento."""
+        budget = self.budgets[budget_name]
+        try:
+            self.store.refund(f'{budget_name}:{client}', budget, cost)
+        except Exception as e:
+            logger.error("Erro ao devolver tokens no rate limiter (%s): %s", budget_name, e)
+
+
+def client_key(request):
+    """
+    Identifica o cliente da requisição.
+
+    Usa o hash da chave do header ``X-API-Key`` quando ela está em
+    RATE_LIMIT_API_KEYS; senão o IP (o primeiro de ``X-Forwarded-For`` só
+    com RATE_LIMIT_TRUST_FORWARDED, atrás de um proxy confiável). Chaves
+    desconhecidas contam no bucket do IP: trocar de chave a cada
+    requisição não escapa do limite.
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in getattr(settings, 'RATE_LIMIT_API_KEYS', ()):
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+    ip = request.META.get('REMOTE_ADDR', '')
+    if getattr(settings, 'RATE_LIMIT_TRUST_FORWARDED', False):
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded:
+            ip = forwarded.split(',')[0].strip()
+    return 'ip:' + (ip or 'unknown')
+
+
+STORES = {
+    'local': LocalBucketStore,
+    'sqlite': SQLiteBucketStore,
+}
+
+_limiter = None
+_limiter_config = None
+_limiter_lock = threading.Lock()
+
+
+def _config():
+    return (
+        getattr(settings, 'RATE_LIMIT_BACKEND', 'local'),
+        getattr(settings, 'RATE_LIMIT_MODEL_PER_MINUTE', 30),
+        getattr(settings, 'RATE_LIMIT_MODEL_BURST', 20),
+        getattr(settings, 'RATE_LIMIT_FAST_PER_MINUTE', 120),
+        getattr(settings, 'RATE_LIMIT_FAST_BURST', 60),
+    )
+
+
+def get_rate_limiter():
+    """
+    Retorna o rate limiter do processo, ou None se desabilitado.
+
+    É recriado (com buckets vazios) quando as configurações mudam.
+    """
+    global _limiter, _limiter_config
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return None
+    config = _config()
+    if _limiter is None or _limiter_config != config:
+        with _limiter_lock:
+            if _limiter is None or _limiter_config != config:
+                backend, model_rate, model_burst, fast_rate, fast_burst = config
+                store_class = STORES.get(backend)
+                if store_class is None:
+                    logger.warning("RATE_LIMIT_BACKEND desconhecido: %s. Usando 'local'.", backend)
+                    store_class = LocalBucketStore
+                _limiter = RateLimiter(store_class(), [
+                    Budget(BUDGET_MODEL, model_rate, model_burst),
+                    Budget(BUDGET_FAST, fast_rate, fast_burst),
+                ])
+                _limiter_config = config
+    return _limiter
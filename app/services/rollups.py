@@ -0,0 +1,141 @@
+"""
+Agregações pré-calculadas de latência e uso
+
+Mantém estatísticas por janela de tempo (hora e dia) e por modelo:
+contagem, soma, mínimo, máximo e um histograma logarítmico de
+``processing_time`` usado para estimar percentis sem varrer o histórico.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import math
+from datetime import datetime
+
+# Granularidades suportadas pelas agregações
+GRANULARITIES = ('hour', 'day')
+
+# Histograma logarítmico: o bin i cobre (BIN_MIN * BIN_GROWTH**(i-1), BIN_MIN * BIN_GROWTH**i].
+# Com crescimento de 20% o erro relativo dos percentis fica abaixo de ~10%.
+BIN_MIN = 0.001
+BIN_GROWTH = 1.2
+MAX_BIN = 80  # ~ 2 horas, acima disso tudo cai no último bin
+
+
+def bucket_start(timestamp, granularity):
+    """
+    Retorna o início da janela de tempo que contém o timestamp.
+
+    Args:
+        timestamp (datetime): instante da interação
+        granularity (str): 'hour' ou 'day'
+
+    Returns:
+        datetime: início da hora ou do dia
+    """
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Granularidade inválida: {granularity}")
+
+
+def bin_index(value):
+    """Retorna o índice do bin do histograma para um tempo em segundos."""
+    if value <= BIN_MIN:
+        return 0
+    index = math.ceil(math.log(value / BIN_MIN) / math.log(BIN_GROWTH))
+    return min(index, MAX_BIN)
+
+
+def bin_value(index):
+    """Retorna o valor representativo (média geométrica dos limites) de um bin."""
+    if index <= 0:
+        return BIN_MIN
+    return BIN_MIN * BIN_GROWTH ** (index - 0.5)
+
+
+def aggregate(interactions):
+    """
+    Agrega interações nas janelas de hora e dia por modelo.
+
+    Args:
+        interactions (iterable): dicts com timestamp, model e processing_time
+
+    Returns:
+        dict: (granularity, bucket, model) -> {count, sum, min, max, hist}
+    """
+    stats = {}
+    for interaction in interactions:
+        timestamp = interaction.get('timestamp') or datetime.now()
+        model = interaction.get('model') or 'local'
+        value = float(interaction.get('processing_time') or 0)
+        index = bin_index(value)
+
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(timestamp, granularity), model)
+            entry = stats.get(key)
+            if entry is None:
+                entry = stats[key] = {'count': 0, 'sum': 0.0, 'min': value, 'max': value, 'hist': {}}
+            entry['count'] += 1
+            entry['sum'] += value
+            entry['min'] = min(entry['min'], value)
+            entry['max'] = max(entry['max'], value)
+            entry['hist'][index] = entry['hist'].get(index, 0) + 1
+    return stats
+
+
+def percentile(hist, count, q, minimum=None, maximum=None):
+    """
+    Estima um percentil a partir do histograma.
+
+    Args:
+        hist (dict): índice do bin -> contagem
+        count (int): total de amostras
+        q (float): percentil entre 0 e 1
+        minimum, maximum (float, optional): limites reais observados
+
+    Returns:
+        float: valor estimado ou None se não houver amostras
+    """
+    if not count:
+        return None
+
+    rank = q * count
+    seen = 0
+    value = None
+    for index in sorted(hist):
+        seen += hist[index]
+        if seen >= rank:
+            value = bin_value(index)
+            break
+    if value is None:
+        value = bin_value(max(hist))
+
+    # O valor real nunca está fora do intervalo observado
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def summarize(granularity, bucket, model, count, total, minimum, maximum, hist):
+    """
+    Monta o resumo de uma janela para o endpoint de estatísticas.
+
+    Returns:
+        dict: contagem, média, mínimo, máximo e percentis p50/p95/p99
+    """
+    return {
+        'granularity': granularity,
+        'bucket': bucket.isoformat() if hasattr(bucket, 'isoformat') else str(bucket),
+        'model': model,
+        'count': count,
+        'sum': total,
+        'avg': total / count if count else None,
+        'min': minimum,
+        'max': maximum,
+        'p50': percentile(hist, count, 0.50, minimum, maximum),
+        'p95': percentile(hist, count, 0.95, minimum, maximum),
+        'p99': percentile(hist, count, 0.99, minimum, maximum),
+    }
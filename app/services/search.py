@@ -0,0 +1,103 @@
+"""
+Utilitários de busca textual no histórico
+
+Converte a busca do usuário em consultas para o índice de texto
+(MongoDB ``$text`` ou SQLite FTS5) e marca os termos encontrados
+para destaque na página de histórico.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import re
+
+# Marcadores de destaque: caracteres de controle que nunca aparecem no texto
+# e são convertidos em <mark> somente depois do escape de HTML
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def extract_terms(query):
+    """
+    Extrai os termos de busca, descartando pontuação e operadores.
+
+    Args:
+        query (str): texto digitado pelo usuário
+
+    Returns:
+        list: termos em minúsculas, sem duplicatas, na ordem original
+    """
+    terms = []
+    for term in _TERM_PATTERN.findall(query or ''):
+        term = term.lower()
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def build_fts_query(terms):
+    """
+    Monta a expressão MATCH do FTS5 a partir dos termos.
+
+    Cada termo é colocado entre aspas (sem sintaxe do FTS5 vinda do usuário)
+    e combinado com OR; a ordenação por relevância fica a cargo do bm25.
+    """
+    return ' OR '.join(f'"{term}"' for term in terms)
+
+
+def build_mongo_search(terms):
+    """Monta a string de ``$search`` do MongoDB a partir dos termos."""
+    return ' '.join(terms)
+
+
+def mark_terms(text, terms):
+    """
+    Marca as ocorrências dos termos no texto com os marcadores de destaque.
+
+    Palavras que começam com o termo também são marcadas, aproximando o
+    comportamento do stemming do índice de texto do MongoDB.
+    """
+    if not text or not terms:
+        return text
+    pattern = re.compile(
+        r'\b(' + '|'.join(re.escape(term) for term in terms) + r')\w*',
+        re.IGNORECASE | re.UNICODE,
+    )
+    return pattern.sub(lambda m: f'{HIGHLIGHT_START}{m.group(0)}{HIGHLIGHT_END}', text)
+
+
+class LazySearchResults:
+    """
+    Sequência preguiçosa de resultados para o Paginator do Django.
+
+    O total é obtido com uma contagem no índice e cada página é buscada
+    com offset/limit, de modo que apenas a página exibida é carregada.
+    """
+
+    def __init__(self, repository, query, filters=None):
+        self.repository = repository
+        self.query = query
+        self.filters = filters or {}
+        self._count = None
+
+    def count(self):
+        """Total de resultados (consultado uma única vez)."""
+        if self._count is None:
+            self._count = self.repository.count_search(self.query, self.filters)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = key.start or 0
+            stop = key.stop if key.stop is not None else self.count()
+            return self.repository.search_interactions(
+                self.query, self.filters, offset=start, limit=max(stop - start, 0)
+            )
+        results = self.repository.search_interactions(self.query, self.filters, offset=key, limit=1)
+        if not results:
+            raise IndexError(key)
+        return results[0]
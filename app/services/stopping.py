@@ -0,0 +1,122 @@
+"""
+Critérios de parada da geração dos modelos causais
+
+O modelo causal recebe ``<instrução>\\nUser: <prompt>\\nBot:`` e costuma
+continuar o diálogo depois de responder (um novo turno ``User:``), repetir
+a instrução ou seguir escrevendo até ``max_new_tokens``; tudo isso era
+descartado depois pelo sanitizador. ``ResponseStoppingCriteria`` encerra
+cada linha do lote assim que isso acontece e registra o motivo, e
+``trim_response`` corta o marcador que disparou a parada.
+
+No perfil de respostas curtas (ANSWER_PROFILE=short) a geração também
+para na primeira frase completa depois de um mínimo de tokens.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import re
+
+import torch
+from transformers import StoppingCriteria
+
+# Motivos de parada (label ``reason`` de pln_generation_stops_total)
+STOP_EOS = 'eos'
+STOP_MAX_TOKENS = 'max_tokens'
+STOP_NEW_TURN = 'new_turn'
+STOP_INSTRUCTION_ECHO = 'instruction_echo'
+STOP_SENTENCE = 'sentence'
+
+PROFILE_DEFAULT = 'default'
+PROFILE_SHORT = 'short'
+
+# Início de um novo turno do diálogo
+TURN_MARKERS = ('User:', 'Usuário:')
+# Início da instrução ecoada (ver nlp_service.INSTRUCTION)
+INSTRUCTION_MARKERS = ('Você é um assistente',)
+
+# Tokens do fim da geração decodificados a cada passo: o suficiente para
+# conter um marcador inteiro mesmo com tokens de um byte
+TAIL_TOKENS = 32
+
+# Fim de frase: pontuação final que não faz parte de um número (3.14)
+SENTENCE_END = re.compile(r'(?<!\d)[.!?]["\')\]]*\s*$')
+
+
+class ResponseStoppingCriteria(StoppingCriteria):
+    """
+    Para cada linha do lote ao começar um novo turno, ecoar a instrução ou,
+    no perfil curto, completar uma frase.
+
+    Args:
+        tokenizer: tokenizer do modelo (para decodificar o fim da geração)
+        prompt_length (int): tamanho da entrada (com padding à esquerda a
+            parte gerada começa no mesmo índice em todas as linhas)
+        short_answer (bool): para na primeira frase completa
+        min_sentence_tokens (int): tokens gerados antes de aceitar um fim
+            de frase no perfil curto
+    """
+
+    def __init__(self, tokenizer, prompt_length, short_answer=False, min_sentence_tokens=8):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.short_answer = short_answer
+        self.min_sentence_tokens = min_sentence_tokens
+        self.reasons = {}
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        generated = input_ids.shape[-1] - self.prompt_length
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if generated <= 0:
+            return done
+
+        start = max(self.prompt_length, input_ids.shape[-1] - TAIL_TOKENS)
+        for row in range(input_ids.shape[0]):
+            if row in self.reasons:
+                done[row] = True
+                continue
+            tail = self.tokenizer.decode(input_ids[row, start:], skip_special_tokens=True)
+            reason = self._reason(tail, generated)
+            if reason:
+                self.reasons[row] = reason
+                done[row] = True
+        return done
+
+    def _reason(self, tail, generated):
+        if _find_marker(tail, TURN_MARKERS) is not None:
+            return STOP_NEW_TURN
+        if _find_marker(tail, INSTRUCTION_MARKERS) is not None:
+            return STOP_INSTRUCTION_ECHO
+        if self.short_answer and generated >= self.min_sentence_tokens and SENTENCE_END.search(tail):
+            return STOP_SENTENCE
+        return None
+
+    def reason(self, row, generated_ids, eos_token_id):
+        """
+        Motivo da parada de uma linha depois do ``generate``.
+
+        Args:
+            row (int): linha do lote
+            generated_ids (list): ids gerados da linha
+            eos_token_id (int): token de fim do tokenizer
+        """
+        if row in self.reasons:
+            return self.reasons[row]
+        return STOP_EOS if eos_token_id in generated_ids else STOP_MAX_TOKENS
+
+
+def _find_marker(text, markers):
+    """Posição do primeiro marcador encontrado no texto (ou None)."""
+    positions = [text.find(marker) for marker in markers]
+    positions = [position for position in positions if position >= 0]
+    return min(positions) if positions else None
+
+
+def trim_response(response, reason):
+    """Remove da resposta o marcador que disparou a parada e o que veio depois dele."""
+    markers = {STOP_NEW_TURN: TURN_MARKERS, STOP_INSTRUCTION_ECHO: INSTRUCTION_MARKERS}.get(reason)
+    if not markers:
+        return response
+    position = _find_marker(response, markers)
+    if position is None:
+        return response
+    return response[:position].strip()
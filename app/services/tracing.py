@@ -0,0 +1,162 @@
+"""
+Rastreamento leve das requisições (request id e spans)
+
+Cada requisição recebe um id (o header X-Request-ID do cliente, se válido,
+ou um id novo) e um Trace guardado em uma ContextVar. As etapas do
+pipeline de chat e as chamadas ao repositório registram spans nesse
+Trace; ao final, o resumo vai no header ``Server-Timing``, pode ser
+devolvido no JSON (``timings``) e é salvo junto com a interação.
+
+Fora de uma requisição (testes, comandos) não há Trace ativo e os spans
+são simplesmente ignorados.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import contextvars
+import functools
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Ids aceitos do cliente: curtos e sem caracteres que quebrem headers ou logs
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+_current_trace = contextvars.ContextVar('pln_trace', default=None)
+
+
+class Trace:
+    """Spans de uma requisição, com início relativo ao começo do trace."""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started_at = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration):
+        """
+        Registra um span.
+
+        Args:
+            name (str): etapa ('generate', 'save_interaction', ...)
+            start (float): instante inicial (time.perf_counter)
+            duration (float): duração em segundos
+        """
+        span = {
+            'name': name,
+            'start': round(start - self.started_at, 6),
+            'duration': round(duration, 6),
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def elapsed(self):
+        """Tempo desde o início do trace, em segundos."""
+        return time.perf_counter() - self.started_at
+
+    def totals(self):
+        """
+        Soma a duração dos spans por etapa, na ordem em que apareceram.
+
+        Returns:
+            dict: nome -> {'duration': segundos, 'count': ocorrências}
+        """
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                entry = totals.setdefault(span['name'], {'duration': 0.0, 'count': 0})
+                entry['duration'] += span['duration']
+                entry['count'] += 1
+        return totals
+
+    def server_timing(self):
+        """Monta o valor do header Server-Timing (durações em milissegundos)."""
+        parts = []
+        for name, entry in self.totals().items():
+            part = f"{name};dur={entry['duration'] * 1000:.1f}"
+            if entry['count'] > 1:
+                part += f';desc="{entry["count"]}x"'
+            parts.append(part)
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(parts)
+
+    def as_dict(self):
+        """Resumo serializável (campo ``timings`` da resposta JSON)."""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'request_id': self.request_id,
+            'total': round(self.elapsed(), 6),
+            'spans': spans,
+        }
+
+
+def new_request_id(candidate=None):
+    """
+    Retorna o id da requisição.
+
+    Args:
+        candidate (str, optional): id enviado pelo cliente (X-Request-ID)
+
+    Returns:
+        str: o id do cliente, se válido, ou um id novo
+    """
+    if candidate and _REQUEST_ID_PATTERN.match(candidate):
+        return candidate
+    return uuid.uuid4().hex
+
+
+def start_trace(request_id=None):
+    """
+    Inicia um Trace no contexto atual.
+
+    Returns:
+        tuple: (trace, token) - o token é passado para ``end_trace``
+    """
+    trace = Trace(request_id or new_request_id())
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    """Encerra o Trace iniciado por ``start_trace``."""
+    _current_trace.reset(token)
+
+
+def current_trace():
+    """Retorna o Trace ativo ou None."""
+    return _current_trace.get()
+
+
+def record_span(name, start, duration):
+    """Registra um span no Trace ativo (sem efeito fora de uma requisição)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, duration)
+
+
+@contextmanager
+def span(name):
+    """Mede um bloco e o registra como span do Trace ativo."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter() - start)
+
+
+def traced(name):
+    """Decorador que registra cada chamada da função como um span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,63 @@
+"""
+Testes unitários para o arquivo frio de interações
+
+Testa gravação particionada comprimida e leitura sob demanda.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import gzip
+import tempfile
+import unittest
+from datetime import date, datetime
+from django.test import TestCase
+from app.services.archive import ArchiveStore
+
+
+class TestArchiveStore(TestCase):
+    """Testes para o ArchiveStore."""
+
+    def setUp(self):
+        """Cria um diretório temporário para o arquivo."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ArchiveStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_partitions_by_day(self):
+        """Testa que cada dia vai para uma partição gzip própria."""
+        self.store.append([
+            {'_id': 1, 'prompt': 'a', 'timestamp': datetime(2024, 1, 1, 10)},
+            {'_id': 2, 'prompt': 'b', 'timestamp': datetime(2024, 1, 2, 11)},
+        ])
+
+        path = self.store.partition_path(date(2024, 1, 1))
+        self.assertTrue(str(path).endswith('2024/01/2024-01-01.jsonl.gz'))
+        with gzip.open(path, 'rt', encoding='utf-8') as archive_file:
+            self.assertEqual(len(archive_file.readlines()), 1)
+        self.assertEqual(self.store.partitions(), [date(2024, 1, 2), date(2024, 1, 1)])
+
+    def test_iter_interactions_by_range_newest_first(self):
+        """Testa leitura por intervalo, mais recente primeiro, com timestamps restaurados."""
+        self.store.append([{'_id': 1, 'prompt': 'a', 'timestamp': datetime(2024, 1, 1, 10)}])
+        # Segundo arquivamento no mesmo dia acrescenta um novo membro gzip
+        self.store.append([{'_id': 2, 'prompt': 'b', 'timestamp': datetime(2024, 1, 1, 12)}])
+        self.store.append([{'_id': 3, 'prompt': 'c', 'timestamp': datetime(2024, 2, 1, 12)}])
+
+        items = list(self.store.iter_interactions(date_to=date(2024, 1, 31)))
+
+        self.assertEqual([item['prompt'] for item in items], ['b', 'a'])
+        self.assertEqual(items[0]['timestamp'], datetime(2024, 1, 1, 12))
+
+    def test_iter_interactions_skips_duplicates(self):
+        """Testa que interações arquivadas duas vezes aparecem uma só vez."""
+        interaction = {'_id': 'x', 'prompt': 'a', 'timestamp': datetime(2024, 1, 1, 10)}
+        self.store.append([interaction])
+        self.store.append([interaction])
+
+        self.assertEqual(len(list(self.store.iter_interactions())), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
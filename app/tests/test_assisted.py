@@ -0,0 +1,191 @@
+"""
+Testes unitários para a geração assistida com modelo rascunho
+
+Testa a verificação de compatibilidade dos tokenizers, a contagem de
+passadas, as estatísticas de aceitação e a integração com o NLPService
+(com modelos stub que simulam as passadas da Hugging Face).
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import threading
+import unittest
+from unittest.mock import Mock, patch
+import torch
+from django.test import TestCase
+from app import benchmark
+from app.services import assisted
+
+# Resposta do stub: 'A luz vira energia.' (19 tokens de um byte + fim)
+REPLY = 'A luz vira energia.'
+
+
+class CountingStub(benchmark.StubCausalLM):
+    """Stub que simula as passadas da geração assistida: rodadas de 4 propostas, 3 aceitas."""
+
+    def forward(self, input_ids=None):
+        return None
+
+    def generate(self, input_ids=None, assistant_model=None, **kwargs):
+        outputs = super().generate(input_ids, **kwargs)
+        generated = outputs.shape[-1] - input_ids.shape[-1]
+        if assistant_model is None:
+            for _ in range(generated):
+                self(input_ids)
+            return outputs
+        # Cada rodada: 4 passadas do rascunho e 1 do principal, que gera 4 tokens
+        for _ in range(-(-generated // 4)):
+            for _ in range(4):
+                assistant_model(input_ids)
+            self(input_ids)
+        return outputs
+
+
+class TestAssistedHelpers(TestCase):
+    """Testes para as funções auxiliares da geração assistida."""
+
+    def test_tokenizers_compatible(self):
+        """Testa que só tokenizers com o mesmo vocabulário são compatíveis."""
+        tokenizer = benchmark.build_stub_tokenizer()
+        other = benchmark.build_stub_tokenizer()
+
+        self.assertTrue(assisted.tokenizers_compatible(tokenizer, other))
+        other.add_tokens(['fotossíntese'])
+        self.assertFalse(assisted.tokenizers_compatible(tokenizer, other))
+
+    def test_incompatible_draft_is_not_loaded(self):
+        """Testa que o rascunho com tokenizer diferente não é carregado."""
+        other = benchmark.build_stub_tokenizer()
+        other.add_tokens(['fotossíntese'])
+        with patch.object(assisted.AutoConfig, 'from_pretrained', return_value=Mock(is_encoder_decoder=False)), \
+                patch.object(assisted.AutoTokenizer, 'from_pretrained', return_value=other), \
+                patch.object(assisted.AutoModelForCausalLM, 'from_pretrained') as mock_model:
+            draft = assisted.load_draft_model('draft', benchmark.build_stub_tokenizer(), torch.device('cpu'))
+
+        self.assertIsNone(draft)
+        mock_model.assert_not_called()
+
+    def test_draft_load_failure_returns_none(self):
+        """Testa que uma falha ao carregar o rascunho não interrompe o serviço."""
+        with patch.object(assisted.AutoConfig, 'from_pretrained', side_effect=OSError('não encontrado')):
+            draft = assisted.load_draft_model('draft', benchmark.build_stub_tokenizer(), torch.device('cpu'))
+
+        self.assertIsNone(draft)
+
+    def test_forward_counter_is_per_thread(self):
+        """Testa que passadas de outra thread não entram na contagem."""
+        module = torch.nn.Linear(2, 2)
+        counter = assisted.ForwardCounter(module)
+        module(torch.zeros(1, 2))
+        thread = threading.Thread(target=lambda: module(torch.zeros(1, 2)))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(counter.count, 1)
+        counter.reset()
+        self.assertEqual(counter.count, 0)
+        counter.remove()
+        module(torch.zeros(1, 2))
+        self.assertEqual(counter.count, 0)
+
+    def test_assisted_stats(self):
+        """Testa a taxa de aceitação e o speedup a partir das passadas."""
+        stats = assisted.assisted_stats(generated_tokens=20, target_passes=5, draft_passes=20)
+
+        self.assertEqual(stats['draft_accepted'], 15)
+        self.assertEqual(stats['draft_acceptance'], 0.75)
+        self.assertEqual(stats['draft_speedup'], 4.0)
+        self.assertIsNone(assisted.assisted_stats(0, 0, 0)['draft_acceptance'])
+
+
+class TestServiceAssisted(TestCase):
+    """Testes para a geração assistida no NLPService."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.service = benchmark.build_stub_service()
+        self.service.model = CountingStub(self.service.tokenizer, replies=(REPLY,))
+        self.draft = CountingStub(self.service.tokenizer, replies=(REPLY,))
+
+    def test_single_prompt_uses_draft_and_records_stats(self):
+        """Testa que a resposta é a mesma e os metadados trazem aceitação e speedup."""
+        self.service.set_assistant_model(self.draft)
+
+        response, _, usage = self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertEqual(response, REPLY)
+        # 20 tokens (resposta + fim) em 5 passadas do principal e 20 do rascunho
+        self.assertEqual(usage['draft_speedup'], 4.0)
+        self.assertEqual(usage['draft_acceptance'], 0.75)
+
+    def test_without_draft_stats_are_empty(self):
+        """Testa que sem rascunho os campos da geração assistida ficam vazios."""
+        _, _, usage = self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertIsNone(usage['draft_acceptance'])
+        self.assertIsNone(usage['draft_speedup'])
+
+    def test_batch_generates_without_draft(self):
+        """Testa que lotes com mais de um prompt não usam o rascunho."""
+        self.service.set_assistant_model(self.draft)
+        with patch.object(self.service.model, 'generate', wraps=self.service.model.generate) as mock_generate:
+            self.service.process_batch([benchmark.MODEL_PROMPT, 'Explique a respiração das plantas'])
+
+        self.assertNotIn('assistant_model', mock_generate.call_args.kwargs)
+
+    def test_assisted_failure_falls_back_and_disables_draft(self):
+        """Testa que uma falha da geração assistida gera sem o rascunho e o desabilita."""
+        self.service.set_assistant_model(self.draft)
+        original = self.service.model.generate
+
+        def generate(input_ids=None, assistant_model=None, **kwargs):
+            if assistant_model is not None:
+                raise ValueError('assisted generation is not supported')
+            return original(input_ids, **kwargs)
+
+        with patch.object(self.service.model, 'generate', side_effect=generate):
+            response, _, usage = self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertEqual(response, REPLY)
+        self.assertIsNone(usage['draft_acceptance'])
+        self.assertIsNone(self.service.assistant_model)
+
+    def test_disable_during_generation_keeps_running_request(self):
+        """Testa que desabilitar o rascunho (falha em outra requisição) não afeta a geração em andamento."""
+        self.service.set_assistant_model(self.draft)
+        original = self.service.model.generate
+        started, resume = threading.Event(), threading.Event()
+        results, errors = [], []
+
+        def generate(input_ids=None, assistant_model=None, **kwargs):
+            if assistant_model is not None:
+                started.set()
+                resume.wait(5)
+            return original(input_ids, assistant_model=assistant_model, **kwargs)
+
+        def request():
+            try:
+                results.append(self.service.process_prompt(benchmark.MODEL_PROMPT))
+            except BaseException as e:
+                errors.append(e)
+
+        with patch.object(self.service.model, 'generate', side_effect=generate):
+            thread = threading.Thread(target=request)
+            thread.start()
+            started.wait(5)
+            self.service._disable_assisted(self.service._assisted)
+            resume.set()
+            thread.join(5)
+
+        self.assertEqual(errors, [])
+        response, _, usage = results[0]
+        self.assertEqual(response, REPLY)
+        # Os contadores continuaram contando até o fim da geração
+        self.assertEqual(usage['draft_speedup'], 4.0)
+        self.assertIsNone(self.service.assistant_model)
+        # ...e foram removidos quando ela terminou
+        self.assertEqual(len(self.service.model._forward_pre_hooks), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Testes unitários para a suíte de benchmarks
+
+Testa o modelo stub com o NLPService, as estatísticas, o resultado em
+JSON e o comando ``benchmark``.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from app import benchmark
+
+
+class TestStubModel(TestCase):
+    """Testes para o modelo stub e o serviço montado com ele."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.service = benchmark.build_stub_service()
+
+    def test_process_prompt_is_deterministic(self):
+        """Testa que o mesmo prompt gera sempre a mesma resposta do stub."""
+        first, _, usage = self.service.process_prompt(benchmark.MODEL_PROMPT)
+        second, _, _ = self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertEqual(first, second)
+        self.assertIn(first, benchmark.STUB_REPLIES)
+        self.assertEqual(usage['path'], 'local')
+        self.assertEqual(usage['generate_calls'], 1)
+        self.assertFalse(usage['truncated'])
+        self.assertEqual(usage['generated_tokens'], len(self.service.tokenizer(first)['input_ids']))
+
+    def test_batch_pads_shorter_rows(self):
+        """Testa que o lote respeita o padding e a ordem dos prompts."""
+        results = self.service.process_batch(list(benchmark.DEFAULT_MIX))
+        self.assertEqual(len(results), len(benchmark.DEFAULT_MIX))
+        paths = [usage['path'] for _, _, usage in results]
+        self.assertEqual(paths.count('local'), 4)
+        self.assertEqual(self.service.model.generate_calls, 1)
+
+
+class TestMeasurement(TestCase):
+    """Testes para as estatísticas e a comparação de resultados."""
+
+    def test_summarize_percentiles(self):
+        """Testa os percentis calculados por interpolação."""
+        stats = benchmark.summarize([float(value) for value in range(1, 101)])
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['min'], 1.0)
+        self.assertAlmostEqual(stats['p50'], 50.5)
+        self.assertAlmostEqual(stats['p99'], 99.01)
+        self.assertEqual(benchmark.summarize([]), {'count': 0})
+
+    def test_compare_results(self):
+        """Testa a razão entre execuções."""
+        baseline = {'micro': {'sanitizer': {'p50': 2.0}}, 'end_to_end': []}
+        current = {'micro': {'sanitizer': {'p50': 3.0}, 'novo': {'p50': 1.0}}, 'end_to_end': []}
+        rows = benchmark.compare_results(baseline, current)
+        self.assertEqual(len(rows), 1)
+        self.assertAlmostEqual(rows[0]['ratio'], 1.5)
+
+
+class TestBenchmarkCommand(TestCase):
+    """Testes para a suíte completa e o comando."""
+
+    def test_run_benchmarks_end_to_end(self):
+        """Testa o ponta a ponta pelo chat_view com clientes concorrentes."""
+        result = benchmark.run_benchmarks(iterations=5, concurrency=(1, 3), requests_per_client=6, micro=False)
+
+        self.assertEqual(result['schema'], benchmark.SCHEMA_VERSION)
+        runs = result['end_to_end']
+        self.assertEqual([run['concurrency'] for run in runs], [1, 3])
+        self.assertEqual(runs[1]['requests'], 18)
+        self.assertEqual(runs[1]['errors'], 0)
+        self.assertEqual(sum(runs[1]['paths'].values()), 18)
+        self.assertIn('p95', runs[0]['latency'])
+        json.dumps(result)
+
+    def test_command_writes_json(self):
+        """Testa que o comando grava o resultado em JSON e compara com o anterior."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'bench.json')
+            call_command('benchmark', iterations=5, concurrency='2', requests=2, output=output, stdout=StringIO())
+            with open(output, encoding='utf-8') as handle:
+                result = json.load(handle)
+            self.assertIn('fast_path.math', result['micro'])
+            self.assertIn('tokenization.batch', result['micro'])
+
+            stdout = StringIO()
+            call_command('benchmark', iterations=5, concurrency='2', requests=2,
+                         output=os.path.join(tmp_dir, 'novo.json'), compare=output, stdout=stdout)
+            self.assertIn('fast_path.math', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Testes unitários para a inferência em massa
+
+Testa a leitura dos arquivos de prompts, a saída em JSONL, o salvamento
+em lote e a retomada a partir do checkpoint.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import Mock
+from django.core.management import call_command
+from django.test import TestCase
+from app import bulk
+
+PROMPTS = ['bom dia', 'quanto é 3 vezes 4', 'Explique a fotossíntese das plantas', 'O que é uma rede neural']
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestBulkInference(TestCase):
+    """Testes para a inferência em massa com o modelo stub no próprio processo."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp_dir.name, 'prompts.jsonl')
+        self.output_path = os.path.join(self.tmp_dir.name, 'respostas.jsonl')
+        with open(self.input_path, 'w', encoding='utf-8') as handle:
+            for index in range(10):
+                handle.write(json.dumps({'id': f'p{index}', 'prompt': PROMPTS[index % len(PROMPTS)]}) + '\n')
+            handle.write('\n')
+            handle.write('{"id": "sem-prompt"}\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _output(self):
+        with open(self.output_path, encoding='utf-8') as handle:
+            return [json.loads(line) for line in handle]
+
+    def _runner(self, **kwargs):
+        return bulk.BulkInference(self.input_path, self.output_path, workers=0, chunk_size=3,
+                                  model=bulk.MODEL_STUB, **kwargs)
+
+    def test_iter_prompts_csv(self):
+        """Testa a leitura do CSV com colunas id e prompt."""
+        path = os.path.join(self.tmp_dir.name, 'prompts.csv')
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write('id,prompt\na,bom dia\nb,\n')
+        self.assertEqual(list(bulk.iter_prompts(path)), [(0, 'a', 'bom dia'), (1, 'b', None)])
+
+    def test_writes_results_in_input_order(self):
+        """Testa a saída em JSONL na ordem da entrada, com os erros por registro."""
+        stats = self._runner().run()
+
+        results = self._output()
+        self.assertEqual([result['id'] for result in results], [f'p{i}' for i in range(10)] + ['sem-prompt'])
+        self.assertEqual(results[0]['path'], 'quick')
+        self.assertEqual(results[2]['path'], 'local')
+        self.assertEqual(results[-1]['error'], 'Registro sem prompt')
+        self.assertEqual(stats['answered'], 10)
+        self.assertEqual(stats['errors'], 1)
+
+    def test_resume_from_checkpoint(self):
+        """Testa que a retomada descarta a escrita parcial e não repete registros."""
+        calls = []
+
+        def interrupt(stats):
+            calls.append(stats['records'])
+            if len(calls) == 2:
+                raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            self._runner(progress=interrupt).run()
+        # Escrita parcial depois do último checkpoint
+        with open(self.output_path, 'a', encoding='utf-8') as handle:
+            handle.write('{"line": 99, "parcial')
+
+        stats = self._runner(resume=True).run()
+
+        results = self._output()
+        self.assertEqual([result['line'] for result in results], list(range(10)) + [11])
+        self.assertEqual(stats['records'], 11)
+
+    def test_save_to_repository(self):
+        """Testa o salvamento em lote só das respostas válidas."""
+        repository = Mock()
+        repository.save_interactions.side_effect = lambda items: len(items)
+
+        stats = self._runner(repository=repository).run()
+
+        self.assertEqual(stats['saved'], 10)
+        saved = repository.save_interactions.call_args_list[0][0][0]
+        self.assertEqual(saved[0]['model'], 'stub-causal')
+        self.assertNotIn('line', saved[0])
+
+    def test_command(self):
+        """Testa o comando no próprio processo."""
+        stdout = StringIO()
+        call_command('bulk_inference', self.input_path, self.output_path, workers=0,
+                     model=bulk.MODEL_STUB, stdout=stdout)
+        self.assertIn('10 respostas gravadas', stdout.getvalue())
+        self.assertEqual(len(self._output()), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
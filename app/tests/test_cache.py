@@ -0,0 +1,67 @@
+"""
+Testes unitários para o cache do histórico
+
+Testa invalidação por geração e tolerância a dados desatualizados.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import unittest
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from app.services.cache import HistoryCache, requested_staleness
+
+
+class TestHistoryCache(TestCase):
+    """Testes para o HistoryCache."""
+
+    def setUp(self):
+        cache.clear()
+        self.history_cache = HistoryCache()
+
+    def test_hit_until_generation_bump(self):
+        """Testa que a entrada vale até a próxima escrita."""
+        generation = self.history_cache.generation()
+        self.history_cache.set('page', {'page': '1'}, b'html', generation)
+
+        self.assertEqual(self.history_cache.get('page', {'page': '1'}), b'html')
+        self.assertIsNone(self.history_cache.get('page', {'page': '2'}))
+
+        self.history_cache.bump()
+        self.assertIsNone(self.history_cache.get('page', {'page': '1'}))
+
+    def test_stale_entry_within_tolerance(self):
+        """Testa que entradas antigas são servidas dentro da tolerância."""
+        generation = self.history_cache.generation()
+        with patch('app.services.cache.time.time', return_value=1000.0):
+            self.history_cache.set('page', {'page': '1'}, b'html', generation)
+        self.history_cache.bump()
+
+        with patch('app.services.cache.time.time', return_value=1005.0):
+            self.assertEqual(self.history_cache.get('page', {'page': '1'}, max_staleness=10), b'html')
+            self.assertIsNone(self.history_cache.get('page', {'page': '1'}, max_staleness=2))
+
+    def test_bump_without_generation_key(self):
+        """Testa que a geração é criada se não existir no cache."""
+        cache.clear()
+        self.assertEqual(self.history_cache.bump(), 1)
+        self.assertEqual(self.history_cache.generation(), 1)
+
+    @override_settings(HISTORY_CACHE_TIMEOUT=0)
+    def test_disabled_cache(self):
+        """Testa que HISTORY_CACHE_TIMEOUT=0 desabilita o cache."""
+        self.history_cache.set('page', {'page': '1'}, b'html', 0)
+        self.assertIsNone(self.history_cache.get('page', {'page': '1'}))
+
+    @override_settings(HISTORY_CACHE_STALENESS=5, HISTORY_CACHE_MAX_STALENESS=30)
+    def test_requested_staleness(self):
+        """Testa a leitura de max-stale limitada pela configuração."""
+        self.assertEqual(requested_staleness(None), 5)
+        self.assertEqual(requested_staleness('max-stale=10'), 10)
+        self.assertEqual(requested_staleness('no-cache, max-stale=999'), 30)
+        self.assertEqual(requested_staleness('max-stale'), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
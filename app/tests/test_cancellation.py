@@ -0,0 +1,219 @@
+"""
+Testes unitários para o cancelamento cooperativo da geração
+
+Testa o token (prazo e ContextVar), a interrupção do ``generate`` com o
+modelo stub, a liberação da vaga do executor quando o cliente desconecta
+e as respostas das views quando o prazo expira.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from app import benchmark
+from app.services import cancellation, metrics
+from app.services.executor import ModelExecutor
+from app.services.metrics import MetricsRegistry
+from app.views import achat_view
+
+
+def _wait_for_cancel(prompt):
+    """Simula uma geração que só termina quando a requisição é cancelada."""
+    token = cancellation.current_token()
+    while not token.cancelled:
+        time.sleep(0.01)
+    token.raise_if_cancelled()
+
+
+class TestCancelToken(TestCase):
+    """Testes para o token de cancelamento."""
+
+    def test_deadline_cancels_token(self):
+        """Testa que o token conta como cancelado depois do prazo."""
+        token = cancellation.CancelToken(deadline=time.monotonic() - 1)
+
+        self.assertEqual(token.reason, cancellation.REASON_DEADLINE)
+        with self.assertRaises(cancellation.GenerationCancelled):
+            token.raise_if_cancelled()
+
+    def test_without_deadline_waits_for_cancel(self):
+        """Testa que sem prazo o token só é cancelado explicitamente, e o primeiro motivo vale."""
+        token = cancellation.CancelToken.with_timeout(0)
+
+        self.assertFalse(token.cancelled)
+        self.assertIsNone(token.remaining)
+        token.cancel(cancellation.REASON_DISCONNECT)
+        token.cancel(cancellation.REASON_DEADLINE)
+        self.assertEqual(token.reason, cancellation.REASON_DISCONNECT)
+
+    def test_token_follows_context(self):
+        """Testa que o token ativo é visível apenas dentro de use_token."""
+        token = cancellation.CancelToken()
+        token.cancel()
+        cancellation.raise_if_cancelled()
+
+        with cancellation.use_token(token):
+            self.assertIs(cancellation.current_token(), token)
+            with self.assertRaises(cancellation.GenerationCancelled):
+                cancellation.raise_if_cancelled()
+        self.assertIsNone(cancellation.current_token())
+
+    def test_generation_cancelled_is_not_an_exception(self):
+        """Testa que os ``except Exception`` de fallback não engolem o cancelamento."""
+        self.assertFalse(issubclass(cancellation.GenerationCancelled, Exception))
+
+
+class TestServiceCancellation(TestCase):
+    """Testes para o cancelamento no NLPService."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.service = benchmark.build_stub_service()
+
+    def test_cancelled_generate_stops_and_skips_fallbacks(self):
+        """Testa que a geração para no primeiro passo e não há regeneração nem API."""
+        steps = []
+        token = cancellation.CancelToken()
+        original_generate = self.service.model.generate
+
+        def generate(*args, **kwargs):
+            # Cliente desconecta depois que a geração começou
+            token.cancel()
+            outputs = original_generate(*args, **kwargs)
+            steps.append(outputs.shape[-1] - args[0].shape[-1])
+            return outputs
+
+        with patch.object(self.service.model, 'generate', side_effect=generate), \
+                patch.object(self.service, 'hf_inference') as mock_hf, \
+                patch.object(self.service, '_sanitize_response') as mock_sanitize:
+            with cancellation.use_token(token):
+                with self.assertRaises(cancellation.GenerationCancelled):
+                    self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertEqual(steps, [1])
+        mock_hf.assert_not_called()
+        mock_sanitize.assert_not_called()
+
+    def test_cancelled_before_start_does_not_generate(self):
+        """Testa que uma requisição já cancelada não chega ao modelo."""
+        token = cancellation.CancelToken(deadline=time.monotonic() - 1)
+        with patch.object(self.service.model, 'generate') as mock_generate:
+            with cancellation.use_token(token), self.assertRaises(cancellation.GenerationCancelled):
+                self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        mock_generate.assert_not_called()
+
+    def test_follower_generates_when_leader_is_cancelled(self):
+        """Testa que uma requisição agrupada continua se a requisição líder for cancelada."""
+        leader_token = cancellation.CancelToken()
+        leader_started = threading.Event()
+        results = {}
+
+        def answer(prompt):
+            if cancellation.current_token() is leader_token:
+                leader_started.set()
+                _wait_for_cancel(prompt)
+            return 'Resposta própria', {'path': 'local'}
+
+        def leader():
+            with cancellation.use_token(leader_token):
+                try:
+                    self.service.process_prompt(benchmark.MODEL_PROMPT)
+                except cancellation.GenerationCancelled as e:
+                    results['leader'] = e.reason
+
+        with patch.object(self.service, '_answer_with_model', side_effect=answer):
+            thread = threading.Thread(target=leader)
+            thread.start()
+            leader_started.wait(5)
+            follower = threading.Thread(
+                target=lambda: results.update(follower=self.service.process_prompt(benchmark.MODEL_PROMPT)[0])
+            )
+            follower.start()
+            time.sleep(0.05)
+            leader_token.cancel()
+            thread.join(5)
+            follower.join(5)
+
+        self.assertEqual(results, {'leader': cancellation.REASON_DISCONNECT, 'follower': 'Resposta própria'})
+
+
+class TestViewCancellation(TestCase):
+    """Testes para o cancelamento nas views de chat."""
+
+    @override_settings(CHAT_DEADLINE_SECONDS=0.05)
+    @patch('app.views.nlp_service')
+    def test_chat_view_deadline_returns_504(self, mock_nlp):
+        """Testa que o prazo expirado interrompe a geração e responde 504."""
+        mock_nlp.process_prompt.side_effect = _wait_for_cancel
+        registry = MetricsRegistry()
+
+        with patch.object(metrics, '_registry', registry):
+            response = self.client.post('/', data=json.dumps({'prompt': 'teste'}), content_type='application/json')
+
+        self.assertEqual(response.status_code, 504)
+        self.assertIn('pln_cancelled_total{reason="deadline"} 1', registry.render())
+
+    @override_settings(CHAT_DEADLINE_SECONDS=0.05)
+    @patch('app.views.nlp_service')
+    def test_batch_view_deadline_returns_504(self, mock_nlp):
+        """Testa o prazo no endpoint de lote."""
+        mock_nlp.process_batch.side_effect = _wait_for_cancel
+
+        response = self.client.post('/batch/', data=json.dumps({'prompts': ['a', 'b']}), content_type='application/json')
+
+        self.assertEqual(response.status_code, 504)
+
+    @patch('app.views.nlp_service')
+    async def test_disconnect_frees_executor_slot(self, mock_nlp):
+        """Testa que o cancelamento da view (cliente desconectado) interrompe a tarefa do executor."""
+        mock_nlp.process_prompt.side_effect = _wait_for_cancel
+        executor = ModelExecutor(max_workers=1, max_queue=0)
+        registry = MetricsRegistry()
+        request = AsyncRequestFactory().post('/', data=json.dumps({'prompt': 'teste'}), content_type='application/json')
+
+        with patch('app.views.get_model_executor', return_value=executor), \
+                patch.object(metrics, '_registry', registry):
+            task = asyncio.ensure_future(achat_view(request))
+            while executor.pending == 0:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            for _ in range(100):
+                if executor.pending == 0:
+                    break
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(executor.pending, 0)
+        self.assertIn('pln_cancelled_total{reason="disconnect"} 1', registry.render())
+        executor.shutdown()
+
+    @override_settings(CHAT_DEADLINE_SECONDS=0.05)
+    @patch('app.views.nlp_service')
+    async def test_achat_view_deadline_while_queued(self, mock_nlp):
+        """Testa que o prazo também vale para a requisição ainda na fila do executor."""
+        release = threading.Event()
+        executor = ModelExecutor(max_workers=1, max_queue=1)
+        executor.submit(release.wait)
+        mock_nlp.process_prompt.return_value = ('nunca', 0.1, {'path': 'local'})
+        request = AsyncRequestFactory().post('/', data=json.dumps({'prompt': 'teste'}), content_type='application/json')
+
+        with patch('app.views.get_model_executor', return_value=executor):
+            response = await achat_view(request)
+
+        self.assertEqual(response.status_code, 504)
+        # A tarefa na fila foi descartada: só a tarefa bloqueada ocupa vaga
+        self.assertEqual(executor.pending, 1)
+        release.set()
+        executor.shutdown()
+        mock_nlp.process_prompt.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Testes unitários para o agrupamento de chamadas em andamento
+
+Testa que chamadas simultâneas com a mesma chave executam uma vez e que
+resultados e exceções chegam a todas elas.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import threading
+import unittest
+from django.test import TestCase
+from app.services.coalescing import SingleFlight
+
+
+class TestSingleFlight(TestCase):
+    """Testes para o SingleFlight."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def _slow(self, value):
+        self.calls.append(value)
+        self.release.wait(timeout=5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _start(self, key, value, outcomes):
+        def target():
+            try:
+                outcomes.append(self.flight.run(key, self._slow, value))
+            except Exception as e:
+                outcomes.append(e)
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread
+
+    def _wait_followers(self, key, count):
+        for _ in range(500):
+            with self.flight._lock:
+                call = self.flight._calls.get(key)
+                if call is not None and call.followers == count:
+                    return
+            threading.Event().wait(0.01)
+        self.fail('seguidores não chegaram')
+
+    def test_same_key_runs_once(self):
+        """Testa que a mesma chave executa uma vez e todos recebem o resultado."""
+        outcomes = []
+        threads = [self._start('k', 'resultado', outcomes)]
+        self._wait_followers('k', 0)
+        threads += [self._start('k', 'outro', outcomes) for _ in range(3)]
+        self._wait_followers('k', 3)
+        self.release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(self.calls, ['resultado'])
+        self.assertEqual(sorted(shared for _, shared in outcomes), [False, True, True, True])
+        self.assertEqual({result for result, _ in outcomes}, {'resultado'})
+        self.assertEqual(self.flight.in_flight(), 0)
+
+    def test_error_is_shared(self):
+        """Testa que a exceção da chamada chega a quem estava esperando."""
+        outcomes = []
+        threads = [self._start('k', ValueError('falhou'), outcomes)]
+        self._wait_followers('k', 0)
+        threads.append(self._start('k', 'outro', outcomes))
+        self._wait_followers('k', 1)
+        self.release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(len(outcomes), 2)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+
+    def test_key_released_after_call(self):
+        """Testa que não é cache: depois de terminar a chamada executa de novo."""
+        self.release.set()
+        self.assertEqual(self.flight.run('k', self._slow, 1), (1, False))
+        self.assertEqual(self.flight.run('k', self._slow, 2), (2, False))
+        self.assertEqual(self.calls, [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
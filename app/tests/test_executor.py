@@ -0,0 +1,186 @@
+"""
+Testes unitários para o executor limitado do modelo
+
+Testa execução assíncrona, recusa quando a fila está cheia, a ordem das
+classes de prioridade (estrita, com envelhecimento, e ponderada), o
+limite da fila bulk e a classificação das requisições.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import threading
+import unittest
+from unittest.mock import patch
+from django.test import RequestFactory, TestCase, override_settings
+from app.services import metrics
+from app.services.executor import (
+    ModelExecutor, ExecutorBusy, PRIORITY_BULK, PRIORITY_INTERACTIVE, POLICY_WEIGHTED,
+    parse_weights, request_priority,
+)
+from app.services.metrics import MetricsRegistry
+
+
+class TestModelExecutor(TestCase):
+    """Testes para o ModelExecutor."""
+
+    def setUp(self):
+        self.executor = ModelExecutor(max_workers=1, max_queue=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    async def test_run_returns_result(self):
+        """Testa que run() devolve o resultado da tarefa."""
+        result = await self.executor.run(lambda x: x * 2, 21)
+        self.assertEqual(result, 42)
+
+    def test_rejects_when_full(self):
+        """Testa que a fila limitada recusa tarefas excedentes e libera vagas ao terminar."""
+        release = threading.Event()
+        running = self.executor.submit(release.wait)
+        queued = self.executor.submit(lambda: 'ok')
+
+        with self.assertRaises(ExecutorBusy):
+            self.executor.submit(lambda: 'recusada')
+
+        release.set()
+        running.result(timeout=5)
+        self.assertEqual(queued.result(timeout=5), 'ok')
+        # Vaga liberada após a conclusão
+        self.assertEqual(self.executor.submit(lambda: 'nova').result(timeout=5), 'nova')
+
+
+class TestPriorityScheduling(TestCase):
+    """Testes para a ordem de execução entre as classes de prioridade."""
+
+    def _run_order(self, executor, priorities):
+        """Enfileira tarefas atrás de uma tarefa bloqueada e devolve a ordem de execução."""
+        started, release = threading.Event(), threading.Event()
+        order = []
+        blocker = executor.submit(lambda: started.set() or release.wait())
+        started.wait(5)
+        futures = [
+            executor.submit(order.append, f'{priority}-{index}', priority=priority)
+            for index, priority in enumerate(priorities)
+        ]
+        release.set()
+        blocker.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        executor.shutdown()
+        return order
+
+    def test_strict_serves_interactive_first(self):
+        """Testa que a política estrita executa o interativo antes do bulk enfileirado antes."""
+        executor = ModelExecutor(max_workers=1, max_queue=4)
+
+        order = self._run_order(executor, [PRIORITY_BULK, PRIORITY_BULK, PRIORITY_INTERACTIVE])
+
+        self.assertEqual(order, ['interactive-2', 'bulk-0', 'bulk-1'])
+
+    def test_strict_promotes_starving_bulk(self):
+        """Testa que o bulk que esperou além de max_wait passa à frente e é contado."""
+        executor = ModelExecutor(max_workers=1, max_queue=4, max_wait=0)
+        registry = MetricsRegistry()
+
+        with patch.object(metrics, '_registry', registry):
+            order = self._run_order(executor, [PRIORITY_BULK, PRIORITY_INTERACTIVE])
+
+        self.assertEqual(order, ['bulk-0', 'interactive-1'])
+        self.assertIn('pln_executor_promoted_total{priority="bulk"} 1', registry.render())
+
+    def test_weighted_shares_by_weight(self):
+        """Testa que a política ponderada alterna as classes na proporção dos pesos."""
+        executor = ModelExecutor(
+            max_workers=1, max_queue=6, policy=POLICY_WEIGHTED,
+            weights={PRIORITY_INTERACTIVE: 2, PRIORITY_BULK: 1},
+        )
+
+        order = self._run_order(executor, [PRIORITY_BULK] * 3 + [PRIORITY_INTERACTIVE] * 3)
+
+        self.assertEqual(
+            [item.split('-')[0] for item in order],
+            ['interactive', 'bulk', 'interactive', 'interactive', 'bulk', 'bulk'],
+        )
+
+    def test_bulk_queue_limit_keeps_room_for_interactive(self):
+        """Testa que o bulk não ocupa as vagas reservadas ao tráfego interativo."""
+        executor = ModelExecutor(max_workers=1, max_queue=2, bulk_queue=1)
+        release = threading.Event()
+        executor.submit(release.wait, priority=PRIORITY_BULK)
+        executor.submit(lambda: 'bulk', priority=PRIORITY_BULK)
+
+        with self.assertRaises(ExecutorBusy):
+            executor.submit(lambda: 'recusada', priority=PRIORITY_BULK)
+        interactive = executor.submit(lambda: 'interativo')
+
+        self.assertEqual(executor.pending_by_class(), {PRIORITY_INTERACTIVE: 1, PRIORITY_BULK: 2})
+        release.set()
+        self.assertEqual(interactive.result(timeout=5), 'interativo')
+        executor.shutdown()
+
+    def test_queue_wait_is_recorded_per_class(self):
+        """Testa o histograma de espera na fila por classe de prioridade."""
+        executor = ModelExecutor(max_workers=1, max_queue=1)
+        registry = MetricsRegistry()
+
+        with patch.object(metrics, '_registry', registry):
+            executor.submit(lambda: None, priority=PRIORITY_BULK).result(timeout=5)
+            executor.call(lambda: None)
+            executor.shutdown()
+
+        rendered = registry.render()
+        self.assertIn('pln_executor_queue_wait_seconds_count{priority="bulk"} 1', rendered)
+        self.assertIn('pln_executor_queue_wait_seconds_count{priority="interactive"} 1', rendered)
+        self.assertIn('pln_executor_queued{priority="bulk"} 0', rendered)
+
+    def test_call_timeout_discards_queued_task(self):
+        """Testa que call() com prazo expirado descarta a tarefa ainda na fila."""
+        executor = ModelExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+        executor.submit(release.wait)
+        called = []
+
+        with self.assertRaises(TimeoutError):
+            executor.call(called.append, 'nunca', timeout=0.05)
+
+        self.assertEqual(executor.pending, 1)
+        release.set()
+        executor.shutdown()
+        self.assertEqual(called, [])
+
+
+class TestRequestPriority(TestCase):
+    """Testes para a classificação das requisições."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_endpoint_default(self):
+        """Testa que sem headers vale a classe padrão do endpoint."""
+        request = self.factory.post('/')
+        self.assertEqual(request_priority(request), PRIORITY_INTERACTIVE)
+        self.assertEqual(request_priority(request, PRIORITY_BULK), PRIORITY_BULK)
+
+    def test_header_only_downgrades(self):
+        """Testa que o header X-Priority rebaixa para bulk, mas não promove."""
+        self.assertEqual(request_priority(self.factory.post('/', headers={'X-Priority': 'bulk'})), PRIORITY_BULK)
+        promoted = self.factory.post('/', headers={'X-Priority': 'interactive'})
+        self.assertEqual(request_priority(promoted, PRIORITY_BULK), PRIORITY_BULK)
+
+    @override_settings(BULK_API_KEYS=['chave-integracao'])
+    def test_bulk_api_key(self):
+        """Testa que as chaves de integração são sempre bulk."""
+        request = self.factory.post('/', headers={'X-API-Key': 'chave-integracao'})
+        self.assertEqual(request_priority(request), PRIORITY_BULK)
+        other = self.factory.post('/', headers={'X-API-Key': 'outra'})
+        self.assertEqual(request_priority(other), PRIORITY_INTERACTIVE)
+
+    def test_parse_weights(self):
+        """Testa a leitura de MODEL_PRIORITY_WEIGHTS."""
+        self.assertEqual(parse_weights('interactive=8, bulk=2'), {PRIORITY_INTERACTIVE: 8, PRIORITY_BULK: 2})
+        self.assertEqual(parse_weights('bulk=0'), {PRIORITY_INTERACTIVE: 4, PRIORITY_BULK: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
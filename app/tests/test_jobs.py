@@ -0,0 +1,157 @@
+"""
+Testes unitários para a fila de jobs assíncronos
+
+Testa enfileiramento, reserva, execução, long-poll, recuperação de jobs
+abandonados e a retomada da fila na inicialização do servidor usando o
+fallback SQLite.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+from django.test import TestCase, TransactionTestCase
+from app import views
+from app.services import jobs
+from app.services.mongo_repo import MongoRepository
+
+
+class TestJobQueue(TestCase):
+    """Testes para a fila persistente e os workers de jobs."""
+
+    def setUp(self):
+        self.repo = MongoRepository()
+        self.repo.client = None
+        self.repo.collection = None
+
+        self.nlp = Mock()
+        self.nlp.model_name = 'test-model'
+        self.nlp.process_prompt.return_value = ('Resposta do job', 0.25, {'path': 'local'})
+        self.pool = jobs.JobWorkerPool(self.nlp, self.repo, workers=1)
+
+    def test_create_and_get_job(self):
+        """Testa que um job novo fica na fila e pode ser consultado."""
+        job = self.repo.create_job('pergunta longa')
+
+        stored = self.repo.get_job(job['job_id'])
+        self.assertEqual(stored['state'], jobs.JOB_QUEUED)
+        self.assertEqual(stored['prompt'], 'pergunta longa')
+        self.assertIsNone(self.repo.get_job('inexistente'))
+
+    def test_worker_processes_oldest_job(self):
+        """Testa que o worker executa o job mais antigo e registra os tempos."""
+        first = self.repo.create_job('primeira')
+        second = self.repo.create_job('segunda')
+
+        self.assertTrue(self.pool.process_next('worker-1'))
+
+        self.nlp.process_prompt.assert_called_once_with('primeira')
+        done = self.repo.get_job(first['job_id'])
+        self.assertEqual(done['state'], jobs.JOB_DONE)
+        self.assertEqual(done['response'], 'Resposta do job')
+        self.assertEqual(done['worker'], 'worker-1')
+        self.assertEqual(done['attempts'], 1)
+        self.assertGreaterEqual(done['queue_wait'], 0)
+        self.assertGreaterEqual(done['run_time'], 0)
+        self.assertEqual(self.repo.get_job(second['job_id'])['state'], jobs.JOB_QUEUED)
+
+        # A interação também vai para o histórico
+        prompts = [item['prompt'] for item in self.repo.get_interactions()]
+        self.assertIn('primeira', prompts)
+
+    def test_worker_records_failure(self):
+        """Testa que erros na geração marcam o job como falho."""
+        self.nlp.process_prompt.side_effect = RuntimeError('modelo indisponível')
+        job = self.repo.create_job('falha')
+
+        self.pool.process_next('worker-1')
+
+        failed = self.repo.get_job(job['job_id'])
+        self.assertEqual(failed['state'], jobs.JOB_FAILED)
+        self.assertIn('modelo indisponível', failed['error'])
+
+    def test_empty_queue(self):
+        """Testa que process_next não faz nada com a fila vazia."""
+        self.assertFalse(self.pool.process_next('worker-1'))
+        self.nlp.process_prompt.assert_not_called()
+
+    def test_requeue_stale_jobs(self):
+        """Testa que jobs presos em execução voltam para a fila ou falham após o limite."""
+        job = self.repo.create_job('interrompido')
+        claimed = self.repo.claim_job('worker-morto')
+        self.assertEqual(claimed['job_id'], job['job_id'])
+
+        later = datetime.now() + timedelta(seconds=120)
+        with unittest.mock.patch('app.services.mongo_repo.datetime') as mock_datetime:
+            mock_datetime.now.return_value = later
+            self.assertEqual(self.repo.requeue_stale_jobs(timeout=60, max_attempts=3), 1)
+        self.assertEqual(self.repo.get_job(job['job_id'])['state'], jobs.JOB_QUEUED)
+
+        # Esgotadas as tentativas o job é marcado como falho
+        self.repo.claim_job('worker-morto')
+        with unittest.mock.patch('app.services.mongo_repo.datetime') as mock_datetime:
+            mock_datetime.now.return_value = later + timedelta(seconds=120)
+            self.repo.requeue_stale_jobs(timeout=60, max_attempts=2)
+        self.assertEqual(self.repo.get_job(job['job_id'])['state'], jobs.JOB_FAILED)
+
+    def test_wait_for_job_returns_when_done(self):
+        """Testa que o long-poll devolve o job terminado sem esperar o timeout."""
+        job = self.repo.create_job('pergunta')
+        self.pool.process_next('worker-1')
+
+        result = jobs.wait_for_job(self.repo, job['job_id'], timeout=5)
+        self.assertEqual(result['state'], jobs.JOB_DONE)
+
+    def test_wait_for_job_times_out(self):
+        """Testa que o long-poll devolve o estado atual ao esgotar o tempo."""
+        job = self.repo.create_job('pergunta')
+
+        with self.settings(JOB_POLL_INTERVAL=0.01):
+            result = jobs.wait_for_job(self.repo, job['job_id'], timeout=0.05)
+        self.assertEqual(result['state'], jobs.JOB_QUEUED)
+
+    def test_serialize_job(self):
+        """Testa a conversão do job para JSON."""
+        data = jobs.serialize_job(jobs.new_job('oi'))
+        self.assertEqual(data['state'], jobs.JOB_QUEUED)
+        self.assertIsInstance(data['created_at'], str)
+        self.assertNotIn('worker', data)
+
+
+class TestJobWorkersStartup(TransactionTestCase):
+    """Testes para a retomada da fila quando o processo web reinicia."""
+
+    def tearDown(self):
+        if jobs._job_workers is not None:
+            jobs._job_workers.stop(timeout=5)
+        jobs._job_workers = None
+
+    def test_persisted_job_finishes_after_restart(self):
+        """Testa que um job enfileirado antes do reinício termina sem um novo POST."""
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+        job = repo.create_job('pendente antes do reinício')
+
+        # Processo novo: serviços recém-criados e nenhum worker em execução
+        jobs._job_workers = None
+        nlp = Mock()
+        nlp.model_name = 'test-model'
+        nlp.process_prompt.return_value = ('Resposta retomada', 0.1, {'path': 'local'})
+        with patch('app.views.nlp_service', nlp), patch('app.views.mongo_repo', repo), \
+                self.settings(JOB_WORKERS=1):
+            self.assertIsNotNone(views.start_job_workers())
+            done = jobs.wait_for_job(repo, job['job_id'], timeout=5)
+
+        self.assertEqual(done['state'], jobs.JOB_DONE)
+        self.assertEqual(done['response'], 'Resposta retomada')
+
+    def test_no_workers_when_disabled(self):
+        """Testa que com JOB_WORKERS=0 a inicialização não cria threads."""
+        with patch('app.views.mongo_repo', Mock()), self.settings(JOB_WORKERS=0):
+            self.assertIsNone(views.start_job_workers())
+
+
+if __name__ == '__main__':
+    unittest.main()
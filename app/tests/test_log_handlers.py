@@ -0,0 +1,79 @@
+"""
+Testes unitários para os handlers de logging
+
+Testa a escrita em background, o descarte com a fila cheia e a amostragem
+dos logs de payload.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import logging
+import os
+import tempfile
+import unittest
+from django.test import TestCase
+from app.log_handlers import BackgroundHandler, PayloadSamplingFilter, PAYLOAD_LOG
+
+
+class TestBackgroundHandler(TestCase):
+    """Testes para o handler com escrita em background."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'app.log')
+        self.logger = logging.getLogger('app.tests.background')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        self.logger.handlers = []
+        self.tmp_dir.cleanup()
+
+    def test_writes_formatted_records(self):
+        """Testa que os registros chegam ao arquivo com o formatter do destino."""
+        handler = BackgroundHandler(target='logging.FileHandler', filename=self.filename)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.logger.addHandler(handler)
+
+        self.logger.info("Prompt processado em %.2f segundos", 1.234)
+        handler.close()
+
+        with open(self.filename, encoding='utf-8') as log_file:
+            self.assertEqual(log_file.read(), "INFO Prompt processado em 1.23 segundos\n")
+
+    def test_drops_when_queue_full(self):
+        """Testa que a fila cheia descarta registros em vez de bloquear."""
+        handler = BackgroundHandler(target='logging.FileHandler', filename=self.filename, queue_size=1)
+        handler.listener.stop()
+        self.logger.addHandler(handler)
+
+        self.logger.info("primeiro")
+        self.logger.info("segundo")
+
+        self.assertEqual(handler.dropped, 1)
+        handler.listener = None
+        handler.target.close()
+
+
+class TestPayloadSamplingFilter(TestCase):
+    """Testes para a amostragem dos logs de payload."""
+
+    def _record(self, **extra):
+        record = logging.LogRecord('app', logging.DEBUG, __file__, 1, "Resposta gerada: %s", ('texto',), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_rate_zero_drops_only_payload(self):
+        """Testa que só os registros marcados como payload são amostrados."""
+        log_filter = PayloadSamplingFilter(rate=0)
+        self.assertFalse(log_filter.filter(self._record(**PAYLOAD_LOG)))
+        self.assertTrue(log_filter.filter(self._record()))
+
+    def test_rate_one_keeps_all(self):
+        """Testa que a taxa 1 mantém todos os registros."""
+        self.assertTrue(PayloadSamplingFilter(rate=1).filter(self._record(**PAYLOAD_LOG)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Testes unitários para as métricas do Prometheus
+
+Testa contadores, histogramas, a exposição em texto e a soma dos
+snapshots de vários processos.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from django.test import TestCase
+from app.services.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(TestCase):
+    """Testes para o registro de métricas."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.registry = MetricsRegistry(directory=self.tmp_dir.name, flush_interval=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_counter_render(self):
+        """Testa contadores com labels."""
+        self.registry.inc('pln_answers_total', path='math')
+        self.registry.inc('pln_answers_total', path='math')
+        self.registry.inc('pln_answers_total', path='local')
+
+        content = self.registry.render()
+
+        self.assertIn('# TYPE pln_answers_total counter', content)
+        self.assertIn('pln_answers_total{path="math"} 2', content)
+        self.assertIn('pln_answers_total{path="local"} 1', content)
+
+    def test_histogram_buckets_cumulative(self):
+        """Testa que os buckets do histograma são acumulados."""
+        self.registry.observe('pln_stage_duration_seconds', 0.002, stage='generate')
+        self.registry.observe('pln_stage_duration_seconds', 3.0, stage='generate')
+
+        content = self.registry.render()
+
+        self.assertIn('pln_stage_duration_seconds_bucket{stage="generate",le="0.001"} 0', content)
+        self.assertIn('pln_stage_duration_seconds_bucket{stage="generate",le="0.005"} 1', content)
+        self.assertIn('pln_stage_duration_seconds_bucket{stage="generate",le="5.0"} 2', content)
+        self.assertIn('pln_stage_duration_seconds_bucket{stage="generate",le="+Inf"} 2', content)
+        self.assertIn('pln_stage_duration_seconds_count{stage="generate"} 2', content)
+
+    def test_stage_timer_records_on_exception(self):
+        """Testa que a etapa é medida mesmo quando levanta exceção."""
+        with self.assertRaises(RuntimeError):
+            with self.registry.stage_timer('hf_api'):
+                raise RuntimeError('falha')
+
+        self.assertIn('pln_stage_duration_seconds_count{stage="hf_api"} 1', self.registry.render())
+
+    def test_model_state_one_hot(self):
+        """Testa que apenas o estado atual do modelo fica marcado."""
+        self.registry.set_model_state('loading')
+        self.registry.set_model_state('ready')
+
+        content = self.registry.render()
+
+        self.assertIn('pln_model_state{state="ready"} 1', content)
+        self.assertIn('pln_model_state{state="loading"} 0', content)
+
+    def test_merges_other_processes(self):
+        """Testa a soma dos snapshots de outros processos vivos."""
+        self.registry.inc('pln_errors_total', component='chat')
+        other = {
+            'pid': os.getppid(),
+            'counters': [['pln_errors_total', {'component': 'chat'}, 4]],
+            'gauges': [['pln_requests_in_flight', {}, 2]],
+            'histograms': [],
+        }
+        with open(os.path.join(self.tmp_dir.name, f"metrics_{os.getppid()}.json"), 'w') as f:
+            json.dump(other, f)
+
+        content = self.registry.render()
+
+        self.assertIn('pln_errors_total{component="chat"} 5', content)
+        self.assertIn('pln_requests_in_flight 2', content)
+
+    def test_dead_process_gauges_ignored(self):
+        """Testa que gauges de processos encerrados não são somados."""
+        dead = {
+            'pid': 0,
+            'counters': [['pln_fallbacks_total', {'kind': 'sqlite'}, 3]],
+            'gauges': [['pln_requests_in_flight', {}, 7]],
+            'histograms': [],
+        }
+        with open(os.path.join(self.tmp_dir.name, 'metrics_0.json'), 'w') as f:
+            json.dump(dead, f)
+
+        content = self.registry.render()
+
+        self.assertIn('pln_fallbacks_total{kind="sqlite"} 3', content)
+        self.assertNotIn('pln_requests_in_flight 7', content)
+
+    def test_flush_writes_snapshot(self):
+        """Testa a gravação do snapshot do processo."""
+        self.registry.inc('pln_cache_hits_total', cache='page')
+
+        path = os.path.join(self.tmp_dir.name, f"metrics_{os.getpid()}.json")
+        with open(path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot['counters'], [['pln_cache_hits_total', {'cache': 'page'}, 1]])
+
+    def test_label_escaping(self):
+        """Testa o escape de aspas e quebras de linha nos labels."""
+        self.registry.inc('pln_errors_total', component='a"b\nc')
+
+        self.assertIn('pln_errors_total{component="a\\"b\\nc"} 1', self.registry.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,12 +6,13 @@ Testa conexão MongoDB, salvamento, recuperação e fallback para SQLite.
 Desenvolvido por: ANNA, CÉSAR E EVILY
 """
 
+import json
 import unittest
 from unittest.mock import Mock, patch, MagicMock
 from django.test import TestCase
 from django.conf import settings
 from datetime import datetime
-from app.services.mongo_repo import MongoRepository
+from app.services.mongo_repo import MongoRepository, STATE_UP
 
 
 class TestMongoRepository(TestCase):
@@ -119,6 +120,170 @@ class TestMongoRepository(TestCase):
         # Deve retornar lista (pode estar vazia se SQLite não configurado)
         self.assertIsInstance(interactions, list)
     
+    def test_get_version_sqlite(self):
+        """Testa que a versão do histórico reflete total e interação mais recente."""
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+
+        empty = repo.get_version()
+        repo.save_interaction({'prompt': 'a', 'response': 'b', 'processing_time': 1.0, 'model': 'm'})
+        version = repo.get_version()
+
+        self.assertEqual(version['count'], empty['count'] + 1)
+        self.assertIsNotNone(version['newest'])
+        self.assertEqual(repo.get_version({'timestamp': {'$lte': '2000-01-01'}})['count'], 0)
+
+    def test_rollups_sqlite_fallback(self):
+        """Testa a atualização incremental das agregações no SQLite."""
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+
+        for processing_time in (1.0, 2.0, 4.0):
+            repo.save_interaction({
+                'prompt': 'teste',
+                'response': 'resposta',
+                'processing_time': processing_time,
+                'model': 'rollup-model'
+            })
+
+        buckets = repo.get_rollups(granularity='hour', model='rollup-model')
+        self.assertEqual(len(buckets), 1)
+        self.assertEqual(buckets[0]['count'], 3)
+        self.assertAlmostEqual(buckets[0]['sum'], 7.0)
+        self.assertEqual(buckets[0]['min'], 1.0)
+        self.assertEqual(buckets[0]['max'], 4.0)
+        self.assertLessEqual(buckets[0]['p95'], 4.0)
+
+        # A reconstrução completa chega ao mesmo resultado
+        repo.rebuild_rollups()
+        rebuilt = repo.get_rollups(granularity='day', model='rollup-model')
+        self.assertEqual(rebuilt[0]['count'], 3)
+
+    def test_save_interactions_sqlite_bulk(self):
+        """Testa o salvamento em lote no SQLite com uma única invalidação do cache."""
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+
+        with patch('app.services.mongo_repo.history_cache') as mock_cache:
+            saved = repo.save_interactions([
+                {'prompt': f'lote {i}', 'response': 'r', 'processing_time': 0.5, 'model': 'batch-model'}
+                for i in range(3)
+            ])
+
+        self.assertEqual(saved, 3)
+        mock_cache.bump.assert_called_once()
+        prompts = [item['prompt'] for item in repo.get_interactions() if item['model'] == 'batch-model']
+        self.assertEqual(sorted(prompts), ['lote 0', 'lote 1', 'lote 2'])
+        self.assertEqual(repo.get_rollups(model='batch-model')[0]['count'], 3)
+
+    def test_save_trace_fields_sqlite(self):
+        """Testa que request id e spans são salvos, migrando tabelas antigas."""
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS chat_interactions_fts")
+            cursor.execute("DROP TABLE IF EXISTS chat_interactions")
+            cursor.execute("""
+                CREATE TABLE chat_interactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    prompt TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    processing_time REAL,
+                    model TEXT,
+                    timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+        spans = [{'name': 'generate', 'start': 0.01, 'duration': 0.5}]
+
+        interaction_id = repo.save_interaction({'prompt': 'p', 'response': 'r', 'processing_time': 0.5,
+                                                'model': 'm', 'request_id': 'req-1', 'spans': spans})
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT request_id, spans FROM chat_interactions WHERE id = ?", [interaction_id])
+            request_id, stored_spans = cursor.fetchone()
+        self.assertEqual(request_id, 'req-1')
+        self.assertEqual(json.loads(stored_spans), spans)
+
+    def test_usage_fields_sqlite(self):
+        """Testa que a contabilidade de tokens é salva e lida do SQLite."""
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+
+        repo.save_interaction({'prompt': 'p', 'response': 'r', 'processing_time': 2.0, 'model': 'usage-model',
+                               'path': 'local-regenerated', 'input_tokens': 30, 'generated_tokens': 80,
+                               'generate_calls': 2, 'truncated': True})
+
+        interaction = [item for item in repo.get_interactions() if item['model'] == 'usage-model'][0]
+        self.assertEqual(interaction['path'], 'local-regenerated')
+        self.assertEqual(interaction['input_tokens'], 30)
+        self.assertEqual(interaction['generated_tokens'], 80)
+        self.assertEqual(interaction['generate_calls'], 2)
+        self.assertIs(interaction['truncated'], True)
+
+    def test_search_sqlite_fts(self):
+        """Testa a busca pelo índice FTS5 do SQLite com ranking e destaque."""
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+
+        repo.save_interaction({'prompt': 'qual a capital da frança', 'response': 'Paris é a capital',
+                               'processing_time': 1.0, 'model': 'm'})
+        repo.save_interaction({'prompt': 'o que é python', 'response': 'Uma linguagem',
+                               'processing_time': 1.0, 'model': 'm'})
+
+        self.assertEqual(repo.count_search('capital'), 1)
+        results = repo.search_interactions('capital', offset=0, limit=10)
+        self.assertEqual(len(results), 1)
+        self.assertIn('\x02capital\x03', results[0]['prompt_highlighted'])
+        self.assertEqual(results[0]['prompt'], 'qual a capital da frança')
+
+        # Busca sem acentos encontra texto acentuado
+        self.assertEqual(repo.count_search('franca'), 1)
+        self.assertEqual(repo.search_interactions('inexistente'), [])
+
+    def test_purge_expired_sqlite_archives_before_delete(self):
+        """Testa que a retenção arquiva e remove apenas interações expiradas."""
+        import tempfile
+        from datetime import timedelta
+
+        repo = MongoRepository()
+        repo.client = None
+        repo.collection = None
+
+        repo.save_interaction({'prompt': 'antiga', 'response': 'r', 'processing_time': 1.0, 'model': 'm'})
+        repo.save_interaction({'prompt': 'recente', 'response': 'r', 'processing_time': 1.0, 'model': 'm'})
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE chat_interactions SET timestamp = ? WHERE prompt = 'antiga'",
+                           [datetime.now() - timedelta(days=40)])
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            with patch.object(settings, 'ARCHIVE_DIR', archive_dir):
+                removed = repo.purge_expired(retention_days=30)
+                archived = list(repo.get_archive().iter_interactions())
+
+        self.assertEqual(removed, 1)
+        self.assertEqual([item['prompt'] for item in archived], ['antiga'])
+        prompts = [item['prompt'] for item in repo.get_interactions()]
+        self.assertIn('recente', prompts)
+        self.assertNotIn('antiga', prompts)
+        # O índice de busca acompanha a remoção
+        self.assertEqual(repo.count_search('antiga'), 0)
+
+    def test_purge_disabled_without_retention(self):
+        """Testa que nada é removido com retenção desabilitada."""
+        repo = MongoRepository()
+        with patch.object(settings, 'RETENTION_DAYS', 0):
+            self.assertEqual(repo.purge_expired(), 0)
+
     @patch('app.services.mongo_repo.MongoClient')
     def test_get_interactions_with_filters(self, mock_mongo_client):
         """Testa recuperação com filtros de data."""
@@ -157,6 +322,162 @@ class TestMongoRepository(TestCase):
         with patch.object(settings, 'MONGODB_URI', None):
             repo = MongoRepository()
             self.assertIsNone(repo.client)
+            self.assertEqual(repo.health_status()['backend'], 'sqlite')
+
+
+class TestMongoConnectionLifecycle(TestCase):
+    """Testes para a conexão não bloqueante e o health check do MongoDB."""
+
+    def _make_repo(self, mock_mongo_client, up=True):
+        """Cria um repositório com MongoClient mockado e sem thread de health check."""
+        mock_client = MagicMock()
+        mock_mongo_client.return_value = mock_client
+        with patch.object(settings, 'MONGODB_URI', 'mongodb://localhost:27017/'), \
+                patch.object(settings, 'MONGODB_DB', 'test_db'), \
+                patch.object(MongoRepository, '_start_health_prober'):
+            repo = MongoRepository()
+        if up:
+            # Como se o primeiro health check já tivesse respondido
+            repo.state = STATE_UP
+        return repo, mock_client
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_init_does_not_connect(self, mock_mongo_client):
+        """Testa que o cliente é criado sem conexão e com pool configurado."""
+        repo, mock_client = self._make_repo(mock_mongo_client, up=False)
+
+        kwargs = mock_mongo_client.call_args.kwargs
+        self.assertFalse(kwargs['connect'])
+        self.assertIn('maxPoolSize', kwargs)
+        self.assertIn('minPoolSize', kwargs)
+        self.assertIn('maxIdleTimeMS', kwargs)
+        mock_client.admin.command.assert_not_called()
+        self.assertEqual(repo.state, 'connecting')
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_connecting_uses_sqlite_until_first_probe(self, mock_mongo_client):
+        """Testa que, antes do primeiro health check, as escritas vão para o SQLite sem esperar o MongoDB."""
+        repo, mock_client = self._make_repo(mock_mongo_client, up=False)
+        mock_collection = MagicMock()
+        repo.collection = mock_collection
+
+        self.assertFalse(repo.is_mongo_available())
+        with patch.object(repo, '_save_to_sqlite', return_value=3) as mock_sqlite:
+            self.assertEqual(repo.save_interaction({'prompt': 'a', 'response': 'b'}), 3)
+            mock_sqlite.assert_called_once()
+        mock_collection.insert_one.assert_not_called()
+
+        self.assertTrue(repo.probe())
+        self.assertTrue(repo.is_mongo_available())
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_open_waits_for_first_probe(self, mock_mongo_client):
+        """Testa que open() já retorna o repositório com o estado do primeiro health check."""
+        mock_mongo_client.return_value = MagicMock()
+        with patch.object(settings, 'MONGODB_URI', 'mongodb://localhost:27017/'), \
+                patch.object(settings, 'MONGODB_DB', 'test_db'), \
+                patch.object(MongoRepository, '_start_health_prober'):
+            repo = MongoRepository.open()
+
+        mock_mongo_client.return_value.admin.command.assert_called_with('ping')
+        self.assertTrue(repo.is_mongo_available())
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_probe_switches_between_mongo_and_fallback(self, mock_mongo_client):
+        """Testa que o health check alterna entre MongoDB e SQLite nos dois sentidos."""
+        repo, mock_client = self._make_repo(mock_mongo_client)
+        mock_collection = MagicMock()
+        mock_collection.insert_one.return_value.inserted_id = 'mongo_id'
+        repo.collection = mock_collection
+
+        # MongoDB cai: as escritas vão direto para o SQLite
+        mock_client.admin.command.side_effect = Exception("down")
+        self.assertFalse(repo.probe())
+        self.assertEqual(repo.health_status()['backend'], 'sqlite')
+        with patch.object(repo, '_save_to_sqlite', return_value=1) as mock_sqlite:
+            self.assertEqual(repo.save_interaction({'prompt': 'a', 'response': 'b'}), 1)
+            mock_sqlite.assert_called_once()
+        mock_collection.insert_one.assert_not_called()
+
+        # MongoDB volta: as escritas retornam ao MongoDB
+        mock_client.admin.command.side_effect = None
+        self.assertTrue(repo.probe())
+        self.assertEqual(repo.health_status()['backend'], 'mongodb')
+        self.assertEqual(repo.save_interaction({'prompt': 'a', 'response': 'b'}), 'mongo_id')
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_connection_failure_marks_down(self, mock_mongo_client):
+        """Testa que falha de conexão em uma operação ativa o fallback."""
+        from pymongo.errors import ServerSelectionTimeoutError
+
+        repo, _ = self._make_repo(mock_mongo_client)
+        mock_collection = MagicMock()
+        mock_collection.insert_one.side_effect = ServerSelectionTimeoutError("timeout")
+        repo.collection = mock_collection
+
+        with patch.object(repo, '_save_to_sqlite', return_value=7):
+            self.assertEqual(repo.save_interaction({'prompt': 'a', 'response': 'b'}), 7)
+        self.assertEqual(repo.state, 'down')
+        self.assertFalse(repo.is_mongo_available())
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_rollups_updated_on_mongo_save(self, mock_mongo_client):
+        """Testa que salvar no MongoDB atualiza as agregações com upsert."""
+        repo, _ = self._make_repo(mock_mongo_client)
+        mock_collection = MagicMock()
+        repo.collection = mock_collection
+        repo.db = MagicMock()
+
+        repo.save_interaction({'prompt': 'a', 'response': 'b', 'processing_time': 0.5, 'model': 'm'})
+
+        operations = repo.db['chat_rollups'].bulk_write.call_args.args[0]
+        self.assertEqual(len(operations), 2)  # hora e dia
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_save_interactions_mongo_insert_many(self, mock_mongo_client):
+        """Testa que o lote é salvo com um único insert_many."""
+        repo, _ = self._make_repo(mock_mongo_client)
+        repo.collection = MagicMock()
+        repo.collection.insert_many.return_value.inserted_ids = ['a', 'b']
+        repo.db = MagicMock()
+
+        saved = repo.save_interactions([
+            {'prompt': 'a', 'response': 'b', 'processing_time': 0.5, 'model': 'm'},
+            {'prompt': 'c', 'response': 'd', 'processing_time': 0.7, 'model': 'm'},
+        ])
+
+        self.assertEqual(saved, 2)
+        repo.collection.insert_many.assert_called_once()
+        repo.collection.insert_one.assert_not_called()
+        self.assertEqual(repo.db['chat_rollups'].bulk_write.call_count, 1)
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_ttl_index_with_retention(self, mock_mongo_client):
+        """Testa que o índice de timestamp vira TTL quando há retenção."""
+        repo, _ = self._make_repo(mock_mongo_client)
+        repo.collection = MagicMock()
+
+        with patch.object(settings, 'RETENTION_DAYS', 30), patch.object(settings, 'RETENTION_TTL_GRACE_DAYS', 1):
+            repo._ensure_timestamp_index()
+
+        kwargs = repo.collection.create_index.call_args.kwargs
+        self.assertEqual(kwargs['expireAfterSeconds'], 31 * 86400)
+
+    @patch('app.services.mongo_repo.MongoClient')
+    def test_search_uses_mongo_text_index(self, mock_mongo_client):
+        """Testa que a busca no MongoDB usa $text ordenado por textScore."""
+        repo, _ = self._make_repo(mock_mongo_client)
+        mock_collection = MagicMock()
+        cursor = mock_collection.find.return_value.sort.return_value.skip.return_value.limit.return_value
+        cursor.__iter__.return_value = iter([{'prompt': 'capital da França', 'response': 'Paris'}])
+        repo.collection = mock_collection
+
+        results = repo.search_interactions('capital', offset=10, limit=10)
+
+        query = mock_collection.find.call_args.args[0]
+        self.assertEqual(query['$text'], {'$search': 'capital'})
+        mock_collection.find.return_value.sort.return_value.skip.assert_called_once_with(10)
+        self.assertIn('\x02capital\x03', results[0]['prompt_highlighted'])
 
 
 if __name__ == '__main__':
@@ -7,11 +7,15 @@ e integração com modelos da Hugging Face.
 Desenvolvido por: ANNA, CÉSAR E EVILY
 """
 
+import threading
+import time
 import unittest
+import torch
 from unittest.mock import Mock, patch, MagicMock
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.conf import settings
-from app.services.nlp_service import NLPService
+from app.benchmark import build_stub_service
+from app.services.nlp_service import NLPService, PromptTooLong
 import json
 
 
@@ -30,33 +34,33 @@ class TestNLPService(TestCase):
     def test_quick_responses(self):
         """Testa se respostas rápidas funcionam corretamente."""
         # Teste de saudação
-        response, time = self.nlp_service.process_prompt("oi")
+        response, time, usage = self.nlp_service.process_prompt("oi")
         self.assertIn("Olá", response)
         
         # Teste de conhecimento
-        response, time = self.nlp_service.process_prompt("me dá as vogais")
+        response, time, usage = self.nlp_service.process_prompt("me dá as vogais")
         self.assertIn("A, E, I, O, U", response)
         
         # Teste de sistema
-        response, time = self.nlp_service.process_prompt("fez o l")
+        response, time, usage = self.nlp_service.process_prompt("fez o l")
         self.assertIn("funcionando", response.lower())
     
     def test_math_calculations(self):
         """Testa se cálculos matemáticos funcionam."""
         # Multiplicação
-        response, time = self.nlp_service.process_prompt("quanto é 5 vezes 3")
+        response, time, usage = self.nlp_service.process_prompt("quanto é 5 vezes 3")
         self.assertIn("15", response)
         
         # Adição
-        response, time = self.nlp_service.process_prompt("10 + 15")
+        response, time, usage = self.nlp_service.process_prompt("10 + 15")
         self.assertIn("25", response)
         
         # Subtração
-        response, time = self.nlp_service.process_prompt("20 - 8")
+        response, time, usage = self.nlp_service.process_prompt("20 - 8")
         self.assertIn("12", response)
         
         # Divisão
-        response, time = self.nlp_service.process_prompt("12 / 4")
+        response, time, usage = self.nlp_service.process_prompt("12 / 4")
         self.assertIn("3", response)
     
     @patch('app.services.nlp_service.AutoTokenizer')
@@ -110,7 +114,7 @@ class TestNLPService(TestCase):
         """Testa tratamento de prompt vazio."""
         # Prompt vazio deve retornar erro ou mensagem apropriada
         try:
-            response, time = self.nlp_service.process_prompt("")
+            response, time, usage = self.nlp_service.process_prompt("")
             # Se não levantar exceção, resposta deve ser válida
             self.assertIsInstance(response, str)
         except:
@@ -121,7 +125,7 @@ class TestNLPService(TestCase):
         """Testa tratamento de prompt muito longo."""
         long_prompt = "a" * 1000
         try:
-            response, time = self.nlp_service.process_prompt(long_prompt)
+            response, time, usage = self.nlp_service.process_prompt(long_prompt)
             # Resposta deve ser gerada ou erro tratado
             self.assertIsInstance(time, float)
         except:
@@ -130,10 +134,340 @@ class TestNLPService(TestCase):
     
     def test_processing_time(self):
         """Testa se o tempo de processamento é retornado."""
-        response, time = self.nlp_service.process_prompt("teste")
+        response, time, usage = self.nlp_service.process_prompt("teste")
         self.assertIsInstance(time, float)
         self.assertGreaterEqual(time, 0)
 
+    def _mock_causal_model(self):
+        """Configura tokenizer e modelo causal falsos para a geração em lote."""
+        import torch
+
+        tokenizer = MagicMock()
+        tokenizer.eos_token_id = 0
+
+        def tokenize(texts, **kwargs):
+            return {
+                'input_ids': torch.ones((len(texts), 4), dtype=torch.long),
+                'attention_mask': torch.ones((len(texts), 4), dtype=torch.long),
+            }
+
+        tokenizer.side_effect = tokenize
+        tokenizer.decode.side_effect = lambda ids, **kwargs: f"gerado-{int(ids[0])}"
+
+        model = MagicMock()
+        model.generate.side_effect = lambda input_ids, **kwargs: torch.cat(
+            [input_ids, torch.arange(len(input_ids)).unsqueeze(1) + 10], dim=1
+        )
+
+        self.nlp_service.tokenizer = tokenizer
+        self.nlp_service.model = model
+        self.nlp_service.is_encoder_decoder = False
+        self.nlp_service._model_loaded = True
+        return model
+
+    def test_process_batch_fast_paths_skip_model(self):
+        """Testa que prompts resolvidos pelos caminhos rápidos não usam o modelo."""
+        with patch.object(self.nlp_service, '_generate_local') as mock_generate:
+            results = self.nlp_service.process_batch(["oi", "10 + 15"])
+
+        mock_generate.assert_not_called()
+        self.assertIn("Olá", results[0][0])
+        self.assertIn("25", results[1][0])
+
+    def test_process_batch_single_generate_in_order(self):
+        """Testa que os prompts restantes usam uma única chamada generate e mantêm a ordem."""
+        model = self._mock_causal_model()
+
+        with patch.object(self.nlp_service, '_postprocess_response', side_effect=lambda p, r, f=None, usage=None: f"{p}:{r}"):
+            with self.settings(BATCH_GENERATE_SIZE=16, USE_HF_FOR_ALL=False):
+                results = self.nlp_service.process_batch([
+                    "explique aprendizado de máquina em detalhes", "oi", "o que é pln",
+                ])
+
+        self.assertEqual(model.generate.call_count, 1)
+        self.assertIn("Olá", results[1][0])
+        self.assertTrue(results[0][0].startswith("explique aprendizado de máquina em detalhes:gerado-"))
+        self.assertTrue(results[2][0].startswith("o que é pln:gerado-"))
+        for response, processing_time, usage in results:
+            self.assertIsInstance(processing_time, float)
+
+    def test_usage_metadata(self):
+        """Testa os metadados de caminho e tokens devolvidos com a resposta."""
+        _, _, usage = self.nlp_service.process_prompt("10 + 15")
+        self.assertEqual(usage['path'], 'math')
+        self.assertIsNone(usage['input_tokens'])
+        self.assertEqual(usage['generate_calls'], 0)
+
+        self._mock_causal_model()
+        with patch.object(self.nlp_service, '_postprocess_response', side_effect=lambda p, r, f=None, usage=None: r):
+            with self.settings(USE_HF_FOR_ALL=False):
+                results = self.nlp_service.process_batch(["pergunta a", "pergunta b"])
+
+        usage = results[0][2]
+        self.assertEqual(usage['path'], 'local')
+        self.assertEqual(usage['input_tokens'], 4)
+        self.assertEqual(usage['generated_tokens'], 1)
+        self.assertEqual(usage['generate_calls'], 1)
+        # O token gerado não é o de fim: a geração parou no limite
+        self.assertTrue(usage['truncated'])
+
+    def test_process_batch_chunks_by_generate_size(self):
+        """Testa a divisão dos prompts em lotes de BATCH_GENERATE_SIZE."""
+        model = self._mock_causal_model()
+
+        with patch.object(self.nlp_service, '_postprocess_response', side_effect=lambda p, r, f=None, usage=None: r):
+            with self.settings(BATCH_GENERATE_SIZE=2, USE_HF_FOR_ALL=False):
+                results = self.nlp_service.process_batch(["pergunta a", "pergunta b", "pergunta c"])
+
+        self.assertEqual(model.generate.call_count, 2)
+        self.assertEqual(len(results), 3)
+
+    @patch('app.services.nlp_service.urllib.request.urlopen')
+    def test_hf_inference_batch_api(self, mock_urlopen):
+        """Testa chamada em lote à API de inferência."""
+        mock_response = Mock()
+        mock_response.read.return_value.decode.return_value = json.dumps([
+            [{"generated_text": "Primeira"}],
+            {"generated_text": "Segunda"},
+        ])
+        mock_urlopen.return_value.__enter__.return_value = mock_response
+
+        responses = self.nlp_service.hf_inference_batch(["a", "b"])
+
+        self.assertEqual(responses, ["Primeira", "Segunda"])
+        self.assertEqual(mock_urlopen.call_count, 1)
+        sent = json.loads(mock_urlopen.call_args[0][0].data.decode('utf-8'))
+        self.assertEqual(sent, {"inputs": ["a", "b"]})
+
+
+
+class TestModelLoadingAndCoalescing(TestCase):
+    """Testes para o carregamento único do modelo e o agrupamento de prompts idênticos."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        with patch.object(settings, 'HF_MODEL_NAME', 'test-model'):
+            self.nlp_service = NLPService()
+
+    def _run_concurrently(self, fn, count):
+        results = [None] * count
+        errors = []
+
+        def target(index):
+            try:
+                results[index] = fn()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        return results, errors
+
+    def test_concurrent_requests_load_model_once(self):
+        """Testa que um burst de requisições dispara um único carregamento."""
+        calls = []
+
+        def slow_load():
+            calls.append(1)
+            time.sleep(0.05)
+            self.nlp_service._model_loaded = True
+            self.nlp_service.model_state = 'ready'
+
+        with patch.object(self.nlp_service, '_load_model', side_effect=slow_load):
+            _, errors = self._run_concurrently(self.nlp_service._ensure_model_loaded, 8)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.nlp_service.model_state, 'ready')
+
+    @override_settings(MODEL_LOAD_RETRY_BACKOFF=10, MODEL_LOAD_RETRY_MAX=15)
+    def test_failed_load_backs_off(self):
+        """Testa que após uma falha só há nova tentativa depois do intervalo, que dobra."""
+        def failing_load():
+            self.nlp_service.model_state = 'failed'
+            raise OSError('sem memória')
+
+        with patch.object(self.nlp_service, '_load_model', side_effect=failing_load) as mock_load:
+            self.nlp_service._ensure_model_loaded()
+            self.nlp_service._ensure_model_loaded()
+            self.assertEqual(mock_load.call_count, 1)
+            self.assertFalse(self.nlp_service._model_loaded)
+
+            # Intervalo expirado: tenta de novo e o próximo intervalo é limitado pelo máximo
+            self.nlp_service._load_retry_at = 0
+            before = time.monotonic()
+            self.nlp_service._ensure_model_loaded()
+            self.assertEqual(mock_load.call_count, 2)
+            self.assertAlmostEqual(self.nlp_service._load_retry_at - before, 15, delta=1)
+
+    def test_failed_load_uses_api_fallback(self):
+        """Testa que durante o intervalo de nova tentativa o prompt vai para a API."""
+        self.nlp_service.model_state = 'failed'
+        self.nlp_service._load_retry_at = time.monotonic() + 60
+        with patch.object(self.nlp_service, '_load_model') as mock_load, \
+                patch.object(self.nlp_service, 'hf_inference', return_value='Resposta da API'):
+            response, _, usage = self.nlp_service.process_prompt('Explique a fotossíntese')
+
+        mock_load.assert_not_called()
+        self.assertEqual(response, 'Resposta da API')
+        self.assertEqual(usage['path'], 'hf')
+
+    def test_identical_prompts_share_generation(self):
+        """Testa que prompts canônicos idênticos simultâneos usam uma única geração."""
+        calls = []
+
+        def slow_answer(prompt):
+            calls.append(prompt)
+            time.sleep(0.1)
+            return 'Resposta única', {'path': 'local', 'generated_tokens': 3}
+
+        prompts = iter(['Explique a fotossíntese', '  explique A   fotossíntese', 'Explique a fotossíntese'])
+        with patch.object(self.nlp_service, '_answer_with_model', side_effect=slow_answer):
+            results, errors = self._run_concurrently(lambda: self.nlp_service.process_prompt(next(prompts)), 3)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({response for response, _, _ in results}, {'Resposta única'})
+        # Cada requisição recebe a própria cópia dos metadados
+        self.assertEqual(len({id(usage) for _, _, usage in results}), 3)
+
+    @override_settings(COALESCE_PROMPTS=False)
+    def test_coalescing_can_be_disabled(self):
+        """Testa que COALESCE_PROMPTS=False gera uma resposta por requisição."""
+        with patch.object(self.nlp_service, '_answer_with_model', return_value=('r', {'path': 'local'})) as mock_answer:
+            self.nlp_service.process_prompt('Explique a fotossíntese')
+            self.nlp_service.process_prompt('Explique a fotossíntese')
+        self.assertEqual(mock_answer.call_count, 2)
+
+
+
+class TestPromptBudget(TestCase):
+    """Testes para o orçamento de tokens da entrada."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.nlp_service = build_stub_service()
+
+    def test_budget_counts_tokens_with_tokenizer(self):
+        """Testa a contagem exata com o tokenizer e a reserva do template e da resposta."""
+        budget = self.nlp_service.prompt_budget('abc')
+
+        self.assertFalse(budget['estimated'])
+        # Tokenizer stub: um token por byte
+        self.assertEqual(budget['prompt_tokens'], 3)
+        preamble = len(self.nlp_service._format_model_input('').encode('utf-8'))
+        context = self.nlp_service._context_tokens()
+        self.assertEqual(budget['max_prompt_tokens'], context - preamble - 150)
+
+    @override_settings(MODEL_MAX_INPUT_TOKENS=400)
+    def test_configured_context_overrides_model(self):
+        """Testa que MODEL_MAX_INPUT_TOKENS substitui a janela do modelo."""
+        self.assertEqual(self.nlp_service._context_tokens(), 400)
+        self.assertEqual(self.nlp_service._max_input_length(), 250)
+
+    @override_settings(MODEL_MAX_INPUT_TOKENS=300)
+    def test_prompt_over_budget_raises(self):
+        """Testa que um prompt acima do orçamento é rejeitado antes da geração."""
+        with patch.object(self.nlp_service.model, 'generate') as mock_generate:
+            with self.assertRaises(PromptTooLong) as context:
+                self.nlp_service.process_prompt('Explique ' + 'x' * 400)
+
+        mock_generate.assert_not_called()
+        self.assertGreater(context.exception.budget['prompt_tokens'], context.exception.budget['max_prompt_tokens'])
+
+    def test_usage_reports_prompt_tokens(self):
+        """Testa que os metadados da resposta trazem o número de tokens do prompt."""
+        _, _, usage = self.nlp_service.process_prompt('Explique a fotossíntese das plantas')
+
+        self.assertEqual(usage['prompt_tokens'], len('Explique a fotossíntese das plantas'.encode('utf-8')))
+
+    def test_budget_estimated_without_tokenizer(self):
+        """Testa a estimativa por caracteres quando só a API de inferência está disponível."""
+        with patch.object(settings, 'HF_MODEL_NAME', 'test-model'):
+            service = NLPService()
+
+        budget = service.prompt_budget('a' * 10)
+
+        self.assertTrue(budget['estimated'])
+        self.assertEqual(budget['prompt_tokens'], 3)
+        self.assertEqual(budget['max_prompt_tokens'], 1024)
+
+    def test_budget_check_does_not_load_model(self):
+        """Testa que o orçamento não carrega o modelo fora da geração compartilhada."""
+        with patch.object(settings, 'HF_MODEL_NAME', 'test-model'):
+            service = NLPService()
+
+        with patch.object(service, '_load_model') as mock_load, \
+                patch.object(service, '_answer_with_model', return_value=('r', {'path': 'local'})) as mock_answer:
+            _, _, usage = service.process_prompt('Explique a fotossíntese')
+
+        mock_load.assert_not_called()
+        mock_answer.assert_called_once()
+        # Sem tokenizer vale a estimativa por caracteres
+        self.assertEqual(usage['prompt_tokens'], service.prompt_budget('Explique a fotossíntese')['prompt_tokens'])
+
+
+
+class TestSeq2SeqEncoderReuse(TestCase):
+    """Testes para a reutilização da saída do encoder nas regenerações seq2seq."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste (T5 minúsculo com pesos aleatórios)."""
+        from transformers import T5Config, T5ForConditionalGeneration
+        self.nlp_service = build_stub_service()
+        tokenizer = self.nlp_service.tokenizer
+        config = T5Config(
+            vocab_size=len(tokenizer), d_model=16, d_kv=4, d_ff=32, num_layers=1, num_heads=2,
+            decoder_start_token_id=tokenizer.pad_token_id, pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+        torch.manual_seed(0)
+        self.nlp_service.model = T5ForConditionalGeneration(config).eval()
+        self.nlp_service.model_name = 'flan-t5-teste'
+        self.nlp_service.is_encoder_decoder = True
+        self.encoder_calls = []
+        self.nlp_service.model.get_encoder().register_forward_pre_hook(lambda module, args: self.encoder_calls.append(1))
+
+    def test_regeneration_reuses_encoder_outputs(self):
+        """Testa que as regenerações da requisição não passam de novo pelo encoder."""
+        with self.nlp_service._request_scope():
+            self.nlp_service._generate_local(['oi tudo bem', 'explique a fotossíntese das plantas'])
+            self.nlp_service._regenerate('oi tudo bem', 'ignorado {prompt}', do_sample=True)
+            self.nlp_service._regenerate('oi tudo bem', 'ignorado {prompt}', do_sample=False)
+
+        # Uma única passada do encoder para o lote inteiro
+        self.assertEqual(len(self.encoder_calls), 1)
+
+    def test_cache_is_per_request(self):
+        """Testa que outra requisição codifica a entrada de novo."""
+        for _ in range(2):
+            with self.nlp_service._request_scope():
+                self.nlp_service._generate_local(['oi tudo bem'])
+
+        self.assertEqual(len(self.encoder_calls), 2)
+
+    def test_cached_outputs_match_fresh_encoding(self):
+        """Testa que a saída guardada de um lote com padding é igual à codificação isolada."""
+        text = self.nlp_service._format_model_input('oi tudo bem')
+        with self.nlp_service._request_scope():
+            cached, mask = self.nlp_service._encode([text, self.nlp_service._format_model_input('uma pergunta bem mais longa')])[0]
+
+        inputs = self.nlp_service.tokenizer([text], return_tensors='pt')
+        fresh = self.nlp_service.model.get_encoder()(**inputs).last_hidden_state
+        self.assertTrue(torch.allclose(cached, fresh, atol=1e-5))
+        self.assertEqual(int(mask.sum()), inputs['input_ids'].shape[-1])
+
+    def test_regeneration_decodes_whole_seq2seq_output(self):
+        """Testa que a regeneração seq2seq usa toda a saída do decoder e conta os tokens da entrada."""
+        response, input_tokens, generated_ids, stopping = self.nlp_service._regenerate('oi', 'ignorado {prompt}', do_sample=False)
+
+        self.assertEqual(input_tokens, len(self.nlp_service._format_model_input('oi').encode('utf-8')))
+        self.assertEqual(response, self.nlp_service.tokenizer.decode(generated_ids, skip_special_tokens=True).strip())
+        self.assertIsNone(stopping)
+
 
 if __name__ == '__main__':
     unittest.main()
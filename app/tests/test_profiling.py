@@ -0,0 +1,136 @@
+"""
+Testes unitários para o profiling sob demanda
+
+Testa o armamento por número de requisições e por tempo, os relatórios
+gravados e o endpoint de administração.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from django.test import TestCase
+from app.services.profiling import Profiler, call
+
+
+def _work():
+    return sum(i * i for i in range(2000))
+
+
+class TestProfiler(TestCase):
+    """Testes para o profiler do processo."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_unarmed_returns_no_session(self):
+        """Testa que sem armar nenhuma captura é feita."""
+        self.assertIsNone(self.profiler.start_session())
+        self.assertEqual(call(None, _work), _work())
+
+    def test_armed_for_n_requests(self):
+        """Testa que apenas as próximas N requisições são capturadas."""
+        self.profiler.arm(requests=2)
+
+        self.assertIsNotNone(self.profiler.start_session())
+        self.assertIsNotNone(self.profiler.start_session())
+        self.assertIsNone(self.profiler.start_session())
+        self.assertFalse(self.profiler.status()['armed'])
+
+    def test_armed_for_seconds(self):
+        """Testa que a janela de tempo desarma o profiler ao expirar."""
+        self.profiler.arm(seconds=0.01)
+        self.assertIsNotNone(self.profiler.start_session())
+        time.sleep(0.02)
+        self.assertIsNone(self.profiler.start_session())
+
+    def test_session_writes_reports(self):
+        """Testa os arquivos pstats/tracemalloc e o resumo com hotspots."""
+        self.profiler.arm(requests=1, memory=True)
+        session = self.profiler.start_session()
+
+        self.assertEqual(call(session, _work), _work())
+        summary = session.finish()
+
+        self.assertTrue(summary['hotspots'])
+        self.assertTrue(any('_work' in row['function'] or 'genexpr' in row['function'] for row in summary['hotspots']))
+        for name in summary['files']:
+            self.assertTrue((Path(self.tmp_dir.name) / name).is_file())
+        self.assertEqual(len(summary['files']), 3)
+        self.assertEqual(self.profiler.list_reports()[0]['id'], summary['id'])
+
+    def test_report_path_rejects_traversal(self):
+        """Testa que o download não sai do diretório de relatórios."""
+        self.assertIsNone(self.profiler.report_path('../settings.py'))
+        self.assertIsNone(self.profiler.report_path('inexistente.pstats'))
+
+
+class TestProfilingView(TestCase):
+    """Testes para o endpoint de administração do profiling."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.tmp_dir.name)
+        patcher = patch('app.services.profiling._profiler', self.profiler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_disabled_without_token(self):
+        """Testa que o endpoint não existe sem PROFILING_TOKEN."""
+        with self.settings(PROFILING_TOKEN=''):
+            response = self.client.get('/profiling/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_token(self):
+        """Testa a recusa de tokens inválidos."""
+        with self.settings(PROFILING_TOKEN='segredo'):
+            response = self.client.get('/profiling/', HTTP_AUTHORIZATION='Bearer errado')
+        self.assertEqual(response.status_code, 401)
+
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_arm_capture_and_download(self, mock_repo, mock_nlp):
+        """Testa armar, capturar uma requisição de chat e baixar o relatório."""
+        mock_nlp.model_name = 'test-model'
+        mock_nlp.process_prompt.side_effect = lambda prompt: (str(_work()), 0.1, {'path': 'local'})
+        headers = {'HTTP_AUTHORIZATION': 'Bearer segredo'}
+
+        with self.settings(PROFILING_TOKEN='segredo'):
+            response = self.client.post('/profiling/', data=json.dumps({'requests': 1}),
+                                        content_type='application/json', **headers)
+            self.assertTrue(json.loads(response.content)['status']['armed'])
+
+            self.client.post('/', data=json.dumps({'prompt': 'teste'}), content_type='application/json')
+
+            data = json.loads(self.client.get('/profiling/', **headers).content)
+            self.assertFalse(data['status']['armed'])
+            self.assertEqual(len(data['reports']), 1)
+            self.assertTrue(data['reports'][0]['hotspots'])
+
+            download = self.client.get(data['reports'][0]['urls'][0], **headers)
+            self.assertEqual(download.status_code, 200)
+            self.assertIn('attachment', download['Content-Disposition'])
+
+    def test_arm_validates_limits(self):
+        """Testa a validação dos parâmetros de armamento."""
+        with self.settings(PROFILING_TOKEN='segredo'):
+            response = self.client.post('/profiling/', data=json.dumps({'requests': 0}),
+                                        content_type='application/json', HTTP_X_PROFILING_TOKEN='segredo')
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+"""
+Testes unitários para o rate limiting
+
+Testa os token buckets (em memória e no SQLite), a identificação do
+cliente e o middleware com orçamentos separados para o modelo e para os
+caminhos rápidos.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import json
+import unittest
+from unittest.mock import Mock, patch
+from django.test import TestCase, RequestFactory, Client, override_settings
+from app.services import ratelimit
+from app.services.ratelimit import Budget, LocalBucketStore, SQLiteBucketStore, RateLimiter, client_key
+
+
+class FakeClock:
+    """Relógio controlado pelo teste."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestBucketStores(TestCase):
+    """Testes para os stores de token buckets."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.clock = FakeClock()
+        self.budget = Budget('model', per_minute=60, burst=3)
+
+    def _assert_burst_and_refill(self, store):
+        decisions = [store.take('model:ip:1', self.budget) for _ in range(4)]
+        self.assertEqual([d.allowed for d in decisions], [True, True, True, False])
+        self.assertEqual(decisions[2].remaining, 0)
+        self.assertAlmostEqual(decisions[3].retry_after, 1.0)
+        self.assertAlmostEqual(decisions[3].reset, 3.0)
+
+        # 1 token por segundo
+        self.clock.now += 1
+        self.assertTrue(store.take('model:ip:1', self.budget).allowed)
+        self.assertFalse(store.take('model:ip:1', self.budget).allowed)
+
+        # Outro cliente tem o próprio bucket
+        self.assertTrue(store.take('model:ip:2', self.budget).allowed)
+
+        # A recarga não passa do burst
+        self.clock.now += 600
+        self.assertEqual(store.take('model:ip:1', self.budget).remaining, 2)
+
+    def test_local_store(self):
+        """Testa burst e recarga do store em memória."""
+        self._assert_burst_and_refill(LocalBucketStore(clock=self.clock))
+
+    def test_sqlite_store(self):
+        """Testa burst e recarga do store compartilhado no SQLite."""
+        self._assert_burst_and_refill(SQLiteBucketStore(clock=self.clock))
+
+    def test_cost_larger_than_tokens(self):
+        """Testa que um custo maior que o saldo é recusado sem consumir."""
+        store = LocalBucketStore(clock=self.clock)
+        self.assertTrue(store.take('k', self.budget, cost=2).allowed)
+        decision = store.take('k', self.budget, cost=2)
+        self.assertFalse(decision.allowed)
+        self.assertEqual(decision.remaining, 1)
+
+    def test_refund_restores_tokens(self):
+        """Testa a devolução de tokens nos dois stores, limitada ao burst."""
+        for store in (LocalBucketStore(clock=self.clock), SQLiteBucketStore(clock=self.clock)):
+            store.take('refund', self.budget, cost=2)
+            store.refund('refund', self.budget, cost=2)
+            self.assertEqual(store.take('refund', self.budget, cost=0).remaining, 3)
+            store.refund('refund', self.budget, cost=5)
+            self.assertEqual(store.take('refund', self.budget, cost=0).remaining, 3)
+
+    def test_store_error_allows_request(self):
+        """Testa que uma falha no store não bloqueia o chat."""
+        store = Mock()
+        store.take.side_effect = Exception('database is locked')
+        limiter = RateLimiter(store, [self.budget])
+        self.assertTrue(limiter.take('ip:1', 'model').allowed)
+
+
+class TestClientKey(TestCase):
+    """Testes para a identificação do cliente."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    @override_settings(RATE_LIMIT_API_KEYS=['secret'])
+    def test_api_key_takes_precedence(self):
+        """Testa que a chave de API cadastrada identifica o cliente (sem expor a chave)."""
+        request = self.factory.post('/', HTTP_X_API_KEY='secret', REMOTE_ADDR='10.0.0.1')
+        key = client_key(request)
+        self.assertTrue(key.startswith('key:'))
+        self.assertNotIn('secret', key)
+
+    @override_settings(RATE_LIMIT_API_KEYS=['secret'])
+    def test_unknown_api_key_uses_ip(self):
+        """Testa que uma chave desconhecida não ganha bucket próprio."""
+        request = self.factory.post('/', HTTP_X_API_KEY='inventada', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(client_key(request), 'ip:10.0.0.1')
+
+    def test_forwarded_only_when_trusted(self):
+        """Testa que X-Forwarded-For só é usado quando configurado."""
+        request = self.factory.post('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.2', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(client_key(request), 'ip:10.0.0.1')
+        with override_settings(RATE_LIMIT_TRUST_FORWARDED=True):
+            self.assertEqual(client_key(request), 'ip:1.2.3.4')
+
+
+@override_settings(
+    RATE_LIMIT_ENABLED=True,
+    RATE_LIMIT_BACKEND='local',
+    RATE_LIMIT_MODEL_PER_MINUTE=1,
+    RATE_LIMIT_MODEL_BURST=2,
+    RATE_LIMIT_FAST_PER_MINUTE=1,
+    RATE_LIMIT_FAST_BURST=4,
+)
+class TestRateLimitMiddleware(TestCase):
+    """Testes para o middleware de rate limiting."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.client = Client()
+        # Buckets vazios a cada teste
+        ratelimit._limiter = None
+
+        self.mock_nlp_service = Mock()
+        self.mock_nlp_service.model_name = 'test-model'
+        self.mock_nlp_service.process_prompt.return_value = ('Resposta', 0.1, {'path': 'local'})
+
+    def _chat(self, prompt, **extra):
+        return self.client.post('/', data=json.dumps({'prompt': prompt}), content_type='application/json', **extra)
+
+    @patch('app.views.mongo_repo', None)
+    def test_model_budget_exhausted_returns_429(self):
+        """Testa o 429 com os headers de reset quando o orçamento do modelo acaba."""
+        with patch('app.views.nlp_service', self.mock_nlp_service):
+            first = self._chat('Conte uma história')
+            second = self._chat('Conte outra história')
+            third = self._chat('Mais uma')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['X-RateLimit-Limit'], '2')
+        self.assertEqual(first['X-RateLimit-Remaining'], '1')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(third.status_code, 429)
+        self.assertEqual(third['Retry-After'], '60')
+        self.assertEqual(third['X-RateLimit-Remaining'], '0')
+        self.assertIn('X-RateLimit-Reset', third)
+        self.assertIn('X-Request-ID', third)
+        self.assertEqual(third.json()['retry_after'], 60)
+        self.assertEqual(self.mock_nlp_service.process_prompt.call_count, 2)
+
+    @patch('app.views.mongo_repo', None)
+    def test_fast_path_has_separate_budget(self):
+        """Testa que prompts dos caminhos rápidos não consomem o orçamento do modelo."""
+        with patch('app.views.nlp_service', self.mock_nlp_service):
+            self._chat('Conte uma história')
+            self._chat('Conte outra história')
+            self.assertEqual(self._chat('Conte mais').status_code, 429)
+
+            fast = self._chat('quanto é 2 + 2')
+            self.assertEqual(fast.status_code, 200)
+            self.assertEqual(fast['X-RateLimit-Limit'], '4')
+
+    @override_settings(RATE_LIMIT_API_KEYS=['cliente-1'])
+    @patch('app.views.mongo_repo', None)
+    def test_api_key_and_ip_have_separate_buckets(self):
+        """Testa que cada chave de API cadastrada tem o seu bucket."""
+        with patch('app.views.nlp_service', self.mock_nlp_service):
+            self._chat('a')
+            self._chat('b')
+            self.assertEqual(self._chat('c').status_code, 429)
+            self.assertEqual(self._chat('c', HTTP_X_API_KEY='cliente-1').status_code, 200)
+
+    @patch('app.views.mongo_repo', None)
+    def test_random_api_keys_do_not_bypass_ip_limit(self):
+        """Testa que enviar uma chave nova a cada requisição não escapa do limite do IP."""
+        with patch('app.views.nlp_service', self.mock_nlp_service):
+            self._chat('a', HTTP_X_API_KEY='chave-1')
+            self._chat('b', HTTP_X_API_KEY='chave-2')
+            self.assertEqual(self._chat('c', HTTP_X_API_KEY='chave-3').status_code, 429)
+
+    @patch('app.views.mongo_repo', None)
+    def test_denied_request_refunds_other_budgets(self):
+        """Testa que um lote recusado no orçamento fast não gasta tokens do modelo."""
+        self.mock_nlp_service.process_batch.return_value = [('r', 0.1, {'path': 'local'})] * 2
+        with patch('app.views.nlp_service', self.mock_nlp_service):
+            for _ in range(4):
+                self._chat('quanto é 2 + 2')
+            response = self.client.post(
+                '/batch/', data=json.dumps({'prompts': ['a', 'quanto é 1 + 1']}), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 429)
+
+            # O token do modelo consumido pelo lote recusado foi devolvido
+            self.assertEqual(self._chat('b').status_code, 200)
+            self.assertEqual(self._chat('c').status_code, 200)
+
+    @patch('app.views.mongo_repo', None)
+    def test_batch_consumes_per_prompt(self):
+        """Testa que um lote consome um token por prompt do orçamento do caminho."""
+        self.mock_nlp_service.process_batch.return_value = [('r', 0.1, {'path': 'local'})] * 3
+        with patch('app.views.nlp_service', self.mock_nlp_service):
+            response = self.client.post(
+                '/batch/', data=json.dumps({'prompts': ['a', 'b', 'olá']}), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self._chat('c').status_code, 429)
+
+    def test_get_is_not_limited(self):
+        """Testa que a página do chat (GET) não consome tokens."""
+        for _ in range(5):
+            response = self.client.get('/')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-RateLimit-Limit', response)
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    @patch('app.views.mongo_repo', None)
+    def test_disabled(self):
+        """Testa que RATE_LIMIT_ENABLED=False desliga o limite."""
+        with patch('app.views.nlp_service', self.mock_nlp_service):
+            for _ in range(4):
+                self.assertEqual(self._chat('Conte uma história').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Testes unitários para o replay do histórico exportado
+
+Testa a leitura dos exports (JSON e CSV), a temporização original com
+multiplicador de taxa, o relatório e o comando ``replay_history``.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from app import replay
+from app.views import EXPORT_CSV_COLUMNS
+
+EXPORTED = [
+    {'timestamp': '2026-01-01T10:00:00.400000', 'prompt': 'bom dia', 'path': 'quick'},
+    {'timestamp': '2026-01-01T10:00:00.200000', 'prompt': 'quanto é 2 vezes 3', 'path': 'math'},
+    {'timestamp': '2026-01-01T10:00:00', 'prompt': 'Explique a fotossíntese das plantas', 'path': 'local'},
+]
+
+
+class FakeTarget:
+    """Alvo que registra os envios e falha nos prompts indicados."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, prompt):
+        with self._lock:
+            self.sent.append((prompt, time.perf_counter()))
+        if prompt in self.failing:
+            return 500, None
+        return 200, 'local'
+
+
+class TestLoadWorkload(TestCase):
+    """Testes para a leitura dos arquivos exportados."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_json_sorted_by_arrival(self):
+        """Testa que o export (mais recente primeiro) é lido em ordem de chegada."""
+        path = os.path.join(self.tmp_dir.name, 'chat_history.json')
+        with open(path, 'w', encoding='utf-8') as handle:
+            json.dump(EXPORTED, handle)
+
+        workload = replay.load_workload(path)
+        self.assertEqual([item['path'] for item in workload], ['local', 'math', 'quick'])
+        self.assertAlmostEqual(workload[2]['timestamp'] - workload[0]['timestamp'], 0.4, places=3)
+        self.assertEqual(len(replay.load_workload(path, limit=2)), 2)
+
+    def test_csv_export(self):
+        """Testa a leitura do CSV no formato do export (com BOM)."""
+        path = os.path.join(self.tmp_dir.name, 'chat_history.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as handle:
+            handle.write('\ufeff')
+            writer = csv.writer(handle)
+            writer.writerow([header for _, header in EXPORT_CSV_COLUMNS])
+            for item in EXPORTED:
+                writer.writerow([item.get(key, '') for key, _ in EXPORT_CSV_COLUMNS])
+
+        workload = replay.load_workload(path)
+        self.assertEqual(workload[0]['prompt'], 'Explique a fotossíntese das plantas')
+        self.assertEqual(workload[1]['path'], 'math')
+
+
+class TestReplay(TestCase):
+    """Testes para o reenvio e o relatório."""
+
+    def setUp(self):
+        self.workload = [
+            {'prompt': 'a', 'timestamp': 100.0, 'path': 'local'},
+            {'prompt': 'b', 'timestamp': 100.2, 'path': 'math'},
+            {'prompt': 'c', 'timestamp': 100.4, 'path': 'local'},
+        ]
+
+    def test_original_timing_with_rate(self):
+        """Testa que os intervalos originais são divididos pelo multiplicador."""
+        target = FakeTarget()
+        report = replay.replay(self.workload, target, concurrency=2, rate=2.0)
+
+        sent_at = [moment for _, moment in sorted(target.sent)]
+        self.assertAlmostEqual(sent_at[2] - sent_at[0], 0.2, delta=0.08)
+        self.assertEqual(report['timing'], replay.TIMING_ORIGINAL)
+        self.assertEqual(report['schedule_lag']['count'], 3)
+        self.assertEqual(report['original_paths'], {'local': 2, 'math': 1})
+
+    def test_report_errors_and_paths(self):
+        """Testa a taxa de erro, os status e os caminhos no modo sem temporização."""
+        report = replay.replay(self.workload, FakeTarget(failing={'b'}), concurrency=3, timing=replay.TIMING_NONE)
+
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['errors'], 1)
+        self.assertAlmostEqual(report['error_rate'], 1 / 3)
+        self.assertEqual(report['status'], {'200': 2, '500': 1})
+        self.assertEqual(report['paths'], {'local': 2})
+        self.assertIn('p99', report['latency'])
+        self.assertNotIn('schedule_lag', report)
+
+    def test_missing_timestamps_fall_back_to_none(self):
+        """Testa que sem timestamps o replay não tenta respeitar intervalos."""
+        self.workload[1]['timestamp'] = None
+        report = replay.replay(self.workload, FakeTarget())
+        self.assertEqual(report['timing'], replay.TIMING_NONE)
+
+
+class TestReplayCommand(TestCase):
+    """Testes para o comando replay_history."""
+
+    def test_in_process_with_stub_model(self):
+        """Testa o replay no próprio processo com o modelo stub."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, 'chat_history.json')
+            output = os.path.join(tmp_dir, 'report.json')
+            with open(source, 'w', encoding='utf-8') as handle:
+                json.dump(EXPORTED, handle)
+
+            stdout = StringIO()
+            call_command('replay_history', source, model='stub', rate=10, output=output, stdout=stdout)
+            with open(output, encoding='utf-8') as handle:
+                report = json.load(handle)
+
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['paths'], {'local': 1, 'math': 1, 'quick': 1})
+        self.assertIn('p95=', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Testes unitários para as agregações de latência e uso
+
+Testa janelas de tempo, histograma logarítmico e estimativa de percentis.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import unittest
+from datetime import datetime
+from django.test import TestCase
+from app.services import rollups
+
+
+class TestRollups(TestCase):
+    """Testes para o módulo de agregações."""
+
+    def test_bucket_start(self):
+        """Testa o início das janelas de hora e dia."""
+        ts = datetime(2024, 5, 10, 14, 37, 12, 500)
+        self.assertEqual(rollups.bucket_start(ts, 'hour'), datetime(2024, 5, 10, 14))
+        self.assertEqual(rollups.bucket_start(ts, 'day'), datetime(2024, 5, 10))
+        with self.assertRaises(ValueError):
+            rollups.bucket_start(ts, 'week')
+
+    def test_aggregate_groups_by_window_and_model(self):
+        """Testa a agregação por granularidade, janela e modelo."""
+        interactions = [
+            {'timestamp': datetime(2024, 5, 10, 14, 1), 'model': 'a', 'processing_time': 1.0},
+            {'timestamp': datetime(2024, 5, 10, 14, 59), 'model': 'a', 'processing_time': 3.0},
+            {'timestamp': datetime(2024, 5, 10, 15, 0), 'model': 'a', 'processing_time': 2.0},
+            {'timestamp': datetime(2024, 5, 10, 15, 0), 'model': 'b', 'processing_time': 0.5},
+        ]
+        stats = rollups.aggregate(interactions)
+
+        hour = stats[('hour', datetime(2024, 5, 10, 14), 'a')]
+        self.assertEqual(hour['count'], 2)
+        self.assertAlmostEqual(hour['sum'], 4.0)
+        self.assertEqual(hour['min'], 1.0)
+        self.assertEqual(hour['max'], 3.0)
+
+        day = stats[('day', datetime(2024, 5, 10), 'a')]
+        self.assertEqual(day['count'], 3)
+        self.assertIn(('day', datetime(2024, 5, 10), 'b'), stats)
+
+    def test_percentile_approximation(self):
+        """Testa que os percentis estimados ficam próximos dos reais."""
+        values = [0.01 * i for i in range(1, 1001)]  # 0.01s .. 10s
+        stats = rollups.aggregate(
+            {'timestamp': datetime(2024, 1, 1), 'model': 'm', 'processing_time': v} for v in values
+        )
+        entry = stats[('day', datetime(2024, 1, 1), 'm')]
+
+        p95 = rollups.percentile(entry['hist'], entry['count'], 0.95, entry['min'], entry['max'])
+        self.assertAlmostEqual(p95, 9.5, delta=9.5 * 0.15)
+        p50 = rollups.percentile(entry['hist'], entry['count'], 0.50, entry['min'], entry['max'])
+        self.assertAlmostEqual(p50, 5.0, delta=5.0 * 0.15)
+
+    def test_percentile_without_samples(self):
+        """Testa percentil sem amostras."""
+        self.assertIsNone(rollups.percentile({}, 0, 0.95))
+
+
+if __name__ == '__main__':
+    unittest.main()
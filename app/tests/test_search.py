@@ -0,0 +1,51 @@
+"""
+Testes unitários para os utilitários de busca textual
+
+Testa extração de termos, montagem das consultas e destaque.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import unittest
+from unittest.mock import Mock
+from django.test import TestCase
+from app.services import search
+
+
+class TestSearchUtils(TestCase):
+    """Testes para o módulo de busca."""
+
+    def test_extract_terms_strips_operators(self):
+        """Testa que pontuação e sintaxe do FTS5 são descartadas."""
+        terms = search.extract_terms('capital "França" OR NEAR(x) capital*')
+        self.assertEqual(terms, ['capital', 'frança', 'or', 'near', 'x'])
+
+    def test_build_fts_query_quotes_terms(self):
+        """Testa que cada termo é citado na expressão MATCH."""
+        self.assertEqual(search.build_fts_query(['capital', 'frança']), '"capital" OR "frança"')
+
+    def test_mark_terms(self):
+        """Testa a marcação de termos (incluindo prefixos) sem diferenciar maiúsculas."""
+        marked = search.mark_terms('Capitalismo e capital', ['capital'])
+        self.assertEqual(
+            marked,
+            f'{search.HIGHLIGHT_START}Capitalismo{search.HIGHLIGHT_END} e '
+            f'{search.HIGHLIGHT_START}capital{search.HIGHLIGHT_END}'
+        )
+
+    def test_lazy_results_fetch_only_requested_page(self):
+        """Testa que o Paginator busca apenas a página pedida."""
+        from django.core.paginator import Paginator
+
+        repo = Mock()
+        repo.count_search.return_value = 25
+        repo.search_interactions.return_value = [{'prompt': 'p'}] * 10
+
+        page = Paginator(search.LazySearchResults(repo, 'termo'), 10).get_page(2)
+
+        self.assertEqual(page.paginator.count, 25)
+        repo.search_interactions.assert_called_once_with('termo', {}, offset=10, limit=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Testes unitários para os critérios de parada da geração causal
+
+Testa o critério com o tokenizer e o modelo stub dos benchmarks (que
+consulta os critérios a cada passo) e a integração com o NLPService.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import unittest
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from transformers import StoppingCriteriaList
+from app import benchmark
+from app.services import metrics, stopping
+from app.services.metrics import MetricsRegistry
+
+
+class TestResponseStoppingCriteria(TestCase):
+    """Testes para o critério de parada por linha do lote."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.tokenizer = benchmark.build_stub_tokenizer()
+
+    def _generate(self, replies, short_answer=False):
+        # Duas linhas ('a' e 'b') recebem respostas diferentes do stub
+        model = benchmark.StubCausalLM(self.tokenizer, replies=replies)
+        input_ids = self.tokenizer(['a', 'b'][:len(replies)], return_tensors='pt', padding=True)['input_ids']
+        criteria = stopping.ResponseStoppingCriteria(self.tokenizer, input_ids.shape[-1], short_answer=short_answer)
+        outputs = model.generate(input_ids, max_new_tokens=200, stopping_criteria=StoppingCriteriaList([criteria]))
+        generated = [row[input_ids.shape[-1]:].tolist() for row in outputs]
+        return criteria, generated
+
+    def _text(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def test_stops_at_new_turn(self):
+        """Testa que a geração para quando o modelo começa um novo turno 'User:'."""
+        criteria, generated = self._generate(['Resposta certa.\nUser: e agora uma pergunta longa'])
+
+        self.assertEqual(criteria.reason(0, generated[0], self.tokenizer.eos_token_id), stopping.STOP_NEW_TURN)
+        self.assertTrue(self._text(generated[0]).endswith('User:'))
+        self.assertEqual(stopping.trim_response(self._text(generated[0]), stopping.STOP_NEW_TURN), 'Resposta certa.')
+
+    def test_stops_at_instruction_echo(self):
+        """Testa que a geração para quando o modelo repete a instrução."""
+        criteria, generated = self._generate(['Claro. Você é um assistente útil, educado e objetivo'])
+
+        self.assertEqual(criteria.reason(0, generated[0], self.tokenizer.eos_token_id), stopping.STOP_INSTRUCTION_ECHO)
+        self.assertEqual(stopping.trim_response(self._text(generated[0]), stopping.STOP_INSTRUCTION_ECHO), 'Claro.')
+
+    def test_short_profile_stops_at_sentence(self):
+        """Testa que o perfil curto para na primeira frase completa."""
+        reply = 'A água ferve a 100 graus. Ela congela a 0 graus.'
+        criteria, generated = self._generate([reply], short_answer=True)
+        _, full = self._generate([reply])
+
+        self.assertEqual(criteria.reason(0, generated[0], self.tokenizer.eos_token_id), stopping.STOP_SENTENCE)
+        self.assertEqual(self._text(generated[0]).strip(), 'A água ferve a 100 graus.')
+        self.assertLess(len(generated[0]), len(full[0]))
+
+    def test_decimal_point_is_not_sentence_end(self):
+        """Testa que o ponto de um número decimal não encerra a frase."""
+        criteria = stopping.ResponseStoppingCriteria(self.tokenizer, 0, short_answer=True, min_sentence_tokens=1)
+
+        self.assertIsNone(criteria._reason('O valor de pi é 3.', 10))
+        self.assertEqual(criteria._reason('O valor é três.', 10), stopping.STOP_SENTENCE)
+
+    def test_rows_stop_independently(self):
+        """Testa que cada linha do lote para pelo próprio motivo."""
+        replies = ['Curta.\nUser: continua', 'Resposta sem marcador']
+        criteria, generated = self._generate(replies)
+        eos = self.tokenizer.eos_token_id
+        reasons = {criteria.reason(row, ids, eos) for row, ids in enumerate(generated)}
+
+        self.assertEqual(reasons, {stopping.STOP_NEW_TURN, stopping.STOP_EOS})
+
+    def test_trim_keeps_response_without_marker(self):
+        """Testa que paradas sem marcador não alteram a resposta."""
+        self.assertEqual(stopping.trim_response('Resposta.', stopping.STOP_EOS), 'Resposta.')
+        self.assertEqual(stopping.trim_response('Resposta.', stopping.STOP_SENTENCE), 'Resposta.')
+
+
+class TestServiceStopping(TestCase):
+    """Testes para os critérios de parada no NLPService."""
+
+    def setUp(self):
+        """Configuração inicial para cada teste."""
+        self.service = benchmark.build_stub_service()
+        self.service.model = benchmark.StubCausalLM(
+            self.service.tokenizer,
+            replies=('A fotossíntese transforma luz em energia.\nUser: e a respiração das plantas?',),
+        )
+
+    def test_new_turn_is_cut_and_counted(self):
+        """Testa que o turno seguinte não é gerado nem aparece na resposta."""
+        registry = MetricsRegistry()
+        with patch.object(metrics, '_registry', registry):
+            response, _, usage = self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertEqual(response, 'A fotossíntese transforma luz em energia.')
+        self.assertEqual(usage['stop_reason'], stopping.STOP_NEW_TURN)
+        self.assertFalse(usage['truncated'])
+        self.assertLess(usage['generated_tokens'], len('A fotossíntese transforma luz em energia.\nUser: e a respiração'))
+        self.assertIn('pln_generation_stops_total{reason="new_turn"} 1', registry.render())
+
+    @override_settings(ANSWER_PROFILE='default')
+    def test_default_profile_keeps_full_answer(self):
+        """Testa que o perfil padrão não corta no fim da frase."""
+        self.service.model = benchmark.StubCausalLM(
+            self.service.tokenizer, replies=('A luz vira energia. As folhas usam clorofila.',),
+        )
+
+        response, _, usage = self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertEqual(response, 'A luz vira energia. As folhas usam clorofila.')
+        self.assertEqual(usage['stop_reason'], stopping.STOP_EOS)
+
+    @override_settings(ANSWER_PROFILE='short')
+    def test_short_profile_answers_first_sentence(self):
+        """Testa que o perfil curto devolve só a primeira frase."""
+        self.service.model = benchmark.StubCausalLM(
+            self.service.tokenizer, replies=('A luz vira energia. As folhas usam clorofila.',),
+        )
+
+        response, _, usage = self.service.process_prompt(benchmark.MODEL_PROMPT)
+
+        self.assertEqual(response, 'A luz vira energia.')
+        self.assertEqual(usage['stop_reason'], stopping.STOP_SENTENCE)
+
+
+if __name__ == '__main__':
+    unittest.main()
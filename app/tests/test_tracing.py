@@ -0,0 +1,78 @@
+"""
+Testes unitários para o rastreamento das requisições
+
+Testa request ids, spans, o header Server-Timing e a integração com as
+métricas por etapa.
+
+Desenvolvido por: ANNA, CÉSAR E EVILY
+"""
+
+import unittest
+from django.test import TestCase
+from app.services import tracing
+from app.services.metrics import MetricsRegistry
+
+
+class TestTracing(TestCase):
+    """Testes para o trace de uma requisição."""
+
+    def test_request_id_from_client(self):
+        """Testa que ids válidos do cliente são mantidos e os inválidos trocados."""
+        self.assertEqual(tracing.new_request_id('abc-123'), 'abc-123')
+        generated = tracing.new_request_id('inválido\r\nX-Injected: 1')
+        self.assertEqual(len(generated), 32)
+        self.assertNotEqual(tracing.new_request_id(), tracing.new_request_id())
+
+    def test_span_without_trace_is_noop(self):
+        """Testa que spans fora de uma requisição são ignorados."""
+        self.assertIsNone(tracing.current_trace())
+        with tracing.span('generate'):
+            pass
+        tracing.record_span('generate', 0.0, 1.0)
+
+    def test_spans_and_server_timing(self):
+        """Testa o registro dos spans e a soma por etapa no Server-Timing."""
+        trace, token = tracing.start_trace('req-1')
+        try:
+            with tracing.span('generate'):
+                pass
+            trace.add_span('regeneration', trace.started_at, 0.25)
+            trace.add_span('regeneration', trace.started_at, 0.25)
+        finally:
+            tracing.end_trace(token)
+
+        self.assertIsNone(tracing.current_trace())
+        self.assertEqual([span['name'] for span in trace.spans], ['generate', 'regeneration', 'regeneration'])
+        header = trace.server_timing()
+        self.assertIn('regeneration;dur=500.0;desc="2x"', header)
+        self.assertTrue(header.startswith('generate;dur='))
+        self.assertIn('total;dur=', header)
+        self.assertEqual(trace.as_dict()['request_id'], 'req-1')
+
+    def test_traced_decorator(self):
+        """Testa o decorador usado nas chamadas do repositório."""
+        @tracing.traced('repo.get')
+        def get():
+            return 42
+
+        trace, token = tracing.start_trace()
+        try:
+            self.assertEqual(get(), 42)
+        finally:
+            tracing.end_trace(token)
+        self.assertEqual(trace.spans[0]['name'], 'repo.get')
+
+    def test_stage_timer_records_span(self):
+        """Testa que as etapas medidas para as métricas também viram spans."""
+        registry = MetricsRegistry()
+        trace, token = tracing.start_trace()
+        try:
+            with registry.stage_timer('sanitizer'):
+                pass
+        finally:
+            tracing.end_trace(token)
+        self.assertEqual(trace.spans[0]['name'], 'sanitizer')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,11 +7,13 @@ Desenvolvido por: ANNA, CÉSAR E EVILY
 """
 
 import json
-from django.test import TestCase, RequestFactory, Client
+from django.test import TestCase, RequestFactory, AsyncRequestFactory, Client
 from django.urls import reverse
+from django.core.cache import cache
 from unittest.mock import Mock, patch, MagicMock
-from app.views import chat_view, history_view, export_history
-from app.services.nlp_service import NLPService
+from asgiref.sync import sync_to_async
+from app.views import chat_view, history_view, export_history, achat_view, ahistory_view, aexport_history
+from app.services.nlp_service import NLPService, PromptTooLong
 from app.services.mongo_repo import MongoRepository
 
 
@@ -26,7 +28,7 @@ class TestChatView(TestCase):
         # Mock do serviço NLP
         self.mock_nlp_service = Mock(spec=NLPService)
         self.mock_nlp_service.model_name = 'test-model'
-        self.mock_nlp_service.process_prompt.return_value = ('Resposta de teste', 1.5)
+        self.mock_nlp_service.process_prompt.return_value = ('Resposta de teste', 1.5, {'path': 'local'})
         
         # Mock do repositório MongoDB
         self.mock_mongo_repo = Mock(spec=MongoRepository)
@@ -43,7 +45,7 @@ class TestChatView(TestCase):
     def test_chat_view_post_success(self, mock_repo, mock_nlp):
         """Testa processamento bem-sucedido de mensagem (POST)."""
         mock_nlp.model_name = 'test-model'
-        mock_nlp.process_prompt.return_value = ('Resposta teste', 1.5)
+        mock_nlp.process_prompt.return_value = ('Resposta teste', 1.5, {'path': 'local'})
         mock_repo.save_interaction.return_value = 'test_id'
         mock_repo.client = Mock()  # Simula MongoDB disponível
         
@@ -58,6 +60,36 @@ class TestChatView(TestCase):
         self.assertIn('response', data)
         self.assertIn('processing_time', data)
         self.assertIn('model', data)
+        self.assertEqual(data['path'], 'local')
+    
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_chat_view_tracing(self, mock_repo, mock_nlp):
+        """Testa request id, Server-Timing, campo timings e spans salvos."""
+        from app.services import tracing
+
+        def process_prompt(prompt):
+            with tracing.span('generate'):
+                return ('Resposta teste', 1.5, {'path': 'local'})
+
+        mock_nlp.model_name = 'test-model'
+        mock_nlp.process_prompt.side_effect = process_prompt
+        
+        response = self.client.post(
+            '/?timings=1',
+            data=json.dumps({'prompt': 'teste'}),
+            content_type='application/json',
+            HTTP_X_REQUEST_ID='req-42'
+        )
+        
+        self.assertEqual(response['X-Request-ID'], 'req-42')
+        self.assertIn('generate;dur=', response['Server-Timing'])
+        data = json.loads(response.content)
+        self.assertEqual(data['timings']['request_id'], 'req-42')
+        self.assertEqual(data['timings']['spans'][0]['name'], 'generate')
+        saved = mock_repo.save_interaction.call_args[0][0]
+        self.assertEqual(saved['request_id'], 'req-42')
+        self.assertEqual(saved['spans'][0]['name'], 'generate')
     
     @patch('app.views.nlp_service')
     def test_chat_view_post_empty_prompt(self, mock_nlp):
@@ -76,19 +108,50 @@ class TestChatView(TestCase):
     
     @patch('app.views.nlp_service')
     def test_chat_view_post_long_prompt(self, mock_nlp):
-        """Testa validação de prompt muito longo."""
+        """Testa prompt acima do orçamento de tokens do modelo."""
         mock_nlp.model_name = 'test-model'
+        mock_nlp.process_prompt.side_effect = PromptTooLong({'prompt_tokens': 900, 'max_prompt_tokens': 800})
         
-        long_prompt = 'a' * 501
         response = self.client.post(
             '/',
-            data=json.dumps({'prompt': long_prompt}),
+            data=json.dumps({'prompt': 'a' * 501}),
             content_type='application/json'
         )
         
         self.assertEqual(response.status_code, 400)
         data = json.loads(response.content)
         self.assertIn('error', data)
+        self.assertEqual(data['prompt_tokens'], 900)
+        self.assertEqual(data['max_prompt_tokens'], 800)
+    
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_chat_view_post_prompt_over_500_chars_accepted(self, mock_repo, mock_nlp):
+        """Testa que o limite não é mais de 500 caracteres."""
+        mock_nlp.model_name = 'test-model'
+        mock_nlp.process_prompt.return_value = ('Resposta', 0.5, {'path': 'local', 'prompt_tokens': 130})
+        
+        response = self.client.post(
+            '/',
+            data=json.dumps({'prompt': 'palavra ' * 70}),
+            content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['prompt_tokens'], 130)
+    
+    @patch('app.views.nlp_service')
+    def test_chat_view_post_prompt_over_char_cap(self, mock_nlp):
+        """Testa a proteção de PROMPT_MAX_CHARS antes da tokenização."""
+        with self.settings(PROMPT_MAX_CHARS=100):
+            response = self.client.post(
+                '/',
+                data=json.dumps({'prompt': 'a' * 101}),
+                content_type='application/json'
+            )
+        
+        self.assertEqual(response.status_code, 400)
+        mock_nlp.process_prompt.assert_not_called()
     
     @patch('app.views.nlp_service')
     def test_chat_view_post_invalid_json(self, mock_nlp):
@@ -113,6 +176,334 @@ class TestChatView(TestCase):
         self.assertEqual(response.status_code, 503)
         data = json.loads(response.content)
         self.assertIn('error', data)
+    
+    @patch('app.views.get_model_executor')
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_chat_view_priority_header(self, mock_repo, mock_nlp, mock_get_executor):
+        """Testa que o header X-Priority rebaixa a geração para a classe bulk."""
+        from app.services.executor import PRIORITY_BULK
+        mock_nlp.model_name = 'test-model'
+        mock_nlp.is_fast_path.return_value = False
+        mock_get_executor.return_value.call.return_value = ('Resposta teste', 1.5, {'path': 'local'})
+        
+        response = self.client.post(
+            '/',
+            data=json.dumps({'prompt': 'teste'}),
+            content_type='application/json',
+            headers={'X-Priority': 'bulk'},
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_get_executor.return_value.call.call_args.kwargs['priority'], PRIORITY_BULK)
+    
+    @patch('app.views.get_model_executor')
+    @patch('app.views.nlp_service')
+    def test_chat_view_busy(self, mock_nlp, mock_get_executor):
+        """Testa resposta 503 quando a fila do modelo está cheia."""
+        from app.services.executor import ExecutorBusy
+        mock_nlp.is_fast_path.return_value = False
+        mock_get_executor.return_value.call.side_effect = ExecutorBusy()
+        
+        response = self.client.post(
+            '/',
+            data=json.dumps({'prompt': 'teste'}),
+            content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class TestAsyncChatView(TestCase):
+    """Testes para a view de chat assíncrona."""
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    def _post(self, payload):
+        return self.factory.post('/', data=json.dumps(payload), content_type='application/json')
+
+    @patch('app.views.mongo_repo')
+    @patch('app.views.nlp_service')
+    async def test_achat_view_uses_executor(self, mock_nlp, mock_repo):
+        """Testa que o modelo roda no executor e a interação é salva."""
+        mock_nlp.model_name = 'test-model'
+        mock_nlp.process_prompt.return_value = ('Resposta async', 0.5, {'path': 'local'})
+
+        response = await achat_view(self._post({'prompt': 'teste'}))
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['response'], 'Resposta async')
+        mock_repo.save_interaction.assert_called_once()
+
+    @patch('app.views.get_model_executor')
+    @patch('app.views.nlp_service')
+    async def test_achat_view_busy(self, mock_nlp, mock_get_executor):
+        """Testa resposta 503 quando a fila do modelo está cheia."""
+        from app.services.executor import ExecutorBusy
+        mock_get_executor.return_value.run.side_effect = ExecutorBusy()
+
+        response = await achat_view(self._post({'prompt': 'teste'}))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    @patch('app.views.nlp_service')
+    async def test_achat_view_empty_prompt(self, mock_nlp):
+        """Testa validação de prompt vazio na view assíncrona."""
+        response = await achat_view(self._post({'prompt': ''}))
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.views.mongo_repo')
+    async def test_ahistory_view(self, mock_repo):
+        """Testa a view de histórico assíncrona."""
+        from django.core.cache import cache
+        cache.clear()
+        mock_repo.get_interactions.return_value = []
+
+        response = await ahistory_view(AsyncRequestFactory().get('/history/'))
+
+        self.assertEqual(response.status_code, 200)
+
+    @patch('app.views.mongo_repo')
+    async def test_ahistory_view_cached_page_skips_threads(self, mock_repo):
+        """Testa que a página em cache e a revalidação 304 não passam por nenhuma thread."""
+        from datetime import datetime
+        cache.clear()
+        mock_repo.get_interactions.return_value = []
+        mock_repo.get_version.return_value = {'count': 2, 'newest': datetime(2024, 1, 15, 10, 0, 0)}
+        first = await ahistory_view(AsyncRequestFactory().get('/history/'))
+
+        with patch('app.views.sync_to_async') as mock_sync_to_async:
+            cached = await ahistory_view(AsyncRequestFactory().get('/history/'))
+            revalidated = await ahistory_view(
+                AsyncRequestFactory().get('/history/', headers={'If-None-Match': first['ETag']})
+            )
+
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(revalidated.status_code, 304)
+        mock_sync_to_async.assert_not_called()
+
+    @patch('app.views.mongo_repo')
+    async def test_ahistory_view_mongo_queries_not_thread_sensitive(self, mock_repo):
+        """Testa que, com o MongoDB ativo, as consultas não usam a thread síncrona compartilhada."""
+        cache.clear()
+        mock_repo.is_mongo_available.return_value = True
+        mock_repo.get_interactions.return_value = [{'prompt': 'oi', 'response': 'olá'}]
+
+        with patch('app.views.sync_to_async', wraps=sync_to_async) as mock_sync_to_async:
+            response = await ahistory_view(AsyncRequestFactory().get('/history/'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_sync_to_async.call_count, 2)  # versão e interações
+        for call in mock_sync_to_async.call_args_list:
+            self.assertFalse(call.kwargs['thread_sensitive'])
+
+    @patch('app.views.mongo_repo')
+    async def test_aexport_history(self, mock_repo):
+        """Testa a exportação assíncrona: snapshot reaproveitado e 304 com o mesmo ETag."""
+        cache.clear()
+        mock_repo.is_mongo_available.return_value = False
+        mock_repo.get_interactions.return_value = []
+        mock_repo.get_version.return_value = {'count': 0, 'newest': None}
+
+        first = await aexport_history(AsyncRequestFactory().get('/export/', {'format': 'csv'}))
+        second = await aexport_history(AsyncRequestFactory().get('/export/', {'format': 'csv'}))
+        revalidated = await aexport_history(
+            AsyncRequestFactory().get('/export/', {'format': 'csv'}, headers={'If-None-Match': first['ETag']})
+        )
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(mock_repo.get_interactions.call_count, 1)
+
+
+class TestBatchView(TestCase):
+    """Testes para o endpoint de chat em lote."""
+
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_batch_results_in_order_and_single_save(self, mock_repo, mock_nlp):
+        """Testa resultados na ordem dos prompts e uma única escrita em lote."""
+        mock_nlp.model_name = 'test-model'
+        mock_nlp.process_batch.return_value = [('R1', 0.1, {'path': 'quick'}), ('R2', 0.2, {'path': 'local'})]
+
+        response = self.client.post(
+            '/batch/',
+            data=json.dumps({'prompts': [' oi ', 'o que é pln']}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual([item['response'] for item in data['results']], ['R1', 'R2'])
+        mock_nlp.process_batch.assert_called_once_with(['oi', 'o que é pln'])
+        mock_repo.save_interactions.assert_called_once()
+        saved = mock_repo.save_interactions.call_args[0][0]
+        self.assertEqual([item['prompt'] for item in saved], ['oi', 'o que é pln'])
+        mock_repo.save_interaction.assert_not_called()
+
+    @patch('app.views.nlp_service')
+    def test_batch_invalid_prompt_reports_index(self, mock_nlp):
+        """Testa que um prompt inválido rejeita o lote indicando a posição."""
+        response = self.client.post(
+            '/batch/',
+            data=json.dumps({'prompts': ['oi', '', 'a' * 501]}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['index'], 1)
+        mock_nlp.process_batch.assert_not_called()
+
+    @patch('app.views.nlp_service')
+    def test_batch_prompt_over_token_budget_reports_index(self, mock_nlp):
+        """Testa que um prompt acima do orçamento de tokens rejeita o lote com a posição."""
+        mock_nlp.is_fast_path.return_value = False
+        mock_nlp.check_prompt.side_effect = [
+            {'prompt_tokens': 3, 'max_prompt_tokens': 10},
+            PromptTooLong({'prompt_tokens': 12, 'max_prompt_tokens': 10}),
+        ]
+        response = self.client.post(
+            '/batch/',
+            data=json.dumps({'prompts': ['curto', 'longo demais']}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.content)
+        self.assertEqual(data['index'], 1)
+        self.assertEqual(data['max_prompt_tokens'], 10)
+        mock_nlp.process_batch.assert_not_called()
+
+    @patch('app.views.nlp_service')
+    def test_batch_too_large(self, mock_nlp):
+        """Testa o limite de prompts por requisição."""
+        with self.settings(BATCH_MAX_PROMPTS=2):
+            response = self.client.post(
+                '/batch/',
+                data=json.dumps({'prompts': ['a', 'b', 'c']}),
+                content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.views.nlp_service')
+    def test_batch_requires_list(self, mock_nlp):
+        """Testa que o body precisa conter uma lista de prompts."""
+        response = self.client.post(
+            '/batch/',
+            data=json.dumps({'prompts': 'oi'}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.views.get_model_executor')
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_batch_runs_as_bulk(self, mock_repo, mock_nlp, mock_get_executor):
+        """Testa que o lote é enfileirado no executor do modelo com prioridade bulk."""
+        from app.services.executor import PRIORITY_BULK
+        mock_nlp.model_name = 'test-model'
+        mock_get_executor.return_value.call.return_value = [('R1', 0.1, {'path': 'local'})]
+
+        response = self.client.post('/batch/', data=json.dumps({'prompts': ['a']}), content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        call = mock_get_executor.return_value.call.call_args
+        self.assertEqual(call.args, (mock_nlp.process_batch, ['a']))
+        self.assertEqual(call.kwargs['priority'], PRIORITY_BULK)
+
+    @patch('app.views.get_model_executor')
+    @patch('app.views.nlp_service')
+    def test_batch_busy(self, mock_nlp, mock_get_executor):
+        """Testa resposta 503 quando a fila bulk do modelo está cheia."""
+        from app.services.executor import ExecutorBusy
+        mock_get_executor.return_value.call.side_effect = ExecutorBusy()
+
+        response = self.client.post('/batch/', data=json.dumps({'prompts': ['a']}), content_type='application/json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class TestJobsView(TestCase):
+    """Testes para a API de jobs assíncronos."""
+
+    @patch('app.views.jobs.get_job_workers')
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_submit_job_returns_202(self, mock_repo, mock_nlp, mock_get_workers):
+        """Testa que o job é enfileirado e a resposta é imediata."""
+        mock_repo.create_job.return_value = {'job_id': 'abc123', 'state': 'queued'}
+
+        response = self.client.post(
+            '/jobs/',
+            data=json.dumps({'prompt': 'explique redes neurais'}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        data = json.loads(response.content)
+        self.assertEqual(data['job_id'], 'abc123')
+        self.assertEqual(response['Location'], '/jobs/abc123/')
+        mock_repo.create_job.assert_called_once_with('explique redes neurais')
+        mock_get_workers.return_value.notify.assert_called_once()
+        mock_nlp.process_prompt.assert_not_called()
+
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_submit_job_validates_prompt(self, mock_repo, mock_nlp):
+        """Testa a validação do prompt ao enfileirar."""
+        response = self.client.post(
+            '/jobs/',
+            data=json.dumps({'prompt': ''}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        mock_repo.create_job.assert_not_called()
+
+    @patch('app.views.mongo_repo')
+    def test_job_detail(self, mock_repo):
+        """Testa a consulta de um job concluído."""
+        mock_repo.get_job.return_value = {
+            'job_id': 'abc123', 'state': 'done', 'response': 'Resposta',
+            'queue_wait': 0.1, 'run_time': 1.2,
+        }
+
+        response = self.client.get('/jobs/abc123/')
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['state'], 'done')
+        self.assertEqual(data['run_time'], 1.2)
+
+    @patch('app.views.mongo_repo')
+    def test_job_detail_not_found(self, mock_repo):
+        """Testa 404 para job inexistente."""
+        mock_repo.get_job.return_value = None
+
+        response = self.client.get('/jobs/nao-existe/')
+        self.assertEqual(response.status_code, 404)
+
+    @patch('app.views.jobs.wait_for_job')
+    @patch('app.views.mongo_repo')
+    def test_job_detail_long_poll_capped(self, mock_repo, mock_wait):
+        """Testa que o long-poll respeita JOB_MAX_WAIT."""
+        mock_wait.return_value = {'job_id': 'abc123', 'state': 'running'}
+
+        with self.settings(JOB_MAX_WAIT=5):
+            response = self.client.get('/jobs/abc123/', {'wait': 120})
+
+        self.assertEqual(response.status_code, 200)
+        mock_wait.assert_called_once_with(mock_repo, 'abc123', 5)
 
 
 class TestHistoryView(TestCase):
@@ -121,6 +512,7 @@ class TestHistoryView(TestCase):
     def setUp(self):
         """Configuração inicial para cada teste."""
         self.client = Client()
+        cache.clear()
         
         # Mock do repositório
         self.mock_repo = Mock(spec=MongoRepository)
@@ -166,6 +558,79 @@ class TestHistoryView(TestCase):
         response = self.client.get('/history/', {'page': 2})
         self.assertEqual(response.status_code, 200)
 
+    @patch('app.views.mongo_repo')
+    def test_history_view_cached_until_write(self, mock_repo):
+        """Testa que a página vem do cache até a próxima escrita."""
+        from app.services.cache import history_cache
+        mock_repo.get_interactions.return_value = []
+
+        self.client.get('/history/')
+        self.client.get('/history/')
+        self.assertEqual(mock_repo.get_interactions.call_count, 1)
+
+        history_cache.bump()
+        self.client.get('/history/')
+        self.assertEqual(mock_repo.get_interactions.call_count, 2)
+
+    @patch('app.views.mongo_repo')
+    def test_history_view_not_modified(self, mock_repo):
+        """Testa 304 com If-None-Match/If-Modified-Since sem consultar nem renderizar."""
+        from datetime import datetime
+        mock_repo.get_interactions.return_value = []
+        mock_repo.get_version.return_value = {'count': 2, 'newest': datetime(2024, 1, 15, 10, 0, 0)}
+
+        first = self.client.get('/history/')
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        self.assertIn('Last-Modified', first)
+
+        mock_repo.get_interactions.reset_mock()
+        cache.clear()
+        revalidated = self.client.get('/history/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], etag)
+        mock_repo.get_interactions.assert_not_called()
+
+        by_date = self.client.get('/history/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(by_date.status_code, 304)
+
+        # Outra página é outra representação
+        other_page = self.client.get('/history/', {'page': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(other_page.status_code, 200)
+
+    @patch('app.views.mongo_repo')
+    def test_history_view_etag_changes_on_write(self, mock_repo):
+        """Testa que uma nova interação muda o ETag."""
+        from datetime import datetime
+        from app.services.cache import history_cache
+        mock_repo.get_interactions.return_value = []
+        mock_repo.get_version.return_value = {'count': 2, 'newest': datetime(2024, 1, 15, 10, 0, 0)}
+        etag = self.client.get('/history/')['ETag']
+
+        mock_repo.get_version.return_value = {'count': 3, 'newest': datetime(2024, 1, 15, 10, 5, 0)}
+        history_cache.bump()
+        response = self.client.get('/history/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @patch('app.views.mongo_repo')
+    def test_history_view_search(self, mock_repo):
+        """Testa busca textual com destaque escapado e paginação pelo índice."""
+        mock_repo.count_search.return_value = 1
+        mock_repo.search_interactions.return_value = [{
+            '_id': 1, 'prompt': '<b>capital</b>', 'response': 'Paris',
+            'prompt_highlighted': '<b>\x02capital\x03</b>', 'response_highlighted': 'Paris',
+            'processing_time': 1.0, 'model': 'test', 'timestamp': '2024-01-01'
+        }]
+
+        response = self.client.get('/history/', {'q': 'capital'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '&lt;b&gt;<mark>capital</mark>&lt;/b&gt;')
+        mock_repo.get_interactions.assert_not_called()
+        mock_repo.search_interactions.assert_called_once_with('capital', {}, offset=0, limit=1)
+
 
 class TestExportHistory(TestCase):
     """Testes para exportação de histórico."""
@@ -173,6 +638,7 @@ class TestExportHistory(TestCase):
     def setUp(self):
         """Configuração inicial para cada teste."""
         self.client = Client()
+        cache.clear()
     
     @patch('app.views.mongo_repo')
     def test_export_json(self, mock_repo):
@@ -198,6 +664,38 @@ class TestExportHistory(TestCase):
         data = json.loads(response.content)
         self.assertIsInstance(data, list)
     
+    @patch('app.views.mongo_repo')
+    def test_export_usage_fields(self, mock_repo):
+        """Testa a exportação da contabilidade de tokens."""
+        from datetime import datetime
+        mock_repo.get_interactions.return_value = [
+            {
+                '_id': 1,
+                'prompt': 'teste',
+                'response': 'resposta',
+                'processing_time': 2.0,
+                'model': 'test-model',
+                'timestamp': datetime.now(),
+                'path': 'local',
+                'input_tokens': 40,
+                'generated_tokens': 50,
+                'generate_calls': 1,
+                'truncated': False,
+            },
+            {'_id': 2, 'prompt': 'antiga', 'response': 'r', 'processing_time': 1.0, 'timestamp': datetime.now()},
+        ]
+        
+        data = json.loads(self.client.get('/export/', {'format': 'json'}).content)
+        
+        self.assertEqual(data[0]['generated_tokens'], 50)
+        self.assertEqual(data[0]['tokens_per_second'], 25.0)
+        self.assertIsNone(data[1]['path'])
+        
+        cache.clear()
+        content = self.client.get('/export/', {'format': 'csv'}).content.decode('utf-8')
+        self.assertIn('Generated Tokens', content)
+        self.assertIn('local,40,50,1,False,25.0', content)
+    
     @patch('app.views.mongo_repo')
     def test_export_csv(self, mock_repo):
         """Testa exportação em formato CSV."""
@@ -221,6 +719,53 @@ class TestExportHistory(TestCase):
         self.assertIn(b'Timestamp', response.content)
         self.assertIn(b'Prompt', response.content)
     
+    @patch('app.views.mongo_repo')
+    def test_export_includes_archived(self, mock_repo):
+        """Testa exportação incluindo interações do arquivo frio."""
+        from datetime import datetime, date
+        mock_repo.get_interactions.return_value = [
+            {'prompt': 'ativa', 'response': 'r', 'processing_time': 1.0,
+             'model': 'm', 'timestamp': datetime(2024, 3, 1)}
+        ]
+        mock_repo.get_archive.return_value.iter_interactions.return_value = iter([
+            {'prompt': 'arquivada', 'response': 'r', 'processing_time': 1.0,
+             'model': 'm', 'timestamp': datetime(2023, 1, 1)}
+        ])
+
+        response = self.client.get('/export/', {'archived': '1', 'date_from': '2023-01-01'})
+
+        data = json.loads(response.content)
+        self.assertEqual([item['prompt'] for item in data], ['ativa', 'arquivada'])
+        mock_repo.get_interactions.assert_called_once_with({'timestamp': {'$gte': '2023-01-01'}})
+        mock_repo.get_archive.return_value.iter_interactions.assert_called_once_with(date(2023, 1, 1), None)
+
+    @patch('app.views.mongo_repo')
+    def test_export_snapshot_cached(self, mock_repo):
+        """Testa que o snapshot de exportação é reaproveitado entre requisições."""
+        mock_repo.get_interactions.return_value = []
+
+        first = self.client.get('/export/', {'format': 'csv'})
+        second = self.client.get('/export/', {'format': 'csv'})
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(mock_repo.get_interactions.call_count, 1)
+
+    @patch('app.views.mongo_repo')
+    def test_export_not_modified(self, mock_repo):
+        """Testa 304 na exportação quando o ETag ainda é válido."""
+        from datetime import datetime
+        mock_repo.get_interactions.return_value = []
+        mock_repo.get_version.return_value = {'count': 0, 'newest': None}
+
+        first = self.client.get('/export/', {'format': 'json'})
+        self.assertNotIn('Last-Modified', first)
+        second = self.client.get('/export/', {'format': 'json'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+        # CSV é outra representação
+        csv_response = self.client.get('/export/', {'format': 'csv'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(csv_response.status_code, 200)
+
     @patch('app.views.mongo_repo')
     def test_export_default_format(self, mock_repo):
         """Testa exportação com formato padrão (JSON)."""
@@ -243,5 +788,75 @@ class TestExportHistory(TestCase):
         self.assertEqual(response['Content-Type'], 'application/json; charset=utf-8')
 
 
+class TestStatsView(TestCase):
+    """Testes para o endpoint de estatísticas."""
+
+    @patch('app.views.mongo_repo')
+    def test_stats_reads_rollups(self, mock_repo):
+        """Testa que o endpoint lê as agregações do repositório."""
+        mock_repo.get_rollups.return_value = [{'bucket': '2024-01-01T10:00:00', 'count': 3, 'p95': 1.2}]
+
+        response = self.client.get('/stats/', {'granularity': 'day', 'model': 'm', 'limit': 5})
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['buckets'][0]['count'], 3)
+        mock_repo.get_rollups.assert_called_once_with(granularity='day', model='m', limit=5)
+        mock_repo.get_interactions.assert_not_called()
+
+    @patch('app.views.mongo_repo')
+    def test_stats_invalid_granularity(self, mock_repo):
+        """Testa validação da granularidade."""
+        response = self.client.get('/stats/', {'granularity': 'week'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestHealthView(TestCase):
+    """Testes para o endpoint de saúde."""
+
+    @patch('app.views.mongo_repo')
+    def test_health_mongodb_up(self, mock_repo):
+        """Testa status 'ok' com MongoDB ativo."""
+        mock_repo.health_status.return_value = {'backend': 'mongodb', 'mongodb_state': 'up'}
+
+        response = self.client.get('/health/')
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['database']['backend'], 'mongodb')
+        self.assertIn('nlp', data)
+
+    @patch('app.views.mongo_repo')
+    def test_health_degraded_on_fallback(self, mock_repo):
+        """Testa status 'degraded' quando o fallback SQLite está ativo."""
+        mock_repo.health_status.return_value = {'backend': 'sqlite', 'mongodb_state': 'down'}
+
+        response = self.client.get('/health/')
+
+        data = json.loads(response.content)
+        self.assertEqual(data['status'], 'degraded')
+
+
+class TestMetricsView(TestCase):
+    """Testes para o endpoint de métricas."""
+
+    @patch('app.views.nlp_service')
+    @patch('app.views.mongo_repo')
+    def test_metrics_exposition(self, mock_repo, mock_nlp):
+        """Testa o formato de texto e o gauge de requisições em andamento."""
+        mock_nlp.process_prompt.return_value = ('Resposta', 0.1, {'path': 'local'})
+        mock_nlp.model_name = 'test-model'
+        self.client.post('/', data=json.dumps({'prompt': 'Olá'}), content_type='application/json')
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode('utf-8')
+        self.assertIn('# TYPE pln_stage_duration_seconds histogram', content)
+        self.assertIn('# TYPE pln_requests_in_flight gauge', content)
+        self.assertIn('pln_requests_in_flight 0', content)
+
+
 if __name__ == '__main__':
     unittest.main()
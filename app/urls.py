@@ -1,8 +1,25 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Sob ASGI (ASYNC_VIEWS=True) chat, histórico, exportação e consulta de jobs usam as views assíncronas
+if settings.ASYNC_VIEWS:
+    chat, history, export = views.achat_view, views.ahistory_view, views.aexport_history
+    job_detail = views.ajob_detail_view
+else:
+    chat, history, export = views.chat_view, views.history_view, views.export_history
+    job_detail = views.job_detail_view
+
 urlpatterns = [
-    path('', views.chat_view, name='chat'),
-    path('history/', views.history_view, name='history'),
-    path('export/', views.export_history, name='export'),
+    path('', chat, name='chat'),
+    path('batch/', views.batch_view, name='batch'),
+    path('jobs/', views.jobs_view, name='jobs'),
+    path('jobs/<str:job_id>/', job_detail, name='job_detail'),
+    path('history/', history, name='history'),
+    path('export/', export, name='export'),
+    path('stats/', views.stats_view, name='stats'),
+    path('health/', views.health_view, name='health'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('profiling/', views.profiling_view, name='profiling'),
+    path('profiling/<str:name>', views.profiling_report_view, name='profiling_report'),
 ]
\ No newline at end of file
@@ -6,14 +6,40 @@ Gerencia as requisições HTTP e interage com os serviços de NLP e MongoDB.
 Desenvolvido por: ANNA, CÉSAR E EVILY
 """
 
+import io
 import json
+import time
+import hashlib
+import hmac
+import asyncio
 import csv
+import itertools
+from datetime import date
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
 from django.core.paginator import Paginator
-from .services.nlp_service import NLPService
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from urllib.parse import urlencode
+from .log_handlers import PAYLOAD_LOG
+from .services.nlp_service import NLPService, PromptTooLong
 from .services.mongo_repo import MongoRepository
+from .services.search import LazySearchResults, HIGHLIGHT_START, HIGHLIGHT_END
+from .services.cache import history_cache, requested_staleness
+from .services.executor import (
+    get_model_executor, request_priority, ExecutorBusy, PRIORITY_BULK, PRIORITY_INTERACTIVE,
+)
+from .services import cancellation
+from .services import jobs
+from .services import metrics
+from .services import tracing
+from .services import profiling
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,19 +53,179 @@ try:
     nlp_service = NLPService()
     logger.info("Serviço NLP inicializado com sucesso")
 except Exception as e:
-    logger.error(f"Falha ao inicializar serviço NLP: {e}")
+    logger.error("Falha ao inicializar serviço NLP: %s", e)
     nlp_service = None
 
 # Inicializa o repositório MongoDB com graceful degradation
+# (não bloqueia: a conexão é verificada em background)
 try:
     mongo_repo = MongoRepository()
     if mongo_repo.client:
-        logger.info("Repositório MongoDB inicializado com sucesso")
+        logger.info("Repositório MongoDB inicializado, conexão verificada em background")
 except Exception as e:
-    logger.warning(f"Falha na conexão MongoDB na inicialização: {e}. A aplicação continuará sem MongoDB.")
+    logger.warning("Falha na conexão MongoDB na inicialização: %s. A aplicação continuará sem MongoDB.", e)
     mongo_repo = None
 
 
+def start_job_workers():
+    """
+    Inicia os workers de jobs do processo web (chamado na inicialização do
+    servidor, em project.wsgi e project.asgi).
+    
+    Jobs que ficaram na fila ou em execução antes de um reinício voltam a
+    ser processados sem esperar um novo POST em /jobs/.
+    
+    Returns:
+        JobWorkerPool: pool iniciado ou None (JOB_WORKERS=0 ou serviços indisponíveis)
+    """
+    if nlp_service is None or mongo_repo is None:
+        return None
+    return jobs.get_job_workers(nlp_service, mongo_repo)
+
+
+def _parse_chat_request(request):
+    """
+    Lê e valida o prompt enviado no body JSON de uma requisição de chat.
+    
+    Args:
+        request: HttpRequest com body JSON contendo 'prompt'
+        
+    Returns:
+        tuple: (prompt, None) se válido ou (None, JsonResponse de erro)
+        
+    Raises:
+        json.JSONDecodeError: se o body não for um JSON válido
+    """
+    # Verifica se o serviço NLP está disponível
+    if nlp_service is None:
+        return None, JsonResponse({
+            'error': 'Serviço NLP não disponível. Verifique os logs do servidor.'
+        }, status=503)
+    
+    # Parse do JSON do body da requisição
+    data = json.loads(request.body)
+    prompt = data.get('prompt', '').strip()
+    
+    # Validação do prompt
+    error = _validate_prompt(prompt)
+    if error:
+        return None, JsonResponse({'error': error}, status=400)
+    
+    return prompt, None
+
+
+def _validate_prompt(prompt):
+    """
+    Valida um prompt já sem espaços nas extremidades.
+    
+    Returns:
+        str: mensagem de erro ou None se o prompt for válido
+    """
+    if not prompt:
+        return 'Prompt não pode estar vazio'
+    
+    # Limite grosseiro só para não tokenizar textos enormes; o limite real é
+    # em tokens (ver _prompt_too_long)
+    max_chars = getattr(settings, 'PROMPT_MAX_CHARS', 20000)
+    if len(prompt) > max_chars:
+        return f'Prompt muito longo. Máximo de {max_chars} caracteres.'
+    
+    return None
+
+
+def _prompt_too_long(error, **extra):
+    """Resposta 400 para um prompt acima do orçamento de tokens do modelo."""
+    budget = error.budget
+    return JsonResponse({
+        'error': (
+            f"Prompt muito longo: {budget['prompt_tokens']} tokens. "
+            f"Máximo de {budget['max_prompt_tokens']} tokens para este modelo."
+        ),
+        'prompt_tokens': budget['prompt_tokens'],
+        'max_prompt_tokens': budget['max_prompt_tokens'],
+        **extra,
+    }, status=400)
+
+
+def _trace_fields():
+    """Request id e spans do trace atual, salvos junto com a interação."""
+    trace = tracing.current_trace()
+    if trace is None:
+        return {}
+    return {'request_id': trace.request_id, 'spans': trace.as_dict()['spans']}
+
+
+def _with_timings(request, data):
+    """Acrescenta o campo ``timings`` ao JSON quando pedido com ``?timings=1``."""
+    trace = tracing.current_trace()
+    if trace is not None and request.GET.get('timings', '').lower() in ('1', 'true'):
+        data['timings'] = trace.as_dict()
+    return data
+
+
+def _save_chat_interaction(prompt, response, processing_time, usage):
+    """Salva a interação (com a contabilidade de tokens) sem falhar a requisição."""
+    if mongo_repo:
+        try:
+            mongo_repo.save_interaction({
+                'prompt': prompt,
+                'response': response,
+                'processing_time': processing_time,
+                'model': nlp_service.model_name,
+                **usage,
+                **_trace_fields(),
+            })
+            logger.debug("Interação salva no banco de dados")
+        except Exception as e:
+            # Registra erro mas não falha a requisição se MongoDB temporariamente indisponível
+            logger.error("Falha ao salvar interação no MongoDB: %s", e)
+
+
+def _cancel_token():
+    """Token de cancelamento da requisição, com o prazo de CHAT_DEADLINE_SECONDS."""
+    return cancellation.CancelToken.with_timeout(getattr(settings, 'CHAT_DEADLINE_SECONDS', 0))
+
+
+def _cancelled_response(reason):
+    """Resposta para o trabalho interrompido pelo prazo da requisição."""
+    metrics.inc('pln_cancelled_total', reason=reason)
+    logger.warning("Geração cancelada (%s)", reason)
+    return JsonResponse({
+        'error': 'Tempo limite da requisição excedido'
+    }, status=504)
+
+
+def _busy_response():
+    """Resposta para a fila do modelo cheia."""
+    busy_response = JsonResponse({
+        'error': 'Servidor ocupado. Tente novamente em instantes.'
+    }, status=503)
+    busy_response['Retry-After'] = '1'
+    return busy_response
+
+
+def _run_model(token, priority, fn, *args, inline=False):
+    """
+    Executa o trabalho do modelo no executor compartilhado (views síncronas).
+
+    Todo o tráfego do modelo passa pela mesma fila com prioridades; a
+    thread da requisição aguarda o resultado até o prazo do token. Com
+    ``inline`` (caminhos rápidos, sem geração) roda na própria thread.
+
+    Raises:
+        ExecutorBusy: fila da classe de prioridade cheia
+        GenerationCancelled: prazo expirado na fila ou durante a geração
+    """
+    with cancellation.use_token(token):
+        if inline:
+            return fn(*args)
+        try:
+            return get_model_executor().call(fn, *args, priority=priority, timeout=token.remaining)
+        except TimeoutError:
+            token.cancel(cancellation.REASON_DEADLINE)
+            raise cancellation.GenerationCancelled(cancellation.REASON_DEADLINE)
+
+
 @csrf_exempt
 def chat_view(request):
     """
@@ -55,54 +241,149 @@ def chat_view(request):
         HttpResponse: Template renderizado (GET) ou JSON response (POST)
     """
     if request.method == 'POST':
+        profiling_session = None
+        token = _cancel_token()
         try:
-            # Verifica se o serviço NLP está disponível
-            if nlp_service is None:
-                return JsonResponse({
-                    'error': 'Serviço NLP não disponível. Verifique os logs do servidor.'
-                }, status=503)
+            prompt, error_response = _parse_chat_request(request)
+            if error_response:
+                return error_response
             
-            # Parse do JSON do body da requisição
-            data = json.loads(request.body)
-            prompt = data.get('prompt', '').strip()
+            logger.debug("Prompt recebido: %s", prompt, extra=PAYLOAD_LOG)
             
-            # Validação do prompt
-            if not prompt:
-                return JsonResponse({
-                    'error': 'Prompt não pode estar vazio'
-                }, status=400)
+            # Captura de profiling sob demanda (None quando não está armado)
+            profiling_session = profiling.get_profiler().start_session()
             
-            if len(prompt) > 500:
-                return JsonResponse({
-                    'error': 'Prompt muito longo. Máximo de 500 caracteres.'
-                }, status=400)
-            
-            logger.debug(f"Prompt recebido: {prompt}")
-            
-            # Processa o prompt através do modelo NLP
-            response, processing_time = nlp_service.process_prompt(prompt)
-            logger.debug(f"Resposta do modelo: {response} (tempo={processing_time:.2f}s)")
+            # Processa o prompt no executor do modelo (interrompido se o prazo expirar)
+            metrics.add_gauge('pln_requests_in_flight', 1)
+            try:
+                response, processing_time, usage = _run_model(
+                    token, request_priority(request, PRIORITY_INTERACTIVE),
+                    profiling.call, profiling_session, nlp_service.process_prompt, prompt,
+                    inline=nlp_service.is_fast_path(prompt),
+                )
+            finally:
+                metrics.add_gauge('pln_requests_in_flight', -1)
+            logger.debug("Resposta do modelo: %s (tempo=%.2fs)", response, processing_time, extra=PAYLOAD_LOG)
             
             # Salva a interação no banco de dados
-            if mongo_repo:
-                try:
-                    mongo_repo.save_interaction({
-                        'prompt': prompt,
-                        'response': response,
-                        'processing_time': processing_time,
-                        'model': nlp_service.model_name,
-                    })
-                    logger.debug("Interação salva no banco de dados")
-                except Exception as e:
-                    # Registra erro mas não falha a requisição se MongoDB temporariamente indisponível
-                    logger.error(f"Falha ao salvar interação no MongoDB: {e}")
+            profiling.call(profiling_session, _save_chat_interaction, prompt, response, processing_time, usage)
             
             # Retorna resposta JSON com os dados da interação
+            return JsonResponse(_with_timings(request, {
+                'response': response,
+                'processing_time': processing_time,
+                'model': nlp_service.model_name,
+                'path': usage.get('path'),
+                'prompt_tokens': usage.get('prompt_tokens'),
+            }))
+            
+        except PromptTooLong as e:
+            return _prompt_too_long(e)
+            
+        except ExecutorBusy:
+            logger.warning("Fila do modelo cheia, recusando requisição de chat")
+            return _busy_response()
+            
+        except cancellation.GenerationCancelled as e:
+            return _cancelled_response(e.reason)
+            
+        except json.JSONDecodeError:
+            logger.error("Erro ao decodificar JSON do body")
             return JsonResponse({
+                'error': 'Formato JSON inválido'
+            }, status=400)
+            
+        except Exception as e:
+            logger.exception("Erro ao processar requisição de chat: %s", e)
+            metrics.inc('pln_errors_total', component='chat')
+            return JsonResponse({
+                'error': 'Ocorreu um erro ao processar sua solicitação'
+            }, status=500)
+        
+        finally:
+            if profiling_session is not None:
+                profiling_session.finish()
+    
+    # GET: Renderiza o template do chat
+    return render(request, 'chat.html')
+
+
+@csrf_exempt
+async def achat_view(request):
+    """
+    Versão assíncrona da view de chat (usada com ASGI e ASYNC_VIEWS=True).
+    
+    A geração é despachada para o executor limitado do modelo e o
+    salvamento roda em sync_to_async, de modo que a conexão aguardando a
+    resposta não ocupa uma thread do servidor. Se o cliente desconectar ou
+    o prazo expirar, a geração é cancelada e a vaga do executor liberada.
+    
+    Args:
+        request: HttpRequest do Django
+        
+    Returns:
+        HttpResponse: Template renderizado (GET) ou JSON response (POST)
+    """
+    if request.method == 'POST':
+        profiling_session = None
+        token = _cancel_token()
+        try:
+            prompt, error_response = _parse_chat_request(request)
+            if error_response:
+                return error_response
+            
+            logger.debug("Prompt recebido: %s", prompt, extra=PAYLOAD_LOG)
+            
+            # Captura de profiling sob demanda (None quando não está armado)
+            profiling_session = profiling.get_profiler().start_session()
+            
+            # Processa o prompt no executor do modelo (fora do event loop); o
+            # token acompanha a tarefa até a thread do executor
+            metrics.add_gauge('pln_requests_in_flight', 1)
+            try:
+                with cancellation.use_token(token):
+                    response, processing_time, usage = await asyncio.wait_for(
+                        get_model_executor().run(
+                            profiling.call, profiling_session, nlp_service.process_prompt, prompt,
+                            priority=request_priority(request, PRIORITY_INTERACTIVE),
+                        ),
+                        timeout=token.remaining,
+                    )
+            except asyncio.TimeoutError:
+                # Prazo expirado (ainda na fila ou gerando): a tarefa é descartada
+                token.cancel(cancellation.REASON_DEADLINE)
+                return _cancelled_response(cancellation.REASON_DEADLINE)
+            except asyncio.CancelledError:
+                # O Django cancela a view quando o cliente desconecta
+                token.cancel(cancellation.REASON_DISCONNECT)
+                metrics.inc('pln_cancelled_total', reason=cancellation.REASON_DISCONNECT)
+                logger.info("Cliente desconectou, geração cancelada")
+                raise
+            except ExecutorBusy:
+                logger.warning("Fila do modelo cheia, recusando requisição de chat")
+                return _busy_response()
+            finally:
+                metrics.add_gauge('pln_requests_in_flight', -1)
+            logger.debug("Resposta do modelo: %s (tempo=%.2fs)", response, processing_time, extra=PAYLOAD_LOG)
+            
+            # Salva a interação no banco de dados (acesso síncrono isolado)
+            await sync_to_async(profiling.call)(
+                profiling_session, _save_chat_interaction, prompt, response, processing_time, usage
+            )
+            
+            return JsonResponse(_with_timings(request, {
                 'response': response,
                 'processing_time': processing_time,
-                'model': nlp_service.model_name
-            })
+                'model': nlp_service.model_name,
+                'path': usage.get('path'),
+                'prompt_tokens': usage.get('prompt_tokens'),
+            }))
+            
+        except PromptTooLong as e:
+            return _prompt_too_long(e)
+            
+        except cancellation.GenerationCancelled as e:
+            return _cancelled_response(e.reason)
             
         except json.JSONDecodeError:
             logger.error("Erro ao decodificar JSON do body")
@@ -111,133 +392,864 @@ def chat_view(request):
             }, status=400)
             
         except Exception as e:
-            logger.exception(f"Erro ao processar requisição de chat: {str(e)}")
+            logger.exception("Erro ao processar requisição de chat: %s", e)
+            metrics.inc('pln_errors_total', component='chat')
             return JsonResponse({
                 'error': 'Ocorreu um erro ao processar sua solicitação'
             }, status=500)
+        
+        finally:
+            if profiling_session is not None:
+                await sync_to_async(profiling_session.finish)()
     
     # GET: Renderiza o template do chat
     return render(request, 'chat.html')
 
 
+@csrf_exempt
+def batch_view(request):
+    """
+    Processa vários prompts em uma única requisição.
+    
+    POST com body JSON ``{"prompts": ["...", "..."]}``. Prompts resolvidos
+    pelos caminhos rápidos não passam pelo modelo; os demais são gerados
+    em lotes com padding. Todas as interações são salvas com uma única
+    escrita em lote.
+    
+    Args:
+        request: HttpRequest do Django
+        
+    Returns:
+        JsonResponse: ``results`` na mesma ordem dos prompts, cada um com
+        response e processing_time
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    
+    if nlp_service is None:
+        return JsonResponse({
+            'error': 'Serviço NLP não disponível. Verifique os logs do servidor.'
+        }, status=503)
+    
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        logger.error("Erro ao decodificar JSON do body")
+        return JsonResponse({'error': 'Formato JSON inválido'}, status=400)
+    
+    raw_prompts = data.get('prompts') if isinstance(data, dict) else data
+    if not isinstance(raw_prompts, list) or not raw_prompts:
+        return JsonResponse({
+            'error': 'Envie uma lista não vazia de prompts'
+        }, status=400)
+    
+    max_prompts = getattr(settings, 'BATCH_MAX_PROMPTS', 64)
+    if len(raw_prompts) > max_prompts:
+        return JsonResponse({
+            'error': f'Lote muito grande. Máximo de {max_prompts} prompts.'
+        }, status=400)
+    
+    prompts = []
+    for index, prompt in enumerate(raw_prompts):
+        prompt = prompt.strip() if isinstance(prompt, str) else ''
+        error = _validate_prompt(prompt)
+        if error:
+            return JsonResponse({'error': error, 'index': index}, status=400)
+        if not nlp_service.is_fast_path(prompt):
+            try:
+                nlp_service.check_prompt(prompt)
+            except PromptTooLong as e:
+                return _prompt_too_long(e, index=index)
+        prompts.append(prompt)
+    
+    metrics.add_gauge('pln_requests_in_flight', 1)
+    try:
+        # Lotes são tráfego bulk: o chat interativo passa à frente na fila do modelo
+        results = _run_model(_cancel_token(), request_priority(request, PRIORITY_BULK), nlp_service.process_batch, prompts)
+    except ExecutorBusy:
+        logger.warning("Fila do modelo cheia, recusando lote de prompts")
+        return _busy_response()
+    except cancellation.GenerationCancelled as e:
+        return _cancelled_response(e.reason)
+    except Exception as e:
+        logger.exception("Erro ao processar lote de prompts: %s", e)
+        metrics.inc('pln_errors_total', component='chat')
+        return JsonResponse({
+            'error': 'Ocorreu um erro ao processar sua solicitação'
+        }, status=500)
+    finally:
+        metrics.add_gauge('pln_requests_in_flight', -1)
+    
+    # Salva todas as interações de uma vez
+    if mongo_repo:
+        trace_fields = _trace_fields()
+        try:
+            mongo_repo.save_interactions([
+                {
+                    'prompt': prompt,
+                    'response': response,
+                    'processing_time': processing_time,
+                    'model': nlp_service.model_name,
+                    **usage,
+                    **trace_fields,
+                }
+                for prompt, (response, processing_time, usage) in zip(prompts, results)
+            ])
+        except Exception as e:
+            logger.error("Falha ao salvar lote de interações: %s", e)
+    
+    return JsonResponse(_with_timings(request, {
+        'results': [
+            {'response': response, 'processing_time': processing_time}
+            for response, processing_time, _ in results
+        ],
+        'model': nlp_service.model_name,
+    }))
+
+
+@csrf_exempt
+def jobs_view(request):
+    """
+    Enfileira um prompt para geração assíncrona.
+    
+    POST com o mesmo body do chat (``{"prompt": "..."}``). A resposta é
+    imediata (202) com o id do job; o resultado é consultado em
+    ``/jobs/<job_id>/``.
+    
+    Args:
+        request: HttpRequest do Django
+        
+    Returns:
+        JsonResponse: job_id, estado e URL de consulta
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    
+    try:
+        prompt, error_response = _parse_chat_request(request)
+    except json.JSONDecodeError:
+        logger.error("Erro ao decodificar JSON do body")
+        return JsonResponse({'error': 'Formato JSON inválido'}, status=400)
+    if error_response:
+        return error_response
+    if not nlp_service.is_fast_path(prompt):
+        try:
+            nlp_service.check_prompt(prompt)
+        except PromptTooLong as e:
+            return _prompt_too_long(e)
+    
+    job = mongo_repo.create_job(prompt) if mongo_repo else None
+    if job is None:
+        return JsonResponse({
+            'error': 'Fila de jobs não disponível. Tente novamente em instantes.'
+        }, status=503)
+    
+    # Workers deste processo (se habilitados) são acordados na hora
+    workers = jobs.get_job_workers(nlp_service, mongo_repo)
+    if workers:
+        workers.notify()
+    
+    status_url = reverse('job_detail', args=[job['job_id']])
+    response = JsonResponse({
+        'job_id': job['job_id'],
+        'state': job['state'],
+        'status_url': status_url,
+    }, status=202)
+    response['Location'] = status_url
+    return response
+
+
+def _job_wait_timeout(request):
+    """Lê o parâmetro ``wait`` (segundos de long-poll), limitado por JOB_MAX_WAIT."""
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = 0
+    return max(0, min(wait, getattr(settings, 'JOB_MAX_WAIT', 30)))
+
+
+def _job_response(job_id, job):
+    """Monta a resposta JSON da consulta de um job."""
+    if job is None:
+        return JsonResponse({'error': f'Job {job_id} não encontrado'}, status=404)
+    return JsonResponse(jobs.serialize_job(job))
+
+
+def job_detail_view(request, job_id):
+    """
+    Consulta o estado e o resultado de um job.
+    
+    Com ``?wait=N`` a requisição aguarda até N segundos (limitado por
+    JOB_MAX_WAIT) o job terminar antes de responder (long-poll).
+    
+    Args:
+        request: HttpRequest do Django
+        job_id (str): id retornado por /jobs/
+        
+    Returns:
+        JsonResponse: estado, resposta (se concluído), espera na fila e
+        tempo de execução
+    """
+    if mongo_repo is None:
+        return JsonResponse({'error': 'Fila de jobs não disponível'}, status=503)
+    
+    timeout = _job_wait_timeout(request)
+    if timeout:
+        job = jobs.wait_for_job(mongo_repo, job_id, timeout)
+    else:
+        job = mongo_repo.get_job(job_id)
+    return _job_response(job_id, job)
+
+
+async def ajob_detail_view(request, job_id):
+    """
+    Versão assíncrona da consulta de job (usada com ASGI e ASYNC_VIEWS=True).
+    
+    O long-poll aguarda com ``asyncio.sleep`` entre as consultas, sem
+    ocupar uma thread do servidor durante a espera.
+    """
+    if mongo_repo is None:
+        return JsonResponse({'error': 'Fila de jobs não disponível'}, status=503)
+    
+    timeout = _job_wait_timeout(request)
+    poll_interval = getattr(settings, 'JOB_POLL_INTERVAL', 0.5)
+    deadline = time.monotonic() + timeout
+    while True:
+        job = await sync_to_async(mongo_repo.get_job)(job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job['state'] in jobs.TERMINAL_STATES or remaining <= 0:
+            return _job_response(job_id, job)
+        await asyncio.sleep(min(poll_interval, remaining))
+
+
 def history_view(request):
     """
     View para exibir o histórico de conversas.
     
-    Suporta filtros por data e paginação.
+    Suporta filtros por data, busca textual e paginação.
     
     Args:
         request: HttpRequest do Django com query parameters opcionais:
             - page: número da página (padrão: 1)
             - date_from: data inicial (formato: YYYY-MM-DD)
             - date_to: data final (formato: YYYY-MM-DD)
+            - q: termos de busca no prompt e na resposta (índice de texto)
+        
+    A página renderizada e o resultado da consulta ficam em cache até a
+    próxima escrita no repositório (ver services/cache.py). A resposta leva
+    ETag e Last-Modified; revalidações sem mudanças recebem 304.
         
     Returns:
         HttpResponse: Template renderizado com histórico paginado
     """
-    # Obtém o número da página da query string
-    page = request.GET.get('page', 1)
-    filters = {}
+    page, date_from, date_to, query, filters, max_staleness, cache_params = _history_params(request)
     
-    # Aplica filtros de data dos parâmetros da query
-    date_from = request.GET.get('date_from', '').strip()
-    date_to = request.GET.get('date_to', '').strip()
+    # GET condicional: nada mudou desde a última visita do cliente
+    not_modified, etag, last_modified = _conditional_response(request, 'page', cache_params, filters, max_staleness)
+    if not_modified is not None:
+        return not_modified
     
-    # Constrói filtros para o MongoDB
-    if date_from:
-        filters['timestamp'] = {'$gte': date_from}
-    if date_to:
-        if 'timestamp' in filters:
-            filters['timestamp']['$lte'] = date_to
-        else:
-            filters['timestamp'] = {'$lte': date_to}
+    # Página já renderizada para os mesmos filtros
+    cached_page = history_cache.get('page', cache_params, max_staleness)
+    if cached_page is not None:
+        return _set_validators(HttpResponse(cached_page), etag, last_modified)
+    generation = history_cache.generation()
     
     # Busca interações do MongoDB (ou SQLite se MongoDB não disponível)
     interactions = []
     if mongo_repo:
-        try:
-            interactions = mongo_repo.get_interactions(filters)
-        except Exception as e:
-            logger.error(f"Falha ao recuperar interações do MongoDB: {e}")
-            interactions = []
+        if query:
+            # Busca pelo índice de texto: apenas a página exibida é carregada
+            interactions = LazySearchResults(mongo_repo, query, filters)
+        else:
+            query_params = {'date_from': date_from, 'date_to': date_to}
+            interactions = history_cache.get('interactions', query_params, max_staleness)
+            if interactions is None:
+                interactions = _fetch_interactions(filters, query_params, generation)
     
-    # Implementa paginação (10 itens por página)
+    page_obj = _history_page(interactions, page, query)
+    return _render_history(request, page_obj, cache_params, generation, etag, last_modified)
+
+
+async def ahistory_view(request):
+    """
+    Versão assíncrona da view de histórico.
+    
+    O GET condicional, o cache e a renderização rodam no event loop; só as
+    consultas ao repositório vão para uma thread (ver ``_offload``), então
+    páginas em cache e revalidações 304 não esperam por nenhuma thread.
+    """
+    page, date_from, date_to, query, filters, max_staleness, cache_params = _history_params(request)
+    
+    not_modified, etag, last_modified = await _aconditional_response(
+        request, 'page', cache_params, filters, max_staleness,
+    )
+    if not_modified is not None:
+        return not_modified
+    
+    cached_page = history_cache.get('page', cache_params, max_staleness)
+    if cached_page is not None:
+        return _set_validators(HttpResponse(cached_page), etag, last_modified)
+    generation = history_cache.generation()
+    
+    interactions = []
+    if mongo_repo:
+        if query:
+            interactions = LazySearchResults(mongo_repo, query, filters)
+        else:
+            query_params = {'date_from': date_from, 'date_to': date_to}
+            interactions = history_cache.get('interactions', query_params, max_staleness)
+            if interactions is None:
+                interactions = await _offload(_fetch_interactions)(filters, query_params, generation)
+    
+    if query:
+        # A busca consulta o repositório ao contar e ao carregar a página
+        page_obj = await _offload(_history_page)(interactions, page, query)
+    else:
+        page_obj = _history_page(interactions, page, query)
+    return _render_history(request, page_obj, cache_params, generation, etag, last_modified)
+
+
+def _offload(fn):
+    """
+    Envolve uma chamada ao repositório para uso nas views assíncronas.
+
+    Com o MongoDB ativo a chamada roda no pool de threads do asgiref
+    (``thread_sensitive=False``), sem disputar a thread síncrona
+    compartilhada; no fallback SQLite ela continua nessa thread, que é a
+    dona da conexão do Django.
+    """
+    thread_sensitive = not (mongo_repo and mongo_repo.is_mongo_available())
+    return sync_to_async(fn, thread_sensitive=thread_sensitive)
+
+
+def _history_params(request):
+    """
+    Lê os parâmetros do histórico da query string.
+
+    Returns:
+        tuple: (page, date_from, date_to, query, filtros do repositório,
+        tolerância a dados desatualizados, parâmetros do cache da página)
+    """
+    page = request.GET.get('page', 1)
+    date_from = request.GET.get('date_from', '').strip()
+    date_to = request.GET.get('date_to', '').strip()
+    query = request.GET.get('q', '').strip()
+    filters = _build_date_filters(date_from, date_to)
+    max_staleness = requested_staleness(request.headers.get('Cache-Control'))
+    cache_params = {'page': str(page), 'date_from': date_from, 'date_to': date_to, 'q': query}
+    return page, date_from, date_to, query, filters, max_staleness, cache_params
+
+
+def _fetch_interactions(filters, query_params, generation):
+    """Consulta as interações do filtro e guarda o resultado no cache."""
+    try:
+        interactions = mongo_repo.get_interactions(filters)
+    except Exception as e:
+        logger.error("Falha ao recuperar interações do MongoDB: %s", e)
+        return []
+    history_cache.set('interactions', query_params, interactions, generation)
+    return interactions
+
+
+def _history_page(interactions, page, query):
+    """Pagina as interações (10 por página) e destaca os termos buscados."""
     paginator = Paginator(interactions, 10)
     try:
         page_obj = paginator.get_page(page)
     except:
         page_obj = paginator.get_page(1)
     
-    # Renderiza template com histórico paginado
-    return render(request, 'history.html', {
+    if query:
+        for interaction in page_obj:
+            interaction['prompt_highlighted'] = _highlight_html(interaction.get('prompt_highlighted'))
+            interaction['response_highlighted'] = _highlight_html(interaction.get('response_highlighted'))
+    return page_obj
+
+
+def _render_history(request, page_obj, cache_params, generation, etag, last_modified):
+    """Renderiza a página do histórico e guarda o HTML no cache."""
+    # Parâmetros de filtro preservados nos links de paginação
+    filter_query = urlencode({
+        key: cache_params[key] for key in ('date_from', 'date_to', 'q') if cache_params[key]
+    })
+    
+    response = render(request, 'history.html', {
         'page_obj': page_obj,
-        'date_from': date_from,
-        'date_to': date_to
+        'date_from': cache_params['date_from'],
+        'date_to': cache_params['date_to'],
+        'query': cache_params['q'],
+        'filter_query': filter_query,
     })
+    history_cache.set('page', cache_params, response.content, generation)
+    return _set_validators(response, etag, last_modified)
+
+
+def _build_date_filters(date_from, date_to):
+    """
+    Constrói os filtros de data no formato aceito pelo repositório.
+
+    Args:
+        date_from (str): data inicial (YYYY-MM-DD) ou vazio
+        date_to (str): data final (YYYY-MM-DD) ou vazio
+
+    Returns:
+        dict: filtros com timestamp $gte/$lte (vazio se não houver datas)
+    """
+    filters = {}
+    if date_from:
+        filters['timestamp'] = {'$gte': date_from}
+    if date_to:
+        if 'timestamp' in filters:
+            filters['timestamp']['$lte'] = date_to
+        else:
+            filters['timestamp'] = {'$lte': date_to}
+    return filters
+
+
+def _conditional_response(request, namespace, params, filters, max_staleness=0):
+    """
+    Avalia If-None-Match / If-Modified-Since antes de consultar ou renderizar.
+    
+    O ETag é derivado do total de interações e do timestamp mais recente
+    do filtro (mais os parâmetros da representação); o Last-Modified é o
+    timestamp mais recente. A versão fica em cache até a próxima escrita,
+    então uma revalidação sem mudanças não toca o banco.
+    
+    Args:
+        request: HttpRequest do Django
+        namespace (str): representação ('page' ou 'export')
+        params (dict): parâmetros que identificam a representação
+        filters (dict): filtros de data do repositório
+        max_staleness (float): tolerância a dados desatualizados
+        
+    Returns:
+        tuple: (resposta 304 ou None, etag, last_modified em segundos)
+    """
+    if not mongo_repo:
+        return None, None, None
+    
+    version = history_cache.get('version', {'filters': filters}, max_staleness)
+    if version is None:
+        version = _fetch_version(filters)
+    return _check_validators(request, namespace, params, version)
+
+
+async def _aconditional_response(request, namespace, params, filters, max_staleness=0):
+    """Versão assíncrona de ``_conditional_response`` (só a consulta da versão vai para uma thread)."""
+    if not mongo_repo:
+        return None, None, None
+    
+    version = history_cache.get('version', {'filters': filters}, max_staleness)
+    if version is None:
+        version = await _offload(_fetch_version)(filters)
+    return _check_validators(request, namespace, params, version)
+
+
+def _fetch_version(filters):
+    """Consulta a versão (total e timestamp mais recente) do filtro e guarda no cache."""
+    generation = history_cache.generation()
+    try:
+        version = mongo_repo.get_version(filters)
+    except Exception as e:
+        logger.error("Falha ao consultar versão do histórico: %s", e)
+        return None
+    history_cache.set('version', {'filters': filters}, version, generation)
+    return version
+
+
+def _check_validators(request, namespace, params, version):
+    """Calcula ETag e Last-Modified da versão e responde 304 se o cliente já a tem."""
+    if version is None:
+        return None, None, None
+    
+    newest = version.get('newest')
+    digest = hashlib.sha1(json.dumps(
+        [namespace, params, version.get('count'), newest.isoformat() if newest else None],
+        sort_keys=True, default=str,
+    ).encode('utf-8')).hexdigest()
+    etag = f'"{digest}"'
+    last_modified = int(newest.timestamp()) if newest else None
+    
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        _set_validators(not_modified, etag, last_modified)
+    return not_modified, etag, last_modified
+
+
+def _set_validators(response, etag, last_modified):
+    """Adiciona ETag e Last-Modified à resposta (quando disponíveis)."""
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def _parse_date(value):
+    """Converte YYYY-MM-DD em date, retornando None se vazio ou inválido."""
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _highlight_html(text):
+    """
+    Converte os marcadores de destaque da busca em <mark>.
+
+    O texto é escapado antes, portanto apenas as tags <mark> são HTML.
+    """
+    if not text:
+        return text
+    escaped = escape(text)
+    return mark_safe(escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
 
 
 def export_history(request):
     """
     View para exportar histórico de conversas.
     
-    Suporta exportação em JSON ou CSV.
+    Suporta exportação em JSON ou CSV, filtro por data e, opcionalmente,
+    a inclusão das interações já movidas para o arquivo frio pela retenção.
     
     Args:
-        request: HttpRequest com query parameter:
+        request: HttpRequest com query parameters:
             - format: 'json' ou 'csv' (padrão: 'json')
+            - date_from / date_to: intervalo de datas (YYYY-MM-DD)
+            - archived: '1' para incluir as interações arquivadas
+        
+    Suporta GET condicional (ETag/Last-Modified) como o histórico.
         
     Returns:
         HttpResponse: Arquivo para download (JSON ou CSV)
     """
+    format_type, date_from, date_to, include_archived, filters, max_staleness, cache_params = _export_params(request)
+    
+    # GET condicional: nada mudou desde a última exportação do cliente
+    not_modified, etag, last_modified = _conditional_response(request, 'export', cache_params, filters, max_staleness)
+    if not_modified is not None:
+        return not_modified
+    
+    # Snapshot já gerado para os mesmos parâmetros (invalidado a cada escrita)
+    snapshot = history_cache.get('export', cache_params, max_staleness)
+    if snapshot is None:
+        generation = history_cache.generation()
+        snapshot = _build_export_body(format_type, filters, date_from, date_to, include_archived)
+        history_cache.set('export', cache_params, snapshot, generation)
+    
+    return _export_response(format_type, snapshot, etag, last_modified)
+
+
+async def aexport_history(request):
+    """
+    Versão assíncrona da exportação do histórico.
+    
+    O GET condicional e o snapshot em cache são resolvidos no event loop;
+    só a leitura do repositório e do arquivo frio vai para uma thread.
+    """
+    format_type, date_from, date_to, include_archived, filters, max_staleness, cache_params = _export_params(request)
+    
+    not_modified, etag, last_modified = await _aconditional_response(
+        request, 'export', cache_params, filters, max_staleness,
+    )
+    if not_modified is not None:
+        return not_modified
+    
+    snapshot = history_cache.get('export', cache_params, max_staleness)
+    if snapshot is None:
+        generation = history_cache.generation()
+        snapshot = await _offload(_build_export_body)(format_type, filters, date_from, date_to, include_archived)
+        history_cache.set('export', cache_params, snapshot, generation)
+    
+    return _export_response(format_type, snapshot, etag, last_modified)
+
+
+def _export_params(request):
+    """
+    Lê os parâmetros da exportação da query string.
+
+    Returns:
+        tuple: (formato, date_from, date_to, incluir arquivadas, filtros do
+        repositório, tolerância a dados desatualizados, parâmetros do cache)
+    """
     format_type = request.GET.get('format', 'json').lower()
     
     # Valida formato
     if format_type not in ['json', 'csv']:
         format_type = 'json'
     
-    # Busca todas as interações
+    date_from = _parse_date(request.GET.get('date_from', '').strip())
+    date_to = _parse_date(request.GET.get('date_to', '').strip())
+    include_archived = request.GET.get('archived', '').lower() in ('1', 'true', 'yes')
+    filters = _build_date_filters(
+        date_from.isoformat() if date_from else '',
+        date_to.isoformat() if date_to else '',
+    )
+    max_staleness = requested_staleness(request.headers.get('Cache-Control'))
+    cache_params = {'format': format_type, 'filters': filters, 'archived': include_archived}
+    return format_type, date_from, date_to, include_archived, filters, max_staleness, cache_params
+
+
+def _export_response(format_type, snapshot, etag, last_modified):
+    """Monta a resposta de download do arquivo exportado."""
+    if format_type == 'json':
+        response = HttpResponse(snapshot, content_type='application/json; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="chat_history.json"'
+    else:
+        response = HttpResponse(snapshot, content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="chat_history.csv"'
+    return _set_validators(response, etag, last_modified)
+
+
+# Colunas do CSV exportado: (campo, cabeçalho)
+EXPORT_CSV_COLUMNS = [
+    ('timestamp', 'Timestamp'),
+    ('prompt', 'Prompt'),
+    ('response', 'Response'),
+    ('processing_time', 'Processing Time (s)'),
+    ('model', 'Model'),
+    ('path', 'Path'),
+    ('input_tokens', 'Input Tokens'),
+    ('generated_tokens', 'Generated Tokens'),
+    ('generate_calls', 'Generate Calls'),
+    ('truncated', 'Truncated'),
+    ('tokens_per_second', 'Tokens/s'),
+]
+
+
+def _build_export_body(format_type, filters, date_from, date_to, include_archived):
+    """
+    Gera o conteúdo da exportação (JSON ou CSV) a partir do repositório.
+
+    Returns:
+        bytes: corpo do arquivo exportado
+    """
+    # Busca as interações ativas
     interactions = []
     if mongo_repo:
         try:
-            interactions = mongo_repo.get_interactions({})
+            interactions = mongo_repo.get_interactions(filters)
         except Exception as e:
-            logger.error(f"Falha ao recuperar interações para exportação: {e}")
+            logger.error("Falha ao recuperar interações para exportação: %s", e)
             interactions = []
     
+    # Interações arquivadas são lidas das partições comprimidas sob demanda
+    if include_archived and mongo_repo:
+        try:
+            archived = mongo_repo.get_archive().iter_interactions(date_from, date_to)
+            interactions = itertools.chain(interactions, archived)
+        except Exception as e:
+            logger.error("Falha ao ler interações arquivadas: %s", e)
+    
     # Prepara dados para serialização
     export_data = []
     for interaction in interactions:
+        processing_time = interaction.get('processing_time', 0)
+        generated_tokens = interaction.get('generated_tokens')
         export_data.append({
             'timestamp': interaction.get('timestamp').isoformat() if hasattr(interaction.get('timestamp'), 'isoformat') else str(interaction.get('timestamp')),
             'prompt': interaction.get('prompt', ''),
             'response': interaction.get('response', ''),
-            'processing_time': interaction.get('processing_time', 0),
-            'model': interaction.get('model', 'local')
+            'processing_time': processing_time,
+            'model': interaction.get('model', 'local'),
+            # Contabilidade de tokens (ausente em interações antigas)
+            'path': interaction.get('path'),
+            'input_tokens': interaction.get('input_tokens'),
+            'generated_tokens': generated_tokens,
+            'generate_calls': interaction.get('generate_calls'),
+            'truncated': interaction.get('truncated'),
+            'tokens_per_second': round(generated_tokens / processing_time, 2) if generated_tokens and processing_time else None,
         })
     
     # Exporta em JSON
     if format_type == 'json':
-        response = HttpResponse(content_type='application/json; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="chat_history.json"'
-        json.dump(export_data, response, ensure_ascii=False, indent=2)
-        return response
+        return json.dumps(export_data, ensure_ascii=False, indent=2).encode('utf-8')
     
     # Exporta em CSV
     else:
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="chat_history.csv"'
-        response.write('\ufeff')  # BOM para Excel reconhecer UTF-8
+        output = io.StringIO()
+        output.write('\ufeff')  # BOM para Excel reconhecer UTF-8
         
-        writer = csv.writer(response)
-        writer.writerow(['Timestamp', 'Prompt', 'Response', 'Processing Time (s)', 'Model'])
+        writer = csv.writer(output)
+        writer.writerow([header for _, header in EXPORT_CSV_COLUMNS])
         
         for interaction in export_data:
             writer.writerow([
-                interaction['timestamp'],
-                interaction['prompt'],
-                interaction['response'],
-                interaction['processing_time'],
-                interaction['model']
+                '' if interaction[key] is None else interaction[key]
+                for key, _ in EXPORT_CSV_COLUMNS
             ])
         
-        return response
+        return output.getvalue().encode('utf-8')
+
+
+def stats_view(request):
+    """
+    Endpoint JSON com estatísticas de latência e uso pré-agregadas.
+
+    Lê apenas as agregações por hora/dia mantidas pelo repositório, sem
+    varrer o histórico de interações.
+
+    Args:
+        request: HttpRequest com query parameters opcionais:
+            - granularity: 'hour' ou 'day' (padrão: 'hour')
+            - model: filtra por modelo
+            - limit: número de janelas (padrão: 24, máximo: STATS_MAX_BUCKETS)
+
+    Returns:
+        JsonResponse: lista de janelas com count, avg, min, max, p50, p95 e p99
+    """
+    granularity = request.GET.get('granularity', 'hour').lower()
+    if granularity not in ('hour', 'day'):
+        return JsonResponse({
+            'error': "Granularidade inválida. Use 'hour' ou 'day'."
+        }, status=400)
+
+    try:
+        limit = int(request.GET.get('limit', 24))
+    except ValueError:
+        return JsonResponse({
+            'error': 'Parâmetro limit deve ser um número inteiro'
+        }, status=400)
+    limit = max(1, min(limit, getattr(settings, 'STATS_MAX_BUCKETS', 744)))
+
+    model = request.GET.get('model', '').strip() or None
+
+    buckets = []
+    if mongo_repo:
+        try:
+            buckets = mongo_repo.get_rollups(granularity=granularity, model=model, limit=limit)
+        except Exception as e:
+            logger.error("Falha ao recuperar agregações: %s", e)
+            buckets = []
+
+    return JsonResponse({
+        'granularity': granularity,
+        'model': model,
+        'buckets': buckets,
+    })
+
+
+def health_view(request):
+    """
+    Endpoint de saúde da aplicação.
+
+    Informa qual backend de persistência está ativo (MongoDB ou fallback
+    SQLite), o estado do health check do MongoDB e se o serviço NLP está
+    disponível.
+
+    Returns:
+        JsonResponse: status 'ok' ou 'degraded' com os detalhes de cada serviço
+    """
+    database = mongo_repo.health_status() if mongo_repo else {'backend': None}
+    nlp = {
+        'available': nlp_service is not None,
+        'model_loaded': bool(getattr(nlp_service, '_model_loaded', False)),
+        'model_state': getattr(nlp_service, 'model_state', None),
+    }
+
+    status = 'ok' if database.get('backend') == 'mongodb' and nlp['available'] else 'degraded'
+    return JsonResponse({
+        'status': status,
+        'database': database,
+        'nlp': nlp,
+    })
+
+
+def metrics_view(request):
+    """
+    Métricas da aplicação no formato de exposição de texto do Prometheus.
+
+    Com METRICS_DIR configurado, os valores somam todos os processos do
+    servidor; sem ele, refletem apenas o processo que atendeu a coleta.
+
+    Returns:
+        HttpResponse: text/plain no formato 0.0.4
+    """
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _profiling_authorized(request):
+    """Confere o token de administração (Authorization: Bearer ou X-Profiling-Token)."""
+    expected = getattr(settings, 'PROFILING_TOKEN', '')
+    if not expected:
+        return False
+    token = request.headers.get('X-Profiling-Token', '')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    return hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+
+@csrf_exempt
+def profiling_view(request):
+    """
+    Endpoint de administração do profiling sob demanda.
+    
+    Protegido por PROFILING_TOKEN (sem token configurado o endpoint não
+    existe). O estado vale apenas para o processo que atende a requisição.
+    
+    GET: estado do profiler e resumos das capturas (funções mais custosas)
+    POST: arma o profiler; body JSON ``{"requests": N, "seconds": T, "memory": true}``
+    DELETE: desarma o profiler
+    
+    Returns:
+        JsonResponse: estado atual e relatórios disponíveis
+    """
+    if not getattr(settings, 'PROFILING_TOKEN', ''):
+        raise Http404
+    if not _profiling_authorized(request):
+        return JsonResponse({'error': 'Não autorizado'}, status=401)
+    
+    profiler = profiling.get_profiler()
+    
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body or b'{}')
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Formato JSON inválido'}, status=400)
+        
+        limits = {'requests': 1000, 'seconds': 3600}
+        values = {}
+        for key, limit in limits.items():
+            value = data.get(key)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= limit:
+                return JsonResponse({'error': f'{key} deve estar entre 1 e {limit}'}, status=400)
+            values[key] = value
+        requests = values.get('requests')
+        profiler.arm(
+            requests=int(requests) if requests is not None else None,
+            seconds=values.get('seconds'),
+            memory=bool(data.get('memory', False)),
+        )
+    elif request.method == 'DELETE':
+        profiler.disarm()
+    elif request.method != 'GET':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    
+    return JsonResponse({
+        'status': profiler.status(),
+        'reports': [
+            dict(summary, urls=[reverse('profiling_report', args=[name]) for name in summary.get('files', [])])
+            for summary in profiler.list_reports()
+        ],
+    })
+
+
+def profiling_report_view(request, name):
+    """
+    Download de um arquivo de relatório (pstats, tracemalloc ou resumo JSON).
+    
+    Protegido pelo mesmo token do endpoint de profiling.
+    """
+    if not getattr(settings, 'PROFILING_TOKEN', ''):
+        raise Http404
+    if not _profiling_authorized(request):
+        return JsonResponse({'error': 'Não autorizado'}, status=401)
+    
+    path = profiling.get_profiler().report_path(name)
+    if path is None:
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
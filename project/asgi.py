@@ -0,0 +1,19 @@
+"""
+ASGI config for project.
+
+Serve with an ASGI server (e.g. ``uvicorn project.asgi:application``) and
+set ASYNC_VIEWS=True so chat, history and export use the async views.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+
+application = get_asgi_application()
+
+# Resume jobs persisted before a restart without waiting for a new POST /jobs/
+from app.views import start_job_workers  # noqa: E402
+
+start_job_workers()
@@ -38,6 +38,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.TracingMiddleware',
+    'app.middleware.RateLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,10 +68,97 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project.wsgi.application'
+ASGI_APPLICATION = 'project.asgi.application'
+
+# Serve chat, history and export with the async views (use with project.asgi)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+# Threads running model work (chat, batch and jobs), and how many requests may wait
+# for one before new requests get a 503
+MODEL_EXECUTOR_WORKERS = int(os.getenv('MODEL_EXECUTOR_WORKERS', '2'))
+MODEL_EXECUTOR_QUEUE = int(os.getenv('MODEL_EXECUTOR_QUEUE', '64'))
+# Priority classes in the model queue: chat is 'interactive'; /batch/, jobs, requests with
+# `X-Priority: bulk` and the API keys in BULK_API_KEYS are 'bulk'. 'strict' always serves
+# interactive work first (bulk work waiting MODEL_PRIORITY_MAX_WAIT seconds jumps ahead);
+# 'weighted' shares the workers by MODEL_PRIORITY_WEIGHTS
+MODEL_SCHEDULER_POLICY = os.getenv('MODEL_SCHEDULER_POLICY', 'strict')
+MODEL_PRIORITY_WEIGHTS = os.getenv('MODEL_PRIORITY_WEIGHTS', 'interactive=4,bulk=1')
+MODEL_PRIORITY_MAX_WAIT = float(os.getenv('MODEL_PRIORITY_MAX_WAIT', '10'))
+# Queue slots bulk work may take, so a large backlog never gets interactive requests a 503
+MODEL_EXECUTOR_BULK_QUEUE = int(os.getenv('MODEL_EXECUTOR_BULK_QUEUE', str(MODEL_EXECUTOR_QUEUE // 2)))
+BULK_API_KEYS = [key.strip() for key in os.getenv('BULK_API_KEYS', '').split(',') if key.strip()]
+# Batch chat endpoint: max prompts per request, and prompts per padded generate call
+BATCH_MAX_PROMPTS = int(os.getenv('BATCH_MAX_PROMPTS', '64'))
+BATCH_GENERATE_SIZE = int(os.getenv('BATCH_GENERATE_SIZE', '16'))
+# Async job API: worker threads per web process (0 = only `manage.py run_job_workers`),
+# long-poll limit, queue polling interval, and when a running job counts as abandoned
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
+JOB_MAX_WAIT = float(os.getenv('JOB_MAX_WAIT', '30'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+JOB_RUNNING_TIMEOUT = int(os.getenv('JOB_RUNNING_TIMEOUT', '600'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# Prometheus metrics (/metrics): with several worker processes, point METRICS_DIR at a
+# shared directory (cleared on deploy) so each process' snapshot is summed at scrape time
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1.0'))
+# Per-request stage breakdown in the Server-Timing response header (the X-Request-ID
+# header and the spans stored with each interaction are always recorded)
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+# On-demand profiling (/profiling/): admin token (empty disables the endpoint) and
+# directory where pstats/tracemalloc reports are written
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+PROFILING_DIR = BASE_DIR / os.getenv('PROFILING_DIR', 'profiles')
+# Per-client rate limiting of chat/batch/jobs (client = X-API-Key if listed in
+# RATE_LIMIT_API_KEYS, else IP). Prompts answered by the math/quick fast paths use
+# their own, larger budget. Buckets hold BURST tokens refilled at PER_MINUTE; backend
+# 'local' (per process) or 'sqlite' (shared by the workers of one host through the
+# default database)
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True') == 'True'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'local')
+RATE_LIMIT_MODEL_PER_MINUTE = float(os.getenv('RATE_LIMIT_MODEL_PER_MINUTE', '30'))
+RATE_LIMIT_MODEL_BURST = int(os.getenv('RATE_LIMIT_MODEL_BURST', '20'))
+RATE_LIMIT_FAST_PER_MINUTE = float(os.getenv('RATE_LIMIT_FAST_PER_MINUTE', '120'))
+RATE_LIMIT_FAST_BURST = int(os.getenv('RATE_LIMIT_FAST_BURST', '60'))
+# Only behind a trusted reverse proxy: take the client IP from X-Forwarded-For
+RATE_LIMIT_TRUST_FORWARDED = os.getenv('RATE_LIMIT_TRUST_FORWARDED', 'False') == 'True'
+# Comma-separated API keys that get their own buckets; any other X-API-Key is limited by IP
+RATE_LIMIT_API_KEYS = [key.strip() for key in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()]
 
 # MongoDB settings
 MONGODB_URI = os.getenv('MONGODB_URI')
 MONGODB_DB = os.getenv('MONGODB_DB')
+# Connection pool (the client connects lazily, never at import time)
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '50'))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', '60000'))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+# Seconds between background pings that switch between MongoDB and the SQLite fallback
+MONGODB_HEALTH_INTERVAL = float(os.getenv('MONGODB_HEALTH_INTERVAL', '10'))
+
+# Retention: interactions older than RETENTION_DAYS are archived to ARCHIVE_DIR
+# (gzip JSON Lines, one file per day) and removed by 'manage.py purge_interactions'.
+# MongoDB also gets a TTL index as a safety net, RETENTION_TTL_GRACE_DAYS later. 0 disables.
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '0'))
+RETENTION_TTL_GRACE_DAYS = int(os.getenv('RETENTION_TTL_GRACE_DAYS', '1'))
+ARCHIVE_DIR = BASE_DIR / os.getenv('ARCHIVE_DIR', 'archive')
+
+# Cache used for rendered history pages and export snapshots. Entries are invalidated
+# by a generation counter bumped on every write, so with several worker processes
+# point this at a shared backend (e.g. FileBasedCache or Redis) instead of LocMemCache.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'pln-chat'),
+    }
+}
+# Seconds a history cache entry is kept (0 disables the cache)
+HISTORY_CACHE_TIMEOUT = int(os.getenv('HISTORY_CACHE_TIMEOUT', '300'))
+# Seconds an entry may be served after a newer write (polling dashboards can ask for
+# more with 'Cache-Control: max-stale=N', up to HISTORY_CACHE_MAX_STALENESS)
+HISTORY_CACHE_STALENESS = int(os.getenv('HISTORY_CACHE_STALENESS', '0'))
+HISTORY_CACHE_MAX_STALENESS = int(os.getenv('HISTORY_CACHE_MAX_STALENESS', '60'))
+
+# Maximum number of rollup buckets returned by /stats/ (31 days of hourly buckets)
+STATS_MAX_BUCKETS = int(os.getenv('STATS_MAX_BUCKETS', '744'))
 
 # Django default database (sqlite) - required so management commands / migrations work.
 # We still use MongoDB for chat persistence via PyMongo, but Django expects a DATABASES setting.
@@ -105,8 +194,36 @@ HF_API_TOKEN = os.getenv('HF_API_TOKEN')
 HF_INFERENCE_MODEL = os.getenv('HF_INFERENCE_MODEL', 'gpt-5-mini')
 # If True, always use the Hugging Face Inference API (HF_INFERENCE_MODEL) instead of local model
 USE_HF_FOR_ALL = os.getenv('USE_HF_FOR_ALL', 'False') == 'True'
+# Local model loading: after a failed load, retry after BACKOFF seconds, doubling up to MAX
+# (requests use the Inference API fallback meanwhile)
+MODEL_LOAD_RETRY_BACKOFF = float(os.getenv('MODEL_LOAD_RETRY_BACKOFF', '5'))
+MODEL_LOAD_RETRY_MAX = float(os.getenv('MODEL_LOAD_RETRY_MAX', '300'))
+# Deadline for chat/batch generation in seconds (0 = none); set it just below the proxy
+# timeout so abandoned requests stop decoding and free their model executor slot
+CHAT_DEADLINE_SECONDS = float(os.getenv('CHAT_DEADLINE_SECONDS', '0'))
+# Assisted (speculative) decoding: a small causal draft model with the same tokenizer as
+# HF_MODEL_NAME proposes ASSISTANT_NUM_TOKENS tokens that the main model verifies in one
+# pass (single-prompt generations only). Empty disables it
+ASSISTANT_MODEL_NAME = os.getenv('ASSISTANT_MODEL_NAME', '')
+ASSISTANT_NUM_TOKENS = int(os.getenv('ASSISTANT_NUM_TOKENS', '5'))
+# Answer profile of the causal model: 'default' stops at a new dialogue turn or an echoed
+# instruction; 'short' also stops at the first complete sentence after
+# SHORT_ANSWER_MIN_TOKENS generated tokens
+ANSWER_PROFILE = os.getenv('ANSWER_PROFILE', 'default')
+SHORT_ANSWER_MIN_TOKENS = int(os.getenv('SHORT_ANSWER_MIN_TOKENS', '8'))
+# Prompt limits: the real limit is in tokens (model context window minus the instruction
+# template and the reserved output tokens); MODEL_MAX_INPUT_TOKENS overrides the context
+# window (0 = read it from the model). PROMPT_MAX_CHARS only guards the tokenizer
+MODEL_MAX_INPUT_TOKENS = int(os.getenv('MODEL_MAX_INPUT_TOKENS', '0'))
+PROMPT_MAX_CHARS = int(os.getenv('PROMPT_MAX_CHARS', '20000'))
+# Concurrent requests with the same prompt (case/whitespace-insensitive) share one generation
+COALESCE_PROMPTS = os.getenv('COALESCE_PROMPTS', 'True') == 'True'
 
 # Logging Configuration
+# Fraction of payload logs (full prompts and model outputs) that are written
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.1'))
+# Max records waiting for the background log writer
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -116,12 +233,24 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        # Full prompts/responses (logged with extra=PAYLOAD_LOG) are only kept for a sample
+        'payload_sampling': {
+            '()': 'app.log_handlers.PayloadSamplingFilter',
+            'rate': LOG_PAYLOAD_SAMPLE_RATE,
+        },
+    },
     'handlers': {
+        # Records are queued and written by a background thread, so a slow disk
+        # never blocks the request thread (records are dropped if the queue fills up)
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'app.log_handlers.BackgroundHandler',
+            'target': 'logging.FileHandler',
             'filename': BASE_DIR / 'debug.log',
+            'queue_size': LOG_QUEUE_SIZE,
             'formatter': 'verbose',
+            'filters': ['payload_sampling'],
         },
     },
     'loggers': {
@@ -142,8 +271,11 @@ if DEBUG:
     LOGGING.setdefault('handlers', {})
     LOGGING['handlers']['console'] = {
         'level': 'DEBUG',
-        'class': 'logging.StreamHandler',
+        'class': 'app.log_handlers.BackgroundHandler',
+        'target': 'logging.StreamHandler',
+        'queue_size': LOG_QUEUE_SIZE,
         'formatter': 'verbose',
+        'filters': ['payload_sampling'],
     }
     LOGGING.setdefault('loggers', {})
     LOGGING['loggers'].setdefault('app', {})
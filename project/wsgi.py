@@ -8,4 +8,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Resume jobs persisted before a restart without waiting for a new POST /jobs/
+from app.views import start_job_workers  # noqa: E402
+
+start_job_workers()
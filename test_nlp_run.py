@@ -5,6 +5,7 @@ from app.services.nlp_service import NLPService
 
 if __name__ == '__main__':
     s = NLPService()
-    r, t = s.process_prompt('Olá, quem descobriu o Brasil?')
+    r, t, usage = s.process_prompt('Olá, quem descobriu o Brasil?')
     print('Response:', r)
     print('Time:', t)
+    print('Usage:', usage)